@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Resource sampling for Kerberos.io agents
+Reads CPU, memory and network counters of every agent straight from its cgroup v2 files and
+network namespace, so a fleet can be watched without opening a `docker stats` stream per
+container. Agents whose cgroup cannot be read locally are sampled through the Engine API.
+"""
+
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from docker_engine import DockerEngine, DockerEngineError, agent_containers
+from fd_limits import raise_fd_limit
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+PROC_ROOT = '/proc'
+
+DEFAULT_INTERVAL = 2.0
+# Seconds between container list calls; restarts are noticed sooner from the counters
+RESYNC_INTERVAL = 30.0
+
+# memory.stat is by far the most expensive file to generate, and only its page cache figure
+# is needed, so each sample re-reads it for one in this many agents
+MEMORY_STAT_EVERY = 5
+
+CGROUP_FILES = ('cpu.stat', 'memory.current', 'memory.stat')
+# Descriptors the sampler may raise the limit to, of which FILE_RESERVE stay free for everything else
+MAX_OPEN_FILES = 8192
+FILE_RESERVE = 256
+
+SORT_KEYS = ('cpu', 'memory', 'net', 'restarts', 'name')
+
+
+def read_bytes(path: str) -> Optional[bytes]:
+    """Contents of a small kernel file, or None if it is gone"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        return os.read(fd, 65536)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+
+
+def stat_value(data: bytes, key: bytes) -> int:
+    """Value of 'key value' in a flat-keyed cgroup file such as cpu.stat or memory.stat"""
+    start = data.find(key + b' ')
+    while start > 0 and data[start - 1:start] != b'\n':
+        start = data.find(key + b' ', start + 1)
+    if start < 0:
+        return 0
+    end = data.find(b'\n', start)
+    return int(data[start + len(key) + 1:end if end >= 0 else None])
+
+
+def net_totals(data: bytes) -> Tuple[int, int]:
+    """Received and sent bytes of every interface but lo, from /proc/<pid>/net/dev"""
+    rx = tx = 0
+    for line in data.splitlines()[2:]:
+        interface, _, counters = line.partition(b':')
+        if interface.strip() == b'lo':
+            continue
+        fields = counters.split()
+        rx += int(fields[0])
+        tx += int(fields[8])
+    return rx, tx
+
+
+def cgroup_path(data: bytes) -> Optional[str]:
+    """Unified (v2) cgroup of a process from /proc/<pid>/cgroup"""
+    for line in data.splitlines():
+        if line.startswith(b'0::'):
+            return line[3:].decode('utf-8', 'replace')
+    return None
+
+
+def format_bytes(value: float) -> str:
+    for unit in ('B', 'K', 'M', 'G'):
+        if abs(value) < 1024:
+            return f"{value:.0f}{unit}" if unit == 'B' else f"{value:.1f}{unit}"
+        value /= 1024
+    return f"{value:.1f}T"
+
+
+def sort_rows(rows: List[Dict[str, Any]], key: str) -> List[Dict[str, Any]]:
+    """Busiest agents first (alphabetical for 'name'); agents without a reading go last"""
+    if key == 'name':
+        return sorted(rows, key=lambda r: r['name'])
+    if key == 'net':
+        value = lambda r: None if r['rx'] is None else r['rx'] + r['tx']
+    else:
+        value = lambda r: r[key]
+    return sorted(rows, key=lambda r: (value(r) is None, -(value(r) or 0), r['name']))
+
+
+class ResourceSampler:
+    """Samples every running agent container; call sample() once per refresh.
+
+    Per container the fast path costs three small reads: cpu.stat and
+    memory.current from its cgroup and net/dev from its init process, with
+    memory.stat read every MEMORY_STAT_EVERY samples. The files stay open
+    and are re-read with pread, so a sample does no path lookups. The Engine
+    API is only used to list containers every resync_interval, to inspect
+    new or restarted ones, and as a fallback ('api' source) when the cgroup
+    files are not visible, e.g. with a remote DOCKER_HOST or cgroup v1.
+    Call close() to release the open files.
+    """
+
+    def __init__(self, engine: DockerEngine, cgroup_root: str = CGROUP_ROOT, proc_root: str = PROC_ROOT,
+                 resync_interval: float = RESYNC_INTERVAL, max_workers: int = 8):
+        self.engine = engine
+        self.cgroup_root = cgroup_root
+        self.proc_root = proc_root
+        self.resync_interval = resync_interval
+        self.max_workers = max_workers
+        self.targets: Dict[str, Dict[str, Any]] = {}
+        self.previous: Dict[str, Tuple[float, int, int, int]] = {}
+        self.synced_at = 0.0
+        self.samples = 0
+        self.files: Dict[str, int] = {}
+        # Counter files kept open between samples, within the descriptor limit
+        self.max_files = raise_fd_limit(MAX_OPEN_FILES - FILE_RESERVE, FILE_RESERVE)
+
+    def _read(self, path: str) -> Optional[bytes]:
+        """Current contents of a counter file, keeping it open for the next sample"""
+        fd = self.files.get(path)
+        if fd is None:
+            if len(self.files) >= self.max_files:
+                return read_bytes(path)
+            try:
+                fd = self.files[path] = os.open(path, os.O_RDONLY)
+            except OSError:
+                return None
+        try:
+            data = os.pread(fd, 65536, 0)
+        except OSError:
+            data = None
+        if not data:
+            # The cgroup or the process is gone
+            os.close(self.files.pop(path))
+            return None
+        return data
+
+    def _forget(self, target: Optional[Dict[str, Any]]):
+        """Close the files kept open for a container that went away or changed"""
+        if target and target['cgroup']:
+            for path in [f"{target['cgroup']}/{name}" for name in CGROUP_FILES] + [target['net']]:
+                fd = self.files.pop(path, None)
+                if fd is not None:
+                    os.close(fd)
+
+    def close(self):
+        for fd in self.files.values():
+            os.close(fd)
+        self.files.clear()
+
+    def _locate(self, name: str) -> Dict[str, Any]:
+        """Inspect one container and find where its counters live"""
+        info = self.engine.inspect_container(name)
+        state = info.get('State') or {}
+        target = {
+            'name': name,
+            'id': info.get('Id', ''),
+            'state': state.get('Status', 'unknown'),
+            'restarts': info.get('RestartCount', 0),
+            'limit': (info.get('HostConfig') or {}).get('Memory') or 0,
+            'cgroup': None,
+            'net': None,
+            'inactive': 0,
+        }
+        pid = state.get('Pid') or 0
+        if pid and state.get('Running'):
+            data = read_bytes(f"{self.proc_root}/{pid}/cgroup")
+            path = cgroup_path(data) if data else None
+            directory = f"{self.cgroup_root}{path}" if path is not None else None
+            if directory and os.path.exists(f"{directory}/cpu.stat"):
+                target['cgroup'] = directory
+                target['net'] = f"{self.proc_root}/{pid}/net/dev"
+                if not target['limit']:
+                    limit = read_bytes(f"{directory}/memory.max")
+                    if limit and limit.strip().isdigit():
+                        target['limit'] = int(limit)
+        return target
+
+    def _locate_many(self, names: List[str]):
+        from concurrent.futures import ThreadPoolExecutor
+
+        def locate(name):
+            try:
+                return self._locate(name)
+            except DockerEngineError as e:
+                if e.status != 404:
+                    raise
+                return None
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(names)))) as pool:
+            for name, target in zip(names, pool.map(locate, names)):
+                self._forget(self.targets.pop(name, None))
+                self.previous.pop(name, None)
+                if target is not None:
+                    self.targets[name] = target
+
+    def sync(self):
+        """List the agents and inspect the ones that are new or changed state"""
+        containers = {c['name']: c for c in agent_containers(self.engine)}
+        for name in list(self.targets):
+            if name not in containers:
+                self._forget(self.targets.pop(name))
+                self.previous.pop(name, None)
+        stale = [name for name, c in containers.items()
+                 if name not in self.targets or self.targets[name]['state'] != c['state']
+                 or not self.targets[name]['id'].startswith(c['id'])]
+        if stale:
+            self._locate_many(stale)
+        self.synced_at = time.monotonic()
+
+    def _read_cgroup(self, target: Dict[str, Any], full: bool) -> Optional[Tuple[int, int, int, int]]:
+        """CPU microseconds, memory bytes, received and sent bytes; None if the process is gone.
+
+        memory.stat is only re-read when full is set.
+        """
+        directory = target['cgroup']
+        cpu = self._read(f"{directory}/cpu.stat")
+        current = self._read(f"{directory}/memory.current")
+        net = self._read(target['net'])
+        if cpu is None or current is None or net is None:
+            return None
+        if full:
+            memory = self._read(f"{directory}/memory.stat")
+            target['inactive'] = stat_value(memory, b'inactive_file') if memory else 0
+        # Like docker stats, leave out page cache the kernel can drop at any time
+        return (stat_value(cpu, b'usage_usec'), max(0, int(current) - target['inactive'])) + net_totals(net)
+
+    def _read_api(self, name: str) -> Optional[Tuple[int, int, int, int]]:
+        try:
+            stats = self.engine.container_stats(name)
+        except DockerEngineError:
+            return None
+        memory = stats.get('memory_stats') or {}
+        usage = memory.get('usage') or 0
+        usage -= (memory.get('stats') or {}).get('inactive_file', 0)
+        networks = (stats.get('networks') or {}).values()
+        cpu = ((stats.get('cpu_stats') or {}).get('cpu_usage') or {}).get('total_usage', 0)
+        return (cpu // 1000, max(0, usage),
+                sum(n.get('rx_bytes', 0) for n in networks), sum(n.get('tx_bytes', 0) for n in networks))
+
+    def sample(self) -> List[Dict[str, Any]]:
+        """One row per agent container.
+
+        cpu is the percentage of one core and rx/tx are bytes per second
+        since the previous sample; all three are None on the first sample
+        of a container. cpu_seconds, rx_bytes and tx_bytes are the raw
+        counters, None when the container could not be read.
+        """
+        if not self.synced_at or time.monotonic() - self.synced_at >= self.resync_interval:
+            self.sync()
+
+        readings = {}
+        remote = []
+        vanished = []
+        turn = self.samples % MEMORY_STAT_EVERY
+        self.samples += 1
+        for index, (name, target) in enumerate(self.targets.items()):
+            if target['state'] != 'running':
+                continue
+            if target['cgroup'] is None:
+                remote.append(name)
+                continue
+            previous = self.previous.get(name)
+            reading = self._read_cgroup(target, full=previous is None or index % MEMORY_STAT_EVERY == turn)
+            if reading is None or (previous and reading[0] < previous[1]):
+                # The process went away or the counters restarted: it was restarted or stopped
+                vanished.append(name)
+            else:
+                readings[name] = reading
+        if remote:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(remote)))) as pool:
+                for name, reading in zip(remote, pool.map(self._read_api, remote)):
+                    if reading is not None:
+                        readings[name] = reading
+        if vanished:
+            self._locate_many(vanished)
+
+        now = time.monotonic()
+        rows = []
+        for name, target in self.targets.items():
+            reading = readings.get(name)
+            row = {'name': name, 'state': target['state'], 'restarts': target['restarts'],
+                   'limit': target['limit'], 'source': 'cgroup' if target['cgroup'] else 'api',
+                   'cpu': None, 'memory': None, 'rx': None, 'tx': None,
+                   'cpu_seconds': None, 'rx_bytes': None, 'tx_bytes': None}
+            if reading is not None:
+                cpu, memory, rx, tx = reading
+                row.update(memory=memory, cpu_seconds=cpu / 1e6, rx_bytes=rx, tx_bytes=tx)
+                previous = self.previous.get(name)
+                if previous:
+                    elapsed = now - previous[0]
+                    if elapsed > 0:
+                        row['cpu'] = (cpu - previous[1]) / (elapsed * 1e6) * 100
+                        row['rx'] = max(0, rx - previous[2]) / elapsed
+                        row['tx'] = max(0, tx - previous[3]) / elapsed
+                self.previous[name] = (now, cpu, rx, tx)
+            rows.append(row)
+        return rows
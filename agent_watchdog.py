@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Health watchdog for Kerberos.io agents
+Probes the health endpoint of every running agent from one asyncio event loop over kept-alive
+connections, probing healthy agents rarely and failing ones with jittered exponential backoff,
+and restarts agents that stay unhealthy within a restart budget, so a dead stream heals without
+a restart storm
+"""
+
+import asyncio
+import random
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from docker_engine import DockerEngine, DockerEngineError
+from fleet_status import FleetStatus
+
+DEFAULT_WATCHDOG = {
+    'interval': 30,               # seconds between probes of a healthy agent
+    'retry_interval': 2,          # first re-probe of a failing agent; doubles with every failure
+    'max_backoff': 30,            # longest wait between probes of a failing agent
+    'timeout': 5,                 # seconds one probe may take
+    'failures': 3,                # consecutive failed probes before a restart
+    'start_period': 60,           # seconds after an agent (re)starts before its failures count
+    'max_restarts': 5,            # restarts the whole fleet may use per restart_window
+    'agent_restarts': 3,          # restarts of one agent per restart_window
+    'restart_window': 3600,
+    'max_unhealthy_share': 0.5,   # with more of the fleet failing, suspect the network and restart nothing
+    'concurrency': 256,           # probes in flight
+}
+
+USER_AGENT = 'kerberos-watchdog'
+
+
+class HttpError(Exception):
+    """The agent did not answer with a valid HTTP response"""
+
+
+def watchdog_settings(docker_config: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate the optional docker.watchdog section"""
+    watchdog = dict(DEFAULT_WATCHDOG, **(docker_config.get('watchdog') or {}))
+    settings = {key: float(watchdog[key]) for key in DEFAULT_WATCHDOG}
+    for key in ('failures', 'max_restarts', 'agent_restarts', 'concurrency'):
+        settings[key] = int(watchdog[key])
+    for key in ('interval', 'retry_interval', 'max_backoff', 'timeout', 'restart_window'):
+        if settings[key] <= 0:
+            raise ValueError(f"docker.watchdog.{key} must be greater than 0")
+    if settings['failures'] < 1 or settings['concurrency'] < 1:
+        raise ValueError("docker.watchdog.failures and concurrency must be at least 1")
+    if not 0 < settings['max_unhealthy_share'] <= 1:
+        raise ValueError("docker.watchdog.max_unhealthy_share must be between 0 and 1")
+    return settings
+
+
+def parse_head(head: bytes) -> Tuple[int, Dict[str, str], bool]:
+    """Status, lowercase headers and whether the connection stays open, from an HTTP response head"""
+    lines = head.decode('latin-1').split('\r\n')
+    parts = lines[0].split(' ', 2)
+    if len(parts) < 2 or not parts[0].startswith('HTTP/') or not parts[1].isdigit():
+        raise HttpError(f"not an HTTP response: {lines[0][:40]!r}")
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(':')
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    connection = headers.get('connection', '').lower()
+    keep_alive = connection != 'close' if parts[0] != 'HTTP/1.0' else connection == 'keep-alive'
+    return int(parts[1]), headers, keep_alive
+
+
+class HealthClient:
+    """GET requests over one kept-alive connection per agent.
+
+    An idle connection is reused for the next probe of the same agent, so
+    a steady fleet is probed without a TCP handshake per request; if the
+    agent closed it in the meantime, the request is retried once on a new
+    connection.
+    """
+
+    def __init__(self):
+        self.idle: Dict[Tuple[str, int], Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = {}
+
+    async def get(self, host: str, port: int, path: str, timeout: float) -> int:
+        """Status code of GET path, within timeout seconds"""
+        return await asyncio.wait_for(self._get(host, port, path), timeout)
+
+    async def _get(self, host: str, port: int, path: str) -> int:
+        key = (host, port)
+        conn = self.idle.pop(key, None)
+        if conn is not None:
+            try:
+                return await self._exchange(key, conn, host, path)
+            except (OSError, HttpError, asyncio.IncompleteReadError):
+                pass
+        conn = await asyncio.open_connection(host, port)
+        return await self._exchange(key, conn, host, path)
+
+    async def _exchange(self, key: Tuple[str, int], conn, host: str, path: str) -> int:
+        reader, writer = conn
+        # Only a connection whose body was read in full goes back to the pool
+        reusable = False
+        try:
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}:{key[1]}\r\nUser-Agent: {USER_AGENT}\r\n"
+                         f"Accept: application/json\r\n\r\n".encode('utf-8'))
+            await writer.drain()
+            status, headers, keep = parse_head(await reader.readuntil(b'\r\n\r\n'))
+            if headers.get('transfer-encoding', '').lower() == 'chunked':
+                while True:
+                    size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                    await reader.readexactly(size + 2)
+                    if not size:
+                        break
+            elif 'content-length' in headers:
+                await reader.readexactly(int(headers['content-length']))
+            else:
+                # The body runs until the agent closes the connection
+                await reader.read()
+                keep = False
+            reusable = keep
+            return status
+        except ValueError as e:
+            raise HttpError(str(e))
+        finally:
+            if reusable:
+                self.idle[key] = conn
+            else:
+                writer.close()
+
+    def close(self):
+        for _, writer in self.idle.values():
+            writer.close()
+        self.idle.clear()
+
+
+class RestartBudget:
+    """Restarts allowed in a sliding window, for the whole fleet and for each agent"""
+
+    def __init__(self, fleet_limit: int, agent_limit: int, window: float):
+        self.fleet_limit = fleet_limit
+        self.agent_limit = agent_limit
+        self.window = window
+        self.fleet: Deque[float] = deque()
+        self.agents: Dict[str, Deque[float]] = {}
+
+    def _trim(self, times: Deque[float], now: float):
+        while times and now - times[0] >= self.window:
+            times.popleft()
+
+    def refusal(self, name: str, now: float) -> Optional[str]:
+        """Why the agent may not be restarted now, or None if it may"""
+        self._trim(self.fleet, now)
+        times = self.agents.get(name, deque())
+        self._trim(times, now)
+        window = f"{self.window / 60:g} min"
+        if len(times) >= self.agent_limit:
+            return f"already restarted {len(times)} times in {window}"
+        if len(self.fleet) >= self.fleet_limit:
+            return f"the fleet used its {self.fleet_limit} restarts for {window}"
+        return None
+
+    def record(self, name: str, now: float):
+        self.fleet.append(now)
+        self.agents.setdefault(name, deque()).append(now)
+
+    def used(self, now: float) -> int:
+        self._trim(self.fleet, now)
+        return len(self.fleet)
+
+
+class AgentHealth:
+    """What the watchdog knows about one agent.
+
+    state is 'unknown' (not probed yet), 'healthy', 'failing', 'no-endpoint'
+    (the agent answers 404, so its health cannot be judged) or 'down' (its
+    container is not running).
+    """
+
+    __slots__ = ('name', 'host', 'port', 'path', 'state', 'failures', 'started', 'error', 'held')
+
+    def __init__(self, name: str, url: str):
+        parts = urlsplit(url)
+        self.name = name
+        self.host = parts.hostname or '127.0.0.1'
+        self.port = parts.port or 80
+        self.path = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+        self.state = 'unknown'
+        self.failures = 0
+        # Monotonic time the watchdog last saw the agent (re)start; None while its container is down
+        self.started: Optional[float] = None
+        self.error: Optional[str] = None
+        # Why the last restart was refused, reported once per failure streak
+        self.held: Optional[str] = None
+
+
+class Watchdog:
+    """Adaptive health probes and budgeted restarts for a fleet of agents.
+
+    Every agent gets its own probe loop on one event loop; the first
+    probes are spread over one interval so the fleet is never probed in
+    lockstep. A healthy agent is probed every interval, a failing one after
+    retry_interval doubled with every failure up to max_backoff, both with
+    jitter. Container states follow the Docker events stream, so agents
+    whose container is not running are not probed. on_event(kind, name,
+    detail) reports 'unhealthy', 'recovered', 'no-endpoint', 'restart',
+    'restart-failed', 'held' and 'summary'.
+    """
+
+    def __init__(self, engine: DockerEngine, agents: List[Dict[str, Any]], urls: Dict[str, str],
+                 settings: Dict[str, Any], restart: bool = True,
+                 on_event: Optional[Callable[[str, Optional[str], Any], None]] = None,
+                 rng: Callable[[], float] = random.random):
+        self.engine = engine
+        self.settings = settings
+        self.restart = restart
+        self.on_event = on_event or (lambda kind, name, detail: None)
+        self.rng = rng
+        self.fleet = FleetStatus(engine, [agent for agent in agents if agent['name'] in urls])
+        self.agents = [AgentHealth(name, url) for name, url in urls.items()]
+        self.budget = RestartBudget(settings['max_restarts'], settings['agent_restarts'], settings['restart_window'])
+        self.client = HealthClient()
+        self.probes = 0
+        self.restarts = 0
+        self.stopping = threading.Event()
+
+    def counts(self) -> Counter:
+        return Counter(agent.state for agent in self.agents)
+
+    def healthy_delay(self) -> float:
+        return self.settings['interval'] * (0.9 + 0.2 * self.rng())
+
+    def failing_delay(self, failures: int) -> float:
+        """Exponential backoff with equal jitter: between half and all of the backoff step"""
+        step = min(self.settings['max_backoff'], self.settings['retry_interval'] * 2 ** (failures - 1))
+        return step / 2 + step / 2 * self.rng()
+
+    async def probe(self, agent: AgentHealth, slots: asyncio.Semaphore) -> Tuple[Optional[int], Optional[str]]:
+        """HTTP status of one health probe, or None and the reason it failed"""
+        async with slots:
+            self.probes += 1
+            try:
+                return await self.client.get(agent.host, agent.port, agent.path, self.settings['timeout']), None
+            except asyncio.TimeoutError:
+                return None, f"no answer in {self.settings['timeout']:g}s"
+            except (OSError, HttpError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+                return None, str(e) or type(e).__name__
+
+    async def check(self, agent: AgentHealth, slots: asyncio.Semaphore) -> float:
+        """Probe one agent, act on the result and return the seconds until its next probe"""
+        if self.fleet.state(agent.name) != 'running':
+            agent.state, agent.failures, agent.started = 'down', 0, None
+            return self.healthy_delay()
+        if agent.started is None:
+            agent.started = time.monotonic()
+
+        status, error = await self.probe(agent, slots)
+        if status is not None and 200 <= status < 300:
+            if agent.state == 'failing':
+                self.on_event('recovered', agent.name, agent.failures)
+            agent.state, agent.failures, agent.error, agent.held = 'healthy', 0, None, None
+            return self.healthy_delay()
+        if status == 404:
+            if agent.state != 'no-endpoint':
+                self.on_event('no-endpoint', agent.name, agent.path)
+            agent.state, agent.failures = 'no-endpoint', 0
+            return self.healthy_delay()
+
+        agent.error = error or f"HTTP {status}"
+        agent.failures += 1
+        if agent.state != 'failing':
+            self.on_event('unhealthy', agent.name, agent.error)
+        agent.state = 'failing'
+        if (agent.failures >= self.settings['failures'] and self.restart
+                and time.monotonic() - agent.started >= self.settings['start_period']):
+            await self.restart_agent(agent)
+        return self.failing_delay(agent.failures)
+
+    async def restart_agent(self, agent: AgentHealth):
+        """Restart a stuck agent unless the budget or a fleet-wide outage says otherwise"""
+        now = time.monotonic()
+        probed = [a for a in self.agents if a.state in ('healthy', 'failing')]
+        failing = sum(a.state == 'failing' for a in probed)
+        if len(probed) > 1 and failing / len(probed) > self.settings['max_unhealthy_share']:
+            reason = f"{failing} of {len(probed)} agents are failing, which looks like a network or host problem"
+        else:
+            reason = self.budget.refusal(agent.name, now)
+        if reason:
+            if reason != agent.held:
+                self.on_event('held', agent.name, reason)
+            agent.held = reason
+            return
+
+        self.budget.record(agent.name, now)
+        self.restarts += 1
+        self.on_event('restart', agent.name, agent.error)
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self.engine.restart_container, agent.name)
+        except DockerEngineError as e:
+            self.on_event('restart-failed', agent.name, str(e))
+            return
+        agent.state, agent.failures, agent.started, agent.held = 'unknown', 0, time.monotonic(), None
+
+    async def agent_loop(self, agent: AgentHealth, slots: asyncio.Semaphore):
+        await asyncio.sleep(self.settings['interval'] * self.rng())
+        while True:
+            await asyncio.sleep(await self.check(agent, slots))
+
+    async def report_loop(self, every: float):
+        while True:
+            await asyncio.sleep(every)
+            self.on_event('summary', None, {'counts': self.counts(), 'probes': self.probes,
+                                            'restarts': self.restarts,
+                                            'budget': self.budget.used(time.monotonic())})
+
+    def _watch_fleet(self):
+        """Follow Docker events for container state; poll while the stream is unavailable"""
+        while not self.stopping.is_set():
+            try:
+                self.fleet.watch(lambda names: None, self.stopping, 1.0)
+            except DockerEngineError as e:
+                self.on_event('docker', None, str(e))
+            if self.stopping.wait(self.settings['retry_interval']):
+                break
+            try:
+                self.fleet.refresh()
+            except DockerEngineError:
+                continue
+
+    async def main(self, report_every: float):
+        import signal
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        slots = asyncio.Semaphore(self.settings['concurrency'])
+        tasks = [asyncio.ensure_future(self.agent_loop(agent, slots)) for agent in self.agents]
+        if report_every:
+            tasks.append(asyncio.ensure_future(self.report_loop(report_every)))
+        try:
+            await stop.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.client.close()
+
+    def run(self, report_every: float = 60.0):
+        """Watch the fleet in the foreground until SIGINT/SIGTERM.
+
+        Raises DockerEngineError when the Engine API cannot be reached for
+        the initial container list.
+        """
+        from fd_limits import raise_fd_limit
+
+        # Every agent keeps a connection open between probes
+        raise_fd_limit(len(self.agents) + self.settings['concurrency'])
+        self.fleet.refresh()
+        threading.Thread(target=self._watch_fleet, daemon=True).start()
+        try:
+            asyncio.run(self.main(report_every))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stopping.set()
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Resource model calibration for Kerberos.io agents
+Records every agent's CPU and memory use in a compact time-series file and fits the capacity
+model's per-feature costs to high percentiles of it, so limits and syscheck follow measured use
+instead of the built-in estimates. Fitting needs NumPy; recording does not
+"""
+
+import csv
+import json
+import struct
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from capacity import CODECS, DEFAULT_RECORDING, MB, parse_resolution
+
+MAGIC = b'KCAL1\n'
+# Every record is a tag and a payload length: 'H' a JSON header naming the agents of the ticks
+# that follow, 'T' one tick, a float64 time and a float32 (CPUs, memory MB) pair per agent
+RECORD = struct.Struct('<cI')
+HEADER, TICK = b'H', b'T'
+
+DEFAULT_PERCENTILE = 90.0
+# Agents with fewer readings than this are left out of the fit
+MIN_SAMPLES = 5
+
+CPU_KEYS = ('base_cpus', 'cpus_per_mpps', 'recording_cpus')
+MEMORY_KEYS = ('base_memory_mb', 'memory_mb_per_megapixel', 'recording_memory_mb')
+
+SIZE_UNITS = {'b': 1, 'kb': 1e3, 'kib': 1024, 'mb': 1e6, 'mib': MB, 'gb': 1e9, 'gib': 1024 ** 3}
+
+
+def telemetry_path(compose_file: str) -> Path:
+    """Samples file kept alongside the compose file (docker-compose.yml -> docker-compose.telemetry.bin)"""
+    compose_path = Path(compose_file)
+    return compose_path.with_name(f"{compose_path.stem}.telemetry.bin")
+
+
+class TelemetryWriter:
+    """Append ticks of per-agent readings to a samples file.
+
+    A header record lists the agents, and each tick stores one fixed-size
+    pair per agent (NaN when an agent had no reading), so a file loads
+    straight into an array. A tick with an agent the header does not name
+    writes a new header first. An interrupted write leaves at most one
+    partial record at the end, which readers skip.
+    """
+
+    def __init__(self, path: Path, source: str):
+        self.path = Path(path)
+        self.source = source
+        self.agents: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.ticks = 0
+        self._fh = None
+
+    def __enter__(self) -> 'TelemetryWriter':
+        new = not self.path.exists() or self.path.stat().st_size == 0
+        self._fh = open(self.path, 'ab')
+        if new:
+            self._fh.write(MAGIC)
+        return self
+
+    def _record(self, tag: bytes, payload: bytes):
+        self._fh.write(RECORD.pack(tag, len(payload)) + payload)
+
+    def add(self, when: float, readings: Dict[str, Tuple[float, float]]):
+        """One tick: name -> (CPUs, memory in bytes)"""
+        if not readings:
+            return
+        if any(name not in self.index for name in readings):
+            self.agents = sorted(set(self.agents).union(readings))
+            self.index = {name: i for i, name in enumerate(self.agents)}
+            header = {'agents': self.agents, 'source': self.source, 'started': when}
+            self._record(HEADER, json.dumps(header, separators=(',', ':')).encode('utf-8'))
+        values = [float('nan')] * (2 * len(self.agents))
+        for name, (cpus, memory) in readings.items():
+            i = self.index[name]
+            values[2 * i] = cpus
+            values[2 * i + 1] = memory / MB
+        self._record(TICK, struct.pack(f'<d{len(values)}f', when, *values))
+        self.ticks += 1
+
+    def flush(self):
+        self._fh.flush()
+
+    def __exit__(self, exc_type, exc, tb):
+        self._fh.close()
+        return False
+
+
+def read_blocks(path: Path) -> Iterator[Tuple[Dict[str, Any], List[bytes]]]:
+    """(header, tick payloads) for every header record of a samples file"""
+    with open(path, 'rb') as fh:
+        data = fh.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a calibration samples file")
+    offset, header, ticks = len(MAGIC), None, []
+    while offset + RECORD.size <= len(data):
+        tag, length = RECORD.unpack_from(data, offset)
+        start = offset + RECORD.size
+        if start + length > len(data):
+            break  # partial record from an interrupted write
+        payload = data[start:start + length]
+        if tag == HEADER:
+            if header is not None:
+                yield header, ticks
+            header, ticks = json.loads(payload), []
+        elif tag == TICK and header is not None:
+            ticks.append(payload)
+        offset = start + length
+    if header is not None:
+        yield header, ticks
+
+
+def load_samples(path: Path):
+    """Times and readings of a samples file as NumPy arrays: (times, agents, values[tick, agent, 2])"""
+    import numpy as np
+
+    blocks = []
+    for header, ticks in read_blocks(path):
+        if ticks:
+            tick = np.dtype([('time', '<f8'), ('values', '<f4', (len(header['agents']), 2))])
+            blocks.append((header['agents'], np.frombuffer(b''.join(ticks), dtype=tick)))
+    agents = sorted({name for names, _ in blocks for name in names})
+    index = {name: i for i, name in enumerate(agents)}
+    count = sum(len(ticks) for _, ticks in blocks)
+    times = np.empty(count)
+    values = np.full((count, len(agents), 2), np.nan, dtype=np.float32)
+    row = 0
+    for names, ticks in blocks:
+        columns = [index[name] for name in names]
+        times[row:row + len(ticks)] = ticks['time']
+        values[row:row + len(ticks), columns] = ticks['values']
+        row += len(ticks)
+    return times, agents, values
+
+
+def parse_size(value: str) -> float:
+    """Bytes from '123456', '512MiB' or docker stats' '512MiB / 1.944GiB'"""
+    text = value.split('/')[0].strip().lower().replace(' ', '')
+    number = text.rstrip('abcdefghijklmnopqrstuvwxyz')
+    unit = text[len(number):] or 'b'
+    if unit not in SIZE_UNITS:
+        raise ValueError(f"Unknown memory unit in '{value}'")
+    return float(number) * SIZE_UNITS[unit]
+
+
+def parse_time(value: str) -> float:
+    """Seconds since the epoch from a number or an ISO 8601 timestamp"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value.strip().replace('Z', '+00:00')).timestamp()
+
+
+def ingest_csv(path: str, writer: TelemetryWriter) -> int:
+    """Append per-container samples from a CSV file; returns the number of rows read.
+
+    Columns are found by name: the container ('name' or 'container'), CPU
+    in percent of one core ('cpu', 'cpu_percent' or docker stats' 'CPUPerc')
+    and memory in bytes or with a unit ('memory', 'mem' or 'MemUsage').
+    Rows with the same 'time' (epoch seconds or ISO 8601) form one tick;
+    without a time column a tick ends when a container repeats.
+    """
+    columns = {'name': ('name', 'container'), 'cpu': ('cpu', 'cpu_percent', 'cpuperc'),
+               'memory': ('memory', 'mem', 'mem_usage', 'memusage'), 'time': ('time', 'timestamp')}
+    rows = 0
+    with open(path, newline='') as fh:
+        reader = csv.DictReader(fh)
+        fields = {field.strip().lower(): field for field in reader.fieldnames or []}
+        found = {key: next((fields[n] for n in names if n in fields), None) for key, names in columns.items()}
+        missing = [key for key in ('name', 'cpu', 'memory') if found[key] is None]
+        if missing:
+            raise ValueError(f"{path} needs {' and '.join(missing)} columns")
+        tick, tick_time, ticks = {}, None, 0
+        for line, row in enumerate(reader, start=2):
+            try:
+                name = row[found['name']].strip().lstrip('/')
+                cpus = float(row[found['cpu']].strip().rstrip('%')) / 100
+                memory = parse_size(row[found['memory']])
+                when = parse_time(row[found['time']]) if found['time'] else None
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"{path}, line {line}: {e}")
+            if tick and ((found['time'] and when != tick_time) or (not found['time'] and name in tick)):
+                writer.add(tick_time if found['time'] else ticks, tick)
+                tick, ticks = {}, ticks + 1
+            tick[name], tick_time = (cpus, memory), when
+            rows += 1
+        if tick:
+            writer.add(tick_time if found['time'] else ticks, tick)
+    return rows
+
+
+def collect(sampler, writer: TelemetryWriter, duration: float, interval: float,
+            progress=None) -> int:
+    """Sample every running agent each interval for duration seconds (until Ctrl+C); returns the ticks written"""
+    sampler.sample()  # CPU use needs a previous reading
+    deadline = time.monotonic() + duration
+    ticks = 0
+    try:
+        while time.monotonic() < deadline:
+            time.sleep(max(0.0, min(interval, deadline - time.monotonic())))
+            readings = {row['name']: (row['cpu'] / 100, row['memory']) for row in sampler.sample()
+                        if row['cpu'] is not None and row['memory'] is not None}
+            writer.add(time.time(), readings)
+            writer.flush()
+            ticks += 1
+            if progress:
+                progress(ticks, len(readings))
+    except KeyboardInterrupt:
+        pass
+    return ticks
+
+
+def agent_features(profile: Dict[str, Any], model: Dict[str, float]) -> Tuple[List[float], List[float], float]:
+    """CPU features, memory features and the pre-recording buffer (MB) of an agent's profile.
+
+    The features are the multipliers of the model's costs in
+    capacity.estimate, after the intercept.
+    """
+    width, height = parse_resolution(profile['resolution'])
+    megapixels = width * height / 1e6
+    fps = float(profile['fps'])
+    codec = CODECS.get(str(profile.get('codec', 'h264')).lower(), CODECS['h264'])
+    recording = 1.0 if profile.get('recording') else 0.0
+    buffer_mb = 0.0
+    if recording:
+        bitrate = float(profile.get('bitrate') or width * height * fps * model['bits_per_pixel'] * codec['bits'])
+        buffer_mb = bitrate / 8 * float(profile.get('pre_recording', DEFAULT_RECORDING['pre_recording'])) / MB
+    return [megapixels * fps * codec['decode'], recording], [megapixels, recording], buffer_mb
+
+
+def fit_costs(features, targets, defaults, percentile: float):
+    """Intercept and per-feature costs so the model meets the percentile of the targets.
+
+    Least squares gives the costs; a feature that is the same for every
+    agent cannot be told apart from the intercept and keeps its default,
+    and a negative cost is pinned to zero. The intercept is then raised
+    (or lowered) to the percentile of what is left, so that share of the
+    agents stays within the model.
+    """
+    import numpy as np
+
+    fixed = np.ptp(features, axis=0) == 0
+    coefs = np.where(fixed, defaults, 0.0)
+    for _ in range(features.shape[1] + 1):
+        free = ~fixed
+        rest = targets - features[:, fixed] @ coefs[fixed]
+        design = np.column_stack([np.ones(len(targets)), features[:, free]])
+        solution = np.linalg.lstsq(design, rest, rcond=None)[0]
+        coefs[free] = solution[1:]
+        negative = free & (coefs < 0)
+        if not negative.any():
+            break
+        coefs[negative] = 0.0
+        fixed = fixed | negative
+    residuals = targets - features @ coefs
+    return max(0.0, float(np.percentile(residuals, percentile))), coefs
+
+
+def fit_model(path: Path, profiles: Dict[str, Dict[str, Any]], base_model: Dict[str, float],
+              percentile: float = DEFAULT_PERCENTILE, min_samples: int = MIN_SAMPLES) -> Dict[str, Any]:
+    """Capacity model costs fitted to the samples of the agents in profiles (name -> camera profile).
+
+    Each agent is reduced to the percentile of its CPU and of its memory
+    over time, then the costs are fitted across agents (see fit_costs).
+    Raises ValueError when no configured agent has enough samples.
+    """
+    import numpy as np
+
+    times, agents, values = load_samples(path)
+    counts = np.sum(~np.isnan(values[:, :, 0]), axis=0) if len(agents) else np.zeros(0)
+    used = [i for i, name in enumerate(agents) if name in profiles and counts[i] >= min_samples]
+    if not used:
+        raise ValueError(f"No configured agent has {min_samples} samples in {path}; "
+                         f"run 'calibrate' while the agents are up")
+    with np.errstate(all='ignore'):
+        levels = np.nanpercentile(values[:, used, :], percentile, axis=0)
+
+    features = [agent_features(profiles[agents[i]], base_model) for i in used]
+    cpu_features = np.array([cpu for cpu, _, _ in features], dtype=float)
+    memory_features = np.array([memory for _, memory, _ in features], dtype=float)
+    buffers = np.array([buffer for _, _, buffer in features])
+
+    cpu_base, cpu_costs = fit_costs(cpu_features, levels[:, 0].astype(float),
+                                    np.array([base_model[key] for key in CPU_KEYS[1:]]), percentile)
+    memory_base, memory_costs = fit_costs(memory_features, levels[:, 1].astype(float) - buffers,
+                                          np.array([base_model[key] for key in MEMORY_KEYS[1:]]), percentile)
+    model = dict(zip(CPU_KEYS, [cpu_base] + [float(c) for c in cpu_costs]))
+    model.update(zip(MEMORY_KEYS, [memory_base] + [float(c) for c in memory_costs]))
+    model = {key: round(value, 6) for key, value in model.items()}
+    return {
+        'model': model,
+        'percentile': percentile,
+        'agents': len(used),
+        'samples': int(counts[used].sum()),
+        'since': float(np.min(times)) if len(times) else None,
+        'until': float(np.max(times)) if len(times) else None,
+        'fitted': time.time(),
+    }
+
+
+def agent_profiles(config: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Camera profile of every configured agent, by container name"""
+    from capacity import profile_for, profile_settings
+    from compose_writer import camera_name_for
+    from ip_ranges import camera_ips
+
+    camera_config = config.get('cameras', {}) or {}
+    profiles = profile_settings(camera_config)
+    return {camera_name_for(ip): profiles[profile_for(profiles, ip)][1] for ip in camera_ips(camera_config)}
+
+
+def calibrated_model(state: Dict[str, Any]) -> Optional[Dict[str, float]]:
+    """Costs of the last calibration in the state file, if any"""
+    return (state.get('calibration') or {}).get('model')
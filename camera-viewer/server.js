@@ -1,5 +1,6 @@
 const express = require('express');
 const cors = require('cors');
+const crypto = require('crypto');
 const fs = require('fs');
 const path = require('path');
 const yaml = require('js-yaml');
@@ -15,6 +16,97 @@ app.use(cors({
 
 app.use(express.json());
 
+// Parsed config snapshot shared with the Python CLI next to config.yml
+// (see config_cache.py). It is reused while config.yml's mtime and size,
+// or failing that its content hash, still match; otherwise the YAML is
+// parsed, normalized the same way and the snapshot is rewritten.
+const CACHE_VERSION = 1;
+const SECTIONS = ['global', 'cameras', 'docker', 'custom_environment'];
+
+// Dates as Python's str() writes them, so both sides produce the same snapshot
+const pad = (value, width = 2) => String(value).padStart(width, '0');
+const formatDate = (date) => {
+  const day = `${date.getUTCFullYear()}-${pad(date.getUTCMonth() + 1)}-${pad(date.getUTCDate())}`;
+  const millis = date.getUTCMilliseconds();
+  if (!date.getUTCHours() && !date.getUTCMinutes() && !date.getUTCSeconds() && !millis) {
+    return day;
+  }
+  const time = `${pad(date.getUTCHours())}:${pad(date.getUTCMinutes())}:${pad(date.getUTCSeconds())}`;
+  return millis ? `${day} ${time}.${pad(millis * 1000, 6)}` : `${day} ${time}`;
+};
+
+// Make sure the main sections are mappings, then round-trip through JSON
+// (dates become strings) so a fresh parse and a cached snapshot look identical
+const normalizeConfig = (config) => {
+  if (config === null || config === undefined) {
+    config = {};
+  }
+  if (typeof config !== 'object' || Array.isArray(config)) {
+    throw new Error('Configuration must be a mapping of sections');
+  }
+  for (const section of SECTIONS) {
+    const value = config[section];
+    if (value === null || value === undefined) {
+      config[section] = {};
+    } else if (typeof value !== 'object' || Array.isArray(value) || value instanceof Date) {
+      throw new Error(`Configuration section '${section}' must be a mapping`);
+    }
+  }
+  return JSON.parse(JSON.stringify(config, function (key, value) {
+    return this[key] instanceof Date ? formatDate(this[key]) : value;
+  }));
+};
+
+const writeSnapshot = (cachePath, snapshot) => {
+  const tmpPath = `${cachePath}.${process.pid}.tmp`;
+  try {
+    fs.writeFileSync(tmpPath, JSON.stringify(snapshot));
+    fs.renameSync(tmpPath, cachePath);
+  } catch (error) {
+    // A read-only config directory just means no cache
+    try {
+      fs.unlinkSync(tmpPath);
+    } catch (unlinkError) {
+      // nothing to clean up
+    }
+  }
+};
+
+const readConfig = (configPath) => {
+  const cachePath = path.join(path.dirname(configPath), `.${path.basename(configPath)}.cache.json`);
+  const stat = fs.statSync(configPath, { bigint: true });
+  const mtimeNs = stat.mtimeNs.toString();
+  const size = Number(stat.size);
+  let snapshot = null;
+
+  try {
+    snapshot = JSON.parse(fs.readFileSync(cachePath, 'utf8'));
+  } catch (error) {
+    snapshot = null;
+  }
+  if (!snapshot || snapshot.version !== CACHE_VERSION || !snapshot.source) {
+    snapshot = null;
+  }
+
+  if (snapshot && snapshot.source.mtime_ns === mtimeNs && snapshot.source.size === size) {
+    return snapshot.config;
+  }
+
+  const configData = fs.readFileSync(configPath);
+  const sha256 = crypto.createHash('sha256').update(configData).digest('hex');
+  // Touched but not edited: refresh the stamp without re-parsing
+  const config = snapshot && snapshot.source.sha256 === sha256
+    ? snapshot.config
+    : normalizeConfig(yaml.load(configData.toString('utf8')));
+
+  writeSnapshot(cachePath, {
+    version: CACHE_VERSION,
+    source: { mtime_ns: mtimeNs, size, sha256 },
+    config
+  });
+  return config;
+};
+
 // API endpoint to read config.yml
 app.get('/api/config', (req, res) => {
   try {
@@ -29,9 +121,8 @@ app.get('/api/config', (req, res) => {
       });
     }
 
-    // Read and parse the YAML file
-    const configData = fs.readFileSync(configPath, 'utf8');
-    const config = yaml.load(configData);
+    // Read the cached snapshot, or parse the YAML file if it changed
+    const config = readConfig(configPath);
     
     // Return the configuration
     res.json(config);
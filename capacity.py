@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Capacity planning for Kerberos.io agents
+Estimates what every agent needs from its camera profile (resolution, frame rate, codec,
+recording), sizes its limits from that estimate and refuses plans the host cannot hold. Profiles
+detected from the cameras' own stream descriptions take the place of the configured one
+"""
+
+import math
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from ip_ranges import IPRangeSet
+from placement import format_cpulist
+
+RESOLUTIONS = {
+    '480p': (854, 480),
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+    '1440p': (2560, 1440),
+    '4mp': (2688, 1520),
+    '5mp': (2592, 1944),
+    '4k': (3840, 2160),
+    '2160p': (3840, 2160),
+}
+
+DEFAULT_PROFILE = {'resolution': '1080p', 'fps': 15, 'recording': True}
+
+# Demand of one agent; `kerberos calibrate` can replace these with measured figures
+DEFAULT_MODEL = {
+    'base_cpus': 0.05,              # idle agent: web interface, uploads, bookkeeping
+    'cpus_per_mpps': 0.006,         # decoding, per megapixel per second of video
+    'recording_cpus': 0.02,         # muxing recordings to disk
+    'base_memory_mb': 160,
+    'memory_mb_per_megapixel': 12,  # decoded frames in flight
+    'recording_memory_mb': 48,
+    'bits_per_pixel': 0.1,          # H.264 at typical camera settings, for bitrates
+}
+
+# Decoding cost and bitrate of other codecs relative to H.264 at the same size and frame rate
+CODECS = {
+    'h264': {'decode': 1.0, 'bits': 1.0},
+    'h265': {'decode': 1.5, 'bits': 0.6},
+    'mjpeg': {'decode': 0.8, 'bits': 8.0},   # every frame is a full picture
+    'mpeg4': {'decode': 0.8, 'bits': 1.5},
+}
+
+# Recording settings the storage estimate assumes when agent_settings.recording leaves them out
+DEFAULT_RECORDING = {'duration': 30, 'pre_recording': 5, 'post_recording': 5}
+# Motion triggers a recording every 10 minutes on average
+RECORDINGS_PER_DAY = 24 * 6
+
+DEFAULT_CAPACITY = {
+    'reserve_cpus': 1.0,        # left for the host and the Docker daemon
+    'reserve_memory': '1g',
+    'max_utilization': 0.8,     # share of the rest the agents' expected load may use
+    'headroom': 0.5,            # limits are the estimate plus this share of it
+}
+
+MB = 1024 ** 2
+
+
+def parse_resolution(value: Any) -> Tuple[int, int]:
+    """Width and height from '1080p', '4k' or '1920x1080'"""
+    text = str(value).strip().lower()
+    if text in RESOLUTIONS:
+        return RESOLUTIONS[text]
+    width, _, height = text.partition('x')
+    if not (width.isdigit() and height.isdigit()):
+        raise ValueError(f"Invalid resolution '{value}': use e.g. 1080p, 4k or 1920x1080")
+    return int(width), int(height)
+
+
+def host_capacity() -> Dict[str, float]:
+    """CPUs this process may run on and physical memory in bytes"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        import psutil
+        memory = psutil.virtual_memory().total
+    return {'cpus': float(cpus), 'memory': float(memory)}
+
+
+def profile_settings(camera_config: Dict[str, Any]) -> List[Tuple[Optional[IPRangeSet], Dict[str, Any]]]:
+    """Camera profiles in match order: the cameras.profiles overrides, the detected profiles, then the default.
+
+    The default profile takes recording, duration, pre_recording and
+    post_recording from agent_settings.recording unless cameras.profile
+    sets them. Cameras with the same detected stream (see
+    with_stream_profiles) share one profile built on the default.
+    """
+    recording = (camera_config.get('agent_settings') or {}).get('recording') or {}
+    default = dict(DEFAULT_PROFILE)
+    if 'enabled' in recording:
+        default['recording'] = bool(recording['enabled'])
+    for key in DEFAULT_RECORDING:
+        if key in recording:
+            default[key] = recording[key]
+    default.update(camera_config.get('profile') or {})
+
+    profiles = []
+    for i, entry in enumerate(camera_config.get('profiles') or []):
+        cameras = entry.get('cameras')
+        if not cameras:
+            raise ValueError(f"cameras.profiles[{i}] needs a 'cameras' list of addresses or ranges")
+        cameras = [cameras] if isinstance(cameras, (str, dict)) else cameras
+        profile = dict(default, **{k: v for k, v in entry.items() if k != 'cameras'})
+        profile.setdefault('name', f"profile-{i + 1}")
+        profiles.append((IPRangeSet.from_specs(cameras), profile))
+
+    groups: Dict[Tuple[Tuple[str, Any], ...], List[str]] = {}
+    for ip, detected in (camera_config.get('detected') or {}).items():
+        groups.setdefault(tuple(sorted(detected.items())), []).append(ip)
+    for i, (detected, ips) in enumerate(groups.items()):
+        profile = dict(default, **dict(detected))
+        profile['name'] = f"detected-{i + 1}"
+        profiles.append((IPRangeSet.from_specs(ips), profile))
+    default.setdefault('name', 'default')
+    profiles.append((None, default))
+
+    for _, profile in profiles:
+        parse_resolution(profile['resolution'])
+        if float(profile['fps']) <= 0:
+            raise ValueError(f"Camera profile '{profile['name']}' needs a positive fps")
+    return profiles
+
+
+def model_settings(capacity: Optional[Dict[str, Any]]) -> Dict[str, float]:
+    """Costs of the demand model: the defaults, then the last `kerberos calibrate` fit, then docker.capacity.model"""
+    capacity = capacity or {}
+    return dict(DEFAULT_MODEL, **(capacity.get('calibrated') or {}), **(capacity.get('model') or {}))
+
+
+def with_calibrated_model(config: Dict[str, Any], model: Optional[Dict[str, float]]) -> Dict[str, Any]:
+    """Config with the costs fitted by `kerberos calibrate` as docker.capacity.calibrated"""
+    if not model:
+        return config
+    docker = dict(config.get('docker') or {})
+    docker['capacity'] = dict(docker.get('capacity') or {}, calibrated=model)
+    return dict(config, docker=docker)
+
+
+def with_stream_profiles(config: Dict[str, Any], detected: Optional[Dict[str, Dict[str, Any]]]) -> Dict[str, Any]:
+    """Config with the stream profiles detected by address ('cameras.stream_detection') as cameras.detected"""
+    if not detected:
+        return config
+    return dict(config, cameras=dict(config.get('cameras') or {}, detected=detected))
+
+
+def profile_for(profiles: List[Tuple[Optional[IPRangeSet], Dict[str, Any]]], camera_ip: str) -> int:
+    """Index of the first profile covering a camera"""
+    for i, (cameras, _) in enumerate(profiles):
+        if cameras is None or camera_ip in cameras:
+            return i
+    return len(profiles) - 1
+
+
+def capacity_settings(limits: Any, capacity: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Validate docker.capacity; None unless docker.limits is 'auto'"""
+    if limits != 'auto':
+        return None
+    from engine_backend import parse_memory
+
+    settings = dict(DEFAULT_CAPACITY, **(capacity or {}))
+    result = {
+        'reserve_cpus': float(settings['reserve_cpus']),
+        'reserve_memory': parse_memory(settings['reserve_memory']),
+        'max_utilization': float(settings['max_utilization']),
+        'headroom': float(settings['headroom']),
+        'cpus': float(settings['cpus']) if 'cpus' in settings else None,
+        'memory': parse_memory(settings['memory']) if 'memory' in settings else None,
+        'model': model_settings(settings),
+    }
+    if not 0 < result['max_utilization'] <= 1:
+        raise ValueError("docker.capacity.max_utilization must be between 0 and 1")
+    if result['headroom'] < 0:
+        raise ValueError("docker.capacity.headroom cannot be negative")
+    return result
+
+
+def estimate(profile: Dict[str, Any], model: Dict[str, float]) -> Dict[str, float]:
+    """Expected CPUs, memory (bytes), video bitrate (bits per second) and recordings (bytes per day) of one agent"""
+    width, height = parse_resolution(profile['resolution'])
+    megapixels = width * height / 1e6
+    fps = float(profile['fps'])
+    recording = bool(profile.get('recording'))
+    codec = CODECS.get(str(profile.get('codec', 'h264')).lower(), CODECS['h264'])
+
+    cpus = model['base_cpus'] + model['cpus_per_mpps'] * megapixels * fps * codec['decode']
+    memory_mb = model['base_memory_mb'] + model['memory_mb_per_megapixel'] * megapixels
+    bitrate = float(profile.get('bitrate') or width * height * fps * model['bits_per_pixel'] * codec['bits'])
+    storage = 0.0
+    if recording:
+        cpus += model['recording_cpus']
+        settings = {key: float(profile.get(key, value)) for key, value in DEFAULT_RECORDING.items()}
+        # The pre-recording buffer holds the encoded stream
+        memory_mb += model['recording_memory_mb'] + bitrate / 8 * settings['pre_recording'] / MB
+        storage = bitrate / 8 * sum(settings.values()) * RECORDINGS_PER_DAY
+    return {'cpus': cpus, 'memory': memory_mb * MB, 'bitrate': bitrate, 'storage': storage}
+
+
+class CapacityPlan:
+    """Per-agent limits from camera profiles, checked against the host.
+
+    Limits depend only on a camera's profile, so they are computed while
+    services stream out; check() walks the whole fleet once to compare the
+    totals (and, with CPU placement, each slot) with what the host offers.
+    Memory limits must fit the host outright since memory cannot be
+    reclaimed from a running agent; CPU limits may overlap, but the
+    expected CPU load has to stay under max_utilization.
+    """
+
+    def __init__(self, settings: Dict[str, Any], profiles: List[Tuple[Optional[IPRangeSet], Dict[str, Any]]],
+                 host: Optional[Dict[str, float]] = None):
+        self.settings = settings
+        self.profiles = profiles
+        self.model = settings['model']
+        measured = host or host_capacity()
+        self.host = {'cpus': settings['cpus'] or measured['cpus'],
+                     'memory': settings['memory'] or measured['memory']}
+        self.estimates = [estimate(profile, self.model) for _, profile in profiles]
+
+    def limits_for(self, index: int) -> Dict[str, str]:
+        """docker.limits-style limits for agents of one profile"""
+        factor = 1 + self.settings['headroom']
+        demand = self.estimates[index]
+        cpus = math.ceil(demand['cpus'] * factor * 100) / 100
+        # Whole 16 MB steps keep the limits readable
+        memory_mb = math.ceil(demand['memory'] * factor / MB / 16) * 16
+        return {'cpus': f"{cpus:g}", 'memory': f"{memory_mb}m"}
+
+    def limits(self, camera_ip: str) -> Dict[str, str]:
+        return self.limits_for(profile_for(self.profiles, camera_ip))
+
+    def usable(self, cpus: Optional[float] = None) -> Dict[str, float]:
+        """CPUs the expected load may use and memory the limits may add up to"""
+        cpus = (self.host['cpus'] - self.settings['reserve_cpus']) if cpus is None else cpus
+        return {'cpus': max(0.0, cpus * self.settings['max_utilization']),
+                'memory': max(0.0, self.host['memory'] - self.settings['reserve_memory'])}
+
+    def summary(self, ips) -> Dict[str, Any]:
+        """Cameras, expected load and limits per profile, plus fleet totals"""
+        counts = [0] * len(self.profiles)
+        for ip in ips:
+            counts[profile_for(self.profiles, ip)] += 1
+        rows = []
+        for (_, profile), demand, count in zip(self.profiles, self.estimates, counts):
+            limits = self.limits_for(len(rows))
+            rows.append({'name': profile['name'], 'resolution': profile['resolution'],
+                         'fps': profile['fps'], 'codec': profile.get('codec'),
+                         'recording': bool(profile.get('recording')),
+                         'cameras': count, 'cpus': demand['cpus'], 'memory': demand['memory'],
+                         'bitrate': demand['bitrate'], 'limits': limits})
+        from engine_backend import parse_memory
+        return {
+            'profiles': rows,
+            'cpus': sum(r['cpus'] * r['cameras'] for r in rows),
+            'memory': sum(r['memory'] * r['cameras'] for r in rows),
+            'memory_limits': sum(parse_memory(r['limits']['memory']) * r['cameras'] for r in rows),
+            'cpu_limits': sum(float(r['limits']['cpus']) * r['cameras'] for r in rows),
+        }
+
+    def review(self, ips, placement=None) -> Dict[str, Any]:
+        """summary() plus what the host offers ('usable') and why it cannot hold the fleet ('problems').
+
+        With CPU placement the agents can only use the pinned CPUs, and the
+        expected load of the agents sharing each slot is also checked
+        against that slot.
+        """
+        review = self.summary(ips)
+        pinned = sum(len(cpus) for _, cpus in placement.slots) if placement else None
+        usable = review['usable'] = self.usable(pinned)
+        problems = review['problems'] = []
+        if review['memory_limits'] > usable['memory']:
+            problems.append(f"memory limits add up to {review['memory_limits'] / 1024 ** 3:.1f} GB, but only "
+                            f"{usable['memory'] / 1024 ** 3:.1f} GB is left after the reserve")
+        if review['cpus'] > usable['cpus']:
+            problems.append(f"agents are expected to use {review['cpus']:.1f} CPUs, more than the "
+                            f"{usable['cpus']:.1f} available at {self.settings['max_utilization']:.0%} utilization")
+        if placement and not problems:
+            load: Dict[Tuple[int, ...], float] = {}
+            for i, ip in enumerate(ips):
+                slot = tuple(placement.assign(i)[1])
+                load[slot] = load.get(slot, 0.0) + self.estimates[profile_for(self.profiles, ip)]['cpus']
+            if load:
+                slot, cpus = max(load.items(), key=lambda item: item[1])
+                size = len(slot) * self.settings['max_utilization']
+                if cpus > size:
+                    problems.append(f"agents pinned to CPUs {format_cpulist(list(slot))} are expected to use "
+                                    f"{cpus:.2f} CPUs, more than their {size:.2f}")
+        return review
+
+    def check(self, ips, placement=None) -> Dict[str, Any]:
+        """review() of a plan; raises ValueError if it oversubscribes the host"""
+        review = self.review(ips, placement)
+        if review['problems']:
+            raise ValueError("Capacity plan does not fit this host: " + "; ".join(review['problems']))
+        return review
+
+
+def fleet_demand(config: Dict[str, Any]) -> Dict[str, float]:
+    """Cameras and their expected CPUs, memory (bytes) and recordings (bytes per day) in total, from the camera profiles"""
+    from ip_ranges import camera_ips
+
+    camera_config = config.get('cameras', {}) or {}
+    model = model_settings((config.get('docker') or {}).get('capacity'))
+    profiles = profile_settings(camera_config)
+    counts = [0] * len(profiles)
+    ips = camera_ips(camera_config)
+    if len(profiles) == 1:
+        counts[0] = len(ips)
+    else:
+        for ip in ips:
+            counts[profile_for(profiles, ip)] += 1
+    estimates = [estimate(profile, model) for _, profile in profiles]
+    return {'cameras': len(ips),
+            'cpus': sum(d['cpus'] * n for d, n in zip(estimates, counts)),
+            'memory': sum(d['memory'] * n for d, n in zip(estimates, counts)),
+            'storage': sum(d['storage'] * n for d, n in zip(estimates, counts))}
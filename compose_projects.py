@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Compose project runner for Kerberos.io agents
+Drives one or more docker-compose projects (shards) concurrently with a bounded worker pool
+"""
+
+import time
+from collections import namedtuple
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from deploy_state import chunked, load_state
+
+ComposeProject = namedtuple('ComposeProject', ['name', 'file', 'project', 'services'])
+ProjectResult = namedtuple('ProjectResult', ['project', 'returncode', 'stdout', 'stderr', 'elapsed'])
+
+DEFAULT_MAX_PARALLEL = 4
+
+
+def load_projects(compose_file: str, deployed: bool = False) -> List[ComposeProject]:
+    """Projects recorded by the last generate (or deploy), or the single default compose file"""
+    state = load_state(compose_file)
+    key = 'deployed_shards' if deployed and 'deployed_shards' in state else 'shards'
+    shards = state.get(key) or []
+    if not shards:
+        return [ComposeProject('default', compose_file, None, None)]
+    return [ComposeProject(s['name'], s['file'], s['project'], s['services']) for s in shards]
+
+
+def projects_exist(compose_file: str) -> bool:
+    """Whether every compose file of the current layout is present on disk"""
+    return all(Path(p.file).exists() for p in load_projects(compose_file))
+
+
+def service_projects(shards: Sequence[Dict]) -> Dict[str, Optional[str]]:
+    """Map service name -> compose project name for a recorded shard layout"""
+    return {name: shard['project'] for shard in shards for name in shard['services']}
+
+
+def compose_command(project: ComposeProject, args: List[str]) -> List[str]:
+    """Build the docker-compose argv for a project"""
+    cmd = ['docker-compose']
+    if project.project:
+        cmd += ['-f', project.file, '-p', project.project]
+    return cmd + args
+
+
+def plan_commands(projects: Iterable[ComposeProject], args: List[str],
+                  services: Optional[Iterable[str]] = None) -> List[Tuple[ComposeProject, List[List[str]]]]:
+    """Expand a compose command into per-project invocations.
+
+    When services are given, each project only receives the services it owns,
+    in batches run one after another, and projects owning none are skipped.
+    """
+    jobs = []
+    wanted = set(services) if services is not None else None
+    for project in projects:
+        if wanted is None:
+            jobs.append((project, [compose_command(project, args)]))
+            continue
+        owned = wanted if project.services is None else [s for s in project.services if s in wanted]
+        commands = [compose_command(project, args + batch) for batch in chunked(sorted(owned))]
+        if commands:
+            jobs.append((project, commands))
+    return jobs
+
+
+def _run_job(job: Tuple[ComposeProject, List[List[str]]]) -> ProjectResult:
+    import subprocess
+    project, commands = job
+    started = time.monotonic()
+    returncode, stdout, stderr = 0, [], []
+    for cmd in commands:
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True)
+        except FileNotFoundError:
+            returncode = 127
+            stderr.append("Docker Compose not found. Please install Docker and Docker Compose.")
+            break
+        stdout.append(result.stdout)
+        stderr.append(result.stderr)
+        returncode = result.returncode
+        if returncode != 0:
+            break
+    return ProjectResult(project, returncode, ''.join(stdout), ''.join(stderr), time.monotonic() - started)
+
+
+def run_commands(jobs: List[Tuple[ComposeProject, List[List[str]]]],
+                 max_parallel: int = DEFAULT_MAX_PARALLEL) -> List[ProjectResult]:
+    """Run each project's commands on a bounded thread pool, returning results in job order"""
+    if len(jobs) <= 1:
+        return [_run_job(job) for job in jobs]
+    # Imported here (like subprocess above) so commands that never run compose start fast
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=max(1, min(max_parallel, len(jobs)))) as pool:
+        return list(pool.map(_run_job, jobs))
+
+
+def stream_commands(jobs: List[Tuple[ComposeProject, List[List[str]]]]) -> int:
+    """Run every command of every project at once with output passed through, until all exit.
+
+    For commands that never finish on their own, such as 'logs -f', so each
+    shard is shown at the same time; Ctrl+C terminates them all. Returns
+    the highest exit status. Raises FileNotFoundError without docker-compose.
+    """
+    import subprocess
+    processes = []
+    try:
+        for _, commands in jobs:
+            for cmd in commands:
+                processes.append(subprocess.Popen(cmd))
+        return max((process.wait() for process in processes), default=0)
+    except BaseException:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        raise
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+Docker Compose generation for Kerberos.io agents
+Streams services to the output file one at a time so memory stays flat for large fleets
+"""
+
+import ipaddress
+import os
+import textwrap
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import yaml
+
+from deploy_state import service_hash
+from capacity import CapacityPlan, capacity_settings, profile_settings
+from ip_ranges import camera_ips
+from multi_host import host_settings
+from placement import CpuPlacement, placement_settings
+from ports import agent_ports
+
+# Anchor names used by the compact output mode
+AGENT_ANCHOR = 'kerberos-agent'
+ENV_ANCHOR = 'kerberos-env'
+
+# Prefer the libyaml-backed dumper; fall back to pure Python when it is not compiled in
+try:
+    from yaml import CSafeDumper as ComposeDumper
+except ImportError:
+    from yaml import SafeDumper as ComposeDumper
+
+
+def compose_settings(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Extract the values needed to generate services from the configuration"""
+    global_config = config.get('global', {})
+    camera_config = config.get('cameras', {})
+    docker_config = config.get('docker', {})
+
+    connection = camera_config.get('connection', {})
+    limits = docker_config.get('limits', {}) or {}
+    hosts = host_settings(docker_config.get('hosts'))
+    if hosts and docker_config.get('backend') != 'engine':
+        raise ValueError("docker.hosts needs docker.backend: engine, which talks to every host directly")
+    # 'auto' sizes every agent from its camera profile instead of one static limit
+    capacity = capacity_settings(limits, docker_config.get('capacity'))
+    if capacity:
+        limits = {}
+
+    return {
+        'kerberos_image': global_config.get('kerberos_image', 'kerberos/agent:latest'),
+        'network_name': global_config.get('network_name', 'kerberos-network'),
+        'config_base_path': global_config.get('config_base_path', './configs'),
+        'recordings_base_path': global_config.get('recordings_base_path', './recordings'),
+        'ips': camera_ips(camera_config),
+        'protocol': connection.get('protocol', 'rtsp'),
+        'port': connection.get('port', 554),
+        'username': connection.get('username', 'admin'),
+        'password': connection.get('password', 'password'),
+        'stream_path': connection.get('stream_path', '/stream1'),
+        'web_port_start': docker_config.get('web_port_start', 8080),
+        'rtmp_port_start': docker_config.get('rtmp_port_start', 1935),
+        'ports': docker_config.get('assigned_ports') or {},
+        'restart_policy': docker_config.get('restart_policy', 'unless-stopped'),
+        'limits': limits,
+        'custom_environment': config.get('custom_environment', {}) or {},
+        'shards': shard_settings(docker_config.get('shards'), hosts),
+        'compact': bool(docker_config.get('compact', False)),
+        'placement': placement_settings(docker_config.get('placement'), limits),
+        'capacity': capacity,
+        'profiles': profile_settings(camera_config) if capacity else None,
+        'hosts': hosts,
+    }
+
+
+def shard_settings(shards: Optional[Dict[str, Any]],
+                   hosts: Optional[List[Dict[str, Any]]] = None) -> Optional[Dict[str, Any]]:
+    """Validate the optional docker.shards section.
+
+    With docker.hosts every host is a shard of its own, with the cameras
+    the multi-host scheduler gives it.
+    """
+    if hosts:
+        if shards:
+            raise ValueError("docker.shards cannot be combined with docker.hosts, where every host is a shard")
+        return {'by': 'host', 'count': len(hosts), 'prefix': 24, 'project_prefix': 'kerberos',
+                'max_parallel': len(hosts)}
+    if not shards:
+        return None
+
+    by = shards.get('by', 'count')
+    if by not in ('count', 'subnet'):
+        raise ValueError(f"docker.shards.by must be 'count' or 'subnet', got '{by}'")
+
+    count = int(shards.get('count', 1))
+    prefix = int(shards.get('prefix', 24))
+    if by == 'count' and count < 1:
+        raise ValueError("docker.shards.count must be at least 1")
+    if by == 'subnet' and not 8 <= prefix <= 32:
+        raise ValueError("docker.shards.prefix must be between 8 and 32")
+
+    return {
+        'by': by,
+        'count': count,
+        'prefix': prefix,
+        'project_prefix': shards.get('project_prefix', 'kerberos'),
+        'max_parallel': int(shards.get('max_parallel', 4)),
+    }
+
+
+def shard_for(shards: Optional[Dict[str, Any]], camera_ip: str, index: int) -> Optional[str]:
+    """Shard name for a camera, or None when the fleet is not sharded"""
+    if shards is None or shards['by'] == 'host':
+        # Hosts are assigned by multi_host.schedule, which keeps state between runs
+        return None
+    if shards['by'] == 'subnet':
+        network = ipaddress.IPv4Network(f"{camera_ip}/{shards['prefix']}", strict=False)
+        return f"subnet-{str(network.network_address).replace('.', '-')}-{network.prefixlen}"
+    # Round-robin keeps shards balanced and appending cameras never moves existing ones
+    return f"shard-{index % shards['count']:02d}"
+
+
+def camera_name_for(camera_ip: str) -> str:
+    """Service and container name for a camera IP"""
+    return f"camera-{camera_ip.replace('.', '-')}"
+
+
+def web_port_of(service: Dict[str, Any]) -> Optional[int]:
+    """Host port published for the agent's web interface (container port 80)"""
+    for mapping in service.get('ports', []):
+        host_port, _, container_port = str(mapping).rpartition(':')
+        if container_port == '80' and host_port:
+            return int(host_port.rsplit(':', 1)[-1])
+    return None
+
+
+def deploy_limits(limits: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Compose deploy section for docker.limits, or None when no limits are set"""
+    deploy_resources = {}
+    if 'memory' in limits:
+        deploy_resources['memory'] = limits['memory']
+    if 'cpus' in limits:
+        deploy_resources['cpus'] = limits['cpus']
+    return {'resources': {'limits': deploy_resources}} if deploy_resources else None
+
+
+def agent_template(settings: Dict[str, Any]) -> Dict[str, Any]:
+    """Fields shared by every agent service, hoisted into x-kerberos-agent in compact mode"""
+    template = {
+        'image': settings['kerberos_image'],
+        'restart': settings['restart_policy'],
+        'networks': [settings['network_name']],
+        'environment': {
+            'AGENT_STREAM_WEBRTC': 'true',
+            'AGENT_STREAM_RECORDING': 'true',
+            **settings['custom_environment']
+        }
+    }
+    deploy = deploy_limits(settings['limits'])
+    if deploy:
+        template['deploy'] = deploy
+    return template
+
+
+def build_service(settings: Dict[str, Any], camera_ip: str, index: int) -> Tuple[str, Dict[str, Any]]:
+    """Build the compose service definition for a single camera"""
+    camera_name = camera_name_for(camera_ip)
+    rtsp_url = (f"{settings['protocol']}://{settings['username']}:{settings['password']}"
+                f"@{camera_ip}:{settings['port']}{settings['stream_path']}")
+    web_port, rtmp_port = agent_ports(settings, camera_name, index)
+    config_base_path = settings['config_base_path']
+    recordings_base_path = settings['recordings_base_path']
+
+    service = {
+        'image': settings['kerberos_image'],
+        'container_name': camera_name,
+        'restart': settings['restart_policy'],
+        'networks': [settings['network_name']],
+        'ports': [
+            f"{web_port}:80",
+            f"{rtmp_port}:1935"
+        ],
+        'volumes': [
+            f"{config_base_path}/{camera_name}:/home/agent/data/config",
+            f"{recordings_base_path}/{camera_name}:/home/agent/data/recordings"
+        ],
+        'environment': {
+            'AGENT_NAME': camera_name,
+            'AGENT_CAPTURE_IPCAMERA_RTSP': rtsp_url,
+            'AGENT_CAPTURE_IPCAMERA_SUB_RTSP': rtsp_url,
+            'AGENT_STREAM_WEBRTC': 'true',
+            'AGENT_STREAM_RECORDING': 'true',
+            **settings['custom_environment']
+        }
+    }
+
+    # Add resource limits if specified
+    deploy = deploy_limits(settings['limits'])
+    if deploy:
+        service['deploy'] = deploy
+
+    return camera_name, service
+
+
+def iter_services(settings: Dict[str, Any], ip_list: Iterable[str],
+                  create_dirs: bool = True) -> Iterator[Tuple[str, Dict[str, Any], Optional[str]]]:
+    """Yield (name, service, shard) lazily, creating per-camera directories on the way"""
+    placement = CpuPlacement(settings['placement']) if settings['placement'] else None
+    plan = CapacityPlan(settings['capacity'], settings['profiles']) if settings['capacity'] else None
+    config_base_path = Path(settings['config_base_path'])
+    recordings_base_path = Path(settings['recordings_base_path'])
+
+    if create_dirs:
+        config_base_path.mkdir(parents=True, exist_ok=True)
+        recordings_base_path.mkdir(parents=True, exist_ok=True)
+
+    for i, camera_ip in enumerate(ip_list):
+        camera_name, service = build_service(settings, camera_ip, i)
+        if plan:
+            service['deploy'] = deploy_limits(plan.limits(camera_ip))
+        if placement:
+            placement.apply(service, i)
+
+        if create_dirs:
+            (config_base_path / camera_name).mkdir(exist_ok=True)
+            (recordings_base_path / camera_name).mkdir(exist_ok=True)
+
+        yield camera_name, service, shard_for(settings['shards'], camera_ip, i)
+
+
+def dump_yaml(data: Any) -> str:
+    """Serialize data as block-style YAML using the fastest available dumper"""
+    return yaml.dump(data, Dumper=ComposeDumper, default_flow_style=False,
+                     indent=2, sort_keys=False)
+
+
+class ComposeWriter:
+    """Write a docker-compose file incrementally, one service at a time.
+
+    The file is written to a temporary path and moved into place on a clean
+    exit, so an interrupted run never leaves a truncated compose file behind.
+    A content hash of every service is kept for incremental redeploys.
+
+    Given a template, the writer emits it once as an x-kerberos-agent
+    extension and each service merges it back with '<<', writing only
+    the fields that differ from it.
+    """
+
+    def __init__(self, path: str, network_name: str, template: Optional[Dict[str, Any]] = None):
+        self.path = Path(path)
+        self.network_name = network_name
+        self.template = template
+        self.tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        self.service_count = 0
+        self.service_hashes: Dict[str, str] = {}
+        self._fh = None
+
+    def __enter__(self) -> 'ComposeWriter':
+        self._fh = open(self.tmp_path, 'w')
+        self._fh.write(dump_yaml({
+            'version': '3.8',
+            'networks': {
+                self.network_name: {
+                    'driver': 'bridge'
+                }
+            }
+        }))
+        if self.template is not None:
+            self._fh.write(self._template_yaml())
+        self._fh.write("services:\n")
+        return self
+
+    def add_service(self, name: str, service: Dict[str, Any]):
+        """Append a single service under the services mapping"""
+        compact = self._compact_yaml(name, service) if self.template is not None else None
+        self._fh.write(textwrap.indent(compact or dump_yaml({name: service}), '  '))
+        self.service_hashes[name] = service_hash(service)
+        self.service_count += 1
+
+    def _template_yaml(self) -> str:
+        fields = {k: v for k, v in self.template.items() if k != 'environment'}
+        text = f"x-{AGENT_ANCHOR}: &{AGENT_ANCHOR}\n" + textwrap.indent(dump_yaml(fields), '  ')
+        text += f"  environment: &{ENV_ANCHOR}\n"
+        return text + textwrap.indent(dump_yaml(self.template['environment']), '    ')
+
+    def _compact_yaml(self, name: str, service: Dict[str, Any]) -> Optional[str]:
+        """Service YAML merging the template, or None if the merge would not reproduce it.
+
+        Merge keys are shallow and only add fields, so a service can use the
+        template only when it defines every template field and environment key.
+        """
+        template = self.template
+        shared_env = template['environment']
+        env = service.get('environment', {})
+        if not all(k in service for k in template) or not all(k in env for k in shared_env):
+            return None
+
+        fields = {k: v for k, v in service.items()
+                  if k != 'environment' and template.get(k) != v}
+        env_fields = {k: v for k, v in env.items() if shared_env.get(k) != v}
+
+        text = f"{name}:\n  <<: *{AGENT_ANCHOR}\n"
+        if fields:
+            text += textwrap.indent(dump_yaml(fields), '  ')
+        text += f"  environment:\n    <<: *{ENV_ANCHOR}\n"
+        if env_fields:
+            text += textwrap.indent(dump_yaml(env_fields), '    ')
+        return text
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.service_count == 0 and exc_type is None:
+            # A bare 'services:' key would load as null; emit an explicit empty mapping
+            self._fh.write("  {}\n")
+        self._fh.close()
+        if exc_type is None:
+            os.replace(self.tmp_path, self.path)
+        else:
+            try:
+                self.tmp_path.unlink()
+            except FileNotFoundError:
+                pass
+        return False
+
+
+class ShardedComposeWriter:
+    """Route services to one compose file per shard, each its own compose project.
+
+    Without shard settings everything goes to the single compose file, so
+    callers can use this writer unconditionally. Shard files are opened on
+    first use and all of them are committed or discarded together.
+    """
+
+    def __init__(self, compose_file: str, network_name: str, shards: Optional[Dict[str, Any]] = None,
+                 template: Optional[Dict[str, Any]] = None):
+        self.compose_file = Path(compose_file)
+        self.network_name = network_name
+        self.shards = shards
+        self.template = template
+        self.service_hashes: Dict[str, str] = {}
+        self._writers: Dict[Optional[str], ComposeWriter] = {}
+        self._services: Dict[Optional[str], List[str]] = {}
+
+    @property
+    def service_count(self) -> int:
+        return len(self.service_hashes)
+
+    def shard_file(self, shard: Optional[str]) -> Path:
+        if shard is None:
+            return self.compose_file
+        return self.compose_file.with_name(f"{self.compose_file.stem}.{shard}.yml")
+
+    def __enter__(self) -> 'ShardedComposeWriter':
+        return self
+
+    def add_service(self, name: str, service: Dict[str, Any], shard: Optional[str] = None):
+        writer = self._writers.get(shard)
+        if writer is None:
+            writer = ComposeWriter(str(self.shard_file(shard)), self.network_name,
+                                   self.template).__enter__()
+            self._writers[shard] = writer
+            self._services[shard] = []
+        writer.add_service(name, service)
+        self.service_hashes[name] = writer.service_hashes[name]
+        self._services[shard].append(name)
+
+    def layout(self) -> List[Dict[str, Any]]:
+        """Shard layout as recorded in the state file (empty when unsharded)"""
+        if self.shards is None:
+            return []
+        return [{
+            'name': shard,
+            'file': str(self.shard_file(shard)),
+            'project': f"{self.shards['project_prefix']}-{shard}",
+            'services': self._services[shard],
+        } for shard in sorted(self._writers)]
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.shards is None and not self._writers:
+            # Keep producing a valid (empty) compose file for an empty fleet
+            self._writers[None] = ComposeWriter(str(self.compose_file), self.network_name,
+                                                   self.template).__enter__()
+            self._services[None] = []
+        for writer in self._writers.values():
+            writer.__exit__(exc_type, exc, tb)
+        return False
+
+
+def fleet_writer(compose_file: str, settings: Dict[str, Any]) -> ShardedComposeWriter:
+    """Writer configured from compose settings (sharding and compact output)"""
+    template = agent_template(settings) if settings['compact'] else None
+    return ShardedComposeWriter(compose_file, settings['network_name'], settings['shards'], template)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Configuration loading for Kerberos.io agents
+Keeps a normalized JSON snapshot of config.yml keyed by mtime, size and content hash,
+so commands (and the camera viewer API) only re-parse the YAML when it actually changes
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+CACHE_VERSION = 1
+
+# Top-level sections that are always present (as mappings) in a loaded config
+SECTIONS = ('global', 'cameras', 'docker', 'custom_environment')
+
+
+def cache_path(config_file: str) -> Path:
+    """Snapshot stored next to the config (config.yml -> .config.yml.cache.json)"""
+    path = Path(config_file)
+    return path.with_name(f".{path.name}.cache.json")
+
+
+def normalize_config(config: Any) -> Dict[str, Any]:
+    """Validate the parsed YAML and make sure the main sections are mappings"""
+    if config is None:
+        config = {}
+    if not isinstance(config, dict):
+        raise ValueError("Configuration must be a mapping of sections")
+    for section in SECTIONS:
+        value = config.get(section)
+        if value is None:
+            config[section] = {}
+        elif not isinstance(value, dict):
+            raise ValueError(f"Configuration section '{section}' must be a mapping")
+    return config
+
+
+def parse_config(data: bytes) -> Dict[str, Any]:
+    """Parse YAML with libyaml when available"""
+    import yaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    try:
+        config = normalize_config(yaml.load(data, Loader=loader))
+    except yaml.YAMLError as e:
+        raise ValueError(f"Invalid YAML in config file: {e}")
+    # Round-trip through JSON so a fresh parse and a cached snapshot look identical
+    # (dates become strings, keys become strings)
+    return json.loads(json.dumps(config, default=str))
+
+
+def _read_snapshot(path: Path) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, 'r') as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get('version') != CACHE_VERSION:
+        return None
+    return snapshot
+
+
+def _write_snapshot(path: Path, snapshot: Dict[str, Any]):
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+    except OSError:
+        # A read-only config directory just means no cache
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+
+
+def load_config(config_file: str) -> Dict[str, Any]:
+    """Load the configuration, using the cached snapshot when the file is unchanged.
+
+    Raises FileNotFoundError if the file is missing and ValueError if it is
+    not valid YAML or not a valid configuration.
+    """
+    path = Path(config_file)
+    stat = path.stat()
+    snapshot_path = cache_path(config_file)
+    snapshot = _read_snapshot(snapshot_path)
+
+    # mtime and size are stored as strings so the viewer (JavaScript) can compare them exactly
+    mtime_ns, size = str(stat.st_mtime_ns), stat.st_size
+    if snapshot and snapshot['source']['mtime_ns'] == mtime_ns and snapshot['source']['size'] == size:
+        return snapshot['config']
+
+    import hashlib
+    data = path.read_bytes()
+    digest = hashlib.sha256(data).hexdigest()
+    if snapshot and snapshot['source']['sha256'] == digest:
+        # Touched but not edited: refresh the stamp without re-parsing
+        config = snapshot['config']
+    else:
+        config = parse_config(data)
+
+    _write_snapshot(snapshot_path, {
+        'version': CACHE_VERSION,
+        'source': {'mtime_ns': mtime_ns, 'size': size, 'sha256': digest},
+        'config': config,
+    })
+    return config
+
+
+def config_summary(config: Dict[str, Any]) -> List[Tuple[str, str]]:
+    """(setting, value) rows shown by 'kerberos info'"""
+    from ip_ranges import camera_ips
+
+    global_config = config.get('global', {})
+    docker_config = config.get('docker', {})
+    rows = [
+        ("Kerberos Image", global_config.get('kerberos_image', 'N/A')),
+        ("Network Name", global_config.get('network_name', 'N/A')),
+        ("Config Path", global_config.get('config_base_path', 'N/A')),
+        ("Recordings Path", global_config.get('recordings_base_path', 'N/A')),
+    ]
+    try:
+        ip_list = camera_ips(config.get('cameras', {}))
+        rows.append(("IP Range", ip_list.describe()))
+        rows.append(("Camera Count", len(ip_list)))
+    except ValueError as e:
+        rows.append(("IP Range", f"N/A ({e})"))
+    rows += [
+        ("Web Port Start", docker_config.get('web_port_start', 'N/A')),
+        ("RTMP Port Start", docker_config.get('rtmp_port_start', 'N/A')),
+        ("Restart Policy", docker_config.get('restart_policy', 'N/A')),
+        ("Backend", docker_config.get('backend', 'compose')),
+        ("Timezone", config.get('custom_environment', {}).get('TZ', 'N/A')),
+    ]
+    return [(label, str(value)) for label, value in rows]
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Deployment state for Kerberos.io agents
+Tracks per-service content hashes next to docker-compose.yml so redeploys only touch what changed
+"""
+
+import json
+import os
+from collections import namedtuple
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List
+
+ServiceDiff = namedtuple('ServiceDiff', ['added', 'changed', 'removed', 'unchanged'])
+
+
+def service_hash(service: Dict[str, Any]) -> str:
+    """Stable content hash of a service definition"""
+    import hashlib
+    canonical = json.dumps(service, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]
+
+
+def state_path(compose_file: str) -> Path:
+    """State file stored alongside the compose file (docker-compose.yml -> docker-compose.state.json)"""
+    compose_path = Path(compose_file)
+    return compose_path.with_name(f"{compose_path.stem}.state.json")
+
+
+def load_state(compose_file: str) -> Dict[str, Any]:
+    """Load the state file, returning an empty state if it is missing or unreadable"""
+    try:
+        with open(state_path(compose_file), 'r') as f:
+            state = json.load(f)
+        return state if isinstance(state, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(compose_file: str, state: Dict[str, Any]):
+    """Atomically write the state file"""
+    path = state_path(compose_file)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def update_state(compose_file: str, **sections):
+    """Replace individual top-level sections of the state file"""
+    state = load_state(compose_file)
+    state.update(sections)
+    save_state(compose_file, state)
+
+
+def generated_config(config: Dict[str, Any], state: Dict[str, Any]) -> Dict[str, Any]:
+    """Config as the last generate saw it: the cameras 'generate --only-live' kept,
+    the stream profiles it detected, the calibrated costs it sized limits with
+    and the host ports it assigned"""
+    from ip_ranges import with_live_cameras
+    from ports import with_assigned_ports
+
+    config = with_live_cameras(config, state.get('live_cameras'))
+    if state.get('stream_profiles') or state.get('capacity_model'):
+        from capacity import with_calibrated_model, with_stream_profiles
+        config = with_stream_profiles(config, state.get('stream_profiles'))
+        config = with_calibrated_model(config, state.get('capacity_model'))
+    return with_assigned_ports(config, state.get('ports'))
+
+
+def diff_services(previous: Dict[str, str], current: Dict[str, str]) -> ServiceDiff:
+    """Compare two name -> hash mappings"""
+    added, changed, unchanged = [], [], []
+    for name, digest in current.items():
+        if name not in previous:
+            added.append(name)
+        elif previous[name] != digest:
+            changed.append(name)
+        else:
+            unchanged.append(name)
+    removed = [name for name in previous if name not in current]
+    return ServiceDiff(added, changed, removed, unchanged)
+
+
+def chunked(items: Iterable[str], size: int = 200) -> Iterator[List[str]]:
+    """Split service names into batches that keep command lines short"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Docker Engine API client for Kerberos.io agents
+Minimal standard-library client with pooled keep-alive connections over the Unix socket or TCP
+"""
+
+import http.client
+import json
+import os
+import socket
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote, urlencode, urlparse
+
+DEFAULT_DOCKER_HOST = 'unix:///var/run/docker.sock'
+
+# Name prefix shared by every agent container (see compose_writer.camera_name_for)
+AGENT_NAME_PREFIX = 'camera-'
+
+# Labels set on containers created through the Engine API backend
+CAMERA_LABEL = 'io.kerberos.swarm.camera'
+HASH_LABEL = 'io.kerberos.swarm.hash'
+
+
+class DockerEngineError(Exception):
+    """Error response (or connection failure) from the Docker Engine API"""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix domain socket"""
+
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class DockerEngine:
+    """Thread-safe Engine API client.
+
+    Connections are kept alive and reused from a small pool, so repeated
+    calls (and calls from worker threads) do not reconnect every time.
+    base_url accepts the DOCKER_HOST forms unix:///path, tcp://host:port
+    and http://host:port.
+    """
+
+    def __init__(self, base_url: Optional[str] = None, timeout: float = 30, pool_size: int = 8):
+        self.base_url = base_url or os.environ.get('DOCKER_HOST') or DEFAULT_DOCKER_HOST
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._pool: List[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+
+        parsed = urlparse(self.base_url)
+        if parsed.scheme == 'unix':
+            self._socket_path = parsed.path
+            self._host = None
+        elif parsed.scheme in ('tcp', 'http'):
+            self._socket_path = None
+            self._host = parsed.netloc
+        else:
+            raise DockerEngineError(f"Unsupported Docker host: {self.base_url}")
+
+    def _new_connection(self, timeout: Optional[float]) -> http.client.HTTPConnection:
+        if self._socket_path:
+            return UnixHTTPConnection(self._socket_path, timeout=timeout)
+        return http.client.HTTPConnection(self._host, timeout=timeout)
+
+    def _acquire(self) -> Tuple[http.client.HTTPConnection, bool]:
+        """A pooled keep-alive connection, or a fresh one; and whether it was pooled"""
+        with self._lock:
+            if self._pool:
+                return self._pool.pop(), True
+        return self._new_connection(self.timeout), False
+
+    def _release(self, conn: http.client.HTTPConnection):
+        with self._lock:
+            if len(self._pool) < self.pool_size:
+                self._pool.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """Close all pooled connections"""
+        with self._lock:
+            pool, self._pool = self._pool, []
+        for conn in pool:
+            conn.close()
+
+    def request(self, method: str, path: str, params: Optional[Dict[str, Any]] = None,
+                body: Any = None, decode: bool = True) -> Any:
+        """Perform a request and return the decoded JSON body (or text, or None).
+
+        With decode=False the raw body text is returned, for endpoints that
+        stream several JSON documents such as image pulls.
+        """
+        if params:
+            path = f"{path}?{urlencode(params)}"
+        payload = json.dumps(body).encode('utf-8') if body is not None else None
+        headers = {'Content-Type': 'application/json'} if payload is not None else {}
+
+        # A pooled keep-alive connection may have been closed by the server. Only then, and only if it
+        # failed before any response arrived, has the Engine not acted on the request: retry once on a
+        # fresh connection. Anything else is not retried, so a restart or create never runs twice.
+        conn, reused = self._acquire()
+        while True:
+            response = None
+            try:
+                conn.request(method, path, body=payload, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (ConnectionError, http.client.HTTPException, socket.timeout, OSError) as e:
+                conn.close()
+                if reused and response is None and isinstance(e, (http.client.RemoteDisconnected, BrokenPipeError,
+                                                                  ConnectionResetError)):
+                    conn, reused = self._new_connection(self.timeout), False
+                    continue
+                raise DockerEngineError(f"Cannot connect to Docker at {self.base_url}: {e}")
+            break
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(conn)
+
+        content_type = response.getheader('Content-Type', '')
+        if response.status >= 400:
+            message = data.decode('utf-8', 'replace').strip()
+            if 'json' in content_type:
+                try:
+                    message = json.loads(data).get('message', message)
+                except ValueError:
+                    pass
+            raise DockerEngineError(f"{method} {path} failed ({response.status}): {message}",
+                                    status=response.status)
+        if not data:
+            return None
+        if decode and 'json' in content_type:
+            return json.loads(data)
+        return data.decode('utf-8', 'replace')
+
+    def stream(self, method: str, path: str, params: Optional[Dict[str, Any]] = None,
+               timeout: Optional[float] = None) -> http.client.HTTPResponse:
+        """Open a long-lived response (logs, events) on its own connection.
+
+        The caller reads from the returned response and closes it; the
+        connection is never returned to the pool. Another thread can end a
+        blocked read with abort_stream().
+        """
+        if params:
+            path = f"{path}?{urlencode(params)}"
+        conn = self._new_connection(timeout)
+        try:
+            conn.request(method, path)
+            sock = conn.sock
+            response = conn.getresponse()
+        except (ConnectionError, http.client.HTTPException, OSError) as e:
+            conn.close()
+            raise DockerEngineError(f"Cannot connect to Docker at {self.base_url}: {e}")
+        if response.status >= 400:
+            message = response.read().decode('utf-8', 'replace').strip()
+            conn.close()
+            raise DockerEngineError(f"{method} {path} failed ({response.status}): {message}",
+                                    status=response.status)
+        response.engine_socket = sock
+        return response
+
+    @staticmethod
+    def abort_stream(response: http.client.HTTPResponse):
+        """Make a read blocked on a stream() response return, from any thread"""
+        try:
+            response.engine_socket.shutdown(socket.SHUT_RDWR)
+        except (AttributeError, OSError):
+            pass
+
+    def ping(self) -> bool:
+        return self.request('GET', '/_ping') == 'OK'
+
+    def version(self) -> Dict[str, Any]:
+        return self.request('GET', '/version')
+
+    def info(self) -> Dict[str, Any]:
+        """System-wide information, including NCPU and MemTotal"""
+        return self.request('GET', '/info')
+
+    def containers(self, filters: Optional[Dict[str, List[str]]] = None,
+                   all: bool = True) -> List[Dict[str, Any]]:
+        """List containers in a single call, optionally filtered server-side"""
+        params = {'all': '1' if all else '0'}
+        if filters:
+            params['filters'] = json.dumps(filters)
+        return self.request('GET', '/containers/json', params=params)
+
+    def inspect_container(self, name: str) -> Dict[str, Any]:
+        return self.request('GET', f"/containers/{quote(name)}/json")
+
+    def container_stats(self, name: str) -> Dict[str, Any]:
+        """One stats sample, without waiting for the second reading docker stats takes"""
+        return self.request('GET', f"/containers/{quote(name)}/stats", params={'stream': 0, 'one-shot': 1})
+
+    def container_logs(self, name: str, follow: bool = False, tail: str = 'all') -> http.client.HTTPResponse:
+        """Raw (multiplexed) log stream of a container"""
+        return self.stream('GET', f"/containers/{quote(name)}/logs",
+                           params={'stdout': 1, 'stderr': 1, 'follow': int(follow), 'tail': tail})
+
+    def events(self, filters: Optional[Dict[str, List[str]]] = None) -> http.client.HTTPResponse:
+        """Stream of newline-separated JSON events from now on"""
+        params = {'filters': json.dumps(filters)} if filters else None
+        return self.stream('GET', '/events', params=params)
+
+    def create_container(self, name: str, spec: Dict[str, Any]) -> str:
+        """Create a container and return its id"""
+        return self.request('POST', '/containers/create', params={'name': name}, body=spec)['Id']
+
+    def start_container(self, name: str):
+        try:
+            self.request('POST', f"/containers/{quote(name)}/start")
+        except DockerEngineError as e:
+            if e.status != 304:  # already running
+                raise
+
+    def stop_container(self, name: str, timeout: int = 10):
+        try:
+            self.request('POST', f"/containers/{quote(name)}/stop", params={'t': timeout})
+        except DockerEngineError as e:
+            if e.status != 304:  # already stopped
+                raise
+
+    def restart_container(self, name: str, timeout: int = 10):
+        self.request('POST', f"/containers/{quote(name)}/restart", params={'t': timeout})
+
+    def remove_container(self, name: str, force: bool = False, volumes: bool = False):
+        try:
+            self.request('DELETE', f"/containers/{quote(name)}",
+                         params={'force': int(force), 'v': int(volumes)})
+        except DockerEngineError as e:
+            if e.status != 404:  # already gone
+                raise
+
+    def ensure_network(self, name: str):
+        """Create a bridge network unless it already exists"""
+        try:
+            self.request('GET', f"/networks/{quote(name)}")
+        except DockerEngineError as e:
+            if e.status != 404:
+                raise
+            self.request('POST', '/networks/create',
+                         body={'Name': name, 'Driver': 'bridge', 'CheckDuplicate': True})
+
+    def remove_network(self, name: str):
+        try:
+            self.request('DELETE', f"/networks/{quote(name)}")
+        except DockerEngineError as e:
+            if e.status not in (404, 409):  # gone, or still used by other containers
+                raise
+
+    def image_id(self, image: str) -> str:
+        return self.request('GET', f"/images/{quote(image, safe='/:')}/json")['Id']
+
+    def tag_image(self, source: str, image: str):
+        """Tag an image (by id or name) as repository:tag"""
+        repo, _, tag = image.rpartition(':')
+        if not repo or '/' in tag:
+            repo, tag = image, 'latest'
+        self.request('POST', f"/images/{quote(source, safe='/:')}/tag", params={'repo': repo, 'tag': tag})
+
+    def pull_image(self, image: str, on_progress: Optional[Callable[[Dict[str, Any]], None]] = None):
+        """Pull an image, raising DockerEngineError if the progress stream reports an error.
+
+        on_progress, if given, receives every progress message as it arrives.
+        """
+        name, _, tag = image.rpartition(':')
+        if not name or '/' in tag:
+            name, tag = image, 'latest'
+        response = self.stream('POST', '/images/create', params={'fromImage': name, 'tag': tag},
+                               timeout=self.timeout)
+        try:
+            for line in iter(response.readline, b''):
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    continue
+                if not isinstance(message, dict):
+                    continue
+                if message.get('error'):
+                    raise DockerEngineError(f"Pulling {image} failed: {message['error']}")
+                if on_progress:
+                    on_progress(message)
+        except (OSError, http.client.HTTPException) as e:
+            raise DockerEngineError(f"Pulling {image} failed: {e}")
+        finally:
+            response.close()
+
+
+def agent_containers(engine: DockerEngine) -> List[Dict[str, Any]]:
+    """Summaries of every agent container, in one filtered list call"""
+    containers = engine.containers(filters={'name': [AGENT_NAME_PREFIX]})
+    agents = []
+    for container in containers:
+        names = [n.lstrip('/') for n in container.get('Names', [])]
+        name = next((n for n in names if n.startswith(AGENT_NAME_PREFIX)), None)
+        if name is None:
+            continue
+        labels = container.get('Labels') or {}
+        agents.append({
+            'name': name,
+            'id': container.get('Id', '')[:12],
+            'image': container.get('Image'),
+            'image_id': container.get('ImageID'),
+            'state': container.get('State'),
+            'status': container.get('Status'),
+            'hash': labels.get(HASH_LABEL),
+            'project': labels.get('com.docker.compose.project'),
+        })
+    return sorted(agents, key=lambda c: c['name'])
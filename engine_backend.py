@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Docker Engine API backend for Kerberos.io agents
+Creates, starts, stops and removes agent containers directly through the Engine API,
+many at a time on a bounded worker pool, instead of shelling out to docker-compose
+"""
+
+import re
+import time
+from collections import namedtuple
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from deploy_state import service_hash
+from docker_engine import CAMERA_LABEL, HASH_LABEL, DockerEngine, DockerEngineError, agent_containers
+from placement import NUMA_NODE_KEY
+
+BatchResult = namedtuple('BatchResult', ['action', 'succeeded', 'skipped', 'failed', 'elapsed'])
+
+BACKENDS = ('compose', 'engine')
+DEFAULT_MAX_WORKERS = 16
+DEFAULT_STOP_TIMEOUT = 10
+
+# Compose commands the engine backend carries out itself; everything else (ps, logs) still
+# goes through docker-compose, which finds the containers through their compose labels
+ENGINE_COMMANDS = ('up', 'down', 'pull', 'restart')
+
+MEMORY_UNITS = {'': 1, 'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+
+def backend_settings(docker_config: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate docker.backend and the optional docker.engine section"""
+    backend = docker_config.get('backend', 'compose')
+    if backend not in BACKENDS:
+        raise ValueError(f"docker.backend must be one of {', '.join(BACKENDS)}, got '{backend}'")
+    engine = docker_config.get('engine') or {}
+    max_workers = int(engine.get('max_workers', DEFAULT_MAX_WORKERS))
+    if max_workers < 1:
+        raise ValueError("docker.engine.max_workers must be at least 1")
+    return {
+        'backend': backend,
+        'max_workers': max_workers,
+        'stop_timeout': int(engine.get('stop_timeout', DEFAULT_STOP_TIMEOUT)),
+    }
+
+
+def parse_memory(value: Any) -> int:
+    """Bytes for a compose-style memory limit such as '512m' or '1g'"""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([bkmg]?)b?\s*', str(value).lower())
+    if not match:
+        raise ValueError(f"Invalid memory limit: {value}")
+    return int(float(match.group(1)) * MEMORY_UNITS[match.group(2)])
+
+
+def default_project(compose_file: str) -> str:
+    """Project name docker-compose derives from the compose file's directory"""
+    name = Path(compose_file).absolute().parent.name.lower()
+    return re.sub(r'[^a-z0-9_-]', '', name) or 'default'
+
+
+def restart_policy(policy: str) -> Dict[str, Any]:
+    name, _, retries = str(policy).partition(':')
+    if name == 'no':
+        return {'Name': ''}
+    result = {'Name': name}
+    if retries:
+        result['MaximumRetryCount'] = int(retries)
+    return result
+
+
+def container_spec(name: str, service: Dict[str, Any], project: str, base_dir: Path) -> Dict[str, Any]:
+    """Engine API create body for a compose service definition.
+
+    The compose project/service labels let 'docker-compose ps' and 'logs'
+    find containers created here; the hash label lets 'up' leave unchanged
+    agents running.
+    """
+    exposed, bindings = {}, {}
+    for mapping in service.get('ports', []):
+        host_port, container_port = str(mapping).rsplit(':', 1)
+        key = container_port if '/' in container_port else f"{container_port}/tcp"
+        exposed[key] = {}
+        bindings[key] = [{'HostPort': host_port}]
+
+    binds = []
+    for volume in service.get('volumes', []):
+        host, target = str(volume).split(':', 1)
+        if host.startswith('.'):
+            host = str((base_dir / host).resolve())
+        binds.append(f"{host}:{target}")
+
+    host_config = {
+        'Binds': binds,
+        'PortBindings': bindings,
+        'RestartPolicy': restart_policy(service.get('restart', 'no')),
+    }
+    limits = (service.get('deploy') or {}).get('resources', {}).get('limits', {})
+    if 'memory' in limits:
+        host_config['Memory'] = parse_memory(limits['memory'])
+    if 'cpus' in limits:
+        host_config['NanoCpus'] = int(float(limits['cpus']) * 1e9)
+    if 'cpuset' in service:
+        host_config['CpusetCpus'] = service['cpuset']
+    if NUMA_NODE_KEY in service:
+        host_config['CpusetMems'] = str(service[NUMA_NODE_KEY])
+
+    networks = service.get('networks') or []
+    if networks:
+        host_config['NetworkMode'] = networks[0]
+
+    return {
+        'Image': service['image'],
+        'Env': [f"{key}={value}" for key, value in service.get('environment', {}).items()],
+        'ExposedPorts': exposed,
+        'Labels': {
+            CAMERA_LABEL: name,
+            HASH_LABEL: service_hash(service),
+            'com.docker.compose.project': project,
+            'com.docker.compose.service': name,
+            'com.docker.compose.oneoff': 'False',
+            'com.docker.compose.container-number': '1',
+        },
+        'HostConfig': host_config,
+        'NetworkingConfig': {'EndpointsConfig': {net: {'Aliases': [name]} for net in networks}},
+    }
+
+
+class EngineBackend:
+    """Drive agent containers through the Engine API with a bounded thread pool.
+
+    One list call tells us what exists; every create/start/stop/remove then
+    runs on up to max_workers threads sharing pooled keep-alive connections,
+    so large fleets are limited by the Docker daemon rather than by a
+    single serial docker-compose process.
+    """
+
+    def __init__(self, settings: Dict[str, Any], compose_file: str, options: Dict[str, Any],
+                 engine: Optional[DockerEngine] = None, project: Optional[str] = None,
+                 owned: Optional[Iterable[str]] = None):
+        self.settings = settings
+        self.compose_file = compose_file
+        self.max_workers = options['max_workers']
+        self.stop_timeout = options['stop_timeout']
+        self.engine = engine or DockerEngine(pool_size=self.max_workers)
+        self.base_dir = Path(compose_file).absolute().parent
+        shards = settings['shards']
+        self.project_prefix = shards['project_prefix'] if shards else None
+        # With docker.hosts, the project and the agents this host runs come from the recorded layout
+        self.project = project
+        self.owned = set(owned) if owned is not None else None
+
+    def project_for(self, shard: Optional[str]) -> str:
+        if shard is None:
+            return default_project(self.compose_file)
+        return f"{self.project_prefix}-{shard}"
+
+    def services(self, names: Optional[Iterable[str]] = None) -> List[Tuple[str, Dict[str, Any], str]]:
+        """(name, service, project) for every configured agent, or only the named ones"""
+        from compose_writer import iter_services
+
+        wanted = set(names) if names is not None else None
+        return [(name, service, self.project or self.project_for(shard))
+                for name, service, shard in iter_services(self.settings, self.settings['ips'])
+                if (wanted is None or name in wanted) and (self.owned is None or name in self.owned)]
+
+    def status(self) -> List[Dict[str, Any]]:
+        return agent_containers(self.engine)
+
+    def map(self, action: str, fn: Callable[[Any], bool], items: List[Tuple[str, Any]]) -> BatchResult:
+        """Run fn(item) for each (name, item) on the worker pool.
+
+        fn returns False when it had nothing to do; exceptions are collected
+        per container instead of aborting the batch.
+        """
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+
+        started = time.monotonic()
+        succeeded, skipped, failed = [], [], {}
+        if items:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(items))) as pool:
+                futures = {pool.submit(fn, item): name for name, item in items}
+                for future in as_completed(futures):
+                    name = futures[future]
+                    try:
+                        (succeeded if future.result() is not False else skipped).append(name)
+                    except (DockerEngineError, OSError, ValueError) as e:
+                        failed[name] = str(e)
+        return BatchResult(action, sorted(succeeded), sorted(skipped), failed, time.monotonic() - started)
+
+    def up(self, names: Optional[Iterable[str]] = None, force_recreate: bool = False) -> BatchResult:
+        """Create and start agents, leaving running agents with an unchanged definition alone"""
+        existing = {c['name']: c for c in self.status()}
+        self.engine.ensure_network(self.settings['network_name'])
+
+        def bring_up(item):
+            name, service, project = item
+            spec = container_spec(name, service, project, self.base_dir)
+            current = existing.get(name)
+            if current and not force_recreate and current['hash'] == spec['Labels'][HASH_LABEL] \
+                    and current['project'] == project:
+                if current['state'] == 'running':
+                    return False
+                self.engine.start_container(name)
+                return True
+            if current:
+                self.engine.remove_container(name, force=True)
+            self.engine.create_container(name, spec)
+            self.engine.start_container(name)
+            return True
+
+        return self.map('up', bring_up, [(item[0], item) for item in self.services(names)])
+
+    def down(self, names: Optional[Iterable[str]] = None, volumes: bool = False) -> BatchResult:
+        """Stop and remove agents (all agent containers when no names are given)"""
+        existing = [c['name'] for c in self.status()]
+        targets = existing if names is None else [n for n in existing if n in set(names)]
+
+        def take_down(name):
+            self.engine.stop_container(name, timeout=self.stop_timeout)
+            self.engine.remove_container(name, volumes=volumes)
+
+        result = self.map('down', take_down, [(name, name) for name in targets])
+        if names is None and not result.failed:
+            self.engine.remove_network(self.settings['network_name'])
+        return result
+
+    def restart(self, names: Optional[Iterable[str]] = None) -> BatchResult:
+        """Restart existing agents in place (all agent containers when no names are given)"""
+        existing = [c['name'] for c in self.status()]
+        targets = existing if names is None else [n for n in existing if n in set(names)]
+
+        def restart(name):
+            self.engine.restart_container(name, timeout=self.stop_timeout)
+
+        return self.map('restart', restart, [(name, name) for name in targets])
+
+    def remove(self, names: Iterable[str]) -> BatchResult:
+        """Force-remove agents, whether or not they are still configured"""
+        def force_remove(name):
+            self.engine.remove_container(name, force=True)
+
+        return self.map('remove', force_remove, [(name, name) for name in names])
+
+    def pull(self) -> BatchResult:
+        """Pull every distinct agent image at the same time"""
+        from image_pull import distinct_images, service_images
+        return self.map('pull', self.engine.pull_image,
+                        [(image, image) for image in distinct_images(service_images(self.settings))])
+
+    def run(self, command: List[str], services: Optional[List[str]] = None) -> BatchResult:
+        """Carry out a docker-compose style command ('up -d', 'down -v', 'pull', 'restart')"""
+        action = command[0]
+        if action == 'up':
+            if '-d' not in command:
+                raise ValueError("The engine backend only runs agents detached; "
+                                 "set docker.backend: compose to run in the foreground")
+            return self.up(services, force_recreate='--force-recreate' in command)
+        if action == 'down':
+            return self.down(services, volumes='-v' in command)
+        if action == 'pull':
+            return self.pull()
+        if action == 'restart':
+            return self.restart(services)
+        raise ValueError(f"The engine backend does not handle '{action}'")
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+Fake Docker Engine API for Kerberos.io development
+Serves the subset of the Engine API used by the engine backend and the daemon from memory,
+so fleet operations can be tried and timed without Docker:
+
+    python fake_engine.py --port 2375 --latency 50 &
+    DOCKER_HOST=tcp://127.0.0.1:2375 kerberos start
+
+Several instances on different ports stand in for the hosts of docker.hosts.
+"""
+
+import argparse
+import json
+import queue
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+class FakeEngine:
+    """In-memory containers, networks and images"""
+
+    def __init__(self, latency: float = 0.0, log_interval: float = 1.0, unchanged_pulls: bool = False,
+                 cpus: int = 8, memory: int = 16 * 1024 ** 3, name: str = 'fake'):
+        self.latency = latency
+        self.cpus = cpus
+        self.memory = memory
+        self.name = name
+        self.log_interval = log_interval
+        self.unchanged_pulls = unchanged_pulls
+        self.lock = threading.Lock()
+        self.containers = {}
+        self.networks = {'bridge': {'Name': 'bridge', 'Id': 'bridge', 'Driver': 'bridge'}}
+        self.images = {}  # tag -> image id
+        self.image_ids = set()  # every id ever pulled; replaced images stay around untagged
+        self.requests = 0
+        self.subscribers = []
+
+    def emit(self, container, action):
+        """Publish a container event to every /events listener"""
+        event = {'Type': 'container', 'Action': action, 'status': action, 'id': container['Id'],
+                 'Actor': {'ID': container['Id'], 'Attributes': {'name': container['Name']}},
+                 'time': int(time.time()), 'timeNano': time.time_ns()}
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.put(event)
+
+    def set_state(self, container, running, exit_code=0):
+        now = time.strftime('%Y-%m-%dT%H:%M:%S.000000000Z', time.gmtime())
+        state = dict(container['State'])
+        state.update(Status='running' if running else 'exited', Running=running)
+        if running:
+            # Not a real process, so agent_stats falls back to the stats endpoint
+            state.update(StartedAt=now, Pid=4000000 + len(self.containers))
+            container['started'] = time.monotonic()
+        else:
+            state.update(FinishedAt=now, ExitCode=exit_code, Pid=0)
+        container['State'] = state
+
+    def find(self, ref):
+        with self.lock:
+            for container in self.containers.values():
+                if container['Id'].startswith(ref) or container['Name'] == ref:
+                    return container
+        return None
+
+    def summary(self, container):
+        return {
+            'Id': container['Id'],
+            'Names': ['/' + container['Name']],
+            'Image': container['Config']['Image'],
+            'ImageID': container['Image'],
+            'Labels': container['Config'].get('Labels') or {},
+            'State': container['State']['Status'],
+            'Status': 'Up' if container['State']['Running'] else 'Exited (0)',
+        }
+
+    def list_containers(self, query):
+        filters = json.loads(query.get('filters', ['{}'])[0])
+        show_all = query.get('all', ['0'])[0] not in ('0', 'false')
+        result = []
+        with self.lock:
+            containers = list(self.containers.values())
+        for container in containers:
+            labels = container['Config'].get('Labels') or {}
+            if not show_all and not container['State']['Running']:
+                continue
+            if any(name not in container['Name'] for name in filters.get('name', [])):
+                continue
+            matched = True
+            for label in filters.get('label', []):
+                key, _, value = label.partition('=')
+                if key not in labels or (value and labels[key] != value):
+                    matched = False
+            if matched:
+                result.append(self.summary(container))
+        return result
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body in one segment so keep-alive clients are not held up by delayed ACKs
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+    engine: FakeEngine = None
+
+    def log_message(self, *args):
+        pass
+
+    def handle(self):
+        # Followers (logs, events) simply disconnect when they are done
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def finish(self):
+        try:
+            super().finish()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def reply(self, status, body=None, content_type='application/json'):
+        if body is None:
+            data = b''
+        elif isinstance(body, (bytes, str)):
+            data = body.encode('utf-8') if isinstance(body, str) else body
+        else:
+            data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        if data:
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def error(self, status, message):
+        self.reply(status, {'message': message})
+
+    def body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def route(self, method):
+        engine = self.engine
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = [unquote(p) for p in url.path.split('/') if p]
+        # Strip an optional API version prefix such as /v1.41
+        if parts and parts[0].startswith('v1.'):
+            parts = parts[1:]
+        payload = self.body()
+        with engine.lock:
+            engine.requests += 1
+        if method != 'GET' and engine.latency:
+            time.sleep(engine.latency)
+
+        if parts == ['_ping']:
+            return self.reply(200, 'OK', 'text/plain')
+        if parts == ['version']:
+            return self.reply(200, {'Version': 'fake', 'ApiVersion': '1.41'})
+        if parts == ['info']:
+            with engine.lock:
+                running = sum(1 for c in engine.containers.values() if c['State']['Running'])
+                total = len(engine.containers)
+            return self.reply(200, {'Name': engine.name, 'NCPU': engine.cpus, 'MemTotal': engine.memory,
+                                    'Containers': total, 'ContainersRunning': running,
+                                    'ServerVersion': 'fake'})
+        if parts == ['events']:
+            return self.events()
+        if parts == ['containers', 'json']:
+            return self.reply(200, engine.list_containers(query))
+        if parts == ['containers', 'create'] and method == 'POST':
+            name = query.get('name', [''])[0]
+            if engine.find(name):
+                return self.error(409, f'Conflict. The container name "/{name}" is already in use')
+            with engine.lock:
+                image_id = engine.images.get(payload.get('Image'), payload.get('Image'))
+            container = {
+                'Id': uuid.uuid4().hex + uuid.uuid4().hex,
+                'Name': name,
+                'Image': image_id,
+                'Config': {'Image': payload.get('Image'), 'Env': payload.get('Env', []),
+                           'Labels': payload.get('Labels', {})},
+                'HostConfig': payload.get('HostConfig', {}),
+                'State': {'Status': 'created', 'Running': False, 'ExitCode': 0},
+                'RestartCount': 0,
+            }
+            with engine.lock:
+                engine.containers[container['Id']] = container
+            engine.emit(container, 'create')
+            return self.reply(201, {'Id': container['Id'], 'Warnings': []})
+        if len(parts) >= 2 and parts[0] == 'containers':
+            container = engine.find(parts[1])
+            if container is None:
+                return self.error(404, f'No such container: {parts[1]}')
+            action = parts[2] if len(parts) > 2 else None
+            if action == 'json':
+                return self.reply(200, dict(container, Name='/' + container['Name']))
+            if action == 'start':
+                if container['State']['Running']:
+                    return self.reply(304)
+                engine.set_state(container, True)
+                engine.emit(container, 'start')
+                return self.reply(204)
+            if action == 'logs':
+                return self.logs(container, query)
+            if action == 'stats':
+                return self.reply(200, self.stats(container))
+            if action == 'restart':
+                engine.set_state(container, True)
+                container['RestartCount'] += 1
+                engine.emit(container, 'restart')
+                return self.reply(204)
+            if action == 'stop':
+                if not container['State']['Running']:
+                    return self.reply(304)
+                engine.set_state(container, False)
+                engine.emit(container, 'die')
+                engine.emit(container, 'stop')
+                return self.reply(204)
+            if action is None and method == 'DELETE':
+                if container['State']['Running'] and query.get('force', ['0'])[0] in ('0', 'false'):
+                    return self.error(409, 'You cannot remove a running container')
+                with engine.lock:
+                    engine.containers.pop(container['Id'], None)
+                engine.emit(container, 'destroy')
+                return self.reply(204)
+        if parts == ['networks', 'create'] and method == 'POST':
+            name = payload.get('Name')
+            with engine.lock:
+                if name in engine.networks:
+                    return self.error(409, f'network with name {name} already exists')
+                engine.networks[name] = {'Name': name, 'Id': uuid.uuid4().hex, 'Driver': 'bridge'}
+            return self.reply(201, {'Id': engine.networks[name]['Id']})
+        if len(parts) == 2 and parts[0] == 'networks':
+            network = engine.networks.get(parts[1])
+            if network is None:
+                return self.error(404, f'network {parts[1]} not found')
+            if method == 'DELETE':
+                with engine.lock:
+                    engine.networks.pop(parts[1], None)
+                return self.reply(204)
+            return self.reply(200, network)
+        if parts == ['images', 'create'] and method == 'POST':
+            return self.pull(f"{query.get('fromImage', [''])[0]}:{query.get('tag', ['latest'])[0]}")
+        if len(parts) >= 3 and parts[0] == 'images' and parts[-1] in ('json', 'tag'):
+            ref = '/'.join(parts[1:-1])
+            image_id = engine.images.get(ref) or engine.images.get(f'{ref}:latest')
+            if image_id is None and ref in engine.image_ids:
+                image_id = ref
+            if image_id is None:
+                return self.error(404, f'No such image: {ref}')
+            if parts[-1] == 'json':
+                return self.reply(200, {'Id': image_id, 'RepoTags': [t for t, i in engine.images.items() if i == image_id]})
+            if parts[-1] == 'tag' and method == 'POST':
+                with engine.lock:
+                    engine.images[f"{query['repo'][0]}:{query.get('tag', ['latest'])[0]}"] = image_id
+                return self.reply(201)
+        return self.error(404, f'page not found: {method} {url.path}')
+
+    def pull(self, image):
+        """Stream pull progress for three layers over ten latency periods"""
+        with self.engine.lock:
+            known = image in self.engine.images
+            if not known or not self.engine.unchanged_pulls:
+                # Every pull brings a "newer" image, so updates and rollbacks can be tried
+                self.engine.images[image] = 'sha256:' + uuid.uuid4().hex
+                self.engine.image_ids.add(self.engine.images[image])
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        layers = [uuid.uuid4().hex[:12] for _ in range(3)]
+        messages = [{'status': f'Pulling from {image}', 'id': image.rpartition(':')[2]}]
+        if known and self.engine.unchanged_pulls:
+            messages += [{'status': 'Already exists', 'id': layer} for layer in layers]
+            messages.append({'status': f'Image is up to date for {image}'})
+        else:
+            for step in range(1, 4):
+                messages += [{'status': 'Downloading', 'id': layer,
+                              'progressDetail': {'current': step * 10 << 20, 'total': 30 << 20}} for layer in layers]
+            messages += [{'status': 'Pull complete', 'id': layer} for layer in layers]
+            messages.append({'status': f'Downloaded newer image for {image}'})
+        for message in messages:
+            time.sleep(self.engine.latency * 10 / len(messages))
+            self.wfile.write(json.dumps(message).encode('utf-8') + b'\r\n')
+            self.wfile.flush()
+
+    def stats(self, container):
+        """One-shot stats with counters growing at a steady, per-container rate"""
+        running = container['State']['Running']
+        uptime = time.monotonic() - container['started'] if running else 0
+        rate = 1 + int(container['Id'][:2], 16) % 20  # 1-20% of a core, ~rate * 25 KB/s of video
+        memory = (40 + rate * 3) * 1024 * 1024 if running else 0
+        return {
+            'read': time.strftime('%Y-%m-%dT%H:%M:%S.000000000Z', time.gmtime()),
+            'cpu_stats': {'cpu_usage': {'total_usage': int(uptime * rate * 1e7)}, 'online_cpus': 4},
+            'memory_stats': {'usage': memory + 8 * 1024 * 1024, 'limit': 8 * 1024 ** 3,
+                             'stats': {'inactive_file': 8 * 1024 * 1024}},
+            'networks': {'eth0': {'rx_bytes': int(uptime * rate * 25000), 'tx_bytes': int(uptime * 2000)}},
+        }
+
+    def logs(self, container, query):
+        """Multiplexed log stream: a few lines of history, then one line per interval when following"""
+        levels = ['info', 'info', 'debug', 'warning', 'error']
+
+        def frame(number):
+            level = levels[number % len(levels)]
+            line = f'time="{time.strftime("%Y-%m-%dT%H:%M:%S")}" level={level} msg="{container["Name"]} frame {number}"\n'
+            data = line.encode('utf-8')
+            return bytes([1 if level != 'error' else 2, 0, 0, 0]) + len(data).to_bytes(4, 'big') + data
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/vnd.docker.raw-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        tail = query.get('tail', ['all'])[0]
+        history = 5 if tail == 'all' else min(5, int(tail))
+        try:
+            for number in range(history):
+                self.wfile.write(frame(number))
+            self.wfile.flush()
+            number = history
+            while query.get('follow', ['0'])[0] not in ('0', 'false') and container['State']['Running']:
+                time.sleep(self.engine.log_interval)
+                self.wfile.write(frame(number))
+                self.wfile.flush()
+                number += 1
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def events(self):
+        """Stream container events as newline-separated JSON until the client goes away"""
+        subscriber = queue.Queue()
+        with self.engine.lock:
+            self.engine.subscribers.append(subscriber)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            self.wfile.flush()
+            while True:
+                try:
+                    event = subscriber.get(timeout=1)
+                except queue.Empty:
+                    continue
+                self.wfile.write(json.dumps(event).encode('utf-8') + b'\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with self.engine.lock:
+                self.engine.subscribers.remove(subscriber)
+
+    def do_GET(self):
+        self.route('GET')
+
+    def do_POST(self):
+        self.route('POST')
+
+    def do_DELETE(self):
+        self.route('DELETE')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a fake Docker Engine API from memory')
+    parser.add_argument('--host', default='127.0.0.1', help='Listen address (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=2375, help='Listen port (default: 2375)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Milliseconds added to every mutating request (default: 0)')
+    parser.add_argument('--log-interval', type=float, default=1.0,
+                        help='Seconds between log lines of each followed container (default: 1)')
+    parser.add_argument('--unchanged-pulls', action='store_true',
+                        help='Pulling an image that is already present keeps its id (default: always a new id)')
+    parser.add_argument('--cpus', type=int, default=8, help='CPUs reported by /info (default: 8)')
+    parser.add_argument('--memory', type=float, default=16,
+                        help='GB of memory reported by /info (default: 16)')
+    parser.add_argument('--name', default='fake', help='Host name reported by /info (default: fake)')
+    args = parser.parse_args()
+
+    Handler.engine = FakeEngine(args.latency / 1000, args.log_interval, args.unchanged_pulls,
+                                args.cpus, int(args.memory * 1024 ** 3), args.name)
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    print(f"Fake Docker Engine API on tcp://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
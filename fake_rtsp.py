@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Fake RTSP cameras for Kerberos.io development
+Answers OPTIONS and DESCRIBE on every address of a range, so camera scans can be tried and timed
+without cameras. On Linux every 127.x.y.z address reaches the loopback interface:
+
+    python fake_rtsp.py --ips 127.0.1.1-127.0.1.200 --port 8554 --silent 10 &
+    kerberos scan
+
+with cameras.ip_range 127.0.1.1 - 127.0.1.254 and cameras.connection.port 8554 in config.yml.
+"""
+
+import argparse
+import asyncio
+import base64
+import os
+
+from ip_ranges import IPRangeSet
+from rtsp_scan import AUTH_PARAM, authorization, parse_response
+
+REALM = 'fake-camera'
+
+
+class BitWriter:
+    """Big-endian bit writer with the Exp-Golomb codes of H.264 parameter sets"""
+
+    def __init__(self):
+        self.bits = []
+
+    def put(self, value: int, count: int):
+        self.bits.extend((value >> (count - 1 - i)) & 1 for i in range(count))
+
+    def ue(self, value: int):
+        code = value + 1
+        self.put(code, 2 * code.bit_length() - 1)
+
+    def data(self) -> bytes:
+        bits = self.bits + [1]  # rbsp_stop_one_bit
+        bits += [0] * (-len(bits) % 8)
+        raw = bytes(int(''.join(map(str, bits[i:i + 8])), 2) for i in range(0, len(bits), 8))
+        # Emulation prevention: no 00 00 followed by 00-03 inside a NAL unit
+        out, zeros = bytearray(), 0
+        for byte in raw:
+            if zeros >= 2 and byte <= 3:
+                out.append(3)
+                zeros = 0
+            out.append(byte)
+            zeros = zeros + 1 if byte == 0 else 0
+        return bytes(out)
+
+
+def h264_sps(width: int, height: int, fps: float) -> bytes:
+    """Baseline H.264 sequence parameter set for a size and frame rate, with VUI timing"""
+    writer = BitWriter()
+    writer.put(66, 8)  # profile_idc: Baseline
+    writer.put(0, 8)
+    writer.put(40, 8)  # level 4.0
+    writer.ue(0)  # seq_parameter_set_id
+    writer.ue(0)  # log2_max_frame_num_minus4
+    writer.ue(2)  # pic_order_cnt_type
+    writer.ue(1)  # max_num_ref_frames
+    writer.put(0, 1)
+    width_mbs, height_mbs = -(-width // 16), -(-height // 16)
+    writer.ue(width_mbs - 1)
+    writer.ue(height_mbs - 1)
+    writer.put(1, 1)  # frame_mbs_only_flag
+    writer.put(1, 1)  # direct_8x8_inference_flag
+    crop_right, crop_bottom = (width_mbs * 16 - width) // 2, (height_mbs * 16 - height) // 2
+    writer.put(1 if crop_right or crop_bottom else 0, 1)
+    if crop_right or crop_bottom:
+        for value in (0, crop_right, 0, crop_bottom):
+            writer.ue(value)
+    writer.put(1, 1)  # vui_parameters_present_flag
+    writer.put(0, 4)  # no aspect ratio, overscan, video signal or chroma location info
+    writer.put(1, 1)  # timing_info_present_flag
+    writer.put(1000, 32)
+    writer.put(round(fps * 2000), 32)
+    writer.put(1, 1)  # fixed_frame_rate_flag
+    writer.put(0, 5)  # no HRD parameters, pic_struct or restrictions
+    return bytes([0x67]) + writer.data()
+
+
+class FakeCamera:
+    """RTSP responses of one camera model, shared by every address.
+
+    Each address takes the next of the configured streams in turn, so a
+    range can mix camera models. With sprop the size and frame rate are
+    only announced inside the H.264 parameter sets, as many cameras do.
+    """
+
+    def __init__(self, path: str = '/stream1', username: str = '', password: str = '',
+                 streams=((1920, 1080, 15),), bitrate: int = 0, sprop: bool = False, latency: float = 0.0):
+        self.path = path
+        self.username = username
+        self.password = password
+        self.streams = list(streams)
+        self.bitrate = bitrate
+        self.sprop = sprop
+        self.latency = latency
+        self.nonce = os.urandom(8).hex()
+        self.requests = 0
+        self.assigned = {}
+
+    def sdp(self, ip: str) -> str:
+        width, height, fps = self.assigned.setdefault(ip, self.streams[len(self.assigned) % len(self.streams)])
+        lines = ["v=0", f"o=- 0 0 IN IP4 {ip}", "s=Fake camera", "t=0 0", "m=video 0 RTP/AVP 96"]
+        if self.bitrate:
+            lines.append(f"b=AS:{self.bitrate}")
+        lines.append("a=rtpmap:96 H264/90000")
+        if self.sprop:
+            sps = base64.b64encode(h264_sps(width, height, fps)).decode('ascii')
+            lines.append(f"a=fmtp:96 packetization-mode=1;sprop-parameter-sets={sps},aM48gA==")
+        else:
+            lines += [f"a=framerate:{fps:g}", f"a=x-dimensions:{width},{height}"]
+        return "\r\n".join(lines + ["a=control:track1", ""])
+
+    def authorized(self, method: str, headers) -> bool:
+        if not self.username:
+            return True
+        header = (headers.get('authorization') or [''])[0]
+        if not header.startswith('Digest '):
+            return False
+        params = {key.lower(): quoted or plain for key, quoted, plain in AUTH_PARAM.findall(header)}
+        expected = authorization(method, params.get('uri', ''),
+                                 [f'Digest realm="{REALM}", nonce="{self.nonce}"'], self.username, self.password)
+        return expected is not None and f'response="{params.get("response")}"' in expected
+
+    def respond(self, ip: str, method: str, url: str, headers) -> bytes:
+        cseq = (headers.get('cseq') or ['0'])[0]
+        extra, body = [], b''
+        if method == 'OPTIONS':
+            status = '200 OK'
+            extra.append("Public: OPTIONS, DESCRIBE, SETUP, PLAY, TEARDOWN")
+        elif method != 'DESCRIBE':
+            status = '405 Method Not Allowed'
+        elif not url.rstrip('/').endswith(self.path.rstrip('/')):
+            status = '404 Not Found'
+        elif not self.authorized(method, headers):
+            status = '401 Unauthorized'
+            extra.append(f'WWW-Authenticate: Digest realm="{REALM}", nonce="{self.nonce}"')
+        else:
+            status = '200 OK'
+            body = self.sdp(ip).encode('utf-8')
+            extra += ["Content-Type: application/sdp", f"Content-Base: {url}/"]
+        head = [f"RTSP/1.0 {status}", f"CSeq: {cseq}", "Server: fake-rtsp"] + extra
+        if body:
+            head.append(f"Content-Length: {len(body)}")
+        return ("\r\n".join(head) + "\r\n\r\n").encode('utf-8') + body
+
+    async def serve(self, ip: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request = parse_request(await reader.readuntil(b'\r\n\r\n'))
+                if request is None:
+                    break
+                method, url, headers = request
+                self.requests += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                writer.write(self.respond(ip, method, url, headers))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def parse_request(head: bytes):
+    """Method, URL and headers of a request head, or None if it is not RTSP"""
+    request_line, _, rest = head.partition(b'\r\n')
+    parts = request_line.decode('latin-1').split(' ')
+    if len(parts) != 3 or not parts[2].startswith('RTSP/'):
+        return None
+    # Requests and responses share the header syntax; borrow the response parser for the headers
+    headers = parse_response(b'RTSP/1.0 200 OK\r\n' + rest)['headers']
+    return parts[0], parts[1], headers
+
+
+async def silent(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Accept and never answer, like a camera that hangs"""
+    try:
+        await reader.read()
+    finally:
+        writer.close()
+
+
+async def run(camera: FakeCamera, ips: IPRangeSet, port: int, every_silent: int):
+    servers = []
+    for i, ip in enumerate(ips):
+        if every_silent and i % every_silent == every_silent - 1:
+            handler = silent
+        else:
+            def handler(reader, writer, ip=ip):
+                return camera.serve(ip, reader, writer)
+        servers.append(await asyncio.start_server(handler, ip, port))
+    print(f"{len(servers)} fake RTSP cameras on {ips.describe()} port {port}"
+          f"{f', every {every_silent}th silent' if every_silent else ''}")
+    await asyncio.gather(*(server.serve_forever() for server in servers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve fake RTSP cameras on a range of addresses')
+    parser.add_argument('--ips', default='127.0.1.1-127.0.1.50',
+                        help='Addresses to answer on, as in cameras.ip_ranges (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=8554, help='RTSP port (default: %(default)s)')
+    parser.add_argument('--path', default='/stream1', help='Stream path DESCRIBE answers (default: %(default)s)')
+    parser.add_argument('--username', default='', help='Require Digest authentication with this user')
+    parser.add_argument('--password', default='', help='Password for --username')
+    parser.add_argument('--resolution', default='1920x1080',
+                        help='Video size in the SDP; a comma-separated list is dealt over the addresses '
+                             '(default: %(default)s)')
+    parser.add_argument('--fps', default='15', help='Frame rate in the SDP, or a list like --resolution '
+                                                    '(default: %(default)s)')
+    parser.add_argument('--bitrate', type=int, default=0, help='Announce this bitrate in kbit/s (b=AS)')
+    parser.add_argument('--sprop', action='store_true',
+                        help='Announce size and frame rate only in the H.264 parameter sets')
+    parser.add_argument('--silent', type=int, default=0,
+                        help='Every Nth address accepts connections but never answers (default: none)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Milliseconds before every response (default: 0)')
+    args = parser.parse_args()
+
+    sizes = [tuple(int(n) for n in size.split('x')) for size in args.resolution.split(',')]
+    rates = [float(fps) for fps in args.fps.split(',')]
+    streams = [sizes[i % len(sizes)] + (rates[i % len(rates)],) for i in range(max(len(sizes), len(rates)))]
+    camera = FakeCamera(args.path, args.username, args.password, streams, args.bitrate, args.sprop,
+                        args.latency / 1000)
+    ips = IPRangeSet.from_specs([spec.strip() for spec in args.ips.split(',')])
+    try:
+        asyncio.run(run(camera, ips, args.port, args.silent))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+Open-file limit handling for Kerberos.io tools
+Raises the soft descriptor limit for commands that keep many sockets or files open at once
+"""
+
+
+def raise_fd_limit(wanted: int, reserve: int = 64) -> int:
+    """Raise the soft open-files limit towards wanted plus reserve; returns how many of wanted it allows.
+
+    The default soft limit of 1024 on most Linux systems would otherwise
+    cap concurrent probes or open counter files. reserve leaves room for
+    the descriptors the process already has open. Without the resource
+    module (Windows) wanted is returned unchanged.
+    """
+    try:
+        import resource
+    except ImportError:
+        return wanted
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = wanted + reserve if hard == resource.RLIM_INFINITY else min(hard, wanted + reserve)
+    if soft != resource.RLIM_INFINITY and soft < target:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+            soft = target
+        except (ValueError, OSError):
+            pass
+    if soft == resource.RLIM_INFINITY:
+        return wanted
+    return max(0, min(wanted, soft - reserve))
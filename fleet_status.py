@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Fleet status for Kerberos.io agents
+Joins the configured cameras with the agent containers from one filtered Engine API list call,
+and keeps that view current from the Docker events stream instead of re-polling every container
+"""
+
+import http.client
+import json
+import queue
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+
+from docker_engine import AGENT_NAME_PREFIX, DockerEngine, DockerEngineError, agent_containers
+
+# Pseudo-state of a configured camera that has no container
+MISSING = 'missing'
+
+
+def configured_agents(config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Name, camera IP and web port of every agent the configuration defines"""
+    from compose_writer import compose_settings, iter_services, web_port_of
+
+    settings = compose_settings(config)
+    ips = settings['ips']
+    return [{'name': name, 'ip': ip, 'web_port': web_port_of(service)}
+            for ip, (name, service, _) in zip(ips, iter_services(settings, ips, create_dirs=False))]
+
+
+def summary_from_inspect(info: Dict[str, Any]) -> Dict[str, Any]:
+    """Container summary (as in agent_containers) from an inspect response"""
+    state = info.get('State') or {}
+    status = state.get('Status', 'unknown')
+    if status == 'running':
+        text = f"Up since {str(state.get('StartedAt', ''))[:19].replace('T', ' ')}"
+    elif status == 'exited':
+        text = f"Exited ({state.get('ExitCode', '?')})"
+    else:
+        text = status.capitalize()
+    labels = (info.get('Config') or {}).get('Labels') or {}
+    return {
+        'name': info.get('Name', '').lstrip('/'),
+        'id': info.get('Id', '')[:12],
+        'image': (info.get('Config') or {}).get('Image'),
+        'image_id': info.get('Image'),
+        'state': status,
+        'status': text,
+        'hash': labels.get('io.kerberos.swarm.hash'),
+        'project': labels.get('com.docker.compose.project'),
+    }
+
+
+class FleetStatus:
+    """Configured agents joined with their containers, safe to read while watch() updates it"""
+
+    def __init__(self, engine: DockerEngine, agents: List[Dict[str, Any]]):
+        self.engine = engine
+        self.agents = agents
+        self.containers: Dict[str, Dict[str, Any]] = {}
+        self.synced_at = 0.0
+        self.live = False
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """Replace the container view with a single list call"""
+        containers = {c['name']: c for c in agent_containers(self.engine)}
+        with self.lock:
+            self.containers = containers
+            self.synced_at = time.time()
+
+    def set_agents(self, agents: List[Dict[str, Any]]):
+        with self.lock:
+            self.agents = agents
+
+    def rows(self) -> List[Dict[str, Any]]:
+        """One row per configured agent, in configuration order"""
+        with self.lock:
+            rows = []
+            for agent in self.agents:
+                container = self.containers.get(agent['name'])
+                rows.append(dict(agent,
+                                 state=container['state'] if container else MISSING,
+                                 status=container['status'] if container else 'No container'))
+            return rows
+
+    def orphans(self) -> List[str]:
+        """Agent containers that are no longer in the configuration"""
+        with self.lock:
+            configured = {agent['name'] for agent in self.agents}
+            return sorted(name for name in self.containers if name not in configured)
+
+    def state(self, name: str) -> str:
+        """Container state of one agent, 'missing' if it has no container"""
+        with self.lock:
+            container = self.containers.get(name)
+            return container['state'] if container else MISSING
+
+    def counts(self) -> Counter:
+        return Counter(row['state'] for row in self.rows())
+
+    def apply_event(self, event: Dict[str, Any]) -> Optional[str]:
+        """Update one container from a Docker event; returns its name if it is an agent"""
+        if event.get('Type') != 'container':
+            return None
+        name = ((event.get('Actor') or {}).get('Attributes') or {}).get('name', '')
+        action = event.get('Action') or event.get('status') or ''
+        if not name.startswith(AGENT_NAME_PREFIX) or action.startswith(('exec_', 'attach', 'top')):
+            return None
+
+        if action == 'destroy':
+            summary = None
+        else:
+            try:
+                summary = summary_from_inspect(self.engine.inspect_container(name))
+            except DockerEngineError as e:
+                if e.status != 404:
+                    raise
+                summary = None
+        with self.lock:
+            if summary is None:
+                self.containers.pop(name, None)
+            else:
+                self.containers[name] = summary
+            self.synced_at = time.time()
+        return name
+
+    def watch(self, on_change: Callable[[List[str]], None], stop: threading.Event, interval: float = 1.0):
+        """Follow the events stream until stop is set, calling on_change(names) at most once per interval.
+
+        The stream is opened before the initial list call so no change is
+        missed; if it drops, the view is re-synced and the stream reopened.
+        Raises DockerEngineError when the Engine API cannot be reached.
+        """
+        while not stop.is_set():
+            response = self.engine.events(filters={'type': ['container']})
+            events: queue.Queue = queue.Queue()
+
+            def read(response=response, events=events):
+                try:
+                    for line in iter(response.readline, b''):
+                        try:
+                            events.put(json.loads(line))
+                        except ValueError:
+                            continue
+                except (OSError, http.client.HTTPException, ValueError):
+                    pass
+                finally:
+                    response.close()
+                events.put(None)
+
+            threading.Thread(target=read, daemon=True).start()
+            try:
+                self.refresh()
+                self.live = True
+                on_change([])
+
+                changed, last_report = set(), time.monotonic()
+                while not stop.is_set():
+                    try:
+                        event = events.get(timeout=interval)
+                    except queue.Empty:
+                        event = False
+                    if event is None:
+                        break
+                    if event:
+                        name = self.apply_event(event)
+                        if name:
+                            changed.add(name)
+                    if changed and time.monotonic() - last_report >= interval:
+                        on_change(sorted(changed))
+                        changed, last_report = set(), time.monotonic()
+            finally:
+                # Closing here would wait for the reader's lock; ending the stream lets it close
+                self.live = False
+                self.engine.abort_stream(response)
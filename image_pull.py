@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Image pulls for Kerberos.io agent updates
+Pulls every distinct image the agents use at the same time, before anything is recreated,
+and works out which containers actually run an outdated image
+"""
+
+import threading
+import time
+from collections import namedtuple
+from typing import Any, Callable, Dict, List, Optional
+
+from rollout import image_id
+
+# before/after are local image ids (sha256 digests of the image config); None when absent
+PullResult = namedtuple('PullResult', ['image', 'before', 'after', 'error', 'elapsed'])
+
+DEFAULT_PULL_WORKERS = 4
+
+
+def service_images(settings: Dict[str, Any]) -> Dict[str, str]:
+    """Image of every configured agent service"""
+    from compose_writer import iter_services
+
+    return {name: service['image']
+            for name, service, _ in iter_services(settings, settings['ips'], create_dirs=False)}
+
+
+def distinct_images(images: Dict[str, str]) -> List[str]:
+    """Each image once, in service order"""
+    return list(dict.fromkeys(images.values()))
+
+
+class PullProgress:
+    """Turns Engine API pull messages into a short per-image summary"""
+
+    def __init__(self):
+        self.layers: Dict[str, Dict[str, int]] = {}
+        self.done = set()
+
+    def update(self, message: Dict[str, Any]):
+        layer = message.get('id')
+        status = message.get('status', '')
+        if not layer or status.startswith('Pulling from'):
+            return
+        if status in ('Pull complete', 'Already exists'):
+            self.done.add(layer)
+        detail = message.get('progressDetail') or {}
+        entry = self.layers.setdefault(layer, {'current': 0, 'total': 0})
+        if status == 'Downloading' and detail.get('total'):
+            entry.update(current=detail.get('current', 0), total=detail['total'])
+
+    def summary(self) -> str:
+        current = sum(entry['current'] for entry in self.layers.values())
+        total = sum(entry['total'] for entry in self.layers.values())
+        text = f"{len(self.done)}/{len(self.layers)} layers"
+        if total:
+            text += f", {current / 1048576:.1f}/{total / 1048576:.1f} MB"
+        return text
+
+
+def pull_image_cli(image: str) -> Optional[str]:
+    """Pull with the docker CLI; returns an error message or None"""
+    import subprocess
+    try:
+        result = subprocess.run(['docker', 'pull', '--quiet', image], capture_output=True, text=True)
+    except FileNotFoundError:
+        return "docker not found"
+    if result.returncode != 0:
+        return result.stderr.strip() or f"docker pull exited with {result.returncode}"
+    return None
+
+
+def pull_images(images: List[str], engine=None, max_workers: int = DEFAULT_PULL_WORKERS,
+                on_progress: Optional[Callable[[str, str], None]] = None,
+                on_done: Optional[Callable[[PullResult], None]] = None,
+                progress_interval: float = 2.0) -> List[PullResult]:
+    """Pull images concurrently, recording each one's local id before and after.
+
+    With an engine, layer progress is passed to on_progress(image, summary)
+    at most every progress_interval seconds per image; without one, the
+    docker CLI pulls quietly. on_done(result) is called as each image
+    finishes. Results are returned in the order of images.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from docker_engine import DockerEngineError
+
+    lock = threading.Lock()
+
+    def pull(image: str) -> PullResult:
+        started = time.monotonic()
+        before = image_id(image, engine)
+        error = None
+        if engine is not None:
+            progress = PullProgress()
+            reported = [started]
+
+            def update(message):
+                progress.update(message)
+                now = time.monotonic()
+                if on_progress and now - reported[0] >= progress_interval:
+                    reported[0] = now
+                    with lock:
+                        on_progress(image, progress.summary())
+
+            try:
+                engine.pull_image(image, update)
+            except DockerEngineError as e:
+                error = str(e)
+        else:
+            error = pull_image_cli(image)
+        result = PullResult(image, before, image_id(image, engine) if error is None else before,
+                            error, time.monotonic() - started)
+        if on_done:
+            with lock:
+                on_done(result)
+        return result
+
+    if not images:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(images)))) as pool:
+        return list(pool.map(pull, images))
+
+
+def outdated_services(images: Dict[str, str], results: List[PullResult], engine=None) -> List[str]:
+    """Services whose container runs something other than the freshly pulled image.
+
+    With an engine this compares each agent container's image id, so agents
+    left behind by an earlier update are caught too and agents without a
+    container are left alone. Without one, every service of an image whose
+    id changed in this pull is outdated.
+    """
+    current = {result.image: result.after for result in results}
+    if engine is None:
+        changed = {result.image for result in results if result.after != result.before}
+        return [name for name, image in images.items() if image in changed]
+
+    from docker_engine import agent_containers
+    running = {c['name']: c['image_id'] for c in agent_containers(engine)}
+    return [name for name, image in images.items()
+            if name in running and current.get(image) and running[name] != current[image]]
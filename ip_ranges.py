@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Camera IP ranges for Kerberos.io agents
+Lazy, interval-based IP sets with O(1) count, fast indexing and iteration without materializing strings
+"""
+
+import bisect
+import ipaddress
+from collections.abc import Sequence
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+Interval = Tuple[int, int]
+
+
+def int_to_ip(value: int) -> str:
+    """Dotted-quad string for an integer IPv4 address"""
+    return f"{value >> 24}.{(value >> 16) & 255}.{(value >> 8) & 255}.{value & 255}"
+
+
+def ip_to_int(ip: str) -> int:
+    return int(ipaddress.IPv4Address(ip))
+
+
+def _merge(intervals: Iterable[Interval]) -> List[Interval]:
+    merged: List[Interval] = []
+    for lo, hi in sorted(intervals):
+        if merged and lo <= merged[-1][1] + 1:
+            if hi > merged[-1][1]:
+                merged[-1] = (merged[-1][0], hi)
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+def _subtract(intervals: List[Interval], excluded: List[Interval]) -> List[Interval]:
+    result = []
+    for lo, hi in intervals:
+        for ex_lo, ex_hi in excluded:
+            if ex_hi < lo or ex_lo > hi:
+                continue
+            if ex_lo > lo:
+                result.append((lo, ex_lo - 1))
+            lo = ex_hi + 1
+            if lo > hi:
+                break
+        if lo <= hi:
+            result.append((lo, hi))
+    return result
+
+
+def parse_range(spec: Union[str, Dict[str, Any]], hosts_only: bool = True) -> Interval:
+    """Parse one range entry into an inclusive integer interval.
+
+    Accepted forms: {'start': a, 'end': b}, {'cidr': net}, 'a-b', a CIDR
+    string such as '10.0.0.0/24', or a single address. With hosts_only,
+    CIDR blocks cover their usable hosts, skipping network and broadcast
+    addresses; exclusions use the whole block.
+    """
+    if isinstance(spec, dict):
+        if 'cidr' in spec:
+            spec = str(spec['cidr'])
+        elif spec.get('start') and spec.get('end'):
+            spec = f"{spec['start']}-{spec['end']}"
+        else:
+            raise ValueError(f"Range needs 'start' and 'end' or 'cidr': {spec}")
+
+    spec = str(spec).strip()
+    try:
+        if '/' in spec:
+            network = ipaddress.IPv4Network(spec, strict=False)
+            lo, hi = int(network.network_address), int(network.broadcast_address)
+            if hosts_only and network.prefixlen < 31:
+                lo, hi = lo + 1, hi - 1
+            return lo, hi
+        if '-' in spec:
+            start, end = (part.strip() for part in spec.split('-', 1))
+            lo, hi = ip_to_int(start), ip_to_int(end)
+        else:
+            lo = hi = ip_to_int(spec)
+    except ipaddress.AddressValueError as e:
+        raise ValueError(f"Invalid IP address: {e}")
+    except ipaddress.NetmaskValueError as e:
+        raise ValueError(f"Invalid network: {e}")
+
+    if lo > hi:
+        raise ValueError("Start IP must be less than or equal to end IP")
+    return lo, hi
+
+
+class IPRangeSet(Sequence):
+    """Ordered set of IPv4 addresses stored as merged inclusive intervals.
+
+    Behaves like a read-only list of address strings: len() is O(1),
+    indexing is a binary search over the intervals, and iteration yields
+    strings one at a time.
+    """
+
+    def __init__(self, intervals: Iterable[Interval] = ()):
+        self._intervals = _merge(intervals)
+        # Cumulative address counts before each interval, for indexing
+        self._offsets = []
+        total = 0
+        for lo, hi in self._intervals:
+            self._offsets.append(total)
+            total += hi - lo + 1
+        self._count = total
+
+    @classmethod
+    def from_specs(cls, ranges: Iterable[Union[str, Dict[str, Any]]],
+                   exclude: Iterable[Union[str, Dict[str, Any]]] = ()) -> 'IPRangeSet':
+        included = _merge(parse_range(spec) for spec in ranges)
+        excluded = _merge(parse_range(spec, hosts_only=False) for spec in exclude)
+        return cls(_subtract(included, excluded))
+
+    @classmethod
+    def from_range(cls, start_ip: str, end_ip: str) -> 'IPRangeSet':
+        return cls([parse_range({'start': start_ip, 'end': end_ip})])
+
+    @property
+    def intervals(self) -> List[Interval]:
+        return list(self._intervals)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("IP index out of range")
+        pos = bisect.bisect_right(self._offsets, index) - 1
+        return int_to_ip(self._intervals[pos][0] + index - self._offsets[pos])
+
+    def __iter__(self) -> Iterator[str]:
+        for lo, hi in self._intervals:
+            for value in range(lo, hi + 1):
+                yield int_to_ip(value)
+
+    def __contains__(self, ip) -> bool:
+        try:
+            value = ip_to_int(ip)
+        except (ipaddress.AddressValueError, ValueError):
+            return False
+        pos = bisect.bisect_right(self._intervals, (value, float('inf'))) - 1
+        return pos >= 0 and self._intervals[pos][0] <= value <= self._intervals[pos][1]
+
+    def index(self, ip) -> int:
+        """Position of an address in the set"""
+        value = ip_to_int(ip)
+        pos = bisect.bisect_right(self._intervals, (value, float('inf'))) - 1
+        if pos < 0 or value > self._intervals[pos][1]:
+            raise ValueError(f"{ip} is not in the camera range")
+        return self._offsets[pos] + value - self._intervals[pos][0]
+
+    def describe(self, limit: int = 3) -> str:
+        """Human-readable summary such as '10.0.0.1 → 10.0.0.9, 10.0.1.1 → 10.0.1.254'"""
+        if not self._intervals:
+            return "(empty)"
+        parts = [int_to_ip(lo) if lo == hi else f"{int_to_ip(lo)} → {int_to_ip(hi)}"
+                 for lo, hi in self._intervals[:limit]]
+        if len(self._intervals) > limit:
+            parts.append(f"+{len(self._intervals) - limit} more")
+        return ", ".join(parts)
+
+    def __repr__(self) -> str:
+        return f"IPRangeSet({self.describe()}, count={self._count})"
+
+
+def camera_ips(camera_config: Dict[str, Any]) -> IPRangeSet:
+    """Build the camera address set from the 'cameras' configuration section.
+
+    Uses 'ip_ranges' (a list of ranges or CIDR blocks) when present,
+    otherwise the single 'ip_range', minus anything listed in 'exclude'.
+    A 'live' list (see with_live_cameras) keeps only those addresses.
+    """
+    ranges = camera_config.get('ip_ranges')
+    if not ranges:
+        ip_range = camera_config.get('ip_range') or {}
+        if not ip_range.get('cidr') and not (ip_range.get('start') and ip_range.get('end')):
+            raise ValueError("IP range (start and end) must be specified in config")
+        ranges = [ip_range]
+    ips = IPRangeSet.from_specs(ranges, camera_config.get('exclude') or [])
+    live = camera_config.get('live')
+    if live is None:
+        return ips
+    return IPRangeSet((value, value) for value in {ip_to_int(ip) for ip in live if ip in ips})
+
+
+def with_live_cameras(config: Dict[str, Any], live: Optional[List[str]]) -> Dict[str, Any]:
+    """Config narrowed to the addresses where a scan found a camera ('generate --only-live')"""
+    if live is None:
+        return config
+    return dict(config, cameras=dict(config.get('cameras') or {}, live=live))
@@ -6,20 +6,37 @@ Cross-platform command-line interface for managing Kerberos.io agent deployments
 
 import os
 import sys
-import json
 import subprocess
-import ipaddress
 from pathlib import Path
 from typing import List, Dict, Any, Optional
-import yaml
 import click
-from rich.console import Console
-from rich.table import Table
-from rich.panel import Panel
-from rich.progress import Progress, SpinnerColumn, TextColumn
-import docker
 
-console = Console()
+# rich, the docker SDK, PyYAML and the compose writer are imported by the
+# commands that use them, so '--help' and quick commands start fast.
+from config_cache import config_summary, load_config
+from compose_projects import (load_projects, plan_commands, projects_exist, run_commands,
+                              service_projects, stream_commands)
+from deploy_state import chunked, diff_services, generated_config, load_state, update_state
+from ip_ranges import IPRangeSet, camera_ips, with_live_cameras
+import kerberos_daemon
+
+class LazyConsole:
+    """Stand-in for rich's Console that only imports rich on first use"""
+    
+    def __init__(self):
+        self._console = None
+    
+    def get(self):
+        """The underlying rich Console, for APIs that need the real object"""
+        if self._console is None:
+            from rich.console import Console
+            self._console = Console()
+        return self._console
+    
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+console = LazyConsole()
 
 class KerberosManager:
     """Main class for managing Kerberos.io deployments"""
@@ -30,25 +47,31 @@ class KerberosManager:
         self.project_name = "kerberos-swarms"
         self.docker_client = None
         self.config = None
+        self.service_hashes: Dict[str, str] = {}
+        self._engine_backend = None
         
-    def load_config(self) -> Dict[str, Any]:
-        """Load and validate configuration file"""
-        config_path = Path(self.config_file)
-        
-        if not config_path.exists():
-            raise click.ClickException(f"Configuration file '{self.config_file}' not found!")
-            
+    def load_config(self, live: bool = True) -> Dict[str, Any]:
+        """Load and validate configuration file (cached until the file changes).
+
+        Unless live is False, the cameras are narrowed to those the last
+        'generate --only-live' kept and carry the stream profiles and host
+        ports it assigned.
+        """
         try:
-            with open(config_path, 'r') as f:
-                self.config = yaml.safe_load(f)
+            self.config = load_config(self.config_file)
+            if live:
+                self.config = generated_config(self.config, load_state(self.compose_file))
             return self.config
-        except yaml.YAMLError as e:
-            raise click.ClickException(f"Invalid YAML in config file: {e}")
+        except FileNotFoundError:
+            raise click.ClickException(f"Configuration file '{self.config_file}' not found!")
+        except ValueError as e:
+            raise click.ClickException(str(e))
     
     def get_docker_client(self):
         """Get Docker client with error handling"""
         if self.docker_client is None:
             try:
+                import docker
                 self.docker_client = docker.from_env()
                 # Test connection
                 self.docker_client.ping()
@@ -56,157 +79,421 @@ class KerberosManager:
                 raise click.ClickException(f"Cannot connect to Docker: {e}")
         return self.docker_client
     
-    def generate_ip_list(self, start_ip: str, end_ip: str) -> List[str]:
-        """Generate list of IP addresses from range"""
+    def planning_config(self) -> Dict[str, Any]:
+        """load_config() with the costs of the latest 'calibrate', which plan and syscheck
+        preview before the next generate sizes the agents with them"""
+        from calibration import calibrated_model
+        from capacity import with_calibrated_model
+        return with_calibrated_model(self.load_config(), calibrated_model(load_state(self.compose_file)))
+    
+    def generate_ip_list(self, start_ip: str, end_ip: str) -> IPRangeSet:
+        """Lazy sequence of IP addresses from range"""
         try:
-            start = ipaddress.IPv4Address(start_ip)
-            end = ipaddress.IPv4Address(end_ip)
-            
-            if start > end:
-                raise ValueError("Start IP must be less than or equal to end IP")
-                
-            ip_list = []
-            current = start
-            while current <= end:
-                ip_list.append(str(current))
-                current = ipaddress.IPv4Address(int(current) + 1)
-                
-            return ip_list
-        except ipaddress.AddressValueError as e:
-            raise click.ClickException(f"Invalid IP address: {e}")
+            return IPRangeSet.from_range(start_ip, end_ip)
         except ValueError as e:
             raise click.ClickException(f"IP range error: {e}")
     
-    def generate_compose_file(self) -> int:
-        """Generate docker-compose.yml from configuration"""
-        config = self.load_config()
+    def camera_ips(self, config: Dict[str, Any]) -> IPRangeSet:
+        """Lazy sequence of camera IPs from the configured ranges and exclusions"""
+        try:
+            return camera_ips(config.get('cameras', {}))
+        except ValueError as e:
+            raise click.ClickException(f"IP range error: {e}")
+    
+    def generate_compose_file(self, only_live: Optional[bool] = None) -> int:
+        """Generate docker-compose.yml from configuration, streaming one service at a time.
+
+        only_live limits the agents to the cameras found by the last scan;
+        None keeps whatever the previous generate did.
+        """
+        live = self.live_cameras(only_live)
+        config = with_live_cameras(self.load_config(live=False), live)
+        from rich.progress import Progress, SpinnerColumn, TextColumn
+        from compose_writer import compose_settings, fleet_writer, iter_services
+        
+        from calibration import calibrated_model
+        from capacity import CapacityPlan, with_calibrated_model, with_stream_profiles
+        from placement import CpuPlacement
+        from ports import port_ranges, port_record
+        
+        detected = self.stream_profiles(config)
+        config = with_stream_profiles(config, detected)
+        calibrated = calibrated_model(load_state(self.compose_file))
+        config = with_calibrated_model(config, calibrated)
+        try:
+            settings = compose_settings(config)
+            placement = CpuPlacement(settings['placement']) if settings['placement'] else None
+            plan = CapacityPlan(settings['capacity'], settings['profiles']) if settings['capacity'] else None
+            # With docker.hosts the scheduler sizes every host instead of this machine
+            review = plan.check(settings['ips'], placement) if plan and not settings['hosts'] else None
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        assignment = self.schedule_hosts(settings) if settings['hosts'] else None
+        skipped = self.assign_ports(settings)
+        
+        ip_list = settings['ips']
+        web_ports, rtmp_ports = port_ranges(settings['ports'])
         
-        # Extract configuration values
-        global_config = config.get('global', {})
-        camera_config = config.get('cameras', {})
-        docker_config = config.get('docker', {})
-        custom_env = config.get('custom_environment', {})
-        
-        # Required values
-        kerberos_image = global_config.get('kerberos_image', 'kerberos/agent:latest')
-        network_name = global_config.get('network_name', 'kerberos-network')
-        config_base_path = global_config.get('config_base_path', './configs')
-        recordings_base_path = global_config.get('recordings_base_path', './recordings')
-        
-        ip_range = camera_config.get('ip_range', {})
-        start_ip = ip_range.get('start')
-        end_ip = ip_range.get('end')
-        
-        if not start_ip or not end_ip:
-            raise click.ClickException("IP range (start and end) must be specified in config")
-        
-        connection = camera_config.get('connection', {})
-        protocol = connection.get('protocol', 'rtsp')
-        port = connection.get('port', 554)
-        username = connection.get('username', 'admin')
-        password = connection.get('password', 'password')
-        stream_path = connection.get('stream_path', '/stream1')
-        
-        web_port_start = docker_config.get('web_port_start', 8080)
-        rtmp_port_start = docker_config.get('rtmp_port_start', 1935)
-        restart_policy = docker_config.get('restart_policy', 'unless-stopped')
-        
-        # Generate IP list
-        ip_list = self.generate_ip_list(start_ip, end_ip)
         camera_count = len(ip_list)
         
         console.print(f"[green]Generating configuration for {camera_count} cameras[/green]")
-        console.print(f"[blue]IP range: {start_ip} → {end_ip}[/blue]")
-        
-        # Build compose structure
-        compose_data = {
-            'version': '3.8',
-            'networks': {
-                network_name: {
-                    'driver': 'bridge'
-                }
-            },
-            'services': {}
-        }
-        
-        # Create directories
-        Path(config_base_path).mkdir(parents=True, exist_ok=True)
-        Path(recordings_base_path).mkdir(parents=True, exist_ok=True)
-        
-        # Generate services
-        with Progress(
-            SpinnerColumn(),
-            TextColumn("[progress.description]{task.description}"),
-            console=console,
-        ) as progress:
-            task = progress.add_task("Creating camera services...", total=camera_count)
-            
-            for i, camera_ip in enumerate(ip_list):
-                camera_name = f"camera-{camera_ip.replace('.', '-')}"
-                rtsp_url = f"{protocol}://{username}:{password}@{camera_ip}:{port}{stream_path}"
-                web_port = web_port_start + i
-                rtmp_port = rtmp_port_start + i
-                
-                # Create camera-specific directories
-                camera_config_dir = Path(config_base_path) / camera_name
-                camera_recordings_dir = Path(recordings_base_path) / camera_name
-                camera_config_dir.mkdir(exist_ok=True)
-                camera_recordings_dir.mkdir(exist_ok=True)
-                
-                # Service definition
-                service = {
-                    'image': kerberos_image,
-                    'container_name': camera_name,
-                    'restart': restart_policy,
-                    'networks': [network_name],
-                    'ports': [
-                        f"{web_port}:80",
-                        f"{rtmp_port}:1935"
-                    ],
-                    'volumes': [
-                        f"{config_base_path}/{camera_name}:/home/agent/data/config",
-                        f"{recordings_base_path}/{camera_name}:/home/agent/data/recordings"
-                    ],
-                    'environment': {
-                        'AGENT_NAME': camera_name,
-                        'AGENT_CAPTURE_IPCAMERA_RTSP': rtsp_url,
-                        'AGENT_CAPTURE_IPCAMERA_SUB_RTSP': rtsp_url,
-                        'AGENT_STREAM_WEBRTC': 'true',
-                        'AGENT_STREAM_RECORDING': 'true',
-                        **custom_env
-                    }
-                }
-                
-                # Add resource limits if specified
-                limits = docker_config.get('limits', {})
-                if limits:
-                    deploy_resources = {}
-                    if 'memory' in limits:
-                        deploy_resources['memory'] = limits['memory']
-                    if 'cpus' in limits:
-                        deploy_resources['cpus'] = limits['cpus']
-                    
-                    if deploy_resources:
-                        service['deploy'] = {'resources': {'limits': deploy_resources}}
-                
-                compose_data['services'][camera_name] = service
-                progress.update(task, advance=1)
+        console.print(f"[blue]IP range: {ip_list.describe()}[/blue]")
+        if placement:
+            console.print(f"[blue]CPU placement ({placement.mode}): {placement.describe(camera_count)}[/blue]")
+        if review:
+            console.print(f"[blue]Capacity plan: {review['cpus']:.1f} of {review['usable']['cpus']:.1f} CPUs "
+                          f"expected, {review['memory_limits'] / 1024 ** 3:.1f} of "
+                          f"{review['usable']['memory'] / 1024 ** 3:.1f} GB in memory limits[/blue]")
         
-        # Write compose file
+        # Generate services and write them out as they are built
         try:
-            with open(self.compose_file, 'w') as f:
-                yaml.dump(compose_data, f, default_flow_style=False, indent=2)
+            with Progress(
+                SpinnerColumn(),
+                TextColumn("[progress.description]{task.description}"),
+                console=console.get(),
+            ) as progress, fleet_writer(self.compose_file, settings) as writer:
+                task = progress.add_task("Creating camera services...", total=camera_count)
+                
+                for camera_name, service, shard in iter_services(settings, ip_list):
+                    writer.add_service(camera_name, service, assignment[camera_name] if assignment else shard)
+                    progress.update(task, advance=1)
             
-            console.print(f"[green]✓ Docker Compose file generated: {self.compose_file}[/green]")
+            self.service_hashes = writer.service_hashes
+            layout = writer.layout()
+            if assignment:
+                urls = {host['name']: host['url'] for host in settings['hosts']}
+                for entry in layout:
+                    entry['docker_host'] = urls[entry['name']]
+            update_state(self.compose_file, generated=self.service_hashes, shards=layout,
+                         max_parallel=settings['shards']['max_parallel'] if layout else 1,
+                         hosts=assignment or {}, live_cameras=live, stream_profiles=detected,
+                         capacity_model=calibrated, ports=port_record(settings, settings['ports']))
+            
+            if layout:
+                console.print(f"[green]✓ Docker Compose files generated: {len(layout)} shards "
+                              f"({layout[0]['file']} ... {layout[-1]['file']})[/green]")
+            else:
+                console.print(f"[green]✓ Docker Compose file generated: {self.compose_file}[/green]")
             console.print(f"[blue]Services created: {camera_count}[/blue]")
-            console.print(f"[blue]Web ports: {web_port_start}-{web_port_start + camera_count - 1}[/blue]")
-            console.print(f"[blue]RTMP ports: {rtmp_port_start}-{rtmp_port_start + camera_count - 1}[/blue]")
+            console.print(f"[blue]Web ports: {web_ports}[/blue]")
+            console.print(f"[blue]RTMP ports: {rtmp_ports}[/blue]")
+            if skipped:
+                console.print(f"[blue]Skipped {len(skipped)} ports already in use: "
+                              f"{', '.join(map(str, skipped[:10]))}{' ...' if len(skipped) > 10 else ''}[/blue]")
             
             return camera_count
             
         except Exception as e:
             raise click.ClickException(f"Failed to write compose file: {e}")
 
+    def stream_profiles(self, config: Dict[str, Any]) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Detected stream profiles of the cameras when cameras.stream_detection is on.
+
+        Only cameras without a cached profile younger than the TTL are
+        described again, all at once; the rest come from the state file.
+        """
+        from compose_writer import compose_settings
+        from rtsp_scan import cache_profiles, cached_profiles, detect_settings, scan, scan_settings, stale_cameras
+        
+        try:
+            detection = detect_settings(config.get('cameras', {}))
+            if not detection:
+                return None
+            settings = compose_settings(config)
+            target = scan_settings(settings)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        
+        ips = settings['ips']
+        cache = load_state(self.compose_file).get('streams') or {}
+        stale = stale_cameras(cache, ips, detection['ttl'])
+        if stale:
+            with console.status(f"Describing {len(stale)} cameras for their stream profiles..."):
+                results = scan(stale, target, detection['concurrency'], detection['timeout'])
+            cache = cache_profiles(cache, results, detection['ttl'])
+            update_state(self.compose_file, streams=cache)
+            silent = sum(result.state != 'stream' for result in results)
+            if silent:
+                console.print(f"[yellow]{silent} cameras did not describe their stream "
+                              f"and keep the configured profile[/yellow]")
+        detected = cached_profiles(cache, ips)
+        console.print(f"[blue]Stream profiles detected for {len(detected)} of {len(ips)} cameras[/blue]")
+        return detected
+
+    def live_cameras(self, only_live: Optional[bool]) -> Optional[List[str]]:
+        """Addresses generate should keep: all (None), the last scan's finds, or the previous choice"""
+        import time
+        from rtsp_scan import live_cameras
+        
+        state = load_state(self.compose_file)
+        if only_live is None:
+            return state.get('live_cameras')
+        if not only_live:
+            return None
+        record = state.get('scan')
+        if not record:
+            raise click.ClickException("No scan results yet. Run 'kerberos scan' first")
+        live = live_cameras(record)
+        age = time.time() - record['time']
+        ago = f"{age / 3600:.1f} hours" if age >= 3600 else f"{age / 60:.0f} minutes"
+        console.print(f"[blue]Only live cameras: {len(live)} of {record['addresses']} addresses answered RTSP "
+                      f"in the scan {ago} ago[/blue]")
+        return live
+
+    def assign_ports(self, settings: Dict[str, Any]) -> List[int]:
+        """Give every agent its web and RTMP host ports in settings['ports'], keeping the previous ones.
+
+        The listening sockets are read once; new agents skip ports that
+        are taken. Returns the busy ports that were skipped.
+        """
+        from compose_writer import camera_name_for
+        from ports import allocate_ports, listening_ports, previous_ports
+        
+        names = [camera_name_for(ip) for ip in settings['ips']]
+        previous = previous_ports(load_state(self.compose_file), settings)
+        # Agents on docker.hosts publish on their own hosts, where this machine's sockets say nothing
+        busy = set() if settings['hosts'] else (listening_ports() or set())
+        try:
+            settings['ports'], skipped = allocate_ports(settings, names, previous, busy)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        return skipped
+
+    def schedule_hosts(self, settings: Dict[str, Any]) -> Dict[str, str]:
+        """Assign every camera to one of docker.hosts, keeping the previous assignments"""
+        from compose_writer import camera_name_for
+        from multi_host import schedule
+        
+        names = [camera_name_for(ip) for ip in settings['ips']]
+        try:
+            assignment, report = schedule(settings, names, load_state(self.compose_file).get('hosts') or {})
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        for host in report:
+            size = f"{host['capacity']} agents"
+            if host['cpus'] is not None:
+                size += f", {host['cpus']} CPUs, {host['memory'] / 1024 ** 3:.1f} GB"
+            moved = f", {host['moved']} moved here" if host['moved'] else ""
+            console.print(f"[blue]Host {host['name']} ({host['url']}): {host['agents']} of {size}{moved}[/blue]")
+            if host['error']:
+                console.print(f"[yellow]Host {host['name']} is not reachable: {host['error']}[/yellow]")
+        return assignment
+
+    def run_compose(self, command: List[str], services: Optional[List[str]] = None,
+                    deployed: bool = False) -> bool:
+        """Run a docker-compose command against every compose project, shards in parallel"""
+        from engine_backend import ENGINE_COMMANDS
+        backend = self.engine_backend() if command[0] in ENGINE_COMMANDS else None
+        if backend:
+            from docker_engine import DockerEngineError
+            try:
+                return self.report_batch(backend.run(command, services))
+            except (ValueError, DockerEngineError) as e:
+                console.print(f"[red]{e}[/red]")
+                return False
+        
+        projects = load_projects(self.compose_file, deployed=deployed)
+        jobs = plan_commands(projects, command, services)
+        results = run_commands(jobs, load_state(self.compose_file).get('max_parallel', 1))
+        sharded = projects[0].project is not None
+        
+        ok = True
+        for result in results:
+            label = f"{result.project.name}: " if sharded else ""
+            if result.returncode == 0:
+                if sharded:
+                    console.print(f"[blue]{label}docker-compose {command[0]} finished in {result.elapsed:.1f}s[/blue]")
+            else:
+                ok = False
+                console.print(f"[red]{label}Error running docker-compose {' '.join(command)}: {result.stderr}[/red]")
+        return ok
+
+    def engine_backend(self):
+        """Engine API backend when docker.backend is 'engine', otherwise None"""
+        if self._engine_backend is None:
+            config = self.load_config()
+            from engine_backend import EngineBackend, backend_settings
+            try:
+                options = backend_settings(config.get('docker', {}))
+                if options['backend'] != 'engine':
+                    self._engine_backend = False
+                    return None
+                from compose_writer import compose_settings
+                settings = compose_settings(config)
+                if settings['hosts']:
+                    from multi_host import MultiHostBackend, host_layout
+                    layout = host_layout(load_state(self.compose_file))
+                    if not layout:
+                        raise ValueError("No cameras are assigned to docker.hosts yet, run 'kerberos generate' first")
+                    self._engine_backend = MultiHostBackend(settings, self.compose_file, options, layout)
+                else:
+                    self._engine_backend = EngineBackend(settings, self.compose_file, options)
+            except ValueError as e:
+                raise click.ClickException(str(e))
+        return self._engine_backend or None
+
+    def single_host(self, backend, command: str):
+        """Refuse commands that still drive only the default Docker host when docker.hosts is set"""
+        from multi_host import MultiHostBackend
+        if isinstance(backend, MultiHostBackend):
+            raise click.ClickException(f"'{command}' does not support docker.hosts yet")
+
+    def report_batch(self, result) -> bool:
+        """Print an engine BatchResult, returning True when nothing failed"""
+        color = "red" if result.failed else "blue"
+        console.print(f"[{color}]{result.action}: {len(result.succeeded)} done, {len(result.skipped)} unchanged, "
+                      f"{len(result.failed)} failed in {result.elapsed:.1f}s[/{color}]")
+        failures = sorted(result.failed.items())
+        for name, error in failures[:10]:
+            console.print(f"[red]{name}: {error}[/red]")
+        if len(failures) > 10:
+            console.print(f"[red]... and {len(failures) - 10} more failures[/red]")
+        return not failures
+
+    def fleet_status(self):
+        """Fleet status refreshed with one Engine API call, or None if the Engine API is unreachable"""
+        config = self.load_config()
+        from docker_engine import DockerEngine, DockerEngineError
+        from fleet_status import FleetStatus, configured_agents
+        try:
+            agents = configured_agents(config)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        
+        from multi_host import HostFleet, MultiHostBackend, host_layout
+        
+        backend = self.engine_backend()
+        if isinstance(backend, MultiHostBackend):
+            fleet = HostFleet(host_layout(load_state(self.compose_file)), agents)
+        else:
+            fleet = FleetStatus(backend.engine if backend else DockerEngine(), agents)
+        try:
+            fleet.refresh()
+        except DockerEngineError as e:
+            if backend:
+                raise click.ClickException(str(e))
+            return None
+        if isinstance(fleet, HostFleet):
+            for host, error in sorted(fleet.errors.items()):
+                console.print(f"[yellow]Host {host} is not reachable: {error}[/yellow]")
+        return fleet
+
+    def pull_latest(self, settings: Dict[str, Any]):
+        """Pull every distinct agent image concurrently.
+
+        Returns (service images, pull results, engine or None), or None if
+        any pull failed, in which case nothing should be recreated.
+        """
+        from docker_engine import DockerEngine, DockerEngineError
+        from image_pull import distinct_images, pull_images, service_images
+        
+        backend = self.engine_backend()
+        self.single_host(backend, 'update')
+        engine = backend.engine if backend else DockerEngine()
+        if not backend:
+            try:
+                engine.ping()
+            except DockerEngineError:
+                engine = None
+        
+        images = service_images(settings)
+        distinct = distinct_images(images)
+        console.print(f"[blue]Pulling {len(distinct)} image{'s' if len(distinct) != 1 else ''} "
+                      f"used by {len(images)} agents...[/blue]")
+        
+        def on_done(result):
+            if result.error:
+                console.print(f"[red]{result.image}: {result.error}[/red]")
+            elif result.after != result.before:
+                console.print(f"[green]✓ {result.image}: new image {(result.after or '')[7:19]} "
+                              f"({result.elapsed:.1f}s)[/green]")
+            else:
+                console.print(f"[green]✓ {result.image}: already up to date ({result.elapsed:.1f}s)[/green]")
+        
+        results = pull_images(distinct, engine, on_done=on_done,
+                              on_progress=lambda image, text: console.print(f"[blue]{image}: {text}[/blue]"))
+        if any(result.error for result in results):
+            console.print("[red]Not recreating any agents because a pull failed[/red]")
+            return None
+        return images, results, engine
+
+    def rolling_rollout(self, action: str, wave_size: Optional[int] = None) -> bool:
+        """Restart ('restart') or recreate on the latest image ('update') agents in health-gated waves"""
+        config = self.load_config()
+        from compose_writer import compose_settings
+        from rollout import (RECREATE_COMMAND, health_urls, missing_health_urls, recreate_plan, rolling,
+                             rollout_settings)
+        try:
+            settings = compose_settings(config)
+            options = rollout_settings(config.get('docker', {}), wave_size)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        # Health checks go to the web ports on this machine
+        self.single_host(self.engine_backend(), f"rolling {action}")
+        
+        state = load_state(self.compose_file)
+        names = list(state.get('deployed' if action == 'restart' else 'generated') or {})
+        if not names:
+            raise click.ClickException("No agents recorded yet. Run 'kerberos start' first")
+        
+        if action == 'update':
+            pulled = self.pull_latest(settings)
+            if pulled is None:
+                return False
+            names, rollback = recreate_plan(
+                pulled, self.run_compose,
+                lambda touched: console.print(f"[yellow]Rolling {len(touched)} agents back to the "
+                                              f"previous image[/yellow]"))
+            if not names:
+                console.print("[green]✓ All agents already run the latest images[/green]")
+                return True
+            command = RECREATE_COMMAND
+        else:
+            command, rollback = ['restart'], None
+        
+        # Every agent must be health-checked, or a wave could pass without looking at it
+        urls = health_urls(settings, options)
+        missing = missing_health_urls(names, urls)
+        if missing:
+            more = f" and {len(missing) - 10} more" if len(missing) > 10 else ""
+            raise click.ClickException(f"No health URL for {', '.join(missing[:10])}{more}: not in the current "
+                                       f"configuration; run 'kerberos generate' first")
+        
+        def on_wave(number, total, wave, unhealthy, elapsed):
+            if unhealthy:
+                console.print(f"[yellow]Wave {number}/{total}: {len(unhealthy)} of {len(wave)} agents "
+                              f"unhealthy after {elapsed:.1f}s[/yellow]")
+            else:
+                console.print(f"[green]✓ Wave {number}/{total}: {len(wave)} agents healthy in {elapsed:.1f}s[/green]")
+        
+        console.print(f"[blue]Rolling {action} of {len(names)} agents in waves of {options['wave_size']}[/blue]")
+        result = rolling(names, lambda wave: self.run_compose(command, services=wave),
+                         urls, options, on_wave, rollback)
+        if result.failed_wave is None:
+            return True
+        
+        console.print(f"[red]Wave {result.failed_wave} failed; stopped after {len(result.completed)} "
+                      f"of {len(names)} agents[/red]")
+        if result.unhealthy:
+            shown = ', '.join(result.unhealthy[:10])
+            more = f" and {len(result.unhealthy) - 10} more" if len(result.unhealthy) > 10 else ""
+            console.print(f"[red]Unhealthy: {shown}{more}[/red]")
+        if result.rolled_back:
+            console.print(f"[blue]Rolled back {len(result.rolled_back)} agents to the previous image[/blue]")
+        return False
+
+    def record_deployed(self):
+        """Mark the currently generated services as deployed"""
+        state = load_state(self.compose_file)
+        update_state(self.compose_file, deployed=state.get('generated', {}),
+                     deployed_shards=state.get('shards', []))
+        kerberos_daemon.notify(self.config_file)
+
+    def clear_deployed(self):
+        """Forget the deployed services after the project has been taken down"""
+        update_state(self.compose_file, deployed={})
+        kerberos_daemon.notify(self.config_file)
+
 # CLI Command Groups
 @click.group()
 @click.option('--config', '-c', default='config.yml', help='Configuration file path')
@@ -221,13 +508,15 @@ def cli(ctx, config):
     ctx.obj['manager'] = KerberosManager(config)
 
 @cli.command()
+@click.option('--only-live', is_flag=True, help="Only create agents for the cameras found by the last 'scan'")
 @click.pass_context
-def generate(ctx):
+def generate(ctx, only_live):
     """Generate docker-compose.yml from configuration"""
     manager = ctx.obj['manager']
     
     try:
-        count = manager.generate_compose_file()
+        count = manager.generate_compose_file(only_live=only_live)
+        from rich.panel import Panel
         console.print(Panel(
             f"[green]✓ Successfully generated configuration for {count} cameras[/green]\n"
             f"[blue]Next: Run 'kerberos start' to deploy agents[/blue]",
@@ -238,6 +527,57 @@ def generate(ctx):
         console.print(f"[red]Error: {e}[/red]")
         sys.exit(1)
 
+@cli.command()
+@click.option('--concurrency', default=1000, show_default=True, type=click.IntRange(min=1),
+              help='Addresses probed at the same time')
+@click.option('--timeout', default=2.0, show_default=True, type=click.FloatRange(min=0, min_open=True),
+              help='Seconds each address gets to answer')
+@click.pass_context
+def scan(ctx, concurrency, timeout):
+    """Probe the camera range for RTSP cameras"""
+    import time
+    from collections import Counter
+    from compose_writer import compose_settings
+    from rtsp_scan import (DEFAULT_PROFILE_TTL, LIVE_STATES, cache_profiles, detect_settings, scan as scan_range,
+                           scan_record, scan_settings)
+    
+    manager = ctx.obj['manager']
+    try:
+        config = manager.load_config(live=False)
+        settings = compose_settings(config)
+        target = scan_settings(settings)
+        detection = detect_settings(config.get('cameras', {}))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    
+    ips = settings['ips']
+    console.print(f"[blue]Probing {len(ips)} addresses ({ips.describe()}) on port {target['port']}, "
+                  f"{concurrency} at a time, {timeout:g}s each[/blue]")
+    
+    def on_result(result):
+        if result.state == 'stream':
+            console.print(f"[green]✓ {result.ip}: camera{' (' + result.server + ')' if result.server else ''}[/green]")
+        elif result.state == 'auth':
+            console.print(f"[yellow]{result.ip}: camera refused the configured credentials[/yellow]")
+        elif result.state == 'rtsp':
+            console.print(f"[yellow]{result.ip}: RTSP server answered {result.status} for {target['path']}[/yellow]")
+    
+    started = time.monotonic()
+    results = scan_range(ips, target, concurrency, timeout, on_result)
+    elapsed = time.monotonic() - started
+    # Cameras that described their stream also refresh the stream profile cache
+    streams = cache_profiles(load_state(manager.compose_file).get('streams') or {},
+                             (result for result in results if result.state == 'stream'),
+                             detection['ttl'] if detection else DEFAULT_PROFILE_TTL)
+    update_state(manager.compose_file, scan=scan_record(results, target, elapsed), streams=streams)
+    
+    counts = Counter(result.state for result in results)
+    live = sum(counts[state] for state in LIVE_STATES)
+    console.print(f"[blue]Scanned {len(results)} addresses in {elapsed:.1f}s "
+                  f"({len(results) / max(elapsed, 0.001):.0f}/s): "
+                  + ", ".join(f"{n} {state}" for state, n in counts.most_common()) + "[/blue]")
+    console.print(f"[green]✓ {live} cameras found; 'kerberos generate --only-live' creates agents for them only[/green]")
+
 @cli.command()
 @click.option('--detach/--no-detach', '-d', default=True, help='Run in background')
 @click.pass_context
@@ -245,8 +585,8 @@ def start(ctx, detach):
     """Start all Kerberos agents"""
     manager = ctx.obj['manager']
     
-    # Check if compose file exists
-    if not Path(manager.compose_file).exists():
+    # Check if compose files exist
+    if not projects_exist(manager.compose_file):
         console.print("[yellow]Docker compose file not found. Generating...[/yellow]")
         try:
             manager.generate_compose_file()
@@ -254,98 +594,302 @@ def start(ctx, detach):
             console.print(f"[red]Failed to generate compose file: {e}[/red]")
             sys.exit(1)
     
-    try:
-        console.print("[blue]Starting Kerberos agents...[/blue]")
-        
-        cmd = ['docker-compose', 'up']
-        if detach:
-            cmd.append('-d')
-            
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        if result.returncode == 0:
-            console.print("[green]✓ All agents started successfully![/green]")
-            
-            # Show port information
-            try:
-                config = manager.load_config()
-                web_port = config.get('docker', {}).get('web_port_start', 8080)
-                console.print(f"[blue]Web interfaces available starting from: http://localhost:{web_port}[/blue]")
-            except:
-                pass
-        else:
-            console.print(f"[red]Error starting agents: {result.stderr}[/red]")
-            sys.exit(1)
-            
-    except FileNotFoundError:
-        console.print("[red]Docker Compose not found. Please install Docker and Docker Compose.[/red]")
-        sys.exit(1)
-    except Exception as e:
-        console.print(f"[red]Error: {e}[/red]")
+    console.print("[blue]Starting Kerberos agents...[/blue]")
+    
+    cmd = ['up']
+    if detach:
+        cmd.append('-d')
+    
+    if not manager.run_compose(cmd):
         sys.exit(1)
+    
+    manager.record_deployed()
+    console.print("[green]✓ All agents started successfully![/green]")
+    
+    # Show port information
+    try:
+        config = manager.load_config()
+        web_port = config.get('docker', {}).get('web_port_start', 8080)
+        console.print(f"[blue]Web interfaces available starting from: http://localhost:{web_port}[/blue]")
+    except:
+        pass
 
 @cli.command()
 @click.pass_context
 def stop(ctx):
     """Stop all Kerberos agents"""
-    try:
-        console.print("[yellow]Stopping all agents...[/yellow]")
-        
-        result = subprocess.run(['docker-compose', 'down'], capture_output=True, text=True)
-        
-        if result.returncode == 0:
-            console.print("[green]✓ All agents stopped successfully![/green]")
-        else:
-            console.print(f"[red]Error stopping agents: {result.stderr}[/red]")
-            sys.exit(1)
-            
-    except FileNotFoundError:
-        console.print("[red]Docker Compose not found.[/red]")
-        sys.exit(1)
-    except Exception as e:
-        console.print(f"[red]Error: {e}[/red]")
+    manager = ctx.obj['manager']
+    
+    console.print("[yellow]Stopping all agents...[/yellow]")
+    
+    if not manager.run_compose(['down'], deployed=True):
         sys.exit(1)
+    
+    manager.clear_deployed()
+    console.print("[green]✓ All agents stopped successfully![/green]")
 
 @cli.command()
+@click.option('--rolling', is_flag=True, help='Restart in health-checked waves instead of all at once')
+@click.option('--wave-size', type=int, help='Agents per wave (default: docker.rollout.wave_size)')
 @click.pass_context
-def restart(ctx):
+def restart(ctx, rolling, wave_size):
     """Restart all Kerberos agents"""
+    if rolling:
+        console.print("[yellow]Rolling restart of all agents...[/yellow]")
+        if not ctx.obj['manager'].rolling_rollout('restart', wave_size):
+            sys.exit(1)
+        console.print("[green]✓ All agents restarted![/green]")
+        return
+    
     console.print("[yellow]Restarting all agents...[/yellow]")
     ctx.invoke(stop)
     ctx.invoke(start)
 
+def fleet_table(rows: List[Dict[str, Any]], title: str, limit: Optional[int] = None):
+    """Rich table of agent rows, optionally only the first limit of them"""
+    from rich.table import Table
+    table = Table(title=title)
+    hosts = any('host' in row for row in rows)
+    table.add_column("Name", style="cyan")
+    if hosts:
+        table.add_column("Host")
+    table.add_column("Camera IP")
+    table.add_column("Web", justify="right")
+    table.add_column("State")
+    table.add_column("Status")
+    for row in rows[:limit]:
+        color = "green" if row['state'] == 'running' else "red"
+        host = [row.get('host', '-')] if hosts else []
+        table.add_row(row['name'], *host, row['ip'], str(row['web_port'] or '-'),
+                      f"[{color}]{row['state']}[/{color}]", row['status'])
+    return table
+
+def watch_status(manager, interval: float):
+    """Live fleet view kept current from the Docker events stream"""
+    import threading
+    import time
+    from collections import deque
+    from rich.console import Group
+    from rich.live import Live
+    from rich.text import Text
+    from docker_engine import DockerEngineError
+    
+    fleet = manager.fleet_status()
+    if fleet is None:
+        raise click.ClickException("The Docker Engine API is not reachable; --watch needs it")
+    recent = deque(maxlen=8)
+    shown = {}
+    
+    def view():
+        rows = fleet.rows()
+        shown.update((row['name'], row['state']) for row in rows)
+        counts = fleet.counts()
+        summary = ", ".join(f"{n} {state}" for state, n in sorted(counts.items()))
+        problems = [row for row in rows if row['state'] != 'running']
+        room = max(3, console.get().size.height - len(recent) - 10)
+        parts = [Text(f"Agent status {time.strftime('%H:%M:%S')} - {summary or 'no agents'} "
+                      f"(live from Docker events, Ctrl+C to quit)", style="blue")]
+        if problems:
+            title = f"Not running ({len(problems)})" if len(problems) <= room else \
+                f"Not running (first {room} of {len(problems)})"
+            parts.append(fleet_table(problems, title, room))
+        else:
+            parts.append(Text("All agents running", style="green"))
+        if recent:
+            parts.append(Text("Recent changes:"))
+            for when, name, state in recent:
+                parts.append(Text(f"  {when}  {name}  {state}"))
+        return Group(*parts)
+    
+    try:
+        with Live(view(), console=console.get(), auto_refresh=False) as live:
+            def render(changed):
+                stamp = time.strftime('%H:%M:%S')
+                for name in changed:
+                    state = fleet.state(name)
+                    if shown.get(name) != state:
+                        recent.appendleft((stamp, name, state))
+                        shown[name] = state
+                live.update(view(), refresh=True)
+            fleet.watch(render, threading.Event(), interval)
+    except KeyboardInterrupt:
+        pass
+    except DockerEngineError as e:
+        raise click.ClickException(str(e))
+
 @cli.command()
+@click.option('--watch', '-w', is_flag=True, help='Keep the view open and update it from Docker events')
+@click.option('--interval', default=1.0, show_default=True,
+              help='Minimum seconds between screen updates in watch mode')
 @click.pass_context
-def status(ctx):
+def status(ctx, watch, interval):
     """Show status of all agents"""
+    manager = ctx.obj['manager']
+    if watch:
+        watch_status(manager, interval)
+        return
+    
     try:
-        result = subprocess.run(['docker-compose', 'ps'], capture_output=True, text=True)
-        
+        reply = kerberos_daemon.request(manager.config_file, 'status')
+    except kerberos_daemon.DaemonError as e:
+        raise click.ClickException(f"Daemon error: {e}")
+    if reply is not None:
+        source = "daemon, live" if reply['live'] else f"daemon, {reply['age']:.1f}s old"
+    else:
+        fleet = manager.fleet_status()
+        if fleet is not None:
+            reply = {'agents': fleet.rows(), 'orphans': fleet.orphans()}
+            source = "engine API"
+    if reply is not None:
+        rows, orphans = reply['agents'], reply['orphans']
+        running = sum(1 for row in rows if row['state'] == 'running')
+        console.print(fleet_table(rows, f"Agent Status ({running}/{len(rows)} running)"))
+        console.print(f"[blue]From {source}[/blue]")
+        if orphans:
+            console.print(f"[yellow]{len(orphans)} agent containers are not in the configuration: "
+                          f"{', '.join(orphans[:5])}{' ...' if len(orphans) > 5 else ''}[/yellow]")
+        return
+    
+    projects = load_projects(manager.compose_file, deployed=True)
+    results = run_commands(plan_commands(projects, ['ps']),
+                           load_state(manager.compose_file).get('max_parallel', 1))
+    
+    console.print("[blue]Agent Status:[/blue]")
+    for result in results:
+        if result.project.project:
+            console.print(f"[cyan]{result.project.name} ({result.elapsed:.1f}s)[/cyan]")
         if result.returncode == 0:
-            console.print("[blue]Agent Status:[/blue]")
             console.print(result.stdout)
         else:
-            console.print("[red]Error getting status[/red]")
-            
-    except FileNotFoundError:
-        console.print("[red]Docker Compose not found.[/red]")
-    except Exception as e:
-        console.print(f"[red]Error: {e}[/red]")
+            console.print(f"[red]Error getting status: {result.stderr}[/red]")
+
+@cli.command()
+@click.option('--interval', '-i', default=2.0, show_default=True, type=click.FloatRange(min=0, min_open=True),
+              help='Seconds between refreshes')
+@click.option('--sort', '-s', type=click.Choice(['cpu', 'memory', 'net', 'restarts', 'name']), default='cpu',
+              show_default=True, help='Column to sort by')
+@click.option('--iterations', '-n', default=0, help='Stop after this many refreshes (0 runs until Ctrl+C)')
+@click.pass_context
+def top(ctx, interval, sort, iterations):
+    """Live CPU, memory and network use per agent"""
+    import time
+    from rich.live import Live
+    from rich.table import Table
+    from agent_stats import ResourceSampler, format_bytes, sort_rows
+    from docker_engine import DockerEngine, DockerEngineError
+    
+    backend = ctx.obj['manager'].engine_backend()
+    ctx.obj['manager'].single_host(backend, 'top')
+    sampler = ResourceSampler(backend.engine if backend else DockerEngine())
+    
+    def view(rows, overhead):
+        running = [r for r in rows if r['state'] == 'running']
+        title = (f"{time.strftime('%H:%M:%S')}  {len(running)}/{len(rows)} agents running  "
+                 f"CPU {sum(r['cpu'] or 0 for r in running):.1f}%  "
+                 f"MEM {format_bytes(sum(r['memory'] or 0 for r in running))}  "
+                 f"NET {format_bytes(sum(r['rx'] or 0 for r in running))}/s in "
+                 f"{format_bytes(sum(r['tx'] or 0 for r in running))}/s out  (top: {overhead:.1f}% CPU)")
+        table = Table(title=title)
+        table.add_column("Name", style="cyan")
+        for column in ("CPU%", "Mem", "Mem%", "RX/s", "TX/s", "Restarts"):
+            table.add_column(column, justify="right")
+        table.add_column("Source")
+        shown = sort_rows(rows, sort)
+        if console.get().is_terminal:
+            shown = shown[:max(1, console.get().size.height - 7)]
+        for r in shown:
+            if r['state'] != 'running':
+                table.add_row(r['name'], f"[red]{r['state']}[/red]", "-", "-", "-", "-", str(r['restarts']), "")
+                continue
+            table.add_row(
+                r['name'],
+                '-' if r['cpu'] is None else f"{r['cpu']:.1f}",
+                '-' if r['memory'] is None else format_bytes(r['memory']),
+                f"{r['memory'] / r['limit'] * 100:.0f}" if r['memory'] and r['limit'] else '-',
+                '-' if r['rx'] is None else format_bytes(r['rx']),
+                '-' if r['tx'] is None else format_bytes(r['tx']),
+                str(r['restarts']),
+                r['source'])
+        return table
+    
+    try:
+        rows = sampler.sample()
+        with Live(view(rows, 0.0), console=console.get(), auto_refresh=False) as live:
+            count = 0
+            started, used = time.monotonic(), time.process_time()
+            while not iterations or count < iterations:
+                time.sleep(interval)
+                rows = sampler.sample()
+                # Our own CPU use over the last cycle, drawing the previous frame included
+                now, cpu = time.monotonic(), time.process_time()
+                live.update(view(rows, (cpu - used) / (now - started) * 100), refresh=True)
+                started, used = now, cpu
+                count += 1
+    except KeyboardInterrupt:
+        pass
+    except DockerEngineError as e:
+        raise click.ClickException(str(e))
+    finally:
+        sampler.close()
 
 @cli.command()
 @click.option('--service', '-s', help='Show logs for specific service')
 @click.option('--follow/--no-follow', '-f', default=False, help='Follow log output')
+@click.option('--grep', '-g', help='Only show lines matching this regular expression')
+@click.option('--level', '-l', help='Only show lines at or above this level (debug, info, warn, error)')
+@click.option('--tail', default='all', show_default=True, help='Lines to show from the end of each log')
 @click.pass_context
-def logs(ctx, service, follow):
+def logs(ctx, service, follow, grep, level, tail):
     """Show logs from agents"""
+    manager = ctx.obj['manager']
+    from docker_engine import DockerEngine, DockerEngineError, agent_containers
+    from log_follower import LogFollower, line_filter
+    
+    try:
+        keep = line_filter(grep, level)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    
+    backend = manager.engine_backend()
+    manager.single_host(backend, 'logs')
+    engine = backend.engine if backend else DockerEngine()
     try:
-        cmd = ['docker-compose', 'logs']
+        names = [c['name'] for c in agent_containers(engine)]
+    except DockerEngineError:
+        names = None
+    
+    if names is not None:
+        if service:
+            if service not in names:
+                raise click.ClickException(f"No agent container named '{service}'")
+            names = [service]
+        if not names:
+            console.print("[yellow]No agent containers found[/yellow]")
+            return
+        
+        width = max(len(name) for name in names)
+        palette = ['green', 'cyan', 'yellow', 'magenta', 'blue']
+        prefixes = {name: click.style(f"{name:<{width}}", fg=palette[i % len(palette)]) + " | "
+                    for i, name in enumerate(names)}
+        follower = LogFollower(engine, names, keep, follow=follow, tail=tail)
+        try:
+            follower.run(lambda name, line: sys.stdout.write(prefixes[name] + line + '\n'), sys.stdout.flush)
+        except KeyboardInterrupt:
+            pass
+        for name, error in sorted(follower.errors.items()):
+            console.print(f"[yellow]{name}: {error}[/yellow]")
+        return
+    
+    # Engine API not reachable: let docker-compose stream the logs unfiltered
+    if grep or level:
+        console.print("[yellow]Docker Engine API not reachable; showing unfiltered docker-compose logs[/yellow]")
+    try:
+        cmd = ['logs', '--tail', tail]
         if follow:
             cmd.append('-f')
-        if service:
-            cmd.append(service)
-            
-        subprocess.run(cmd)
+        
+        projects = load_projects(manager.compose_file, deployed=True)
+        stream_commands(plan_commands(projects, cmd, [service] if service else None))
         
     except FileNotFoundError:
         console.print("[red]Docker Compose not found.[/red]")
@@ -355,20 +899,39 @@ def logs(ctx, service, follow):
         console.print(f"[red]Error: {e}[/red]")
 
 @cli.command()
+@click.option('--rolling', is_flag=True, help='Recreate in health-checked waves, rolling back if a wave fails')
+@click.option('--wave-size', type=int, help='Agents per wave (default: docker.rollout.wave_size)')
 @click.pass_context
-def update(ctx):
+def update(ctx, rolling, wave_size):
     """Update agents to latest version"""
-    try:
-        console.print("[blue]Pulling latest images...[/blue]")
-        subprocess.run(['docker-compose', 'pull'])
-        
-        console.print("[blue]Recreating containers...[/blue]")
-        subprocess.run(['docker-compose', 'up', '-d', '--force-recreate'])
-        
+    manager = ctx.obj['manager']
+    
+    if rolling:
+        if not manager.rolling_rollout('update', wave_size):
+            sys.exit(1)
+        manager.record_deployed()
         console.print("[green]✓ Update completed![/green]")
-        
-    except Exception as e:
-        console.print(f"[red]Error updating: {e}[/red]")
+        return
+    
+    from compose_writer import compose_settings
+    from image_pull import outdated_services
+    try:
+        settings = compose_settings(manager.load_config())
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    pulled = manager.pull_latest(settings)
+    if pulled is None:
+        sys.exit(1)
+    outdated = outdated_services(*pulled)
+    if not outdated:
+        console.print("[green]✓ All agents already run the latest images[/green]")
+        return
+    
+    console.print(f"[blue]Recreating {len(outdated)} agents with a new image...[/blue]")
+    if not manager.run_compose(['up', '-d', '--no-deps', '--force-recreate'], services=outdated):
+        sys.exit(1)
+    manager.record_deployed()
+    console.print("[green]✓ Update completed![/green]")
 
 @cli.command()
 @click.option('--volumes/--no-volumes', default=False, help='Also remove volumes')
@@ -376,25 +939,73 @@ def update(ctx):
 @click.pass_context
 def cleanup(ctx, volumes):
     """Remove all containers and optionally volumes"""
-    try:
-        cmd = ['docker-compose', 'down']
-        if volumes:
-            cmd.extend(['-v', '--remove-orphans'])
-            
-        subprocess.run(cmd)
-        console.print("[green]✓ Cleanup completed![/green]")
-        
-    except Exception as e:
-        console.print(f"[red]Error during cleanup: {e}[/red]")
+    manager = ctx.obj['manager']
+    
+    cmd = ['down']
+    if volumes:
+        cmd.extend(['-v', '--remove-orphans'])
+    
+    if manager.run_compose(cmd, deployed=True):
+        manager.clear_deployed()
+    console.print("[green]✓ Cleanup completed![/green]")
 
 @cli.command()
+@click.option('--full', is_flag=True, help='Take every agent down and back up instead of only changed ones')
 @click.pass_context
-def redeploy(ctx):
-    """Regenerate configuration and restart all agents"""
+def redeploy(ctx, full):
+    """Regenerate configuration and recreate changed agents"""
+    manager = ctx.obj['manager']
     console.print("[blue]Redeploying agents...[/blue]")
-    ctx.invoke(stop)
+    
+    previous_state = load_state(manager.compose_file)
+    previous = previous_state.get('deployed', {})
+    if full:
+        ctx.invoke(stop)
+    if full or not previous:
+        ctx.invoke(generate)
+        ctx.invoke(start)
+        return
+    
     ctx.invoke(generate)
-    ctx.invoke(start)
+    changes = diff_services(previous, manager.service_hashes)
+    
+    # Services that moved to another shard must leave their old compose project first
+    old_projects = service_projects(previous_state.get('deployed_shards', []))
+    new_projects = service_projects(load_state(manager.compose_file).get('shards', []))
+    moved = [name for name in changes.changed + changes.unchanged
+             if old_projects.get(name) != new_projects.get(name)]
+    recreate = changes.added + changes.changed + [n for n in moved if n not in changes.changed]
+    
+    console.print(f"[blue]Services: {len(changes.added)} added, {len(changes.changed)} changed, "
+                  f"{len(changes.removed)} removed, {len(moved)} moved, "
+                  f"{len(changes.unchanged)} unchanged[/blue]")
+    
+    ok = True
+    backend = manager.engine_backend()
+    if backend:
+        if changes.removed + moved:
+            ok = manager.report_batch(backend.remove(changes.removed + moved))
+    else:
+        try:
+            # Removed services are no longer in the compose file, so remove their containers directly
+            for batch in chunked(changes.removed + moved):
+                result = subprocess.run(['docker', 'rm', '-f'] + batch, capture_output=True, text=True)
+                if result.returncode != 0:
+                    console.print(f"[red]Error removing agents: {result.stderr}[/red]")
+                    ok = False
+        except FileNotFoundError:
+            console.print("[red]Docker not found.[/red]")
+            sys.exit(1)
+    if recreate:
+        ok = manager.run_compose(['up', '-d', '--no-deps'], services=recreate) and ok
+    
+    if not ok:
+        sys.exit(1)
+    manager.record_deployed()
+    if not (recreate or changes.removed):
+        console.print("[green]✓ No service changes, all agents left running[/green]")
+    else:
+        console.print("[green]✓ Redeployment completed![/green]")
 
 @cli.command()
 def check():
@@ -407,6 +1018,7 @@ def check():
     
     # Check Docker
     try:
+        import docker
         docker_client = docker.from_env()
         docker_client.ping()
         docker_version = docker_client.version()['Version']
@@ -433,6 +1045,195 @@ def check():
     
     console.print("\n[green]System check completed![/green]")
 
+@cli.command()
+@click.pass_context
+def plan(ctx):
+    """Show per-agent limits from camera profiles and check host capacity"""
+    manager = ctx.obj['manager']
+    from rich.table import Table
+    from capacity import CapacityPlan, capacity_settings, profile_settings
+    from compose_writer import compose_settings
+    from placement import CpuPlacement
+    
+    config = manager.planning_config()
+    try:
+        settings = compose_settings(config)
+        docker_config = config.get('docker', {}) or {}
+        capacity = settings['capacity'] or capacity_settings('auto', docker_config.get('capacity'))
+        profiles = settings['profiles'] or profile_settings(config.get('cameras', {}))
+        placement = CpuPlacement(settings['placement']) if settings['placement'] else None
+        capacity_plan = CapacityPlan(capacity, profiles)
+        review = capacity_plan.review(settings['ips'], placement)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    
+    if not settings['capacity']:
+        console.print("[yellow]docker.limits is not 'auto': these limits are not applied to the agents[/yellow]")
+    table = Table(title="Capacity Plan")
+    table.add_column("Profile", style="cyan")
+    table.add_column("Cameras", justify="right")
+    table.add_column("Video")
+    table.add_column("CPU", justify="right")
+    table.add_column("Memory", justify="right")
+    table.add_column("Limits", style="green")
+    for row in review['profiles']:
+        table.add_row(row['name'], str(row['cameras']),
+                      f"{row['resolution']}@{row['fps']}{' ' + row['codec'] if row['codec'] else ''}"
+                      f"{' rec' if row['recording'] else ''}",
+                      f"{row['cpus']:.2f}", f"{row['memory'] / 1024 ** 2:.0f} MB",
+                      f"{row['limits']['cpus']} / {row['limits']['memory']}")
+    console.print(table)
+    
+    gb = 1024 ** 3
+    usable = review['usable']
+    pinned = f" (pinned: {placement.describe(len(settings['ips']))})" if placement else ""
+    console.print(f"Host: {capacity_plan.host['cpus']:g} CPUs, {capacity_plan.host['memory'] / gb:.1f} GB{pinned}")
+    console.print(f"Expected CPU load: {review['cpus']:.1f} of {usable['cpus']:.1f} CPUs")
+    console.print(f"Memory limits: {review['memory_limits'] / gb:.1f} of {usable['memory'] / gb:.1f} GB "
+                  f"(expected use {review['memory'] / gb:.1f} GB)")
+    if review['problems']:
+        for problem in review['problems']:
+            console.print(f"[red]✗ {problem}[/red]")
+        sys.exit(1)
+    console.print("[green]✓ The host can hold this plan[/green]")
+
+@cli.command()
+@click.option('--duration', default=600.0, show_default=True, type=click.FloatRange(min=0),
+              help='Seconds to sample the running agents')
+@click.option('--interval', default=10.0, show_default=True, type=click.FloatRange(min=0, min_open=True),
+              help='Seconds between samples')
+@click.option('--ingest', type=click.Path(exists=True, dir_okay=False), metavar='CSV',
+              help='Add samples from a CSV file (name, cpu, memory and optional time columns) instead of sampling')
+@click.option('--percentile', default=90.0, show_default=True, type=click.FloatRange(min=0, max=100, min_open=True),
+              help="Percentile of each agent's use the model must cover")
+@click.option('--fit-only', is_flag=True, help='Refit the samples recorded so far without sampling')
+@click.pass_context
+def calibrate(ctx, duration, interval, ingest, percentile, fit_only):
+    """Fit the resource model to the agents' measured use"""
+    from rich.table import Table
+    from calibration import TelemetryWriter, agent_profiles, collect, fit_model, ingest_csv, telemetry_path
+    from capacity import model_settings
+    from docker_engine import DockerEngine, DockerEngineError
+    
+    manager = ctx.obj['manager']
+    config = manager.planning_config()
+    capacity = (config.get('docker') or {}).get('capacity') or {}
+    path = telemetry_path(manager.compose_file)
+    if ingest:
+        try:
+            with TelemetryWriter(path, f"csv:{ingest}") as writer:
+                rows = ingest_csv(ingest, writer)
+        except (OSError, ValueError) as e:
+            raise click.ClickException(f"Cannot ingest {ingest}: {e}")
+        console.print(f"[green]✓ Ingested {rows} samples in {writer.ticks} ticks from {ingest} into {path}[/green]")
+    elif not fit_only:
+        from agent_stats import ResourceSampler
+        backend = manager.engine_backend()
+        manager.single_host(backend, 'calibrate')
+        sampler = ResourceSampler(backend.engine if backend else DockerEngine())
+        try:
+            with console.status(f"Sampling agents every {interval:g}s for {duration:g}s (Ctrl+C to stop early)...") \
+                    as status, TelemetryWriter(path, 'sampler') as writer:
+                collect(sampler, writer, duration, interval,
+                        lambda ticks, agents: status.update(f"{ticks} samples of {agents} agents..."))
+        except DockerEngineError as e:
+            raise click.ClickException(str(e))
+        finally:
+            sampler.close()
+    
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        raise click.ClickException("numpy is required to fit the model. Install it with: pip install numpy")
+    previous = model_settings(capacity)
+    try:
+        fit = fit_model(path, agent_profiles(config), previous, percentile)
+    except FileNotFoundError:
+        raise click.ClickException(f"No samples yet: run 'calibrate' without --fit-only first ({path} not found)")
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    update_state(manager.compose_file, calibration=fit)
+    
+    table = Table(title=f"Fitted to the {percentile:g}th percentile of {fit['samples']} samples "
+                        f"from {fit['agents']} agents")
+    table.add_column("Cost", style="cyan")
+    table.add_column("Before", justify="right")
+    table.add_column("Fitted", justify="right")
+    for key, value in fit['model'].items():
+        table.add_row(key, f"{previous[key]:.4g}", f"{value:.4g}")
+    console.print(table)
+    overridden = [key for key in fit['model'] if key in (capacity.get('model') or {})]
+    if overridden:
+        console.print(f"[yellow]docker.capacity.model still overrides {', '.join(overridden)}[/yellow]")
+    console.print("[blue]plan uses the fitted costs now; 'generate' or 'redeploy' sizes the agents with them[/blue]")
+
+@cli.command()
+@click.option('--window', default=7.0, show_default=True, type=click.FloatRange(min=0, min_open=True),
+              help='Days of recordings the daily rates average over')
+@click.option('--top', default=20, show_default=True, type=click.IntRange(min=0),
+              help='Cameras to list, busiest first; 0 for all')
+@click.option('--workers', default=8, show_default=True, type=click.IntRange(min=1),
+              help='Camera directories scanned at once')
+@click.option('--json', 'as_json', is_flag=True, help='Print the report as JSON')
+@click.pass_context
+def storage(ctx, window, top, workers, as_json):
+    """Measure recordings per camera per day and days until full"""
+    import json
+    import time
+    from rich.table import Table
+    from agent_stats import format_bytes
+    from compose_writer import camera_name_for, compose_settings
+    from recordings_index import index_path, measure_storage
+    
+    manager = ctx.obj['manager']
+    try:
+        settings = compose_settings(manager.load_config())
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    recordings = Path(manager.compose_file).absolute().parent / settings['recordings_base_path']
+    names = [camera_name_for(ip) for ip in settings['ips']]
+    with console.status(f"Scanning recordings of {len(names)} cameras..."):
+        report = measure_storage(str(recordings), names, manager.compose_file, window, workers)
+    if as_json:
+        click.echo(json.dumps(report, indent=2))
+        return
+    
+    scan = report['scan']
+    cameras = sorted(report['cameras'], key=lambda c: c['bytes_per_day'], reverse=True)
+    shown = cameras[:top] if top else cameras
+    table = Table(title=f"Recordings in {report['path']}")
+    table.add_column("Camera", style="cyan")
+    table.add_column("Files", justify="right")
+    table.add_column("Stored", justify="right")
+    table.add_column("Per day", justify="right")
+    table.add_column("Last recording")
+    for camera in shown:
+        last = time.strftime('%Y-%m-%d %H:%M', time.localtime(camera['newest'])) if camera['newest'] else '-'
+        table.add_row(camera['camera'], str(camera['files']), format_bytes(camera['bytes']),
+                      format_bytes(camera['bytes_per_day']), last)
+    console.print(table)
+    if len(shown) < len(cameras):
+        console.print(f"[blue]{len(cameras) - len(shown)} more cameras (--top 0 shows all)[/blue]")
+    console.print(f"[blue]Scanned in {scan['elapsed']:.2f}s: {scan['listed']} directories listed, "
+                  f"{scan['stated']} files stat'ed, {scan['reused']} taken from {index_path(manager.compose_file)}[/blue]")
+    
+    console.print(f"Stored: {format_bytes(report['bytes'])} in {report['files']} files from "
+                  f"{report['recording_cameras']}/{len(names)} cameras")
+    console.print(f"Written: {format_bytes(report['bytes_per_day'])}/day over the last {window:g} days "
+                  f"({format_bytes(report['bytes_per_camera_day'])}/day per recording camera)")
+    if report['net_growth_per_day'] is not None:
+        console.print(f"Net growth: {format_bytes(report['net_growth_per_day'])}/day between scans, retention included")
+    else:
+        console.print("[blue]Net growth needs scans an hour apart; the write rate stands in for it[/blue]")
+    console.print(f"Volume: {format_bytes(report['volume_free'])} free of {format_bytes(report['volume_total'])}")
+    days = report['days_until_full']
+    if days is None:
+        console.print("[green]✓ Recordings are not growing[/green]")
+    elif days < 7:
+        console.print(f"[yellow]Recordings volume full in {days:.1f} days[/yellow]")
+    else:
+        console.print(f"[green]✓ Recordings volume full in {days:.1f} days at the current growth[/green]")
+
 @cli.command()
 @click.pass_context
 def info(ctx):
@@ -440,49 +1241,143 @@ def info(ctx):
     manager = ctx.obj['manager']
     
     try:
-        config = manager.load_config()
+        reply = kerberos_daemon.request(manager.config_file, 'info')
+        summary = reply['summary'] if reply else config_summary(manager.load_config())
         
         # Create info table
+        from rich.table import Table
         table = Table(title="Kerberos.io Multi-Agent Configuration")
         table.add_column("Setting", style="cyan")
         table.add_column("Value", style="green")
-        
-        # Global settings
-        global_config = config.get('global', {})
-        table.add_row("Kerberos Image", global_config.get('kerberos_image', 'N/A'))
-        table.add_row("Network Name", global_config.get('network_name', 'N/A'))
-        table.add_row("Config Path", global_config.get('config_base_path', 'N/A'))
-        table.add_row("Recordings Path", global_config.get('recordings_base_path', 'N/A'))
-        
-        # Camera settings
-        cameras = config.get('cameras', {})
-        ip_range = cameras.get('ip_range', {})
-        if ip_range:
-            start_ip = ip_range.get('start', 'N/A')
-            end_ip = ip_range.get('end', 'N/A')
-            table.add_row("IP Range", f"{start_ip} → {end_ip}")
-            
-            # Calculate camera count
-            try:
-                ip_list = manager.generate_ip_list(start_ip, end_ip)
-                table.add_row("Camera Count", str(len(ip_list)))
-            except:
-                pass
-        
-        # Docker settings
-        docker_config = config.get('docker', {})
-        table.add_row("Web Port Start", str(docker_config.get('web_port_start', 'N/A')))
-        table.add_row("RTMP Port Start", str(docker_config.get('rtmp_port_start', 'N/A')))
-        table.add_row("Restart Policy", docker_config.get('restart_policy', 'N/A'))
-        
-        # Timezone
-        custom_env = config.get('custom_environment', {})
-        table.add_row("Timezone", custom_env.get('TZ', 'N/A'))
+        for label, value in summary:
+            table.add_row(label, value)
         
         console.print(table)
         
     except Exception as e:
         console.print(f"[red]Error reading configuration: {e}[/red]")
 
+@cli.command()
+@click.option('--address', default='0.0.0.0', show_default=True, help='Listen address')
+@click.option('--port', default=9470, show_default=True, help='Listen port')
+@click.option('--interval', default=15.0, show_default=True, type=click.FloatRange(min=0, min_open=True),
+              help='Seconds between container and host samples')
+@click.option('--disk-interval', default=300.0, show_default=True, type=click.FloatRange(min=0, min_open=True),
+              help='Seconds between recordings directory scans')
+@click.pass_context
+def exporter(ctx, address, port, interval, disk_interval):
+    """Serve Prometheus metrics for the fleet"""
+    manager = ctx.obj['manager']
+    config = manager.load_config()
+    from compose_writer import compose_settings
+    from docker_engine import DockerEngine
+    from fleet_status import configured_agents
+    from metrics_exporter import MetricsExporter, serve
+    try:
+        settings = compose_settings(config)
+        agents = configured_agents(config)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    
+    backend = manager.engine_backend()
+    manager.single_host(backend, 'exporter')
+    recordings = Path(manager.compose_file).absolute().parent / settings['recordings_base_path']
+    metrics = MetricsExporter(backend.engine if backend else DockerEngine(), agents, str(recordings),
+                              interval, disk_interval)
+    try:
+        serve(metrics, address, port,
+              on_ready=lambda url: console.print(f"[blue]Serving metrics for {len(agents)} agents on {url}[/blue]"))
+    except OSError as e:
+        raise click.ClickException(f"Cannot serve metrics: {e}")
+    console.print("[green]✓ Exporter stopped[/green]")
+
+@cli.command()
+@click.option('--no-restart', is_flag=True, help='Only report unhealthy agents, never restart them')
+@click.option('--report', default=60.0, show_default=True, type=click.FloatRange(min=0),
+              help='Seconds between fleet health summaries, 0 for none')
+@click.pass_context
+def watchdog(ctx, no_restart, report):
+    """Probe agent health and restart stuck agents"""
+    manager = ctx.obj['manager']
+    config = manager.load_config()
+    from agent_watchdog import Watchdog, watchdog_settings
+    from compose_writer import compose_settings
+    from docker_engine import DockerEngine, DockerEngineError
+    from fleet_status import configured_agents
+    from rollout import health_urls, rollout_settings
+    try:
+        settings = compose_settings(config)
+        docker_config = config.get('docker', {}) or {}
+        options = watchdog_settings(docker_config)
+        urls = health_urls(settings, rollout_settings(docker_config))
+        agents = configured_agents(config)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    
+    # Health probes go to the web ports on this machine
+    backend = manager.engine_backend()
+    manager.single_host(backend, 'watchdog')
+    
+    def on_event(kind, name, detail):
+        if kind == 'unhealthy':
+            console.print(f"[yellow]{name}: unhealthy ({detail})[/yellow]")
+        elif kind == 'recovered':
+            console.print(f"[green]✓ {name}: healthy again after {detail} failed probes[/green]")
+        elif kind == 'no-endpoint':
+            console.print(f"[yellow]{name}: no health endpoint at {detail}; not watched[/yellow]")
+        elif kind == 'restart':
+            console.print(f"[blue]{name}: restarting ({detail})[/blue]")
+        elif kind == 'restart-failed':
+            console.print(f"[red]{name}: restart failed: {detail}[/red]")
+        elif kind == 'held':
+            console.print(f"[yellow]{name}: not restarted, {detail}[/yellow]")
+        elif kind == 'docker':
+            console.print(f"[yellow]Docker events unavailable, polling: {detail}[/yellow]")
+        elif kind == 'summary':
+            counts = detail['counts']
+            console.print(", ".join(f"{counts[state]} {state}" for state in
+                                    ('healthy', 'failing', 'no-endpoint', 'down', 'unknown') if counts[state])
+                          + f"; {detail['probes']} probes, {detail['restarts']} restarts "
+                          f"({detail['budget']} of {options['max_restarts']} in the current window)")
+    
+    agent_watchdog = Watchdog(backend.engine if backend else DockerEngine(), agents, urls, options,
+                              restart=not no_restart, on_event=on_event)
+    restarts = '' if no_restart else f", restart after {options['failures']} failures"
+    console.print(f"[blue]Watching {len(urls)} agents: every {options['interval']:g}s while healthy, "
+                  f"backing off from {options['retry_interval']:g}s while failing{restarts}[/blue]")
+    try:
+        agent_watchdog.run(report)
+    except DockerEngineError as e:
+        raise click.ClickException(f"Cannot reach Docker: {e}")
+    console.print("[green]✓ Watchdog stopped[/green]")
+
+@cli.command()
+@click.option('--stop', 'stop_daemon', is_flag=True, help='Stop a running daemon')
+@click.option('--refresh', default=kerberos_daemon.REFRESH_INTERVAL, show_default=True,
+              help='Seconds between container state refreshes')
+@click.pass_context
+def daemon(ctx, stop_daemon, refresh):
+    """Run the resident control daemon in the foreground"""
+    manager = ctx.obj['manager']
+    
+    if stop_daemon:
+        try:
+            reply = kerberos_daemon.request(manager.config_file, 'shutdown')
+        except kerberos_daemon.DaemonError as e:
+            raise click.ClickException(f"Daemon error: {e}")
+        if reply is None:
+            console.print("[yellow]No daemon is running for this configuration[/yellow]")
+        else:
+            console.print(f"[green]✓ Daemon (pid {reply['pid']}) stopped[/green]")
+        return
+    
+    manager.load_config()
+    console.print(f"[blue]Daemon listening on {kerberos_daemon.socket_path(manager.config_file)}[/blue]")
+    try:
+        kerberos_daemon.serve(manager.config_file, refresh, manager.compose_file)
+    except OSError as e:
+        raise click.ClickException(str(e))
+    console.print("[green]✓ Daemon stopped[/green]")
+
 if __name__ == '__main__':
     cli()
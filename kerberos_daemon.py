@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Resident control daemon for Kerberos.io agents
+Holds the parsed configuration, a warm Docker Engine connection and container state kept
+current from the Docker events stream, and answers CLI requests as JSON lines over a local
+Unix socket
+"""
+
+import json
+import os
+import socket
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+# Seconds between container list refreshes while the Docker events stream is unavailable
+REFRESH_INTERVAL = 2.0
+
+# Seconds a client waits for the daemon before falling back to doing the work itself
+CLIENT_TIMEOUT = 5.0
+
+
+class DaemonError(Exception):
+    """Error reported by the daemon for a request"""
+
+
+def socket_path(config_file: str) -> Path:
+    """Socket stored next to the config (config.yml -> .config.yml.sock), or $KERBEROS_SOCKET"""
+    override = os.environ.get('KERBEROS_SOCKET')
+    if override:
+        return Path(override)
+    path = Path(config_file).absolute()
+    return path.with_name(f".{path.name}.sock")
+
+
+def request(config_file: str, command: str, timeout: float = CLIENT_TIMEOUT, **params) -> Optional[Any]:
+    """Send one request to the daemon serving config_file.
+
+    Returns the result, or None when no daemon is running for this config
+    so the caller can do the work itself. Raises DaemonError if the daemon
+    answered with an error.
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+    path = socket_path(config_file)
+    message = dict(params, command=command, config=str(Path(config_file).absolute()))
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(str(path))
+            sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+            with sock.makefile('rb') as reader:
+                line = reader.readline()
+    except OSError:
+        return None
+    if not line:
+        return None
+
+    try:
+        reply = json.loads(line)
+    except ValueError:
+        return None
+    if reply.get('ok'):
+        return reply.get('result')
+    if reply.get('code') in ('config', 'fallback'):
+        # The socket belongs to a daemon for another config file, or it cannot answer this one
+        return None
+    raise DaemonError(reply.get('error', 'unknown daemon error'))
+
+
+def notify(config_file: str, command: str = 'refresh'):
+    """Best-effort nudge after the CLI changed the deployment; ignored when no daemon runs"""
+    try:
+        request(config_file, command, timeout=1.0)
+    except DaemonError:
+        pass
+
+
+class DaemonState:
+    """Everything the daemon keeps warm between requests"""
+
+    def __init__(self, config_file: str, refresh_interval: float = REFRESH_INTERVAL,
+                 compose_file: Optional[str] = None):
+        import threading
+        from docker_engine import DockerEngine
+        from fleet_status import FleetStatus
+
+        self.config_file = str(Path(config_file).absolute())
+        self.compose_file = compose_file
+        self.refresh_interval = refresh_interval
+        self.started = time.time()
+        self.engine = DockerEngine()
+        self.fleet = FleetStatus(self.engine, [])
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+
+        self._config_stamp = None
+        self.config: Dict[str, Any] = {}
+        self.summary = []
+        self.containers_error: Optional[str] = None
+
+        self.reload_config()
+
+    def reload_config(self, force: bool = False):
+        """Re-read the configuration if the file changed since the last load"""
+        from config_cache import config_summary, load_config
+        from deploy_state import generated_config, load_state, state_path
+        from fleet_status import configured_agents
+
+        stat = os.stat(self.config_file)
+        # 'generate' narrows the cameras and assigns their ports in the state file, not the config file
+        try:
+            state_stamp = os.stat(state_path(self.compose_file)).st_mtime_ns if self.compose_file else None
+        except OSError:
+            state_stamp = None
+        stamp = (stat.st_mtime_ns, stat.st_size, state_stamp)
+        with self.lock:
+            if stamp == self._config_stamp and not force:
+                return
+        config = load_config(self.config_file)
+        if self.compose_file:
+            config = generated_config(config, load_state(self.compose_file))
+        summary = config_summary(config)
+        try:
+            agents = configured_agents(config)
+        except ValueError:
+            # The summary already reports the broken IP range
+            agents = []
+        self.fleet.set_agents(agents)
+        with self.lock:
+            self.config, self.summary, self._config_stamp = config, summary, stamp
+
+    def refresh_containers(self):
+        """Re-sync the container view with a single Engine API call"""
+        from docker_engine import DockerEngineError
+
+        try:
+            self.fleet.refresh()
+            error = None
+        except DockerEngineError as e:
+            error = str(e)
+        with self.lock:
+            self.containers_error = error
+
+    def _watching(self, names):
+        with self.lock:
+            self.containers_error = None
+
+    def refresh_loop(self):
+        """Follow the Docker events stream; poll every refresh_interval while it is unavailable"""
+        from docker_engine import DockerEngineError
+
+        while not self.stopping.is_set():
+            try:
+                self.fleet.watch(self._watching, self.stopping, self.refresh_interval)
+            except DockerEngineError as e:
+                with self.lock:
+                    self.containers_error = str(e)
+            if self.stopping.wait(self.refresh_interval):
+                break
+            self.refresh_containers()
+
+    def handle(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Dispatch one request and build its reply"""
+        if message.get('config') and message['config'] != self.config_file:
+            return {'ok': False, 'code': 'config',
+                    'error': f"daemon serves {self.config_file}, not {message['config']}"}
+
+        command = message.get('command')
+        try:
+            if command == 'ping':
+                result = {'pid': os.getpid(), 'config': self.config_file,
+                          'uptime': round(time.time() - self.started, 1)}
+            elif command == 'info':
+                self.reload_config()
+                with self.lock:
+                    result = {'summary': self.summary}
+            elif command == 'status':
+                self.reload_config()
+                with self.lock:
+                    hosts = (self.config.get('docker') or {}).get('hosts')
+                if hosts:
+                    # The daemon follows the default Docker host only
+                    return {'ok': False, 'code': 'fallback', 'error': "status of docker.hosts is read by the CLI"}
+                if not self.fleet.live and time.time() - self.fleet.synced_at > self.refresh_interval:
+                    self.refresh_containers()
+                with self.lock:
+                    if self.containers_error and not self.fleet.live:
+                        raise DaemonError(self.containers_error)
+                result = {'agents': self.fleet.rows(), 'orphans': self.fleet.orphans(),
+                          'live': self.fleet.live, 'age': round(time.time() - self.fleet.synced_at, 2)}
+            elif command == 'refresh':
+                self.refresh_containers()
+                result = {'containers': len(self.fleet.containers)}
+            elif command == 'reload':
+                self.reload_config(force=True)
+                self.refresh_containers()
+                result = {'summary': self.summary}
+            elif command == 'shutdown':
+                self.stopping.set()
+                result = {'pid': os.getpid()}
+            else:
+                return {'ok': False, 'error': f"Unknown command: {command}"}
+        except (OSError, ValueError, DaemonError) as e:
+            return {'ok': False, 'error': str(e)}
+        return {'ok': True, 'result': result}
+
+
+def serve(config_file: str, refresh_interval: float = REFRESH_INTERVAL, compose_file: Optional[str] = None):
+    """Run the daemon in the foreground until SIGINT/SIGTERM or a 'shutdown' request.
+
+    Raises OSError if the socket cannot be created or another daemon is
+    already serving this configuration.
+    """
+    import signal
+    import socketserver
+    import threading
+
+    if not hasattr(socket, 'AF_UNIX'):
+        raise OSError("The daemon needs Unix domain sockets, which this platform does not provide")
+
+    path = socket_path(config_file)
+    if path.exists():
+        if request(config_file, 'ping', timeout=1.0) is not None:
+            raise OSError(f"A daemon is already running on {path}")
+        path.unlink()
+
+    state = DaemonState(config_file, refresh_interval, compose_file)
+    state.refresh_containers()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                try:
+                    message = json.loads(line)
+                    reply = state.handle(message if isinstance(message, dict) else {})
+                except ValueError:
+                    reply = {'ok': False, 'error': 'Invalid request'}
+                self.wfile.write(json.dumps(reply, separators=(',', ':')).encode('utf-8') + b'\n')
+                self.wfile.flush()
+                if state.stopping.is_set():
+                    return
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    old_umask = os.umask(0o077)
+    try:
+        server = Server(str(path), Handler)
+    finally:
+        os.umask(old_umask)
+
+    def stop(*_):
+        state.stopping.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.2}, daemon=True).start()
+    try:
+        state.refresh_loop()
+    finally:
+        server.shutdown()
+        server.server_close()
+        state.engine.close()
+        try:
+            path.unlink()
+        except OSError:
+            pass
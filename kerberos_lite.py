@@ -6,26 +6,20 @@ Cross-platform command-line interface with minimal dependencies
 
 import os
 import sys
-import json
-import subprocess
-import ipaddress
+import importlib
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 import argparse
 
-try:
-    import yaml
-except ImportError:
-    print("Installing PyYAML...")
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "PyYAML"])
-    import yaml
-
-try:
-    import psutil
-except ImportError:
-    print("Installing psutil for system checks...")
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "psutil"])
-    import psutil
+# Only light, stdlib-backed modules are imported up front. PyYAML, psutil and
+# the compose writer are loaded by the commands that need them (see require()),
+# which keeps 'kerberos info' and friends fast for cron and monitoring scripts.
+from config_cache import config_summary, load_config
+from compose_projects import (load_projects, plan_commands, projects_exist, run_commands,
+                              service_projects, stream_commands)
+from deploy_state import chunked, diff_services, generated_config, load_state, update_state
+from ip_ranges import IPRangeSet, camera_ips, with_live_cameras
+import kerberos_daemon
 
 class Colors:
     """ANSI color codes for cross-platform terminal colors"""
@@ -63,6 +57,14 @@ def print_header(msg: str):
 def print_info(msg: str):
     print(f"{Colors.CYAN}[i]{Colors.NC} {msg}")
 
+def require(module: str, package: str):
+    """Import a third-party module on first use, exiting with an install hint if it is missing"""
+    try:
+        return importlib.import_module(module)
+    except ImportError:
+        print_error(f"{package} is required for this command. Install it with: pip install {package}")
+        sys.exit(1)
+
 class KerberosManager:
     """Simplified Kerberos manager with minimal dependencies"""
     
@@ -70,165 +72,133 @@ class KerberosManager:
         self.config_file = config_file
         self.compose_file = "docker-compose.yml"
         self.config = None
+        self.service_hashes: Dict[str, str] = {}
+        self._engine_backend = None
         
-    def load_config(self) -> Dict[str, Any]:
-        """Load and validate configuration file"""
-        config_path = Path(self.config_file)
-        
-        if not config_path.exists():
-            print_error(f"Configuration file '{self.config_file}' not found!")
-            sys.exit(1)
-            
+    def load_config(self, live: bool = True) -> Dict[str, Any]:
+        """Load and validate configuration file (cached until the file changes).
+
+        Unless live is False, the cameras are narrowed to those the last
+        'generate --only-live' kept and carry the stream profiles and host
+        ports it assigned.
+        """
         try:
-            with open(config_path, 'r') as f:
-                self.config = yaml.safe_load(f)
+            self.config = load_config(self.config_file)
+            if live:
+                self.config = generated_config(self.config, load_state(self.compose_file))
             return self.config
-        except yaml.YAMLError as e:
-            print_error(f"Invalid YAML in config file: {e}")
+        except FileNotFoundError:
+            print_error(f"Configuration file '{self.config_file}' not found!")
+            sys.exit(1)
+        except ValueError as e:
+            print_error(str(e))
             sys.exit(1)
+        except ImportError:
+            require('yaml', 'PyYAML')
+            raise
     
-    def generate_ip_list(self, start_ip: str, end_ip: str) -> List[str]:
-        """Generate list of IP addresses from range"""
+    def planning_config(self) -> Dict[str, Any]:
+        """load_config() with the costs of the latest 'calibrate', which plan and syscheck
+        preview before the next generate sizes the agents with them"""
+        from calibration import calibrated_model
+        from capacity import with_calibrated_model
+        return with_calibrated_model(self.load_config(), calibrated_model(load_state(self.compose_file)))
+    
+    def generate_ip_list(self, start_ip: str, end_ip: str) -> IPRangeSet:
+        """Lazy sequence of IP addresses from range"""
         try:
-            start = ipaddress.IPv4Address(start_ip)
-            end = ipaddress.IPv4Address(end_ip)
-            
-            if start > end:
-                raise ValueError("Start IP must be less than or equal to end IP")
-                
-            ip_list = []
-            current = start
-            while current <= end:
-                ip_list.append(str(current))
-                current = ipaddress.IPv4Address(int(current) + 1)
-                
-            return ip_list
-        except ipaddress.AddressValueError as e:
-            print_error(f"Invalid IP address: {e}")
+            return IPRangeSet.from_range(start_ip, end_ip)
+        except ValueError as e:
+            print_error(f"IP range error: {e}")
             sys.exit(1)
+    
+    def camera_ips(self, config: Dict[str, Any]) -> IPRangeSet:
+        """Lazy sequence of camera IPs from the configured ranges and exclusions"""
+        try:
+            return camera_ips(config.get('cameras', {}))
         except ValueError as e:
             print_error(f"IP range error: {e}")
             sys.exit(1)
     
-    def generate_compose_file(self) -> int:
-        """Generate docker-compose.yml from configuration"""
-        config = self.load_config()
-        
-        # Extract configuration values
-        global_config = config.get('global', {})
-        camera_config = config.get('cameras', {})
-        docker_config = config.get('docker', {})
-        custom_env = config.get('custom_environment', {})
-        
-        # Required values
-        kerberos_image = global_config.get('kerberos_image', 'kerberos/agent:latest')
-        network_name = global_config.get('network_name', 'kerberos-network')
-        config_base_path = global_config.get('config_base_path', './configs')
-        recordings_base_path = global_config.get('recordings_base_path', './recordings')
+    def generate_compose_file(self, only_live: Optional[bool] = None) -> int:
+        """Generate docker-compose.yml from configuration, streaming one service at a time.
+
+        only_live limits the agents to the cameras found by the last scan;
+        None keeps whatever the previous generate did.
+        """
+        config = self.load_config(live=False)
+        require('yaml', 'PyYAML')
+        live = self.live_cameras(only_live)
+        config = with_live_cameras(config, live)
+        from compose_writer import compose_settings, fleet_writer, iter_services
         
-        ip_range = camera_config.get('ip_range', {})
-        start_ip = ip_range.get('start')
-        end_ip = ip_range.get('end')
+        from calibration import calibrated_model
+        from capacity import CapacityPlan, with_calibrated_model, with_stream_profiles
+        from placement import CpuPlacement
+        from ports import port_ranges, port_record
         
-        if not start_ip or not end_ip:
-            print_error("IP range (start and end) must be specified in config")
+        detected = self.stream_profiles(config)
+        config = with_stream_profiles(config, detected)
+        calibrated = calibrated_model(load_state(self.compose_file))
+        config = with_calibrated_model(config, calibrated)
+        try:
+            settings = compose_settings(config)
+            placement = CpuPlacement(settings['placement']) if settings['placement'] else None
+            plan = CapacityPlan(settings['capacity'], settings['profiles']) if settings['capacity'] else None
+            # With docker.hosts the scheduler sizes every host instead of this machine
+            review = plan.check(settings['ips'], placement) if plan and not settings['hosts'] else None
+        except ValueError as e:
+            print_error(str(e))
             sys.exit(1)
+        assignment = self.schedule_hosts(settings) if settings['hosts'] else None
+        skipped = self.assign_ports(settings)
         
-        connection = camera_config.get('connection', {})
-        protocol = connection.get('protocol', 'rtsp')
-        port = connection.get('port', 554)
-        username = connection.get('username', 'admin')
-        password = connection.get('password', 'password')
-        stream_path = connection.get('stream_path', '/stream1')
+        ip_list = settings['ips']
+        web_ports, rtmp_ports = port_ranges(settings['ports'])
         
-        web_port_start = docker_config.get('web_port_start', 8080)
-        rtmp_port_start = docker_config.get('rtmp_port_start', 1935)
-        restart_policy = docker_config.get('restart_policy', 'unless-stopped')
-        
-        # Generate IP list
-        ip_list = self.generate_ip_list(start_ip, end_ip)
         camera_count = len(ip_list)
         
         print_status(f"Generating configuration for {camera_count} cameras")
-        print_info(f"IP range: {start_ip} → {end_ip}")
-        
-        # Build compose structure
-        compose_data = {
-            'version': '3.8',
-            'networks': {
-                network_name: {
-                    'driver': 'bridge'
-                }
-            },
-            'services': {}
-        }
-        
-        # Create directories
-        Path(config_base_path).mkdir(parents=True, exist_ok=True)
-        Path(recordings_base_path).mkdir(parents=True, exist_ok=True)
-        
-        # Generate services
-        for i, camera_ip in enumerate(ip_list):
-            camera_name = f"camera-{camera_ip.replace('.', '-')}"
-            rtsp_url = f"{protocol}://{username}:{password}@{camera_ip}:{port}{stream_path}"
-            web_port = web_port_start + i
-            rtmp_port = rtmp_port_start + i
-            
-            print_info(f"Configuring {camera_name} - Web: {web_port}, RTMP: {rtmp_port}")
-            
-            # Create camera-specific directories
-            camera_config_dir = Path(config_base_path) / camera_name
-            camera_recordings_dir = Path(recordings_base_path) / camera_name
-            camera_config_dir.mkdir(exist_ok=True)
-            camera_recordings_dir.mkdir(exist_ok=True)
-            
-            # Service definition
-            service = {
-                'image': kerberos_image,
-                'container_name': camera_name,
-                'restart': restart_policy,
-                'networks': [network_name],
-                'ports': [
-                    f"{web_port}:80",
-                    f"{rtmp_port}:1935"
-                ],
-                'volumes': [
-                    f"{config_base_path}/{camera_name}:/home/agent/data/config",
-                    f"{recordings_base_path}/{camera_name}:/home/agent/data/recordings"
-                ],
-                'environment': {
-                    'AGENT_NAME': camera_name,
-                    'AGENT_CAPTURE_IPCAMERA_RTSP': rtsp_url,
-                    'AGENT_CAPTURE_IPCAMERA_SUB_RTSP': rtsp_url,
-                    'AGENT_STREAM_WEBRTC': 'true',
-                    'AGENT_STREAM_RECORDING': 'true',
-                    **custom_env
-                }
-            }
-            
-            # Add resource limits if specified
-            limits = docker_config.get('limits', {})
-            if limits:
-                deploy_resources = {}
-                if 'memory' in limits:
-                    deploy_resources['memory'] = limits['memory']
-                if 'cpus' in limits:
-                    deploy_resources['cpus'] = limits['cpus']
-                
-                if deploy_resources:
-                    service['deploy'] = {'resources': {'limits': deploy_resources}}
-            
-            compose_data['services'][camera_name] = service
+        print_info(f"IP range: {ip_list.describe()}")
+        if placement:
+            print_info(f"CPU placement ({placement.mode}): {placement.describe(camera_count)}")
+        if review:
+            print_info(f"Capacity plan: {review['cpus']:.1f} of {review['usable']['cpus']:.1f} CPUs expected, "
+                       f"{review['memory_limits'] / 1024 ** 3:.1f} of {review['usable']['memory'] / 1024 ** 3:.1f} GB "
+                       f"in memory limits")
         
         # Write compose file
         try:
-            with open(self.compose_file, 'w') as f:
-                yaml.dump(compose_data, f, default_flow_style=False, indent=2)
+            shards = settings['shards']
+            with fleet_writer(self.compose_file, settings) as writer:
+                for camera_name, service, shard in iter_services(settings, ip_list):
+                    pinned = f", CPUs: {service['cpuset']}" if 'cpuset' in service else ""
+                    web_port, rtmp_port = settings['ports'][camera_name]
+                    print_info(f"Configuring {camera_name} - Web: {web_port}, RTMP: {rtmp_port}{pinned}")
+                    writer.add_service(camera_name, service, assignment[camera_name] if assignment else shard)
             
-            print_status(f"Docker Compose file generated: {self.compose_file}")
+            self.service_hashes = writer.service_hashes
+            layout = writer.layout()
+            if assignment:
+                urls = {host['name']: host['url'] for host in settings['hosts']}
+                for entry in layout:
+                    entry['docker_host'] = urls[entry['name']]
+            update_state(self.compose_file, generated=self.service_hashes, shards=layout,
+                         max_parallel=shards['max_parallel'] if shards else 1,
+                         hosts=assignment or {}, live_cameras=live, stream_profiles=detected,
+                         capacity_model=calibrated, ports=port_record(settings, settings['ports']))
+            
+            if layout:
+                print_status(f"Docker Compose files generated: {len(layout)} shards "
+                             f"({layout[0]['file']} ... {layout[-1]['file']})")
+            else:
+                print_status(f"Docker Compose file generated: {self.compose_file}")
             print_info(f"Services created: {camera_count}")
-            print_info(f"Web ports: {web_port_start}-{web_port_start + camera_count - 1}")
-            print_info(f"RTMP ports: {rtmp_port_start}-{rtmp_port_start + camera_count - 1}")
+            print_info(f"Web ports: {web_ports}")
+            print_info(f"RTMP ports: {rtmp_ports}")
+            if skipped:
+                print_info(f"Skipped {len(skipped)} ports already in use: "
+                           f"{', '.join(map(str, skipped[:10]))}{' ...' if len(skipped) > 10 else ''}")
             
             return camera_count
             
@@ -236,31 +206,726 @@ class KerberosManager:
             print_error(f"Failed to write compose file: {e}")
             sys.exit(1)
 
-    def run_docker_compose(self, command: List[str]) -> bool:
-        """Run docker-compose command"""
+    def live_cameras(self, only_live: Optional[bool]) -> Optional[List[str]]:
+        """Addresses generate should keep: all (None), the last scan's finds, or the previous choice"""
+        import time
+        from rtsp_scan import live_cameras
+        
+        state = load_state(self.compose_file)
+        if only_live is None:
+            return state.get('live_cameras')
+        if not only_live:
+            return None
+        record = state.get('scan')
+        if not record:
+            print_error("No scan results yet. Run 'scan' first")
+            sys.exit(1)
+        live = live_cameras(record)
+        age = time.time() - record['time']
+        ago = f"{age / 3600:.1f} hours" if age >= 3600 else f"{age / 60:.0f} minutes"
+        print_info(f"Only live cameras: {len(live)} of {record['addresses']} addresses answered RTSP "
+                   f"in the scan {ago} ago")
+        return live
+
+    def stream_profiles(self, config: Dict[str, Any]) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Detected stream profiles of the cameras when cameras.stream_detection is on.
+
+        Only cameras without a cached profile younger than the TTL are
+        described again, all at once; the rest come from the state file.
+        """
+        from compose_writer import compose_settings
+        from rtsp_scan import cache_profiles, cached_profiles, detect_settings, scan, scan_settings, stale_cameras
+        
         try:
-            cmd = ['docker-compose'] + command
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
+            detection = detect_settings(config.get('cameras', {}))
+            if not detection:
+                return None
+            settings = compose_settings(config)
+            target = scan_settings(settings)
+        except ValueError as e:
+            print_error(str(e))
+            sys.exit(1)
+        
+        ips = settings['ips']
+        cache = load_state(self.compose_file).get('streams') or {}
+        stale = stale_cameras(cache, ips, detection['ttl'])
+        if stale:
+            print_info(f"Describing {len(stale)} cameras for their stream profiles")
+            results = scan(stale, target, detection['concurrency'], detection['timeout'])
+            cache = cache_profiles(cache, results, detection['ttl'])
+            update_state(self.compose_file, streams=cache)
+            silent = sum(result.state != 'stream' for result in results)
+            if silent:
+                print_warning(f"{silent} cameras did not describe their stream and keep the configured profile")
+        detected = cached_profiles(cache, ips)
+        print_info(f"Stream profiles detected for {len(detected)} of {len(ips)} cameras")
+        return detected
+
+    def scan_cameras(self, concurrency: int, timeout: float):
+        """Probe the camera range for RTSP cameras and record where they answered"""
+        import time
+        from collections import Counter
+        from rtsp_scan import (DEFAULT_PROFILE_TTL, LIVE_STATES, cache_profiles, detect_settings, scan,
+                               scan_record, scan_settings)
+        
+        config = self.load_config(live=False)
+        require('yaml', 'PyYAML')
+        from compose_writer import compose_settings
+        try:
+            settings = compose_settings(config)
+            target = scan_settings(settings)
+            detection = detect_settings(config.get('cameras', {}))
+        except ValueError as e:
+            print_error(str(e))
+            sys.exit(1)
+        
+        ips = settings['ips']
+        print_info(f"Probing {len(ips)} addresses ({ips.describe()}) on port {target['port']}, "
+                   f"{concurrency} at a time, {timeout:g}s each")
+        
+        def on_result(result):
+            if result.state == 'stream':
+                print_status(f"{result.ip}: camera{' (' + result.server + ')' if result.server else ''}")
+            elif result.state == 'auth':
+                print_warning(f"{result.ip}: camera refused the configured credentials")
+            elif result.state == 'rtsp':
+                print_warning(f"{result.ip}: RTSP server answered {result.status} for {target['path']}")
+        
+        started = time.monotonic()
+        results = scan(ips, target, concurrency, timeout, on_result)
+        elapsed = time.monotonic() - started
+        # Cameras that described their stream also refresh the stream profile cache
+        streams = cache_profiles(load_state(self.compose_file).get('streams') or {},
+                                 (result for result in results if result.state == 'stream'),
+                                 detection['ttl'] if detection else DEFAULT_PROFILE_TTL)
+        update_state(self.compose_file, scan=scan_record(results, target, elapsed), streams=streams)
+        
+        counts = Counter(result.state for result in results)
+        live = sum(counts[state] for state in LIVE_STATES)
+        print_info(f"Scanned {len(results)} addresses in {elapsed:.1f}s ({len(results) / max(elapsed, 0.001):.0f}/s): "
+                   + ", ".join(f"{n} {state}" for state, n in counts.most_common()))
+        print_status(f"{live} cameras found; 'generate --only-live' creates agents for them only")
+
+    def assign_ports(self, settings: Dict[str, Any]) -> List[int]:
+        """Give every agent its web and RTMP host ports in settings['ports'], keeping the previous ones.
+
+        The listening sockets are read once; new agents skip ports that
+        are taken. Returns the busy ports that were skipped.
+        """
+        from compose_writer import camera_name_for
+        from ports import allocate_ports, listening_ports, previous_ports
+        
+        names = [camera_name_for(ip) for ip in settings['ips']]
+        previous = previous_ports(load_state(self.compose_file), settings)
+        # Agents on docker.hosts publish on their own hosts, where this machine's sockets say nothing
+        busy = set() if settings['hosts'] else (listening_ports() or set())
+        try:
+            settings['ports'], skipped = allocate_ports(settings, names, previous, busy)
+        except ValueError as e:
+            print_error(str(e))
+            sys.exit(1)
+        return skipped
+
+    def schedule_hosts(self, settings: Dict[str, Any]) -> Dict[str, str]:
+        """Assign every camera to one of docker.hosts, keeping the previous assignments"""
+        from compose_writer import camera_name_for
+        from multi_host import schedule
+        
+        names = [camera_name_for(ip) for ip in settings['ips']]
+        try:
+            assignment, report = schedule(settings, names, load_state(self.compose_file).get('hosts') or {})
+        except ValueError as e:
+            print_error(str(e))
+            sys.exit(1)
+        for host in report:
+            size = f"{host['capacity']} agents"
+            if host['cpus'] is not None:
+                size += f", {host['cpus']} CPUs, {host['memory'] / 1024 ** 3:.1f} GB"
+            moved = f", {host['moved']} moved here" if host['moved'] else ""
+            print_info(f"Host {host['name']} ({host['url']}): {host['agents']} of {size}{moved}")
+            if host['error']:
+                print_warning(f"Host {host['name']} is not reachable: {host['error']}")
+        return assignment
+
+    def run_docker_compose(self, command: List[str], services: Optional[List[str]] = None,
+                           deployed: bool = False) -> bool:
+        """Run a docker-compose command against every compose project, shards in parallel"""
+        from engine_backend import ENGINE_COMMANDS
+        backend = self.engine_backend() if command[0] in ENGINE_COMMANDS else None
+        if backend:
+            return self.run_engine(backend, command, services)
+        
+        projects = load_projects(self.compose_file, deployed=deployed)
+        jobs = plan_commands(projects, command, services)
+        results = run_commands(jobs, load_state(self.compose_file).get('max_parallel', 1))
+        sharded = projects[0].project is not None
+        
+        ok = True
+        for result in results:
+            label = f"{result.project.name}: " if sharded else ""
             if result.returncode == 0:
                 if result.stdout:
                     print(result.stdout)
-                return True
+                if sharded:
+                    print_info(f"{label}docker-compose {command[0]} finished in {result.elapsed:.1f}s")
             else:
-                print_error(f"Command failed: {' '.join(cmd)}")
+                ok = False
+                print_error(f"{label}Command failed: docker-compose {' '.join(command)}")
+                if result.stderr:
+                    print(result.stderr)
+        return ok
+
+    def engine_backend(self):
+        """Engine API backend when docker.backend is 'engine', otherwise None"""
+        if self._engine_backend is None:
+            config = self.load_config()
+            from engine_backend import EngineBackend, backend_settings
+            try:
+                options = backend_settings(config.get('docker', {}))
+                if options['backend'] != 'engine':
+                    self._engine_backend = False
+                    return None
+                require('yaml', 'PyYAML')
+                from compose_writer import compose_settings
+                settings = compose_settings(config)
+                if settings['hosts']:
+                    from multi_host import MultiHostBackend, host_layout
+                    layout = host_layout(load_state(self.compose_file))
+                    if not layout:
+                        raise ValueError("No cameras are assigned to docker.hosts yet, run generate first")
+                    self._engine_backend = MultiHostBackend(settings, self.compose_file, options, layout)
+                else:
+                    self._engine_backend = EngineBackend(settings, self.compose_file, options)
+            except ValueError as e:
+                print_error(str(e))
+                sys.exit(1)
+        return self._engine_backend or None
+
+    def single_host(self, backend, command: str):
+        """Refuse commands that still drive only the default Docker host when docker.hosts is set"""
+        from multi_host import MultiHostBackend
+        if isinstance(backend, MultiHostBackend):
+            print_error(f"'{command}' does not support docker.hosts yet")
+            sys.exit(1)
+
+    def run_engine(self, backend, command: List[str], services: Optional[List[str]] = None) -> bool:
+        """Run a compose-style command through the Engine API backend and report the outcome"""
+        from docker_engine import DockerEngineError
+        try:
+            result = backend.run(command, services)
+        except (ValueError, DockerEngineError) as e:
+            print_error(str(e))
+            return False
+        return self.report_batch(result)
+
+    def report_batch(self, result) -> bool:
+        """Print an engine BatchResult, returning True when nothing failed"""
+        print_info(f"{result.action}: {len(result.succeeded)} done, {len(result.skipped)} unchanged, "
+                   f"{len(result.failed)} failed in {result.elapsed:.1f}s")
+        failures = sorted(result.failed.items())
+        for name, error in failures[:10]:
+            print_error(f"{name}: {error}")
+        if len(failures) > 10:
+            print_warning(f"... and {len(failures) - 10} more failures")
+        return not failures
+
+    def fleet_status(self):
+        """Fleet status refreshed with one Engine API call, or None if the Engine API is unreachable"""
+        config = self.load_config()
+        require('yaml', 'PyYAML')
+        from docker_engine import DockerEngine, DockerEngineError
+        from fleet_status import FleetStatus, configured_agents
+        try:
+            agents = configured_agents(config)
+        except ValueError as e:
+            print_error(str(e))
+            sys.exit(1)
+        
+        from multi_host import HostFleet, MultiHostBackend, host_layout
+        
+        backend = self.engine_backend()
+        if isinstance(backend, MultiHostBackend):
+            fleet = HostFleet(host_layout(load_state(self.compose_file)), agents)
+        else:
+            fleet = FleetStatus(backend.engine if backend else DockerEngine(), agents)
+        try:
+            fleet.refresh()
+        except DockerEngineError as e:
+            if backend:
+                print_error(str(e))
+                sys.exit(1)
+            return None
+        if isinstance(fleet, HostFleet):
+            for host, error in sorted(fleet.errors.items()):
+                print_warning(f"Host {host} is not reachable: {error}")
+        return fleet
+
+    def show_fleet(self, rows: List[Dict[str, Any]], orphans: List[str], source: str):
+        """Print the configured agents with their container state"""
+        width = max([len(r['name']) for r in rows] + [4])
+        hosts = max([len(r['host']) for r in rows if 'host' in r] + [0])
+        host_width = max(hosts, 4) if hosts else 0
+        host_header = f"{'HOST':<{host_width}}  " if host_width else ""
+        print(f"{'NAME':<{width}}  {host_header}{'CAMERA IP':<15}  {'WEB':<5}  {'STATE':<10}  STATUS")
+        for row in rows:
+            color = Colors.GREEN if row['state'] == 'running' else Colors.RED
+            host = f"{row['host']:<{host_width}}  " if host_width else ""
+            print(f"{row['name']:<{width}}  {host}{row['ip']:<15}  {str(row['web_port'] or '-'):<5}  "
+                  f"{color}{row['state']:<10}{Colors.NC}  {row['status']}")
+        
+        running = sum(1 for r in rows if r['state'] == 'running')
+        print_info(f"{running}/{len(rows)} agents running ({source})")
+        if orphans:
+            print_warning(f"{len(orphans)} agent containers are not in the configuration: "
+                          f"{', '.join(orphans[:5])}{' ...' if len(orphans) > 5 else ''}")
+
+    def watch_status(self, interval: float):
+        """Live fleet view kept current from the Docker events stream"""
+        import shutil
+        import threading
+        import time
+        from collections import deque
+        from docker_engine import DockerEngineError
+        
+        fleet = self.fleet_status()
+        if fleet is None:
+            print_error("The Docker Engine API is not reachable; --watch needs it")
+            sys.exit(1)
+        recent = deque(maxlen=8)
+        shown = {}
+        
+        def render(changed):
+            stamp = time.strftime('%H:%M:%S')
+            for name in changed:
+                state = fleet.state(name)
+                if shown.get(name) != state:
+                    recent.appendleft((stamp, name, state))
+                    shown[name] = state
+            rows = fleet.rows()
+            shown.update((row['name'], row['state']) for row in rows)
+            counts = fleet.counts()
+            running = counts.get('running', 0)
+            
+            lines = ["\033[2J\033[H" + f"{Colors.BLUE}[KERBEROS]{Colors.NC} Agent status  {stamp}  "
+                     f"(live from Docker events, Ctrl+C to quit)",
+                     f"{Colors.GREEN}{running} running{Colors.NC}  " +
+                     "  ".join(f"{Colors.RED}{n} {state}{Colors.NC}" for state, n in sorted(counts.items())
+                               if state != 'running') +
+                     f"  of {len(rows)} agents", ""]
+            problems = [row for row in rows if row['state'] != 'running']
+            room = max(3, shutil.get_terminal_size().lines - len(recent) - 8)
+            if problems:
+                lines.append("Not running:")
+                for row in problems[:room]:
+                    lines.append(f"  {row['name']:<22} {row['ip']:<15} {Colors.RED}{row['state']:<10}{Colors.NC} {row['status']}")
+                if len(problems) > room:
+                    lines.append(f"  ... and {len(problems) - room} more")
+            else:
+                lines.append(f"{Colors.GREEN}All agents running{Colors.NC}")
+            if recent:
+                lines += ["", "Recent changes:"]
+                for when, name, state in recent:
+                    lines.append(f"  {when}  {name:<22} {state}")
+            sys.stdout.write("\n".join(lines) + "\n")
+            sys.stdout.flush()
+        
+        try:
+            fleet.watch(render, threading.Event(), interval)
+        except KeyboardInterrupt:
+            pass
+        except DockerEngineError as e:
+            print_error(str(e))
+            sys.exit(1)
+
+    def run_docker(self, command: List[str]) -> bool:
+        """Run a plain docker command"""
+        import subprocess
+        try:
+            result = subprocess.run(['docker'] + command, capture_output=True, text=True)
+            if result.returncode != 0:
+                print_error(f"Command failed: docker {' '.join(command)}")
                 if result.stderr:
                     print(result.stderr)
                 return False
-                
+            return True
         except FileNotFoundError:
-            print_error("Docker Compose not found. Please install Docker and Docker Compose.")
+            print_error("Docker not found. Please install Docker.")
             return False
-        except Exception as e:
-            print_error(f"Error running command: {e}")
+
+    def record_deployed(self):
+        """Mark the currently generated services as deployed"""
+        state = load_state(self.compose_file)
+        update_state(self.compose_file, deployed=state.get('generated', {}),
+                     deployed_shards=state.get('shards', []))
+        kerberos_daemon.notify(self.config_file)
+
+    def clear_deployed(self):
+        """Forget the deployed services after the project has been taken down"""
+        update_state(self.compose_file, deployed={})
+        kerberos_daemon.notify(self.config_file)
+
+    def redeploy_incremental(self) -> bool:
+        """Regenerate and recreate only the services whose definition changed"""
+        previous_state = load_state(self.compose_file)
+        previous = previous_state.get('deployed', {})
+        self.generate_compose_file()
+        
+        if not previous:
+            print_info("No previous deployment recorded, bringing up all agents")
+            if not self.run_docker_compose(['up', '-d', '--remove-orphans']):
+                return False
+            self.record_deployed()
+            return True
+        
+        changes = diff_services(previous, self.service_hashes)
+        
+        # Services that moved to another shard must leave their old compose project first
+        old_projects = service_projects(previous_state.get('deployed_shards', []))
+        new_projects = service_projects(load_state(self.compose_file).get('shards', []))
+        moved = [name for name in changes.changed + changes.unchanged
+                 if old_projects.get(name) != new_projects.get(name)]
+        recreate = changes.added + changes.changed + [n for n in moved if n not in changes.changed]
+        
+        print_info(f"Services: {len(changes.added)} added, {len(changes.changed)} changed, "
+                   f"{len(changes.removed)} removed, {len(moved)} moved, "
+                   f"{len(changes.unchanged)} unchanged")
+        
+        ok = True
+        # Removed services are no longer in the compose file, so remove their containers directly
+        backend = self.engine_backend()
+        if backend and changes.removed + moved:
+            ok = self.report_batch(backend.remove(changes.removed + moved))
+        elif not backend:
+            for batch in chunked(changes.removed + moved):
+                ok = self.run_docker(['rm', '-f'] + batch) and ok
+        if recreate:
+            ok = self.run_docker_compose(['up', '-d', '--no-deps'], services=recreate) and ok
+        
+        if not (recreate or changes.removed):
+            print_info("No service changes, all agents left running")
+        if ok:
+            self.record_deployed()
+        return ok
+
+    def follow_logs(self, service: Optional[str] = None, follow: bool = False, pattern: Optional[str] = None,
+                    level: Optional[str] = None, tail: str = 'all') -> bool:
+        """Stream agent logs with per-camera prefixes; False if the Engine API is unreachable"""
+        from docker_engine import DockerEngine, DockerEngineError, agent_containers
+        from log_follower import LogFollower, line_filter
+        try:
+            keep = line_filter(pattern, level)
+        except ValueError as e:
+            print_error(str(e))
+            sys.exit(1)
+        
+        backend = self.engine_backend()
+        self.single_host(backend, 'logs')
+        engine = backend.engine if backend else DockerEngine()
+        try:
+            names = [c['name'] for c in agent_containers(engine)]
+        except DockerEngineError:
+            return False
+        if service:
+            if service not in names:
+                print_error(f"No agent container named '{service}'")
+                sys.exit(1)
+            names = [service]
+        if not names:
+            print_warning("No agent containers found")
+            return True
+        
+        width = max(len(name) for name in names)
+        palette = [Colors.GREEN, Colors.CYAN, Colors.YELLOW, Colors.PURPLE, Colors.BLUE]
+        prefixes = {name: f"{palette[i % len(palette)]}{name:<{width}}{Colors.NC} | "
+                    for i, name in enumerate(names)}
+        follower = LogFollower(engine, names, keep, follow=follow, tail=tail)
+        try:
+            follower.run(lambda name, line: sys.stdout.write(prefixes[name] + line + '\n'), sys.stdout.flush)
+        except KeyboardInterrupt:
+            pass
+        for name, error in sorted(follower.errors.items()):
+            print_warning(f"{name}: {error}")
+        return True
+
+    def top(self, interval: float, sort: str = 'cpu', iterations: int = 0):
+        """Refresh a per-agent CPU, memory and network view every interval seconds"""
+        import shutil
+        import time
+        from agent_stats import ResourceSampler, format_bytes, sort_rows
+        from docker_engine import DockerEngine, DockerEngineError
+        
+        backend = self.engine_backend()
+        self.single_host(backend, 'top')
+        sampler = ResourceSampler(backend.engine if backend else DockerEngine())
+        interactive = sys.stdout.isatty()
+        
+        def render(rows, overhead):
+            running = [r for r in rows if r['state'] == 'running']
+            cpu = sum(r['cpu'] or 0 for r in running)
+            memory = sum(r['memory'] or 0 for r in running)
+            rx = sum(r['rx'] or 0 for r in running)
+            tx = sum(r['tx'] or 0 for r in running)
+            lines = [f"{Colors.BLUE}[KERBEROS]{Colors.NC} {time.strftime('%H:%M:%S')}  "
+                     f"{len(running)}/{len(rows)} agents running  CPU {cpu:.1f}%  MEM {format_bytes(memory)}  "
+                     f"NET {format_bytes(rx)}/s in {format_bytes(tx)}/s out  (top: {overhead:.1f}% CPU)",
+                     f"{'NAME':<24} {'CPU%':>6} {'MEM':>8} {'MEM%':>5} {'RX/s':>8} {'TX/s':>8} {'RESTARTS':>8}  SOURCE"]
+            shown = sort_rows(rows, sort)
+            if interactive:
+                shown = shown[:max(1, shutil.get_terminal_size().lines - 3)]
+            for r in shown:
+                if r['state'] != 'running':
+                    lines.append(f"{r['name']:<24} {Colors.RED}{r['state']:>6}{Colors.NC} "
+                                 f"{'-':>8} {'-':>5} {'-':>8} {'-':>8} {r['restarts']:>8}")
+                    continue
+                percent = f"{r['memory'] / r['limit'] * 100:.0f}" if r['memory'] and r['limit'] else '-'
+                lines.append(f"{r['name']:<24} {'-' if r['cpu'] is None else format(r['cpu'], '.1f'):>6} "
+                             f"{'-' if r['memory'] is None else format_bytes(r['memory']):>8} {percent:>5} "
+                             f"{'-' if r['rx'] is None else format_bytes(r['rx']):>8} "
+                             f"{'-' if r['tx'] is None else format_bytes(r['tx']):>8} {r['restarts']:>8}  {r['source']}")
+            sys.stdout.write(("\033[2J\033[H" if interactive else "\n") + "\n".join(lines) + "\n")
+            sys.stdout.flush()
+        
+        try:
+            sampler.sample()
+            count = 0
+            started, used = time.monotonic(), time.process_time()
+            while not iterations or count < iterations:
+                time.sleep(interval)
+                rows = sampler.sample()
+                # Our own CPU use over the last cycle, drawing the previous frame included
+                now, cpu = time.monotonic(), time.process_time()
+                render(rows, (cpu - used) / (now - started) * 100)
+                started, used = now, cpu
+                count += 1
+        except KeyboardInterrupt:
+            pass
+        except DockerEngineError as e:
+            print_error(str(e))
+            sys.exit(1)
+        finally:
+            sampler.close()
+
+    def calibrate(self, duration: float, interval: float, ingest: Optional[str] = None,
+                  percentile: float = 90.0, fit_only: bool = False) -> bool:
+        """Record every agent's CPU and memory (or ingest them from CSV) and fit the capacity model to them"""
+        from calibration import TelemetryWriter, agent_profiles, collect, fit_model, ingest_csv, telemetry_path
+        from capacity import model_settings
+        from docker_engine import DockerEngine, DockerEngineError
+        
+        config = self.planning_config()
+        capacity = (config.get('docker') or {}).get('capacity') or {}
+        path = telemetry_path(self.compose_file)
+        if ingest:
+            try:
+                with TelemetryWriter(path, f"csv:{ingest}") as writer:
+                    rows = ingest_csv(ingest, writer)
+            except (OSError, ValueError) as e:
+                print_error(f"Cannot ingest {ingest}: {e}")
+                return False
+            print_status(f"Ingested {rows} samples in {writer.ticks} ticks from {ingest} into {path}")
+        elif not fit_only:
+            from agent_stats import ResourceSampler
+            backend = self.engine_backend()
+            self.single_host(backend, 'calibrate')
+            sampler = ResourceSampler(backend.engine if backend else DockerEngine())
+            print_header(f"Sampling agents every {interval:g}s for {duration:g}s into {path} (Ctrl+C to stop early)")
+            
+            def progress(ticks, agents):
+                sys.stdout.write(f"\r{Colors.CYAN}[i]{Colors.NC} {ticks} samples of {agents} agents")
+                sys.stdout.flush()
+            
+            try:
+                with TelemetryWriter(path, 'sampler') as writer:
+                    collect(sampler, writer, duration, interval, progress)
+            except DockerEngineError as e:
+                print_error(str(e))
+                return False
+            finally:
+                sampler.close()
+            print()
+        
+        require('numpy', 'numpy')
+        previous = model_settings(capacity)
+        try:
+            fit = fit_model(path, agent_profiles(config), previous, percentile)
+        except FileNotFoundError:
+            print_error(f"No samples yet: run 'calibrate' without --fit-only first ({path} not found)")
+            return False
+        except ValueError as e:
+            print_error(str(e))
+            return False
+        update_state(self.compose_file, calibration=fit)
+        
+        print_status(f"Fitted to the {percentile:g}th percentile of {fit['samples']} samples from {fit['agents']} agents")
+        print(f"\n{'COST':<26} {'BEFORE':>10} {'FITTED':>10}")
+        for key, value in fit['model'].items():
+            print(f"{key:<26} {previous[key]:>10.4g} {value:>10.4g}")
+        overridden = [key for key in fit['model'] if key in (capacity.get('model') or {})]
+        if overridden:
+            print_warning(f"docker.capacity.model still overrides {', '.join(overridden)}")
+        print_info("plan and syscheck use the fitted costs now; 'generate' or 'redeploy' sizes the agents with them")
+        return True
+    
+    def storage(self, window_days: float = 7.0, top: int = 20, as_json: bool = False, workers: int = 8) -> bool:
+        """Rescan the recordings incrementally and show what each camera writes per day and when the volume fills"""
+        import json
+        import time
+        from agent_stats import format_bytes
+        from compose_writer import camera_name_for, compose_settings
+        from recordings_index import index_path, measure_storage
+        
+        try:
+            settings = compose_settings(self.load_config())
+        except ValueError as e:
+            print_error(str(e))
             return False
+        recordings = Path(self.compose_file).absolute().parent / settings['recordings_base_path']
+        names = [camera_name_for(ip) for ip in settings['ips']]
+        report = measure_storage(str(recordings), names, self.compose_file, window_days, workers)
+        if as_json:
+            print(json.dumps(report, indent=2))
+            return True
+        
+        scan = report['scan']
+        print_header(f"📼 Recordings in {report['path']}")
+        print_info(f"Scanned {len(names)} cameras in {scan['elapsed']:.2f}s: {scan['listed']} directories listed, "
+                   f"{scan['stated']} files stat'ed, {scan['reused']} taken from {index_path(self.compose_file)}")
+        cameras = sorted(report['cameras'], key=lambda c: c['bytes_per_day'], reverse=True)
+        shown = cameras[:top] if top else cameras
+        print(f"\n{'CAMERA':<28} {'FILES':>7} {'STORED':>8} {'PER DAY':>8}  LAST RECORDING")
+        for camera in shown:
+            last = time.strftime('%Y-%m-%d %H:%M', time.localtime(camera['newest'])) if camera['newest'] else '-'
+            print(f"{camera['camera']:<28} {camera['files']:>7} {format_bytes(camera['bytes']):>8} "
+                  f"{format_bytes(camera['bytes_per_day']):>8}  {last}")
+        if len(shown) < len(cameras):
+            print_info(f"{len(cameras) - len(shown)} more cameras (--top 0 shows all)")
+        
+        print(f"\nStored: {format_bytes(report['bytes'])} in {report['files']} files from "
+              f"{report['recording_cameras']}/{len(names)} cameras")
+        print(f"Written: {format_bytes(report['bytes_per_day'])}/day over the last {window_days:g} days "
+              f"({format_bytes(report['bytes_per_camera_day'])}/day per recording camera)")
+        if report['net_growth_per_day'] is not None:
+            print(f"Net growth: {format_bytes(report['net_growth_per_day'])}/day between scans, retention included")
+        else:
+            print_info("Net growth needs scans an hour apart; the write rate stands in for it")
+        print(f"Volume: {format_bytes(report['volume_free'])} free of {format_bytes(report['volume_total'])}")
+        days = report['days_until_full']
+        if days is None:
+            print_status("Recordings are not growing")
+        elif days < 7:
+            print_warning(f"Recordings volume full in {days:.1f} days")
+        else:
+            print_status(f"Recordings volume full in {days:.1f} days at the current growth")
+        return True
+    
+    def pull_latest(self, settings: Dict[str, Any]):
+        """Pull every distinct agent image concurrently.
+
+        Returns (service images, pull results, engine or None), or None if
+        any pull failed, in which case nothing should be recreated.
+        """
+        from docker_engine import DockerEngine, DockerEngineError
+        from image_pull import distinct_images, pull_images, service_images
+        
+        backend = self.engine_backend()
+        self.single_host(backend, 'update')
+        engine = backend.engine if backend else DockerEngine()
+        if not backend:
+            try:
+                engine.ping()
+            except DockerEngineError:
+                engine = None
+        
+        images = service_images(settings)
+        distinct = distinct_images(images)
+        print_info(f"Pulling {len(distinct)} image{'s' if len(distinct) != 1 else ''} "
+                   f"used by {len(images)} agents...")
+        
+        def on_done(result):
+            if result.error:
+                print_error(f"{result.image}: {result.error}")
+            elif result.after != result.before:
+                print_status(f"{result.image}: new image {(result.after or '')[7:19]} ({result.elapsed:.1f}s)")
+            else:
+                print_status(f"{result.image}: already up to date ({result.elapsed:.1f}s)")
+        
+        results = pull_images(distinct, engine, on_progress=lambda image, text: print_info(f"{image}: {text}"),
+                              on_done=on_done)
+        if any(result.error for result in results):
+            print_error("Not recreating any agents because a pull failed")
+            return None
+        return images, results, engine
+
+    def rolling_rollout(self, action: str, wave_size: Optional[int] = None) -> bool:
+        """Restart ('restart') or recreate on the latest image ('update') agents in health-gated waves"""
+        config = self.load_config()
+        require('yaml', 'PyYAML')
+        from compose_writer import compose_settings
+        from rollout import (RECREATE_COMMAND, health_urls, missing_health_urls, recreate_plan, rolling,
+                             rollout_settings)
+        try:
+            settings = compose_settings(config)
+            options = rollout_settings(config.get('docker', {}), wave_size)
+        except ValueError as e:
+            print_error(str(e))
+            sys.exit(1)
+        # Health checks go to the web ports on this machine
+        self.single_host(self.engine_backend(), f"rolling {action}")
+        
+        state = load_state(self.compose_file)
+        names = list(state.get('deployed' if action == 'restart' else 'generated') or {})
+        if not names:
+            print_error("No agents recorded yet. Run 'start' first")
+            return False
+        
+        if action == 'update':
+            pulled = self.pull_latest(settings)
+            if pulled is None:
+                return False
+            names, rollback = recreate_plan(
+                pulled, self.run_docker_compose,
+                lambda touched: print_warning(f"Rolling {len(touched)} agents back to the previous image"))
+            if not names:
+                print_status("All agents already run the latest images")
+                return True
+            command = RECREATE_COMMAND
+        else:
+            command, rollback = ['restart'], None
+        
+        # Every agent must be health-checked, or a wave could pass without looking at it
+        urls = health_urls(settings, options)
+        missing = missing_health_urls(names, urls)
+        if missing:
+            more = f" and {len(missing) - 10} more" if len(missing) > 10 else ""
+            print_error(f"No health URL for {', '.join(missing[:10])}{more}: not in the current configuration; "
+                        f"run 'generate' first")
+            return False
+        
+        def on_wave(number, total, wave, unhealthy, elapsed):
+            if unhealthy:
+                print_warning(f"Wave {number}/{total}: {len(unhealthy)} of {len(wave)} agents unhealthy "
+                              f"after {elapsed:.1f}s")
+            else:
+                print_status(f"Wave {number}/{total}: {len(wave)} agents healthy in {elapsed:.1f}s")
+        
+        print_info(f"Rolling {action} of {len(names)} agents in waves of {options['wave_size']}")
+        result = rolling(names, lambda wave: self.run_docker_compose(command, services=wave),
+                         urls, options, on_wave, rollback)
+        if result.failed_wave is None:
+            return True
+        
+        print_error(f"Wave {result.failed_wave} failed; stopped after {len(result.completed)} of {len(names)} agents")
+        if result.unhealthy:
+            shown = ', '.join(result.unhealthy[:10])
+            more = f" and {len(result.unhealthy) - 10} more" if len(result.unhealthy) > 10 else ""
+            print_error(f"Unhealthy: {shown}{more}")
+        if result.rolled_back:
+            print_info(f"Rolled back {len(result.rolled_back)} agents to the previous image")
+        return False
 
     def check_dependencies(self):
         """Check system dependencies"""
+        import subprocess
         print_header("Checking system dependencies...")
         
         # Check Python
@@ -293,73 +958,83 @@ class KerberosManager:
         else:
             print_warning(f"Configuration file not found: {self.config_file}")
 
-    def system_check(self):
-        """Comprehensive system resources and capacity check"""
-        print_header("🔍 System Resources Check")
+    def system_check(self, cpu_window: float = 1.0, as_json: bool = False):
+        """Comprehensive system resources and capacity check, all probes at once (see system_check.run_checks)"""
+        import json
+        if not as_json:
+            print_header("🔍 System Resources Check")
         
         # Load configuration
-        config = self.load_config()
+        config = self.planning_config()
         if not config:
             print_error("Cannot perform system check without valid configuration")
             return False
             
         # Calculate camera count
         try:
-            cameras = config.get('cameras', {})
-            ip_range = cameras.get('ip_range', {})
-            start_ip = ip_range.get('start', '')
-            end_ip = ip_range.get('end', '')
-            
-            if not start_ip or not end_ip:
-                print_error("IP range not properly configured")
-                return False
-                
-            ip_list = self.generate_ip_list(start_ip, end_ip)
-            camera_count = len(ip_list)
-            
-        except Exception as e:
-            print_error(f"Error calculating camera count: {e}")
+            camera_count = len(camera_ips(config.get('cameras', {})))
+        except ValueError as e:
+            print_error(f"IP range not properly configured: {e}")
             return False
         
-        print_info(f"Checking capacity for {camera_count} cameras")
-        
-        # Calculate resource requirements
-        requirements = self._calculate_resource_requirements(config, camera_count)
+        from system_check import run_checks
+        if not as_json:
+            print_info(f"Checking capacity for {camera_count} cameras")
         
-        # Get current system resources
-        system_resources = self._get_system_resources()
+        # Calculate resource requirements and sample the host concurrently
+        try:
+            report = run_checks(config, camera_count, cpu_window, self.compose_file)
+        except ValueError as e:
+            print_error(f"Camera profiles not properly configured: {e}")
+            return False
+        if as_json:
+            print(json.dumps(report, indent=2))
+            return report['ready']
+        requirements = report['requirements']
+        system_resources = report['resources']
+        checks = report['checks']
         
         # Print current system status
+        cpu = system_resources['cpu']
+        disk = system_resources['disk']
         print(f"\n💻 System Resources:")
         print(f"   Memory: {system_resources['memory']['available_gb']:.1f} GB available / {system_resources['memory']['total_gb']:.1f} GB total")
-        print(f"   CPU: {system_resources['cpu']['cores']} cores ({system_resources['cpu']['current_usage']:.1f}% current usage)")
-        print(f"   Disk: {system_resources['disk']['free_gb']:.1f} GB free / {system_resources['disk']['total_gb']:.1f} GB total")
+        cpu_sample = (f"peak {cpu['peak_percent']:.1f}% over {cpu['window_seconds']:g}s"
+                      if cpu['source'] == 'sampled' else "load average")
+        print(f"   CPU: {cpu['cores']} cores ({cpu['current_usage_percent']:.1f}% current usage, {cpu_sample})")
+        print(f"   Disk: {disk['free_gb']:.1f} GB free / {disk['total_gb']:.1f} GB total on {disk['mount']} (recordings)")
         
         # Print requirements
         print(f"\n📊 Estimated Requirements:")
         print(f"   Memory per agent: {requirements['memory_per_agent_mb']} MB")
         print(f"   Total memory needed: {requirements['total_memory_gb']:.1f} GB")
         print(f"   Estimated CPU usage: {requirements['total_cpu_percent']:.1f}%")
-        print(f"   Daily storage: {requirements['daily_storage_gb']:.1f} GB/day")
+        print(f"   Daily storage: {requirements['estimated_disk_usage_gb_per_day']:.1f} GB/day")
+        storage = report['storage']
+        if storage:
+            print(f"   Measured storage: {report['daily_storage_gb']:.1f} GB/day "
+                  f"({storage['recording_cameras']} cameras recording; see 'storage')")
         
         # Capacity check
         print(f"\n✅ Capacity Assessment:")
         
-        memory_ok = system_resources['memory']['available_gb'] >= requirements['total_memory_gb']
-        cpu_ok = requirements['total_cpu_percent'] <= 80
-        storage_ok = True  # We'll just warn about storage
-        
-        print(f"   Memory: {'✅ OK' if memory_ok else '❌ INSUFFICIENT'}")
-        if not memory_ok:
+        print(f"   Memory: {'✅ OK' if checks['memory'] else '❌ INSUFFICIENT'}")
+        if not checks['memory']:
             shortage = requirements['total_memory_gb'] - system_resources['memory']['available_gb']
             print(f"      Need {shortage:.1f} GB more memory")
             
-        print(f"   CPU: {'✅ OK' if cpu_ok else '⚠️  HIGH LOAD'}")
-        if not cpu_ok:
+        print(f"   CPU: {'✅ OK' if checks['cpu'] else '⚠️  HIGH LOAD'}")
+        if not checks['cpu']:
             print(f"      Warning: {requirements['total_cpu_percent']:.1f}% estimated usage")
+        
+        print(f"   Disk (1 week): {'✅ OK' if checks['disk'] else '⚠️  LIMITED'}")
+        if not checks['disk']:
+            print(f"      Warning: {disk['free_gb']:.1f} GB free, {report['weekly_storage_gb']:.1f} GB needed")
+        if storage and storage['days_until_full'] is not None:
+            print(f"      Recordings volume full in {storage['days_until_full']:.1f} days at the current growth")
             
         # Check ports
-        busy_ports = self._check_ports(config, camera_count)
+        busy_ports = report['busy_ports']
         if busy_ports:
             print(f"   Ports: ⚠️  CONFLICTS DETECTED")
             for port in busy_ports[:5]:  # Show first 5
@@ -368,126 +1043,65 @@ class KerberosManager:
             print(f"   Ports: ✅ AVAILABLE")
             
         # Overall assessment
-        if memory_ok and cpu_ok and not busy_ports:
+        if report['ready']:
             print_status("\n🎯 SYSTEM READY FOR DEPLOYMENT")
             return True
         else:
             print_warning("\n⚠️  DEPLOYMENT MAY HAVE ISSUES")
-            if not memory_ok:
+            if not checks['memory']:
                 print("   - Add more RAM or reduce camera count")
-            if not cpu_ok:
+            if not checks['cpu']:
                 print("   - Monitor performance during operation")
+            if not checks['disk']:
+                print("   - Plan for regular cleanup of recordings or add more storage")
             if busy_ports:
                 print("   - Stop conflicting services or change ports")
             return False
     
-    def _calculate_resource_requirements(self, config, camera_count):
-        """Calculate estimated resource requirements"""
+    def capacity_plan(self) -> bool:
+        """Show the limits docker.limits: auto gives each camera profile and whether the host holds them"""
+        config = self.planning_config()
+        from capacity import CapacityPlan, capacity_settings, profile_settings
+        from compose_writer import compose_settings
+        from placement import CpuPlacement
         
-        # Base requirements per agent
-        base_memory_mb = 256
-        base_cpu_percent = 5
+        try:
+            settings = compose_settings(config)
+            docker_config = config.get('docker', {}) or {}
+            capacity = settings['capacity'] or capacity_settings('auto', docker_config.get('capacity'))
+            profiles = settings['profiles'] or profile_settings(config.get('cameras', {}))
+            placement = CpuPlacement(settings['placement']) if settings['placement'] else None
+            plan = CapacityPlan(capacity, profiles)
+            review = plan.review(settings['ips'], placement)
+        except ValueError as e:
+            print_error(str(e))
+            sys.exit(1)
         
-        # Additional based on features
-        additional_memory = 0
-        additional_cpu = 0
+        print_header("📐 Capacity Plan")
+        if not settings['capacity']:
+            print_warning("docker.limits is not 'auto': these limits are not applied to the agents")
+        gb = 1024 ** 3
+        print(f"\n{'PROFILE':<14} {'CAMERAS':>7} {'VIDEO':<24} {'CPU':>6} {'MEMORY':>8} {'LIMITS':<16}")
+        for row in review['profiles']:
+            codec = f" {row['codec']}" if row['codec'] else ''
+            video = f"{row['resolution']}@{row['fps']}{codec}{' rec' if row['recording'] else ''}"
+            limits = f"{row['limits']['cpus']} / {row['limits']['memory']}"
+            print(f"{row['name'][:14]:<14} {row['cameras']:>7} {video:<24} {row['cpus']:>6.2f} "
+                  f"{row['memory'] / 1024 ** 2:>6.0f}MB {limits:<16}")
         
-        # Recording adds overhead
-        if config.get('cameras', {}).get('recording', {}).get('enabled', False):
-            additional_memory += 128
-            additional_cpu += 3
-            
-        # Streaming adds overhead
-        if config.get('cameras', {}).get('stream', {}).get('enabled', False):
-            additional_memory += 64
-            additional_cpu += 2
-            
-        # Motion detection adds overhead
-        if config.get('cameras', {}).get('motion_detection', {}).get('enabled', False):
-            additional_memory += 32
-            additional_cpu += 2
-            
-        memory_per_agent = base_memory_mb + additional_memory
-        cpu_per_agent = base_cpu_percent + additional_cpu
-        
-        total_memory_mb = memory_per_agent * camera_count
-        total_cpu_percent = cpu_per_agent * camera_count
-        
-        # Estimate daily storage (very rough)
-        daily_storage_gb = 0
-        if config.get('cameras', {}).get('recording', {}).get('enabled', False):
-            # Rough estimate: 10MB per minute of recording
-            # Assume motion triggers every 10 minutes, 40 seconds per trigger
-            daily_recordings = 24 * 6  # 6 per hour
-            mb_per_recording = 10 * (40/60)  # 40 seconds
-            daily_storage_gb = (daily_recordings * mb_per_recording * camera_count) / 1024
-            
-        return {
-            'memory_per_agent_mb': memory_per_agent,
-            'total_memory_gb': total_memory_mb / 1024,
-            'total_cpu_percent': total_cpu_percent,
-            'daily_storage_gb': daily_storage_gb
-        }
-    
-    def _get_system_resources(self):
-        """Get current system resource information"""
-        # Memory
-        memory = psutil.virtual_memory()
-        
-        # CPU
-        cpu_usage = psutil.cpu_percent(interval=1)
-        
-        # Disk
-        disk = psutil.disk_usage('/')
-        
-        return {
-            'memory': {
-                'total_gb': memory.total / (1024**3),
-                'available_gb': memory.available / (1024**3),
-                'usage_percent': memory.percent
-            },
-            'cpu': {
-                'cores': psutil.cpu_count(),
-                'current_usage': cpu_usage
-            },
-            'disk': {
-                'total_gb': disk.total / (1024**3),
-                'free_gb': disk.free / (1024**3),
-                'usage_percent': (disk.used / disk.total) * 100
-            }
-        }
-        
-    def _check_ports(self, config, camera_count):
-        """Check if required ports are available"""
-        import socket
-        
-        busy_ports = []
-        web_port_start = config.get('docker', {}).get('web_port_start', 8080)
-        rtmp_port_start = config.get('docker', {}).get('rtmp_port_start', 1935)
-        
-        # Check web ports
-        for i in range(camera_count):
-            port = web_port_start + i
-            if self._is_port_busy(port):
-                busy_ports.append(f"Web port {port}")
-                
-        # Check RTMP ports  
-        for i in range(camera_count):
-            port = rtmp_port_start + i
-            if self._is_port_busy(port):
-                busy_ports.append(f"RTMP port {port}")
-                
-        return busy_ports
-        
-    def _is_port_busy(self, port):
-        """Check if a port is in use"""
-        import socket
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.bind(('localhost', port))
-                return False
-        except OSError:
-            return True
+        usable = review['usable']
+        print(f"\nHost: {plan.host['cpus']:g} CPUs, {plan.host['memory'] / gb:.1f} GB"
+              f"{' (pinned: ' + placement.describe(len(settings['ips'])) + ')' if placement else ''}")
+        print(f"Expected CPU load: {review['cpus']:.1f} of {usable['cpus']:.1f} CPUs")
+        print(f"Memory limits: {review['memory_limits'] / gb:.1f} of {usable['memory'] / gb:.1f} GB "
+              f"(expected use {review['memory'] / gb:.1f} GB)")
+        
+        if review['problems']:
+            for problem in review['problems']:
+                print_error(problem)
+            return False
+        print_status("The host can hold this plan")
+        return True
 
 def main():
     parser = argparse.ArgumentParser(
@@ -495,6 +1109,8 @@ def main():
         formatter_class=argparse.RawDescriptionHelpFormatter,
         epilog="""
 Examples:
+  %(prog)s scan                  Find the addresses where RTSP cameras answer
+  %(prog)s generate --only-live  Generate docker-compose.yml for the cameras found
   %(prog)s generate              Generate docker-compose.yml
   %(prog)s start                 Start all agents
   %(prog)s stop                  Stop all agents  
@@ -502,6 +1118,9 @@ Examples:
   %(prog)s logs                  Show logs
   %(prog)s check                 Check dependencies
   %(prog)s syscheck              Check system resources and capacity
+  %(prog)s calibrate             Fit the resource model to the agents' measured use
+  %(prog)s watchdog              Restart agents whose health endpoint stops answering
+  %(prog)s daemon                Keep config and Docker state warm for fast status/info
         """
     )
     
@@ -511,7 +1130,16 @@ Examples:
     subparsers = parser.add_subparsers(dest='command', help='Available commands')
     
     # Generate command
-    subparsers.add_parser('generate', help='Generate docker-compose.yml from configuration')
+    generate_parser = subparsers.add_parser('generate', help='Generate docker-compose.yml from configuration')
+    generate_parser.add_argument('--only-live', action='store_true',
+                                 help="Only create agents for the cameras found by the last 'scan'")
+    
+    # Scan command
+    scan_parser = subparsers.add_parser('scan', help='Probe the camera range for RTSP cameras')
+    scan_parser.add_argument('--concurrency', type=int, default=1000,
+                             help='Addresses probed at the same time (default: %(default)s)')
+    scan_parser.add_argument('--timeout', type=float, default=2.0,
+                             help='Seconds each address gets to answer (default: %(default)s)')
     
     # Start command
     start_parser = subparsers.add_parser('start', help='Start all Kerberos agents')
@@ -521,18 +1149,40 @@ Examples:
     subparsers.add_parser('stop', help='Stop all Kerberos agents')
     
     # Restart command
-    subparsers.add_parser('restart', help='Restart all Kerberos agents')
+    restart_parser = subparsers.add_parser('restart', help='Restart all Kerberos agents')
+    restart_parser.add_argument('--rolling', action='store_true',
+                                help='Restart in health-checked waves instead of all at once')
+    restart_parser.add_argument('--wave-size', type=int, help='Agents per wave (default: docker.rollout.wave_size)')
     
     # Status command
-    subparsers.add_parser('status', help='Show status of all agents')
+    status_parser = subparsers.add_parser('status', help='Show status of all agents')
+    status_parser.add_argument('--watch', '-w', action='store_true',
+                               help='Keep the view open and update it from Docker events')
+    status_parser.add_argument('--interval', type=float, default=1.0,
+                               help='Minimum seconds between screen updates in watch mode (default: 1)')
+    
+    # Top command
+    top_parser = subparsers.add_parser('top', help='Live CPU, memory and network use per agent')
+    top_parser.add_argument('--interval', '-i', type=float, default=2.0,
+                            help='Seconds between refreshes (default: %(default)s)')
+    top_parser.add_argument('--sort', '-s', choices=['cpu', 'memory', 'net', 'restarts', 'name'], default='cpu',
+                            help='Column to sort by (default: %(default)s)')
+    top_parser.add_argument('--iterations', '-n', type=int, default=0,
+                            help='Stop after this many refreshes (default: run until Ctrl+C)')
     
     # Logs command
     logs_parser = subparsers.add_parser('logs', help='Show logs from agents')
     logs_parser.add_argument('--service', '-s', help='Show logs for specific service')
     logs_parser.add_argument('--follow', '-f', action='store_true', help='Follow log output')
+    logs_parser.add_argument('--grep', '-g', help='Only show lines matching this regular expression')
+    logs_parser.add_argument('--level', '-l', help='Only show lines at or above this level (debug, info, warn, error)')
+    logs_parser.add_argument('--tail', default='all', help='Lines to show from the end of each log (default: all)')
     
     # Update command
-    subparsers.add_parser('update', help='Update agents to latest version')
+    update_parser = subparsers.add_parser('update', help='Update agents to latest version')
+    update_parser.add_argument('--rolling', action='store_true',
+                               help='Recreate in health-checked waves, rolling back if a wave fails')
+    update_parser.add_argument('--wave-size', type=int, help='Agents per wave (default: docker.rollout.wave_size)')
     
     # Cleanup command
     cleanup_parser = subparsers.add_parser('cleanup', help='Remove all containers and optionally volumes')
@@ -540,17 +1190,68 @@ Examples:
     cleanup_parser.add_argument('--yes', '-y', action='store_true', help='Skip confirmation')
     
     # Redeploy command
-    subparsers.add_parser('redeploy', help='Regenerate configuration and restart all agents')
+    redeploy_parser = subparsers.add_parser('redeploy', help='Regenerate configuration and recreate changed agents')
+    redeploy_parser.add_argument('--full', action='store_true',
+                                 help='Take every agent down and back up instead of only changed ones')
     
     # Check command
     subparsers.add_parser('check', help='Check system dependencies and requirements')
     
     # System check command  
-    subparsers.add_parser('syscheck', help='Comprehensive system resources and capacity check')
+    syscheck_parser = subparsers.add_parser('syscheck', help='Comprehensive system resources and capacity check')
+    syscheck_parser.add_argument('--sampling', default='standard',
+                                 help='CPU sampling: instant (load average), quick, standard, long '
+                                      'or seconds (default: %(default)s)')
+    syscheck_parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    
+    subparsers.add_parser('plan', help='Show per-agent limits from camera profiles and check host capacity')
+    
+    calibrate_parser = subparsers.add_parser('calibrate', help="Fit the resource model to the agents' measured use")
+    calibrate_parser.add_argument('--duration', type=float, default=600.0,
+                                  help='Seconds to sample the running agents (default: %(default)s)')
+    calibrate_parser.add_argument('--interval', type=float, default=10.0,
+                                  help='Seconds between samples (default: %(default)s)')
+    calibrate_parser.add_argument('--ingest', metavar='CSV',
+                                  help='Add samples from a CSV file (name, cpu, memory and optional time '
+                                       'columns) instead of sampling')
+    calibrate_parser.add_argument('--percentile', type=float, default=90.0,
+                                  help='Percentile of each agent\'s use the model must cover (default: %(default)s)')
+    calibrate_parser.add_argument('--fit-only', action='store_true',
+                                  help='Refit the samples recorded so far without sampling')
+    
+    storage_parser = subparsers.add_parser('storage', help='Measure recordings per camera per day and days until full')
+    storage_parser.add_argument('--window', type=float, default=7.0,
+                                help='Days of recordings the daily rates average over (default: %(default)s)')
+    storage_parser.add_argument('--top', type=int, default=20,
+                                help='Cameras to list, busiest first; 0 for all (default: %(default)s)')
+    storage_parser.add_argument('--workers', type=int, default=8,
+                                help='Camera directories scanned at once (default: %(default)s)')
+    storage_parser.add_argument('--json', action='store_true', help='Print the report as JSON')
     
     # Info command
     subparsers.add_parser('info', help='Show project information and configuration summary')
     
+    # Exporter command
+    exporter_parser = subparsers.add_parser('exporter', help='Serve Prometheus metrics for the fleet')
+    exporter_parser.add_argument('--address', default='0.0.0.0', help='Listen address (default: %(default)s)')
+    exporter_parser.add_argument('--port', type=int, default=9470, help='Listen port (default: %(default)s)')
+    exporter_parser.add_argument('--interval', type=float, default=15.0,
+                                 help='Seconds between container and host samples (default: %(default)s)')
+    exporter_parser.add_argument('--disk-interval', type=float, default=300.0,
+                                 help='Seconds between recordings directory scans (default: %(default)s)')
+    
+    watchdog_parser = subparsers.add_parser('watchdog', help='Probe agent health and restart stuck agents')
+    watchdog_parser.add_argument('--no-restart', action='store_true',
+                                 help='Only report unhealthy agents, never restart them')
+    watchdog_parser.add_argument('--report', type=float, default=60.0,
+                                 help='Seconds between fleet health summaries, 0 for none (default: %(default)s)')
+    
+    # Daemon command
+    daemon_parser = subparsers.add_parser('daemon', help='Run the resident control daemon in the foreground')
+    daemon_parser.add_argument('--stop', action='store_true', help='Stop a running daemon')
+    daemon_parser.add_argument('--refresh', type=float, default=kerberos_daemon.REFRESH_INTERVAL,
+                               help='Seconds between container state refreshes (default: %(default)s)')
+    
     args = parser.parse_args()
     
     if not args.command:
@@ -563,19 +1264,60 @@ Examples:
         manager.check_dependencies()
         
     elif args.command == 'syscheck':
-        success = manager.system_check()
+        require('psutil', 'psutil')
+        from system_check import sampling_window
+        try:
+            cpu_window = sampling_window(args.sampling)
+        except ValueError as e:
+            print_error(str(e))
+            sys.exit(1)
+        success = manager.system_check(cpu_window, args.json)
+        if args.json:
+            sys.exit(0 if success else 1)
         if not success:
             print_info("\nTip: Use 'kerberos check' to verify Docker installation first")
         
+    elif args.command == 'plan':
+        require('yaml', 'PyYAML')
+        if not manager.capacity_plan():
+            sys.exit(1)
+    
+    elif args.command == 'calibrate':
+        if not 0 < args.percentile <= 100 or args.interval <= 0:
+            print_error("--percentile must be between 0 and 100 and --interval positive")
+            sys.exit(1)
+        if not manager.calibrate(args.duration, args.interval, args.ingest, args.percentile, args.fit_only):
+            sys.exit(1)
+        
+    elif args.command == 'storage':
+        if args.window <= 0 or args.workers < 1:
+            print_error("--window must be greater than 0 and --workers at least 1")
+            sys.exit(1)
+        require('yaml', 'PyYAML')
+        if not manager.storage(args.window, args.top, args.json, args.workers):
+            sys.exit(1)
+        
     elif args.command == 'generate':
         print_header("Generating docker-compose.yml")
-        count = manager.generate_compose_file()
+        count = manager.generate_compose_file(only_live=args.only_live)
         print_status(f"Successfully generated configuration for {count} cameras")
+        deployed = load_state(manager.compose_file).get('deployed', {})
+        if deployed:
+            changes = diff_services(deployed, manager.service_hashes)
+            print_info(f"Pending changes: {len(changes.added)} added, {len(changes.changed)} changed, "
+                       f"{len(changes.removed)} removed (apply with 'redeploy')")
         print_info("Next: Run 'python kerberos_lite.py start' to deploy agents")
         
+    elif args.command == 'scan':
+        if args.concurrency < 1 or args.timeout <= 0:
+            print_error("--concurrency must be at least 1 and --timeout greater than 0")
+            sys.exit(1)
+        print_header("Scanning for cameras")
+        manager.scan_cameras(args.concurrency, args.timeout)
+        
     elif args.command == 'start':
         # Check if compose file exists
-        if not Path(manager.compose_file).exists():
+        if not projects_exist(manager.compose_file):
             print_warning("Docker compose file not found. Generating...")
             manager.generate_compose_file()
         
@@ -585,6 +1327,7 @@ Examples:
             cmd.append('-d')
             
         if manager.run_docker_compose(cmd):
+            manager.record_deployed()
             print_status("All agents started successfully!")
             try:
                 config = manager.load_config()
@@ -595,33 +1338,96 @@ Examples:
         
     elif args.command == 'stop':
         print_header("Stopping Kerberos agents...")
-        if manager.run_docker_compose(['down']):
+        if manager.run_docker_compose(['down'], deployed=True):
+            manager.clear_deployed()
             print_status("All agents stopped successfully!")
         
+    elif args.command == 'restart' and args.rolling:
+        print_header("Rolling restart of Kerberos agents...")
+        if manager.rolling_rollout('restart', args.wave_size):
+            print_status("All agents restarted!")
+        else:
+            sys.exit(1)
+        
     elif args.command == 'restart':
         print_header("Restarting Kerberos agents...")
-        manager.run_docker_compose(['down'])
-        manager.run_docker_compose(['up', '-d'])
+        manager.run_docker_compose(['down'], deployed=True)
+        manager.clear_deployed()
+        if manager.run_docker_compose(['up', '-d']):
+            manager.record_deployed()
         print_status("All agents restarted!")
         
+    elif args.command == 'status' and args.watch:
+        manager.watch_status(args.interval)
+        
     elif args.command == 'status':
         print_header("Agent Status")
-        manager.run_docker_compose(['ps'])
+        try:
+            reply = kerberos_daemon.request(manager.config_file, 'status')
+        except kerberos_daemon.DaemonError as e:
+            print_error(f"Daemon error: {e}")
+            sys.exit(1)
+        if reply is not None:
+            source = "daemon, live" if reply['live'] else f"daemon, {reply['age']:.1f}s old"
+            manager.show_fleet(reply['agents'], reply['orphans'], source)
+        else:
+            fleet = manager.fleet_status()
+            if fleet is not None:
+                manager.show_fleet(fleet.rows(), fleet.orphans(), "engine API")
+            else:
+                manager.run_docker_compose(['ps'])
+        
+    elif args.command == 'top':
+        if args.interval <= 0:
+            print_error("--interval must be greater than 0")
+            sys.exit(1)
+        manager.top(args.interval, args.sort, args.iterations)
         
     elif args.command == 'logs':
-        cmd = ['logs']
-        if args.follow:
-            cmd.append('-f')
-        if args.service:
-            cmd.append(args.service)
-        manager.run_docker_compose(cmd)
+        if not manager.follow_logs(args.service, args.follow, args.grep, args.level, args.tail):
+            if args.grep or args.level:
+                print_warning("Docker Engine API not reachable; showing unfiltered docker-compose logs")
+            cmd = ['logs', '--tail', args.tail]
+            if args.follow:
+                cmd.append('-f')
+            projects = load_projects(manager.compose_file, deployed=True)
+            try:
+                stream_commands(plan_commands(projects, cmd, [args.service] if args.service else None))
+            except FileNotFoundError:
+                print_error("Docker Compose not found. Please install Docker and Docker Compose.")
+            except KeyboardInterrupt:
+                pass
+        
+    elif args.command == 'update' and args.rolling:
+        print_header("Rolling update of agents...")
+        if manager.rolling_rollout('update', args.wave_size):
+            manager.record_deployed()
+            print_status("Update completed!")
+        else:
+            sys.exit(1)
         
     elif args.command == 'update':
         print_header("Updating agents...")
-        print_info("Pulling latest images...")
-        manager.run_docker_compose(['pull'])
-        print_info("Recreating containers...")
-        manager.run_docker_compose(['up', '-d', '--force-recreate'])
+        config = manager.load_config()
+        require('yaml', 'PyYAML')
+        from compose_writer import compose_settings
+        from image_pull import outdated_services
+        try:
+            settings = compose_settings(config)
+        except ValueError as e:
+            print_error(str(e))
+            sys.exit(1)
+        pulled = manager.pull_latest(settings)
+        if pulled is None:
+            sys.exit(1)
+        outdated = outdated_services(*pulled)
+        if not outdated:
+            print_status("All agents already run the latest images")
+            return
+        print_info(f"Recreating {len(outdated)} agents with a new image...")
+        if not manager.run_docker_compose(['up', '-d', '--no-deps', '--force-recreate'], services=outdated):
+            sys.exit(1)
+        manager.record_deployed()
         print_status("Update completed!")
         
     elif args.command == 'cleanup':
@@ -636,54 +1442,143 @@ Examples:
         if args.volumes:
             cmd.extend(['-v', '--remove-orphans'])
         
-        if manager.run_docker_compose(cmd):
+        if manager.run_docker_compose(cmd, deployed=True):
+            manager.clear_deployed()
             print_status("Cleanup completed!")
         
     elif args.command == 'redeploy':
         print_header("Redeploying agents...")
-        manager.run_docker_compose(['down'])
-        manager.generate_compose_file()
-        manager.run_docker_compose(['up', '-d'])
-        print_status("Redeployment completed!")
+        if args.full:
+            manager.run_docker_compose(['down'], deployed=True)
+            manager.clear_deployed()
+            manager.generate_compose_file()
+            if manager.run_docker_compose(['up', '-d']):
+                manager.record_deployed()
+            print_status("Redeployment completed!")
+        elif manager.redeploy_incremental():
+            print_status("Redeployment completed!")
+        else:
+            print_error("Redeployment finished with errors")
         
     elif args.command == 'info':
         try:
-            config = manager.load_config()
+            reply = kerberos_daemon.request(manager.config_file, 'info')
+            summary = reply['summary'] if reply else config_summary(manager.load_config())
             print_header("Kerberos.io Multi-Agent Configuration")
-            
-            # Global settings
-            global_config = config.get('global', {})
-            print(f"Kerberos Image: {global_config.get('kerberos_image', 'N/A')}")
-            print(f"Network Name: {global_config.get('network_name', 'N/A')}")
-            print(f"Config Path: {global_config.get('config_base_path', 'N/A')}")
-            print(f"Recordings Path: {global_config.get('recordings_base_path', 'N/A')}")
-            
-            # Camera settings
-            cameras = config.get('cameras', {})
-            ip_range = cameras.get('ip_range', {})
-            if ip_range:
-                start_ip = ip_range.get('start', 'N/A')
-                end_ip = ip_range.get('end', 'N/A')
-                print(f"IP Range: {start_ip} → {end_ip}")
-                
-                # Calculate camera count
-                try:
-                    ip_list = manager.generate_ip_list(start_ip, end_ip)
-                    print(f"Camera Count: {len(ip_list)}")
-                except:
-                    pass
-            
-            # Docker settings
-            docker_config = config.get('docker', {})
-            print(f"Web Port Start: {docker_config.get('web_port_start', 'N/A')}")
-            print(f"RTMP Port Start: {docker_config.get('rtmp_port_start', 'N/A')}")
-            
-            # Timezone
-            custom_env = config.get('custom_environment', {})
-            print(f"Timezone: {custom_env.get('TZ', 'N/A')}")
+            for label, value in summary:
+                print(f"{label}: {value}")
             
         except Exception as e:
             print_error(f"Error reading configuration: {e}")
+    
+    elif args.command == 'exporter':
+        if args.interval <= 0 or args.disk_interval <= 0:
+            print_error("--interval and --disk-interval must be greater than 0")
+            sys.exit(1)
+        config = manager.load_config()
+        require('yaml', 'PyYAML')
+        require('psutil', 'psutil')
+        from compose_writer import compose_settings
+        from docker_engine import DockerEngine
+        from fleet_status import configured_agents
+        from metrics_exporter import MetricsExporter, serve
+        try:
+            settings = compose_settings(config)
+            agents = configured_agents(config)
+        except ValueError as e:
+            print_error(str(e))
+            sys.exit(1)
+        
+        backend = manager.engine_backend()
+        manager.single_host(backend, 'exporter')
+        recordings = Path(manager.compose_file).absolute().parent / settings['recordings_base_path']
+        exporter = MetricsExporter(backend.engine if backend else DockerEngine(), agents, str(recordings),
+                                   args.interval, args.disk_interval)
+        try:
+            serve(exporter, args.address, args.port,
+                  on_ready=lambda url: print_header(f"Serving metrics for {len(agents)} agents on {url}"))
+        except OSError as e:
+            print_error(f"Cannot serve metrics: {e}")
+            sys.exit(1)
+        print_status("Exporter stopped")
+        
+    elif args.command == 'watchdog':
+        config = manager.load_config()
+        require('yaml', 'PyYAML')
+        from agent_watchdog import Watchdog, watchdog_settings
+        from compose_writer import compose_settings
+        from docker_engine import DockerEngine, DockerEngineError
+        from fleet_status import configured_agents
+        from rollout import health_urls, rollout_settings
+        try:
+            settings = compose_settings(config)
+            docker_config = config.get('docker', {}) or {}
+            options = watchdog_settings(docker_config)
+            urls = health_urls(settings, rollout_settings(docker_config))
+            agents = configured_agents(config)
+        except ValueError as e:
+            print_error(str(e))
+            sys.exit(1)
+        
+        # Health probes go to the web ports on this machine
+        backend = manager.engine_backend()
+        manager.single_host(backend, 'watchdog')
+        
+        def on_event(kind, name, detail):
+            if kind == 'unhealthy':
+                print_warning(f"{name}: unhealthy ({detail})")
+            elif kind == 'recovered':
+                print_status(f"{name}: healthy again after {detail} failed probes")
+            elif kind == 'no-endpoint':
+                print_warning(f"{name}: no health endpoint at {detail}; not watched")
+            elif kind == 'restart':
+                print_info(f"{name}: restarting ({detail})")
+            elif kind == 'restart-failed':
+                print_error(f"{name}: restart failed: {detail}")
+            elif kind == 'held':
+                print_warning(f"{name}: not restarted, {detail}")
+            elif kind == 'docker':
+                print_warning(f"Docker events unavailable, polling: {detail}")
+            elif kind == 'summary':
+                counts = detail['counts']
+                print_info(", ".join(f"{counts[state]} {state}" for state in
+                                     ('healthy', 'failing', 'no-endpoint', 'down', 'unknown') if counts[state])
+                           + f"; {detail['probes']} probes, {detail['restarts']} restarts "
+                           f"({detail['budget']} of {options['max_restarts']} in the current window)")
+        
+        watchdog = Watchdog(backend.engine if backend else DockerEngine(), agents, urls, options,
+                            restart=not args.no_restart, on_event=on_event)
+        restarts = '' if args.no_restart else f", restart after {options['failures']} failures"
+        print_header(f"Watching {len(urls)} agents: every {options['interval']:g}s while healthy, "
+                     f"backing off from {options['retry_interval']:g}s while failing{restarts}")
+        try:
+            watchdog.run(args.report)
+        except DockerEngineError as e:
+            print_error(f"Cannot reach Docker: {e}")
+            sys.exit(1)
+        print_status("Watchdog stopped")
+        
+    elif args.command == 'daemon':
+        if args.stop:
+            try:
+                reply = kerberos_daemon.request(manager.config_file, 'shutdown')
+            except kerberos_daemon.DaemonError as e:
+                reply = None
+                print_error(f"Daemon error: {e}")
+            if reply is None:
+                print_warning("No daemon is running for this configuration")
+            else:
+                print_status(f"Daemon (pid {reply['pid']}) stopped")
+            return
+        
+        manager.load_config()
+        print_header(f"Daemon listening on {kerberos_daemon.socket_path(manager.config_file)}")
+        try:
+            kerberos_daemon.serve(manager.config_file, args.refresh, manager.compose_file)
+        except OSError as e:
+            print_error(str(e))
+            sys.exit(1)
+        print_status("Daemon stopped")
 
 if __name__ == '__main__':
     main()
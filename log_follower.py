@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Log following for Kerberos.io agents
+Tails every agent container concurrently over the Engine API, filters lines as they arrive
+and interleaves them fairly through small bounded per-camera buffers
+"""
+
+import http.client
+import queue
+import re
+import threading
+from typing import Callable, Dict, Iterator, List, Optional
+
+from docker_engine import DockerEngine, DockerEngineError
+
+# Severity of the level names the agents (logrus/zap style) and most tools use
+LEVELS = {
+    'trace': 0, 'debug': 10, 'info': 20, 'notice': 25, 'warn': 30, 'warning': 30,
+    'error': 40, 'err': 40, 'fatal': 50, 'critical': 50, 'panic': 50,
+}
+LEVEL_PATTERN = re.compile(
+    r'(?:level|lvl|severity)["\']?\s*[=:]\s*["\']?(\w+)|\b(TRACE|DEBUG|INFO|NOTICE|WARN|WARNING|ERROR|FATAL|PANIC)\b',
+    re.IGNORECASE)
+
+DEFAULT_QUEUE_SIZE = 256
+DEFAULT_BURST = 16
+
+# Marks the end of one container's stream in its queue
+_END = object()
+
+
+def line_level(line: str) -> int:
+    """Severity of a log line; lines without a recognizable level count as info"""
+    match = LEVEL_PATTERN.search(line)
+    if match:
+        return LEVELS.get((match.group(1) or match.group(2)).lower(), LEVELS['info'])
+    return LEVELS['info']
+
+
+def line_filter(pattern: Optional[str] = None, level: Optional[str] = None) -> Callable[[str], bool]:
+    """Predicate keeping lines that match the regex and are at least the given level.
+
+    Raises ValueError for an invalid regex or unknown level name.
+    """
+    regex = None
+    if pattern:
+        try:
+            regex = re.compile(pattern)
+        except re.error as e:
+            raise ValueError(f"Invalid log filter '{pattern}': {e}")
+    minimum = None
+    if level:
+        if level.lower() not in LEVELS:
+            raise ValueError(f"Unknown log level '{level}' (use one of debug, info, warn, error, fatal)")
+        minimum = LEVELS[level.lower()]
+
+    def keep(line: str) -> bool:
+        if minimum is not None and line_level(line) < minimum:
+            return False
+        return regex is None or regex.search(line) is not None
+
+    return keep
+
+
+def iter_log_lines(response) -> Iterator[str]:
+    """Decode lines from an Engine API log stream.
+
+    Containers without a TTY send frames with an 8-byte header (stream
+    type, three zero bytes, big-endian length); TTY containers send raw
+    bytes. Partial lines are held until their newline arrives.
+    """
+    buffers: Dict[int, bytes] = {}
+    raw = False
+    while True:
+        if raw:
+            chunk = response.read1(65536) if hasattr(response, 'read1') else response.read(4096)
+            stream = 1
+        else:
+            header = response.read(8)
+            if len(header) < 8:
+                break
+            if header[0] in (0, 1, 2) and header[1:4] == b'\0\0\0':
+                chunk = response.read(int.from_bytes(header[4:8], 'big'))
+                stream = header[0]
+            else:
+                # Not multiplexed: the "header" was ordinary output
+                raw, chunk, stream = True, header, 1
+        if not chunk:
+            break
+        data = buffers.get(stream, b'') + chunk
+        *lines, rest = data.split(b'\n')
+        buffers[stream] = rest
+        for line in lines:
+            yield line.rstrip(b'\r').decode('utf-8', 'replace')
+    for rest in buffers.values():
+        if rest:
+            yield rest.decode('utf-8', 'replace')
+
+
+class LogFollower:
+    """Tail several containers at once and hand their lines to one writer.
+
+    Each container gets a reader thread and a queue of at most queue_size
+    lines. A full queue blocks its reader, which stops reading from the
+    socket, so a chatty camera is throttled by TCP backpressure instead of
+    growing memory. The writer drains the queues round-robin, at most burst
+    lines per camera per turn, so no camera can starve the others.
+    """
+
+    def __init__(self, engine: DockerEngine, names: List[str], keep: Callable[[str], bool] = None,
+                 follow: bool = False, tail: str = 'all', queue_size: int = DEFAULT_QUEUE_SIZE,
+                 burst: int = DEFAULT_BURST):
+        self.engine = engine
+        self.names = list(names)
+        self.keep = keep or (lambda line: True)
+        self.follow = follow
+        self.tail = tail
+        self.burst = burst
+        self.queues = {name: queue.Queue(maxsize=queue_size) for name in self.names}
+        self.wakeup = threading.Event()
+        self.errors: Dict[str, str] = {}
+
+    def _read(self, name: str):
+        q = self.queues[name]
+        try:
+            response = self.engine.container_logs(name, follow=self.follow, tail=self.tail)
+            try:
+                for line in iter_log_lines(response):
+                    if self.keep(line):
+                        q.put(line)
+                        self.wakeup.set()
+            finally:
+                response.close()
+        except (DockerEngineError, OSError, http.client.HTTPException) as e:
+            self.errors[name] = str(e)
+        q.put(_END)
+        self.wakeup.set()
+
+    def run(self, write: Callable[[str, str], None], flush: Optional[Callable[[], None]] = None):
+        """Stream until every container's log ends (never, when following, unless interrupted).
+
+        write(name, line) is called for every kept line; flush, if given,
+        after each round that wrote something.
+        """
+        for name in self.names:
+            threading.Thread(target=self._read, args=(name,), daemon=True).start()
+
+        active = list(self.names)
+        while active:
+            self.wakeup.clear()
+            moved = False
+            for name in list(active):
+                q = self.queues[name]
+                for _ in range(self.burst):
+                    try:
+                        line = q.get_nowait()
+                    except queue.Empty:
+                        break
+                    moved = True
+                    if line is _END:
+                        active.remove(name)
+                        break
+                    write(name, line)
+            if moved:
+                if flush:
+                    flush()
+            else:
+                self.wakeup.wait(0.5)
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Prometheus metrics exporter for Kerberos.io agents
+Collects container state, resource use, recordings usage and host totals in background
+threads and serves the last results from memory, so a scrape costs the same at any fleet size
+"""
+
+import gzip
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from agent_stats import ResourceSampler
+from docker_engine import DockerEngine, DockerEngineError
+from fleet_status import FleetStatus
+from recordings_index import DEFAULT_WINDOW_DAYS, RecordingsIndex, camera_report
+
+DEFAULT_PORT = 9470
+# Seconds between container resource samples and host readings
+DEFAULT_INTERVAL = 15.0
+# Seconds between walks of the recordings directories
+DEFAULT_DISK_INTERVAL = 300.0
+# Seconds stop() waits for the collectors to finish their current run
+STOP_TIMEOUT = 10.0
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# (name, type, help, [(labels, value), ...])
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def escape_label(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    """Exact sample value: counters of bytes and Unix timestamps must not be rounded"""
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def format_families(families: List[Family]) -> str:
+    """Prometheus text exposition of metric families"""
+    lines = []
+    for name, kind, help_text, samples in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            if labels:
+                rendered = ','.join(f'{key}="{escape_label(val)}"' for key, val in labels.items())
+                lines.append(f"{name}{{{rendered}}} {format_value(value)}")
+            else:
+                lines.append(f"{name} {format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsExporter:
+    """Background collectors plus the pre-rendered /metrics body they keep current.
+
+    Each collector runs in its own thread at its own interval and replaces
+    its section of the output when it finishes, so a slow collector (the
+    recordings walk) never delays a scrape or the other collectors. Fleet
+    state follows the Docker events stream.
+    """
+
+    def __init__(self, engine: DockerEngine, agents: List[Dict[str, Any]], recordings_path: str,
+                 interval: float = DEFAULT_INTERVAL, disk_interval: float = DEFAULT_DISK_INTERVAL):
+        self.engine = engine
+        self.agents = agents
+        self.recordings_path = recordings_path
+        self.recordings = RecordingsIndex(recordings_path)
+        self.interval = interval
+        self.disk_interval = disk_interval
+        self.fleet = FleetStatus(engine, agents)
+        self.sampler = ResourceSampler(engine)
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.sections: Dict[str, str] = {}
+        self.health: Dict[str, Dict[str, float]] = {}
+        self.body = b''
+        self.compressed: Optional[bytes] = None
+        self.threads: Dict[str, threading.Thread] = {}
+
+    def publish(self, collector: str, families: List[Family], elapsed: float):
+        text = format_families(families)
+        with self.lock:
+            self.sections[collector] = text
+            health = self.health.setdefault(collector, {'errors': 0, 'success': 0.0, 'duration': 0.0})
+            health.update(success=time.time(), duration=elapsed)
+            self._render()
+
+    def fail(self, collector: str):
+        with self.lock:
+            self.health.setdefault(collector, {'errors': 0, 'success': 0.0, 'duration': 0.0})['errors'] += 1
+            self._render()
+
+    def _render(self):
+        """Rebuild the scrape body; called with the lock held"""
+        names = sorted(self.health)
+        own = format_families([
+            ('kerberos_exporter_collector_duration_seconds', 'gauge',
+             'Seconds the last successful run of each collector took',
+             [({'collector': n}, self.health[n]['duration']) for n in names]),
+            ('kerberos_exporter_collector_last_success_timestamp_seconds', 'gauge',
+             'Unix time of the last successful run of each collector',
+             [({'collector': n}, self.health[n]['success']) for n in names]),
+            ('kerberos_exporter_collector_errors_total', 'counter',
+             'Failed runs of each collector',
+             [({'collector': n}, self.health[n]['errors']) for n in names]),
+        ])
+        self.body = (''.join(self.sections[name] for name in sorted(self.sections)) + own).encode('utf-8')
+        self.compressed = None
+
+    def scrape(self, accept_gzip: bool = False) -> bytes:
+        with self.lock:
+            if not accept_gzip:
+                return self.body
+            if self.compressed is None:
+                self.compressed = gzip.compress(self.body, compresslevel=5)
+            return self.compressed
+
+    def collect_fleet(self) -> List[Family]:
+        rows = self.fleet.rows()
+        return [
+            ('kerberos_agents_configured', 'gauge', 'Cameras in the configuration', [({}, len(rows))]),
+            ('kerberos_agents_running', 'gauge', 'Agents whose container is running',
+             [({}, sum(1 for r in rows if r['state'] == 'running'))]),
+            ('kerberos_agent_up', 'gauge', 'Whether the agent container is running',
+             [({'camera': r['name'], 'ip': r['ip']}, r['state'] == 'running') for r in rows]),
+            ('kerberos_agent_state', 'gauge', 'Container state of each agent (missing: no container)',
+             [({'camera': r['name'], 'state': r['state']}, 1) for r in rows]),
+        ]
+
+    def collect_containers(self) -> List[Family]:
+        rows = self.sampler.sample()
+
+        def samples(key):
+            return [({'camera': r['name']}, r[key]) for r in rows if r[key] is not None]
+
+        return [
+            ('kerberos_agent_restarts', 'gauge', 'Restarts of the agent container by its restart policy',
+             [({'camera': r['name']}, r['restarts']) for r in rows]),
+            ('kerberos_agent_cpu_seconds_total', 'counter', 'CPU time used by the agent container',
+             samples('cpu_seconds')),
+            ('kerberos_agent_memory_bytes', 'gauge', 'Memory used by the agent container, without page cache',
+             samples('memory')),
+            ('kerberos_agent_memory_limit_bytes', 'gauge', 'Memory limit of the agent container',
+             [({'camera': r['name']}, r['limit']) for r in rows if r['limit']]),
+            ('kerberos_agent_network_receive_bytes_total', 'counter', 'Bytes received by the agent container',
+             samples('rx_bytes')),
+            ('kerberos_agent_network_transmit_bytes_total', 'counter', 'Bytes sent by the agent container',
+             samples('tx_bytes')),
+        ]
+
+    def collect_recordings(self) -> List[Family]:
+        names = [agent['name'] for agent in self.agents]
+        # The index stays in memory, so each walk only stats recordings written since the last one
+        self.recordings.scan(names)
+        now = time.time()
+        reports = [camera_report(self.recordings, name, now, DEFAULT_WINDOW_DAYS) for name in names]
+        return [
+            ('kerberos_recordings_bytes', 'gauge', 'Bytes of recordings stored for each camera',
+             [({'camera': r['camera']}, r['bytes']) for r in reports]),
+            ('kerberos_recordings_files', 'gauge', 'Recording files stored for each camera',
+             [({'camera': r['camera']}, r['files']) for r in reports]),
+            ('kerberos_recordings_bytes_per_day', 'gauge',
+             'Bytes of recordings each camera wrote per day over the last week',
+             [({'camera': r['camera']}, r['bytes_per_day']) for r in reports]),
+        ]
+
+    def collect_host(self) -> List[Family]:
+        import psutil
+
+        memory = psutil.virtual_memory()
+        families = [
+            ('kerberos_host_cpu_count', 'gauge', 'Logical CPUs of the host', [({}, psutil.cpu_count())]),
+            # Utilization since the previous collection; the first reading is 0
+            ('kerberos_host_cpu_usage_ratio', 'gauge', 'Host CPU utilization between collections',
+             [({}, psutil.cpu_percent(interval=None) / 100)]),
+            ('kerberos_host_memory_total_bytes', 'gauge', 'Host memory', [({}, memory.total)]),
+            ('kerberos_host_memory_available_bytes', 'gauge', 'Host memory available to new processes',
+             [({}, memory.available)]),
+        ]
+        if hasattr(os, 'getloadavg'):
+            load = os.getloadavg()
+            families.append(('kerberos_host_load', 'gauge', 'Host load average',
+                             [({'period': period}, value) for period, value in zip(('1m', '5m', '15m'), load)]))
+        try:
+            disk = psutil.disk_usage(self.recordings_path)
+        except OSError:
+            disk = None
+        if disk is not None:
+            families += [
+                ('kerberos_host_recordings_disk_total_bytes', 'gauge', 'Size of the recordings filesystem',
+                 [({}, disk.total)]),
+                ('kerberos_host_recordings_disk_free_bytes', 'gauge', 'Free space on the recordings filesystem',
+                 [({}, disk.free)]),
+            ]
+        return families
+
+    def _run(self, collector: str, collect: Callable[[], List[Family]]) -> bool:
+        started = time.monotonic()
+        try:
+            families = collect()
+        except (DockerEngineError, OSError, ValueError):
+            self.fail(collector)
+            return False
+        except Exception as e:
+            # An unexpected payload must not end the collector's thread and freeze its values
+            sys.stderr.write(f"Collector {collector} failed: {type(e).__name__}: {e}\n")
+            self.fail(collector)
+            return False
+        self.publish(collector, families, time.monotonic() - started)
+        return True
+
+    def _loop(self, collector: str, collect: Callable[[], List[Family]], interval: float):
+        while not self.stopping.is_set():
+            self._run(collector, collect)
+            self.stopping.wait(interval)
+
+    def _watch_fleet(self):
+        """Follow Docker events for container state; poll every interval while that fails"""
+        def changed(names):
+            self._run('fleet', self.collect_fleet)
+
+        while not self.stopping.is_set():
+            try:
+                self.fleet.watch(changed, self.stopping, 1.0)
+            except DockerEngineError:
+                self.fail('fleet')
+            if self.stopping.wait(self.interval):
+                break
+            try:
+                self.fleet.refresh()
+            except DockerEngineError:
+                self.fail('fleet')
+                continue
+            self._run('fleet', self.collect_fleet)
+
+    def start(self):
+        """Start the collector threads"""
+        jobs = {
+            'fleet': (self._watch_fleet, ()),
+            'containers': (self._loop, ('containers', self.collect_containers, self.interval)),
+            'host': (self._loop, ('host', self.collect_host, self.interval)),
+            'recordings': (self._loop, ('recordings', self.collect_recordings, self.disk_interval)),
+        }
+        for collector, (target, args) in jobs.items():
+            self.threads[collector] = threading.Thread(target=target, args=args, daemon=True)
+            self.threads[collector].start()
+
+    def stop(self, timeout: float = STOP_TIMEOUT):
+        """Stop the collectors, then release the sampler once the containers collector no longer reads it"""
+        self.stopping.set()
+        deadline = time.monotonic() + timeout
+        for thread in self.threads.values():
+            thread.join(max(0.0, deadline - time.monotonic()))
+        containers = self.threads.get('containers')
+        if containers is None or not containers.is_alive():
+            self.sampler.close()
+
+
+def serve(exporter: MetricsExporter, address: str = '0.0.0.0', port: int = DEFAULT_PORT,
+          on_ready: Optional[Callable[[str], None]] = None):
+    """Serve /metrics in the foreground until SIGINT/SIGTERM.
+
+    Raises OSError if the address cannot be bound.
+    """
+    import signal
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split('?')[0] == '/metrics':
+                accept_gzip = 'gzip' in self.headers.get('Accept-Encoding', '')
+                body = exporter.scrape(accept_gzip)
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                if accept_gzip:
+                    self.send_header('Content-Encoding', 'gzip')
+            elif self.path == '/':
+                body = b'<html><body><h1>Kerberos exporter</h1><a href="/metrics">Metrics</a></body></html>'
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html')
+            else:
+                body = b'Not found\n'
+                self.send_response(404)
+                self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((address, port), Handler)
+    server.daemon_threads = True
+
+    def stop(*_):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    exporter.start()
+    if on_ready:
+        on_ready(f"http://{address}:{server.server_address[1]}/metrics")
+    try:
+        server.serve_forever(poll_interval=0.5)
+    finally:
+        exporter.stop()
+        server.server_close()
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""
+Multi-host scheduling for Kerberos.io agents
+Spreads cameras over several Docker hosts by capacity, keeps every camera on the host it was
+given across regenerations, and drives the Engine API of all hosts at the same time
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from docker_engine import DEFAULT_DOCKER_HOST, DockerEngine, DockerEngineError
+from engine_backend import BatchResult, EngineBackend, parse_memory
+
+HOST_NAME = re.compile(r'[a-z0-9][a-z0-9_-]*')
+
+# Seconds to wait for a host while measuring it or reading its status
+HOST_TIMEOUT = 10.0
+
+
+def context_url(context: str) -> str:
+    """Docker endpoint of a docker CLI context, read from its metadata like `docker context inspect`"""
+    import hashlib
+
+    if context == 'default':
+        return os.environ.get('DOCKER_HOST') or DEFAULT_DOCKER_HOST
+    config_dir = Path(os.environ.get('DOCKER_CONFIG') or Path.home() / '.docker')
+    meta = config_dir / 'contexts' / 'meta' / hashlib.sha256(context.encode('utf-8')).hexdigest() / 'meta.json'
+    try:
+        with open(meta) as f:
+            return json.load(f)['Endpoints']['docker']['Host']
+    except (OSError, ValueError, KeyError, TypeError):
+        raise ValueError(f"Docker context '{context}' not found (looked for {meta})")
+
+
+def host_settings(hosts: Optional[List[Dict[str, Any]]]) -> Optional[List[Dict[str, Any]]]:
+    """Validate the optional docker.hosts list"""
+    if not hosts:
+        return None
+
+    result, seen = [], set()
+    for i, host in enumerate(hosts):
+        name = str(host.get('name', ''))
+        if not HOST_NAME.fullmatch(name):
+            raise ValueError(f"docker.hosts[{i}].name must be lowercase letters, digits, '-' or '_'")
+        if name in seen:
+            raise ValueError(f"docker.hosts has two hosts named '{name}'")
+        seen.add(name)
+
+        url = host.get('url') or (context_url(str(host['context'])) if host.get('context') else None)
+        if not url:
+            raise ValueError(f"docker.hosts[{i}] needs a 'url' (as in DOCKER_HOST) or a docker 'context'")
+        if urlparse(url).scheme not in ('unix', 'tcp', 'http'):
+            raise ValueError(f"docker.hosts[{i}]: only unix://, tcp:// and http:// endpoints are supported, "
+                             f"got {url}")
+        max_agents = host.get('max_agents')
+        if max_agents is not None and int(max_agents) < 0:
+            raise ValueError(f"docker.hosts[{i}].max_agents cannot be negative")
+        result.append({'name': name, 'url': url,
+                       'max_agents': int(max_agents) if max_agents is not None else None})
+    return result
+
+
+def agent_footprint(settings: Dict[str, Any]) -> Tuple[float, float]:
+    """CPUs and memory (bytes) one agent takes out of a host's capacity.
+
+    With docker.limits: auto this is the fleet's average expected CPU load
+    and memory limit; otherwise the static limits, or the estimate for the
+    default camera profile where no limit is set.
+    """
+    from capacity import DEFAULT_MODEL, DEFAULT_PROFILE, CapacityPlan, estimate
+
+    if settings['capacity']:
+        plan = CapacityPlan(settings['capacity'], settings['profiles'], host={'cpus': 1.0, 'memory': 1.0})
+        summary = plan.summary(settings['ips'])
+        count = max(1, sum(row['cameras'] for row in summary['profiles']))
+        return summary['cpus'] / count, summary['memory_limits'] / count
+
+    limits = settings['limits']
+    default = estimate(DEFAULT_PROFILE, DEFAULT_MODEL)
+    cpus = float(limits['cpus']) if 'cpus' in limits else default['cpus']
+    memory = parse_memory(limits['memory']) if 'memory' in limits else default['memory']
+    return cpus, memory
+
+
+def agents_that_fit(info: Dict[str, Any], footprint: Tuple[float, float], capacity: Dict[str, Any]) -> int:
+    """How many agents of a footprint a host holds, from its /info and the docker.capacity reserve"""
+    cpus = max(0.0, info.get('NCPU', 0) - capacity['reserve_cpus']) * capacity['max_utilization']
+    memory = max(0.0, info.get('MemTotal', 0) - capacity['reserve_memory'])
+    return int(min(cpus / footprint[0], memory / footprint[1]))
+
+
+def measure_hosts(hosts: List[Dict[str, Any]], footprint: Tuple[float, float],
+                  capacity: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Ask every host for its size at the same time.
+
+    Returns per host its capacity in agents (None when it could not be
+    reached and sets no max_agents), NCPU, MemTotal and any error.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def measure(host):
+        engine = DockerEngine(host['url'], timeout=HOST_TIMEOUT, pool_size=1)
+        try:
+            info = engine.info()
+        except DockerEngineError as e:
+            return {'capacity': host['max_agents'], 'cpus': None, 'memory': None, 'error': str(e)}
+        finally:
+            engine.close()
+        fits = agents_that_fit(info, footprint, capacity)
+        if host['max_agents'] is not None:
+            fits = min(fits, host['max_agents'])
+        return {'capacity': fits, 'cpus': info.get('NCPU'), 'memory': info.get('MemTotal'), 'error': None}
+
+    with ThreadPoolExecutor(max_workers=len(hosts)) as pool:
+        return dict(zip((host['name'] for host in hosts), pool.map(measure, hosts)))
+
+
+def assign_hosts(names: List[str], capacity: Dict[str, int], previous: Dict[str, str]) -> Dict[str, str]:
+    """Camera -> host, keeping previous assignments where the host still has room.
+
+    Cameras that are new, or whose host is gone or now too small, go to the
+    host with the lowest share of its capacity in use, so hosts fill in
+    proportion to their size. Raises ValueError if the cameras do not fit.
+    """
+    load = {host: 0 for host in capacity}
+    assignment: Dict[str, Optional[str]] = {}
+    pending = []
+    for name in names:
+        host = previous.get(name)
+        if host in load and load[host] < capacity[host]:
+            assignment[name] = host
+            load[host] += 1
+        else:
+            assignment[name] = None
+            pending.append(name)
+
+    free = sum(capacity[host] - load[host] for host in capacity)
+    if len(pending) > free:
+        raise ValueError(f"{len(names)} cameras do not fit on docker.hosts, which hold "
+                         f"{sum(capacity.values())} agents")
+    order = {host: i for i, host in enumerate(capacity)}
+    for name in pending:
+        host = min((h for h in capacity if load[h] < capacity[h]),
+                   key=lambda h: (load[h] / capacity[h], order[h]))
+        assignment[name] = host
+        load[host] += 1
+    return assignment
+
+
+def schedule(settings: Dict[str, Any], names: List[str],
+             previous: Dict[str, str]) -> Tuple[Dict[str, str], List[Dict[str, Any]]]:
+    """Measure the hosts and assign every camera to one.
+
+    A host that cannot be reached and has no max_agents keeps the cameras
+    it already runs but gets no new ones. Returns the assignment and a
+    report row per host.
+    """
+    from capacity import capacity_settings
+
+    hosts = settings['hosts']
+    reserve = settings['capacity'] or capacity_settings('auto', None)
+    measured = measure_hosts(hosts, agent_footprint(settings), reserve)
+
+    configured = set(names)
+    capacity = {}
+    for host in hosts:
+        found = measured[host['name']]
+        if found['capacity'] is None:
+            found['capacity'] = sum(1 for name, owner in previous.items()
+                                    if owner == host['name'] and name in configured)
+        capacity[host['name']] = found['capacity']
+
+    assignment = assign_hosts(names, capacity, previous)
+    agents = Counter(assignment.values())
+    report = [dict(measured[host['name']], name=host['name'], url=host['url'], agents=agents[host['name']],
+                   moved=sum(1 for name, owner in assignment.items()
+                             if owner == host['name'] and previous.get(name) not in (None, owner)))
+              for host in hosts]
+    return assignment, report
+
+
+def host_layout(state: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Per-host projects of the recorded layout (empty unless generated for docker.hosts)"""
+    return [shard for shard in state.get('shards') or [] if shard.get('docker_host')]
+
+
+def merge_results(action: str, results: Dict[str, BatchResult], elapsed: float) -> BatchResult:
+    succeeded, skipped, failed = [], [], {}
+    for host, result in results.items():
+        succeeded += result.succeeded
+        skipped += result.skipped
+        failed.update((name, f"{host}: {error}") for name, error in result.failed.items())
+    return BatchResult(action, sorted(succeeded), sorted(skipped), failed, elapsed)
+
+
+class MultiHostBackend:
+    """An EngineBackend per host of the recorded layout, all driven at the same time.
+
+    Each host only creates the agents assigned to it. After 'up', agents
+    that were moved to another host are removed from the host they left.
+    """
+
+    def __init__(self, settings: Dict[str, Any], compose_file: str, options: Dict[str, Any],
+                 layout: List[Dict[str, Any]]):
+        self.backends: Dict[str, EngineBackend] = {}
+        self.owner: Dict[str, str] = {}
+        for entry in layout:
+            engine = DockerEngine(entry['docker_host'], pool_size=options['max_workers'])
+            self.backends[entry['name']] = EngineBackend(settings, compose_file, options, engine,
+                                                         project=entry['project'], owned=entry['services'])
+            self.owner.update((name, entry['name']) for name in entry['services'])
+        self.results: Dict[str, BatchResult] = {}
+
+    def run_host(self, host: str, command: List[str], services: Optional[List[str]]) -> BatchResult:
+        backend = self.backends[host]
+        started = time.monotonic()
+        # Names no host owns (removed cameras) are looked for everywhere
+        wanted = None if services is None else [n for n in services if self.owner.get(n, host) == host]
+        if wanted == [] and command[0] != 'pull':
+            return BatchResult(command[0], [], [], {}, 0.0)
+        try:
+            result = backend.run(command, wanted)
+            if command[0] == 'up':
+                strays = [c['name'] for c in backend.status() if self.owner.get(c['name'], host) != host]
+                if strays:
+                    removed = backend.remove(strays)
+                    result = result._replace(failed=dict(result.failed, **removed.failed))
+        except (DockerEngineError, OSError) as e:
+            names = wanted if wanted is not None else sorted(backend.owned)
+            return BatchResult(command[0], [], [], {name: str(e) for name in names} or {host: str(e)},
+                               time.monotonic() - started)
+        return result
+
+    def run(self, command: List[str], services: Optional[List[str]] = None) -> BatchResult:
+        """Carry out a compose-style command on every host at once, merging the results"""
+        from concurrent.futures import ThreadPoolExecutor
+
+        started = time.monotonic()
+        hosts = list(self.backends)
+        with ThreadPoolExecutor(max_workers=max(1, len(hosts))) as pool:
+            results = list(pool.map(lambda host: self.run_host(host, command, services), hosts))
+        self.results = dict(zip(hosts, results))
+        return merge_results(command[0], self.results, time.monotonic() - started)
+
+    def status(self) -> List[Dict[str, Any]]:
+        containers = []
+        for host, backend in self.backends.items():
+            containers += [dict(c, host=host) for c in backend.status()]
+        return containers
+
+    def remove(self, names: Iterable[str]) -> BatchResult:
+        """Force-remove agents from whichever host runs them"""
+        from concurrent.futures import ThreadPoolExecutor
+
+        names = list(names)
+        started = time.monotonic()
+
+        def remove(host):
+            backend = self.backends[host]
+            existing = {c['name'] for c in backend.status()}
+            return backend.remove([name for name in names if name in existing])
+
+        hosts = list(self.backends)
+        with ThreadPoolExecutor(max_workers=max(1, len(hosts))) as pool:
+            results = dict(zip(hosts, pool.map(remove, hosts)))
+        return merge_results('remove', results, time.monotonic() - started)
+
+
+class HostFleet:
+    """Fleet status read from every host at once, with the host of each agent in its row.
+
+    Offers the FleetStatus interface the status views use; agents of a
+    host that cannot be reached are reported as 'unknown'.
+    """
+
+    def __init__(self, layout: List[Dict[str, Any]], agents: List[Dict[str, Any]]):
+        from fleet_status import FleetStatus
+
+        self.agents = agents
+        self.owner = {name: entry['name'] for entry in layout for name in entry['services']}
+        self.fleets = {}
+        for entry in layout:
+            owned = set(entry['services'])
+            self.fleets[entry['name']] = FleetStatus(DockerEngine(entry['docker_host'], timeout=HOST_TIMEOUT),
+                                                     [a for a in agents if a['name'] in owned])
+        self.errors: Dict[str, str] = {}
+        self.lock = threading.Lock()
+
+    @property
+    def live(self) -> bool:
+        return all(fleet.live for fleet in self.fleets.values())
+
+    def refresh(self):
+        """Re-sync every host concurrently; raises DockerEngineError only if no host answered"""
+        from concurrent.futures import ThreadPoolExecutor
+
+        def refresh(item):
+            host, fleet = item
+            try:
+                fleet.refresh()
+                return host, None
+            except DockerEngineError as e:
+                return host, str(e)
+
+        with ThreadPoolExecutor(max_workers=max(1, len(self.fleets))) as pool:
+            errors = {host: error for host, error in pool.map(refresh, self.fleets.items()) if error}
+        with self.lock:
+            self.errors = errors
+        if self.fleets and len(errors) == len(self.fleets):
+            raise DockerEngineError("; ".join(f"{host}: {error}" for host, error in sorted(errors.items())))
+
+    def rows(self) -> List[Dict[str, Any]]:
+        """One row per configured agent, in configuration order"""
+        from fleet_status import MISSING
+
+        with self.lock:
+            errors = dict(self.errors)
+        by_name = {}
+        for host, fleet in self.fleets.items():
+            for row in fleet.rows():
+                row['host'] = host
+                if host in errors:
+                    row.update(state='unknown', status='Host unreachable')
+                by_name[row['name']] = row
+        return [by_name.get(agent['name']) or dict(agent, host='-', state=MISSING, status='Not scheduled')
+                for agent in self.agents]
+
+    def orphans(self) -> List[str]:
+        """Agent containers a host runs although the configuration puts them elsewhere or nowhere"""
+        return sorted(f"{name} ({host})" for host, fleet in self.fleets.items() for name in fleet.orphans())
+
+    def state(self, name: str) -> str:
+        from fleet_status import MISSING
+
+        host = self.owner.get(name)
+        return self.fleets[host].state(name) if host else MISSING
+
+    def counts(self) -> Counter:
+        return Counter(row['state'] for row in self.rows())
+
+    def watch(self, on_change: Callable[[List[str]], None], stop: threading.Event, interval: float = 1.0):
+        """Follow the events of every host until stop is set.
+
+        A host whose stream fails is re-synced and followed again after
+        interval; the other hosts carry on.
+        """
+        report = threading.Lock()
+
+        def changed(names):
+            with report:
+                on_change(names)
+
+        def follow(host, fleet):
+            def host_changed(names):
+                with self.lock:
+                    self.errors.pop(host, None)
+                changed(names)
+
+            while not stop.is_set():
+                try:
+                    fleet.watch(host_changed, stop, interval)
+                except DockerEngineError as e:
+                    with self.lock:
+                        self.errors[host] = str(e)
+                    changed([])
+                if stop.wait(interval):
+                    break
+                try:
+                    fleet.refresh()
+                except DockerEngineError:
+                    continue
+                host_changed([])
+
+        threads = [threading.Thread(target=follow, args=item, daemon=True) for item in self.fleets.items()]
+        for thread in threads:
+            thread.start()
+        stop.wait()
+        for thread in threads:
+            thread.join(timeout=2.0)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+CPU placement for Kerberos.io agents
+Pins every agent to its own slot of CPUs read from the host topology, balancing the fleet over
+NUMA nodes and physical cores so agents keep their caches and a busy agent only slows down the
+agents sharing its slot
+"""
+
+import glob
+import math
+import os
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+SYS_ROOT = '/sys/devices/system'
+
+PLACEMENT_MODES = ('spread', 'pack')
+
+# Compose extension field recording an agent's NUMA node; compose has no key for memory
+# nodes, so the engine backend turns it into CpusetMems
+NUMA_NODE_KEY = 'x-numa-node'
+
+# [(node, [core, ...]), ...] where a core is the list of its hardware threads
+Topology = List[Tuple[int, List[List[int]]]]
+
+
+def parse_cpulist(text: str) -> List[int]:
+    """CPUs of a kernel cpulist such as '0-3,8,10-11'"""
+    cpus = []
+    for part in text.replace(' ', '').strip().split(','):
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        if not first.isdigit() or (last and not last.isdigit()):
+            raise ValueError(f"Invalid CPU list: '{text}'")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def format_cpulist(cpus: List[int]) -> str:
+    """Compact cpulist of a set of CPUs, as written to cpuset"""
+    ranges = []
+    for cpu in sorted(set(cpus)):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+
+def read_text(path: str) -> Optional[str]:
+    try:
+        with open(path) as fh:
+            return fh.read()
+    except OSError:
+        return None
+
+
+@lru_cache(maxsize=4)
+def host_topology(sys_root: str = SYS_ROOT) -> Topology:
+    """Online CPUs grouped by NUMA node and physical core.
+
+    Without NUMA information (or outside Linux) every CPU is placed on a
+    single node 0 and every CPU counts as its own core.
+    """
+    online_text = read_text(f"{sys_root}/cpu/online")
+    online = parse_cpulist(online_text) if online_text else list(range(os.cpu_count() or 1))
+    online_set = set(online)
+
+    nodes = []
+    for path in glob.glob(f"{sys_root}/node/node[0-9]*/cpulist"):
+        node = int(re.search(r'node(\d+)/cpulist$', path).group(1))
+        cpus = [cpu for cpu in parse_cpulist(read_text(path) or '') if cpu in online_set]
+        if cpus:
+            # Memory-only nodes have no CPUs to pin to
+            nodes.append((node, cpus))
+    if not nodes:
+        nodes = [(0, online)]
+
+    topology = []
+    for node, cpus in sorted(nodes):
+        members, cores, seen = set(cpus), [], set()
+        for cpu in sorted(cpus):
+            if cpu in seen:
+                continue
+            siblings = read_text(f"{sys_root}/cpu/cpu{cpu}/topology/thread_siblings_list")
+            core = [c for c in parse_cpulist(siblings) if c in members] if siblings else []
+            core = sorted(set(core) | {cpu})
+            seen.update(core)
+            cores.append(core)
+        topology.append((node, cores))
+    return topology
+
+
+def cpu_slots(cores: List[List[int]], size: int) -> List[List[int]]:
+    """Split a node's cores into slots of size CPUs.
+
+    When a slot is a multiple of a core, it takes whole cores so its
+    threads share their caches; otherwise slots take the first thread of
+    every core before any second thread, so agents only share a core once
+    every core is busy. CPUs left over from the last full slot stay free.
+    """
+    threads = max(len(core) for core in cores)
+    if size % threads == 0:
+        order = [cpu for core in cores for cpu in core]
+    else:
+        order = [core[rank] for rank in range(threads) for core in cores if rank < len(core)]
+    if size >= len(order):
+        return [sorted(order)]
+    return [sorted(order[i:i + size]) for i in range(0, len(order) - size + 1, size)]
+
+
+def placement_settings(placement: Optional[Dict[str, Any]], limits: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Validate the optional docker.placement section"""
+    if not placement:
+        return None
+
+    mode = placement.get('mode', 'spread')
+    if mode not in PLACEMENT_MODES:
+        raise ValueError(f"docker.placement.mode must be 'spread' or 'pack', got '{mode}'")
+
+    limit = float(limits['cpus']) if 'cpus' in limits else None
+    default = max(1, math.ceil(limit)) if limit else 1
+    size = int(placement.get('cpus_per_agent', default))
+    if size < 1:
+        raise ValueError("docker.placement.cpus_per_agent must be at least 1")
+    if limit and limit > size:
+        raise ValueError(f"docker.limits.cpus ({limits['cpus']}) is more than the "
+                         f"{size} CPUs docker.placement.cpus_per_agent pins each agent to")
+
+    reserved = placement.get('reserved_cpus', '')
+    if isinstance(reserved, list):
+        reserved = ','.join(str(cpu) for cpu in reserved)
+    return {
+        'mode': mode,
+        'cpus_per_agent': size,
+        'reserved_cpus': parse_cpulist(str(reserved)),
+    }
+
+
+class CpuPlacement:
+    """Assigns CPU slots to agents by their position in the fleet.
+
+    'spread' deals agents round-robin over the NUMA nodes, one slot of
+    each node at a time; 'pack' fills the slots of node 0 before moving on
+    to node 1. Either way an agent's slot depends only on its index, so
+    appending cameras never moves existing agents, and agents share slots
+    evenly once there are more agents than slots.
+    """
+
+    def __init__(self, settings: Dict[str, Any], topology: Optional[Topology] = None):
+        self.mode = settings['mode']
+        self.size = settings['cpus_per_agent']
+        reserved = set(settings['reserved_cpus'])
+        self.nodes: List[Tuple[int, List[List[int]]]] = []
+        for node, cores in (topology if topology is not None else host_topology()):
+            cores = [[cpu for cpu in core if cpu not in reserved] for core in cores]
+            cores = [core for core in cores if core]
+            if cores:
+                self.nodes.append((node, cpu_slots(cores, self.size)))
+        if not self.nodes:
+            raise ValueError("docker.placement.reserved_cpus leaves no CPUs for the agents")
+        if self.mode == 'pack':
+            self.slots = [(node, slot) for node, slots in self.nodes for slot in slots]
+        else:
+            depth = max(len(slots) for _, slots in self.nodes)
+            self.slots = [(node, slots[i]) for i in range(depth) for node, slots in self.nodes if i < len(slots)]
+
+    @property
+    def numa(self) -> bool:
+        return len(self.nodes) > 1
+
+    def assign(self, index: int) -> Tuple[int, List[int]]:
+        """NUMA node and CPUs of the agent at index"""
+        return self.slots[index % len(self.slots)]
+
+    def apply(self, service: Dict[str, Any], index: int):
+        """Pin a compose service definition to its slot"""
+        node, cpus = self.assign(index)
+        service['cpuset'] = format_cpulist(cpus)
+        if self.numa:
+            service[NUMA_NODE_KEY] = node
+
+    def describe(self, agents: int) -> str:
+        """One-line summary of how many agents share each slot"""
+        slots = len(self.slots)
+        text = (f"{slots} slot{'s' if slots > 1 else ''} of {self.size} CPU{'s' if self.size > 1 else ''} "
+                f"on {len(self.nodes)} NUMA node{'s' if self.numa else ''}")
+        if agents > slots:
+            text += f", up to {-(-agents // slots)} agents per slot"
+        return text
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Host port assignment for Kerberos.io agents
+Reads the listening sockets once and hands every agent a web and RTMP port that is free and stays put
+"""
+
+import socket
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+PORT_MAX = 65535
+LISTEN = '0A'  # TCP_LISTEN in /proc/net/tcp
+
+
+def listening_ports(proc_root: str = '/proc') -> Optional[Set[int]]:
+    """TCP ports something listens on, from one read of /proc/net/tcp{,6} or psutil.
+
+    Returns None when neither is available (or psutil is not allowed to
+    look), so callers can fall back to probing ports one by one.
+    """
+    ports, found = set(), False
+    for table in ('tcp', 'tcp6'):
+        try:
+            fh = open(f"{proc_root}/net/{table}")
+        except OSError:
+            continue
+        found = True
+        with fh:
+            next(fh, None)  # header
+            for line in fh:
+                fields = line.split()
+                # sl local_address rem_address st ...; local_address is HEXIP:HEXPORT
+                if len(fields) > 3 and fields[3] == LISTEN:
+                    ports.add(int(fields[1].rsplit(':', 1)[1], 16))
+    if found:
+        return ports
+
+    try:
+        import psutil
+    except ImportError:
+        return None
+    try:
+        return {conn.laddr.port for conn in psutil.net_connections('tcp') if conn.status == psutil.CONN_LISTEN}
+    except (psutil.AccessDenied, OSError):
+        return None
+
+
+def port_in_use(port: int) -> bool:
+    """Whether binding the port fails; the slow path when no snapshot is available"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        try:
+            s.bind(('localhost', port))
+            return False
+        except OSError:
+            return True
+
+
+def busy_ports(ports: Iterable[int]) -> Set[int]:
+    """Those of the ports that are already taken"""
+    listening = listening_ports()
+    if listening is None:
+        return {port for port in ports if port_in_use(port)}
+    return listening.intersection(ports)
+
+
+def agent_ports(settings: Dict[str, Any], camera_name: str, index: int) -> Tuple[int, int]:
+    """Web and RTMP host ports of an agent: its recorded assignment, or the next ones from the starts"""
+    assigned = (settings.get('ports') or {}).get(camera_name)
+    if assigned:
+        return assigned[0], assigned[1]
+    return settings['web_port_start'] + index, settings['rtmp_port_start'] + index
+
+
+def previous_ports(state: Dict[str, Any], settings: Dict[str, Any]) -> Dict[str, List[int]]:
+    """Ports the last generate gave each agent, if they were handed out from the same starts"""
+    record = state.get('ports')
+    if record:
+        if (record.get('web_start'), record.get('rtmp_start')) != (settings['web_port_start'],
+                                                                   settings['rtmp_port_start']):
+            return {}
+        return record.get('agents') or {}
+    # Generated before assignments were recorded: agents were numbered in order from the starts
+    return {name: [settings['web_port_start'] + i, settings['rtmp_port_start'] + i]
+            for i, name in enumerate(state.get('generated') or {})}
+
+
+def allocate_ports(settings: Dict[str, Any], names: Iterable[str], previous: Dict[str, List[int]],
+                   busy: Set[int]) -> Tuple[Dict[str, List[int]], List[int]]:
+    """Assign [web, rtmp] host ports to every agent.
+
+    Agents keep the ports they had, so adding or removing a camera never
+    moves the others. New agents get the lowest ports from each start that
+    are neither busy nor assigned, which for a fresh fleet on a quiet host
+    is the start plus the camera's position, as before. Returns the
+    assignment and the busy ports that were skipped.
+    """
+    names = list(names)
+    assignment = {name: list(previous[name]) for name in names if name in previous}
+    taken = {port for pair in assignment.values() for port in pair}
+    skipped = set()
+    cursors = [settings['web_port_start'], settings['rtmp_port_start']]
+
+    def take(kind: int) -> int:
+        port = cursors[kind]
+        while port in taken or port in busy:
+            if port in busy and port not in taken:
+                skipped.add(port)
+            port += 1
+        if port > PORT_MAX:
+            raise ValueError(f"Not enough free ports for {len(names)} agents: web ports from "
+                             f"{settings['web_port_start']} and RTMP ports from {settings['rtmp_port_start']} "
+                             f"run past {PORT_MAX}; lower docker.web_port_start or docker.rtmp_port_start")
+        taken.add(port)
+        cursors[kind] = port + 1
+        return port
+
+    for name in names:
+        if name not in assignment:
+            assignment[name] = [take(0), take(1)]
+    return {name: assignment[name] for name in names}, sorted(skipped)
+
+
+def port_record(settings: Dict[str, Any], assignment: Dict[str, List[int]]) -> Dict[str, Any]:
+    """State file section for an assignment"""
+    return {'web_start': settings['web_port_start'], 'rtmp_start': settings['rtmp_port_start'],
+            'agents': assignment}
+
+
+def with_assigned_ports(config: Dict[str, Any], record: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Config carrying the ports the last generate assigned, so every command builds the same services"""
+    if not record:
+        return config
+    return dict(config, docker=dict(config.get('docker') or {}, assigned_ports=record.get('agents') or {}))
+
+
+def port_ranges(assignment: Dict[str, List[int]]) -> Tuple[str, str]:
+    """'first-last' of the web and of the RTMP ports, for summaries"""
+    if not assignment:
+        return '-', '-'
+    web = [pair[0] for pair in assignment.values()]
+    rtmp = [pair[1] for pair in assignment.values()]
+    return f"{min(web)}-{max(web)}", f"{min(rtmp)}-{max(rtmp)}"
+
+
+def port_conflicts(settings: Dict[str, Any]) -> List[str]:
+    """Agent ports something else already listens on, checked against one snapshot"""
+    from compose_writer import camera_name_for
+
+    pairs = [agent_ports(settings, camera_name_for(ip), i) for i, ip in enumerate(settings['ips'])]
+    taken = busy_ports(port for pair in pairs for port in pair)
+    return ([f"Web port {web}" for web, _ in pairs if web in taken] +
+            [f"RTMP port {rtmp}" for _, rtmp in pairs if rtmp in taken])
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Recordings storage accounting for Kerberos.io agents
+Walks every camera's recordings directory in parallel and keeps an index of file sizes and
+modification times, so a rescan only lists directories that changed and only stats files it has
+not seen settle. From the index it reports what each camera actually writes per day, how fast the
+recordings grow and when the volume fills up
+"""
+
+import json
+import os
+import shutil
+import time
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Files modified this close to the previous scan may still be recording and are stat'ed again
+SETTLE_SECONDS = 120.0
+DEFAULT_WINDOW_DAYS = 7.0
+# Totals of past scans kept for the net growth rate
+HISTORY_LENGTH = 500
+# Net growth needs scans at least this far apart (seconds)
+MIN_HISTORY_SPAN = 3600.0
+
+DAY = 86400.0
+
+
+def index_path(compose_file: str) -> Path:
+    """Index kept alongside the compose file (docker-compose.yml -> docker-compose.recordings.json)"""
+    compose_path = Path(compose_file)
+    return compose_path.with_name(f"{compose_path.stem}.recordings.json")
+
+
+def free_space(path: str) -> Tuple[int, int]:
+    """Total and free bytes of the volume holding path (or its nearest existing parent)"""
+    existing = Path(path).resolve()
+    while not existing.exists():
+        existing = existing.parent
+    usage = shutil.disk_usage(str(existing))
+    return usage.total, usage.free
+
+
+class RecordingsIndex:
+    """Sizes and mtimes of every recording below root/<camera>, kept current by scan().
+
+    Per camera the index maps each directory (relative to the camera's
+    root) to [mtime_ns, {file: [size, mtime_ns]}, [subdirectories]]. A
+    directory whose mtime has not changed still has the same entries, so
+    only its files that were still being written at the previous scan are
+    stat'ed again; a changed directory is listed, and only its new or
+    unsettled files are stat'ed. Recordings are written once, so a file
+    rewritten in place under the same name is not noticed until it is
+    renamed or removed.
+    """
+
+    def __init__(self, root: str, settle: float = SETTLE_SECONDS):
+        self.root = root
+        self.settle = settle
+        self.cameras: Dict[str, Dict[str, list]] = {}
+        self.scanned: Optional[float] = None
+        self.history: List[List[float]] = []
+        self.stats = {'listed': 0, 'reused': 0, 'stated': 0, 'elapsed': 0.0}
+
+    @classmethod
+    def load(cls, path: Path, root: str, settle: float = SETTLE_SECONDS) -> 'RecordingsIndex':
+        """Index saved by save(), or an empty one if it is missing, unreadable or for another root"""
+        index = cls(root, settle)
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return index
+        if isinstance(data, dict) and data.get('root') == os.path.abspath(root):
+            index.cameras = data.get('cameras') or {}
+            index.scanned = data.get('scanned')
+            index.history = data.get('history') or []
+        return index
+
+    def save(self, path: Path):
+        """Atomically write the index"""
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump({'root': os.path.abspath(self.root), 'scanned': self.scanned, 'history': self.history,
+                       'cameras': self.cameras}, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    def _scan_camera(self, name: str, cutoff: Optional[int]) -> Tuple[Dict[str, list], int, int, int]:
+        """New directory map of one camera and the directories listed, files reused and files stat'ed"""
+        root = os.path.join(self.root, name)
+        previous = self.cameras.get(name) or {}
+        directories = {}
+        listed = reused = stated = 0
+        pending = ['']
+        while pending:
+            relative = pending.pop()
+            path = os.path.join(root, relative) if relative else root
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            old = previous.get(relative)
+            if old is not None and old[0] == mtime:
+                files, subdirs = dict(old[1]), old[2]
+                for file_name, (_, file_mtime) in old[1].items():
+                    if cutoff is None or file_mtime < cutoff:
+                        reused += 1
+                        continue
+                    try:
+                        st = os.stat(os.path.join(path, file_name))
+                        files[file_name] = [st.st_size, st.st_mtime_ns]
+                    except OSError:
+                        del files[file_name]
+                    stated += 1
+            else:
+                listed += 1
+                known = old[1] if old is not None else {}
+                files, subdirs = {}, []
+                try:
+                    with os.scandir(path) as entries:
+                        for entry in entries:
+                            try:
+                                if entry.is_dir(follow_symlinks=False):
+                                    subdirs.append(entry.name)
+                                elif entry.is_file(follow_symlinks=False):
+                                    seen = known.get(entry.name)
+                                    if seen is not None and cutoff is not None and seen[1] < cutoff:
+                                        files[entry.name] = seen
+                                        reused += 1
+                                    else:
+                                        st = entry.stat(follow_symlinks=False)
+                                        files[entry.name] = [st.st_size, st.st_mtime_ns]
+                                        stated += 1
+                            except OSError:
+                                continue
+                except OSError:
+                    continue
+            directories[relative] = [mtime, files, subdirs]
+            pending.extend(os.path.join(relative, d) if relative else d for d in subdirs)
+        return directories, listed, reused, stated
+
+    def scan(self, names: Iterable[str], workers: int = 8):
+        """Bring the index up to date for these cameras, several cameras at a time.
+
+        Cameras that are no longer named are dropped from the index.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        names = list(names)
+        started = time.monotonic()
+        now = time.time()
+        # Anything modified after this at the previous scan may have grown since
+        cutoff = int((self.scanned - self.settle) * 1e9) if self.scanned else None
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(names)))) as pool:
+            results = list(pool.map(lambda name: self._scan_camera(name, cutoff), names))
+        self.cameras = {name: directories for name, (directories, _, _, _) in zip(names, results) if directories}
+        self.stats = {'listed': sum(r[1] for r in results), 'reused': sum(r[2] for r in results),
+                      'stated': sum(r[3] for r in results), 'elapsed': time.monotonic() - started}
+        self.scanned = now
+        self.history = (self.history + [[now, self.total()[0]]])[-HISTORY_LENGTH:]
+
+    def files(self, name: str) -> Iterable[Tuple[int, int]]:
+        """(size, mtime_ns) of every recording of a camera"""
+        for _, files, _ in (self.cameras.get(name) or {}).values():
+            yield from files.values()
+
+    def usage(self, name: str) -> Tuple[int, int]:
+        """Bytes and number of recordings of a camera"""
+        total = count = 0
+        for size, _ in self.files(name):
+            total += size
+            count += 1
+        return total, count
+
+    def total(self) -> Tuple[int, int]:
+        totals = [self.usage(name) for name in self.cameras]
+        return sum(t for t, _ in totals), sum(c for _, c in totals)
+
+    def net_growth(self, window: float) -> Optional[float]:
+        """Bytes per day the stored total changed over the scans of the last window seconds, retention included"""
+        if not self.history:
+            return None
+        recent = [entry for entry in self.history if entry[0] >= self.history[-1][0] - window]
+        span = recent[-1][0] - recent[0][0]
+        if span < MIN_HISTORY_SPAN:
+            return None
+        return (recent[-1][1] - recent[0][1]) / span * DAY
+
+
+def camera_report(index: RecordingsIndex, name: str, now: float, window_days: float) -> Dict[str, Any]:
+    """Stored bytes and files of a camera, and what it wrote per day over the window"""
+    since = now - window_days * DAY
+    total = count = recent = 0
+    oldest = newest = None
+    days: Dict[str, int] = {}
+    for size, mtime_ns in index.files(name):
+        mtime = mtime_ns / 1e9
+        total += size
+        count += 1
+        oldest = mtime if oldest is None else min(oldest, mtime)
+        newest = mtime if newest is None else max(newest, mtime)
+        if mtime >= since:
+            recent += size
+            day = date.fromtimestamp(mtime).isoformat()
+            days[day] = days.get(day, 0) + size
+    # A camera recording for less than the window is averaged over the time it has recorded
+    span = max(min(window_days * DAY, now - oldest), 3600.0) if oldest is not None else None
+    return {
+        'camera': name,
+        'bytes': total,
+        'files': count,
+        'bytes_per_day': recent / span * DAY if span else 0.0,
+        'oldest': oldest,
+        'newest': newest,
+        'days': dict(sorted(days.items())),
+    }
+
+
+def storage_report(index: RecordingsIndex, names: List[str], window_days: float = DEFAULT_WINDOW_DAYS,
+                   now: Optional[float] = None) -> Dict[str, Any]:
+    """Per-camera and fleet storage use, growth and days until the recordings volume is full.
+
+    The growth rate is the net change of the stored total between scans
+    when they span at least an hour, so deletions by retention count;
+    otherwise it is what the cameras wrote per day over the window.
+    """
+    now = time.time() if now is None else now
+    cameras = [camera_report(index, name, now, window_days) for name in names]
+    written = sum(camera['bytes_per_day'] for camera in cameras)
+    net = index.net_growth(window_days * DAY)
+    growth = net if net is not None else written
+    total_bytes, free_bytes = free_space(index.root)
+    recording = [camera for camera in cameras if camera['files']]
+    return {
+        'path': os.path.abspath(index.root),
+        'cameras': cameras,
+        'bytes': sum(camera['bytes'] for camera in cameras),
+        'files': sum(camera['files'] for camera in cameras),
+        'recording_cameras': len(recording),
+        'bytes_per_day': written,
+        'bytes_per_camera_day': written / len(recording) if recording else 0.0,
+        'net_growth_per_day': net,
+        'growth_per_day': growth,
+        'volume_total': total_bytes,
+        'volume_free': free_bytes,
+        'days_until_full': free_bytes / growth if growth > 0 else None,
+        'window_days': window_days,
+        'scan': dict(index.stats),
+        'scanned': datetime.fromtimestamp(index.scanned).isoformat(timespec='seconds') if index.scanned else None,
+    }
+
+
+def measure_storage(recordings_path: str, names: List[str], compose_file: Optional[str] = None,
+                    window_days: float = DEFAULT_WINDOW_DAYS, workers: int = 8) -> Dict[str, Any]:
+    """Scan with the saved index (when compose_file is given), save it back and report"""
+    path = index_path(compose_file) if compose_file else None
+    index = RecordingsIndex.load(path, recordings_path) if path else RecordingsIndex(recordings_path)
+    index.scan(names, workers)
+    if path:
+        index.save(path)
+    return storage_report(index, names, window_days)
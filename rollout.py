@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Rolling restarts and updates for Kerberos.io agents
+Recreates agents in waves, waiting for each wave's health endpoint before starting the next,
+so the whole fleet never reconnects to its cameras at the same moment
+"""
+
+import time
+from collections import namedtuple
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from deploy_state import chunked
+
+RolloutResult = namedtuple('RolloutResult', ['completed', 'failed_wave', 'unhealthy', 'rolled_back'])
+
+DEFAULT_WAVE_SIZE = 10
+DEFAULT_HEALTH_PATH = '/api/health'
+# Compose command recreating agents on the image their tag points at now
+RECREATE_COMMAND = ['up', '-d', '--no-deps', '--force-recreate']
+
+
+def rollout_settings(docker_config: Dict[str, Any], wave_size: Optional[int] = None) -> Dict[str, Any]:
+    """Validate the optional docker.rollout section; wave_size overrides the configured one"""
+    rollout = docker_config.get('rollout') or {}
+    settings = {
+        'wave_size': int(wave_size or rollout.get('wave_size', DEFAULT_WAVE_SIZE)),
+        'health_path': rollout.get('health_path', DEFAULT_HEALTH_PATH),
+        'health_host': rollout.get('health_host', '127.0.0.1'),
+        'health_timeout': float(rollout.get('health_timeout', 120)),
+        'health_interval': float(rollout.get('health_interval', 2)),
+        'max_unhealthy': int(rollout.get('max_unhealthy', 0)),
+        'pause': float(rollout.get('pause', 0)),
+    }
+    if settings['wave_size'] < 1:
+        raise ValueError("docker.rollout.wave_size must be at least 1")
+    return settings
+
+
+def health_urls(settings: Dict[str, Any], rollout: Dict[str, Any]) -> Dict[str, str]:
+    """Health URL of every configured agent, built from its published web port"""
+    from compose_writer import iter_services, web_port_of
+
+    urls = {}
+    for name, service, _ in iter_services(settings, settings['ips'], create_dirs=False):
+        web_port = web_port_of(service)
+        if web_port:
+            urls[name] = f"http://{rollout['health_host']}:{web_port}{rollout['health_path']}"
+    return urls
+
+
+def missing_health_urls(names: Iterable[str], urls: Dict[str, str]) -> List[str]:
+    """Agents the rollout would touch but cannot health-check, such as ones no longer configured"""
+    return sorted(name for name in names if name not in urls)
+
+
+def is_healthy(url: str, timeout: float = 2.0) -> bool:
+    """Whether the endpoint answers 2xx"""
+    import urllib.error
+    import urllib.request
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return 200 <= response.status < 300
+    except (urllib.error.URLError, OSError, ValueError):
+        return False
+
+
+def wait_healthy(urls: Dict[str, str], timeout: float, interval: float) -> List[str]:
+    """Poll the agents until all are healthy or the timeout passes; returns those still unhealthy"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    pending = dict(urls)
+    deadline = time.monotonic() + timeout
+    with ThreadPoolExecutor(max_workers=max(1, min(32, len(pending)))) as pool:
+        while pending:
+            results = dict(zip(pending, pool.map(is_healthy, pending.values())))
+            pending = {name: url for name, url in pending.items() if not results[name]}
+            if not pending or time.monotonic() + interval > deadline:
+                break
+            time.sleep(interval)
+    return sorted(pending)
+
+
+def rolling(names: Iterable[str], apply_wave: Callable[[List[str]], bool], urls: Dict[str, str],
+            rollout: Dict[str, Any], on_wave: Optional[Callable[..., None]] = None,
+            rollback: Optional[Callable[[List[str]], bool]] = None) -> RolloutResult:
+    """Apply apply_wave to the agents wave by wave, health-gating every wave.
+
+    A wave fails when apply_wave returns False or more than max_unhealthy of
+    its agents are not healthy within health_timeout; an agent without a
+    health URL counts as unhealthy. The rollout then stops
+    and, if given, rollback is called with every agent touched so far.
+    on_wave(number, total, wave, unhealthy, elapsed) reports progress.
+    """
+    waves = list(chunked(names, rollout['wave_size']))
+    completed: List[str] = []
+    for number, wave in enumerate(waves, 1):
+        started = time.monotonic()
+        ok = apply_wave(wave)
+        unhealthy = wave if not ok else sorted(missing_health_urls(wave, urls) + wait_healthy(
+            {name: urls[name] for name in wave if name in urls},
+            rollout['health_timeout'], rollout['health_interval']))
+        if on_wave:
+            on_wave(number, len(waves), wave, unhealthy, time.monotonic() - started)
+
+        if not ok or len(unhealthy) > rollout['max_unhealthy']:
+            touched = completed + wave
+            rolled_back = touched if rollback and rollback(touched) else []
+            return RolloutResult(completed, number, unhealthy, rolled_back)
+
+        completed.extend(wave)
+        if rollout['pause'] and number < len(waves):
+            time.sleep(rollout['pause'])
+    return RolloutResult(completed, None, [], [])
+
+
+def recreate_plan(pulled, run_compose: Callable[..., bool],
+                  on_rollback: Optional[Callable[[List[str]], None]] = None):
+    """Agents whose image a pull changed, and a rollback for them (None if no image changed).
+
+    pulled is what the CLIs' pull_latest returns and run_compose(command,
+    services=...) runs a compose command. The rollback points every changed
+    tag back at its previous image and recreates the touched agents on it.
+    """
+    from image_pull import outdated_services
+
+    images, results, engine = pulled
+    names = outdated_services(images, results, engine)
+    previous = {r.image: r.before for r in results if r.before and r.after != r.before}
+    if not previous:
+        return names, None
+
+    def restore_previous(touched: List[str]) -> bool:
+        if on_rollback:
+            on_rollback(touched)
+        return (all(tag_image(before, image, engine) for image, before in previous.items()) and
+                run_compose(RECREATE_COMMAND, services=touched))
+    return names, restore_previous
+
+
+def image_id(image: str, engine=None) -> Optional[str]:
+    """Local image id for a tag, or None if it is not present"""
+    if engine is not None:
+        from docker_engine import DockerEngineError
+        try:
+            return engine.image_id(image)
+        except DockerEngineError:
+            return None
+
+    import subprocess
+    try:
+        result = subprocess.run(['docker', 'image', 'inspect', '--format', '{{.Id}}', image],
+                                capture_output=True, text=True)
+    except FileNotFoundError:
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip() or None
+
+
+def tag_image(source_id: str, image: str, engine=None) -> bool:
+    """Point the image tag back at source_id, so recreated agents use that image again"""
+    if engine is not None:
+        from docker_engine import DockerEngineError
+        try:
+            engine.tag_image(source_id, image)
+            return True
+        except DockerEngineError:
+            return False
+
+    import subprocess
+    try:
+        return subprocess.run(['docker', 'tag', source_id, image], capture_output=True).returncode == 0
+    except FileNotFoundError:
+        return False
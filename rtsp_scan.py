@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+"""
+Camera discovery for Kerberos.io agents
+Probes every address of the camera range with a TCP connect and RTSP OPTIONS/DESCRIBE from one
+asyncio event loop, keeping thousands of probes in flight under a deadline per address, so only
+addresses where a camera answers get an agent. The session descriptions the cameras return give
+each camera's stream profile (codec, resolution, frame rate, bitrate), cached per address
+"""
+
+import os
+import re
+import time
+from collections import namedtuple
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from fd_limits import raise_fd_limit
+
+DEFAULT_CONCURRENCY = 1000
+# Seconds one address gets for the connect and both requests together
+DEFAULT_TIMEOUT = 2.0
+# Seconds a detected stream profile is trusted before the camera is described again
+DEFAULT_PROFILE_TTL = 24 * 3600
+
+USER_AGENT = 'kerberos-scan'
+
+# state: 'stream' (DESCRIBE answered with a session description), 'auth' (the credentials were
+# refused), 'rtsp' (an RTSP server answered, but not with the stream), 'open' (something accepted
+# the connection but did not speak RTSP), 'closed' (refused or unreachable) or 'timeout'
+ProbeResult = namedtuple('ProbeResult', ['ip', 'state', 'status', 'server', 'sdp', 'elapsed'])
+
+# States where a camera is listening, whether or not the agent could use it as configured
+LIVE_STATES = ('stream', 'auth', 'rtsp')
+
+AUTH_PARAM = re.compile(r'(\w+)=(?:"([^"]*)"|([^\s,]+))')
+
+# Payload types with a static codec (RFC 3551), for cameras that skip a=rtpmap
+STATIC_PAYLOADS = {'26': 'jpeg', '32': 'mpv', '34': 'h263'}
+CODEC_NAMES = {'h264': 'h264', 'h265': 'h265', 'hevc': 'h265', 'jpeg': 'mjpeg', 'mp4v-es': 'mpeg4'}
+# H.264 profiles whose SPS carries chroma format and bit depth fields
+HIGH_PROFILES = (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135)
+
+
+class RtspError(Exception):
+    """The peer did not answer with a valid RTSP response"""
+
+
+def scan_settings(settings: Dict[str, Any]) -> Dict[str, Any]:
+    """Probe target from compose settings; only RTSP cameras can be scanned"""
+    if settings['protocol'] != 'rtsp':
+        raise ValueError(f"Camera scans need cameras.connection.protocol: rtsp, not '{settings['protocol']}'")
+    return {
+        'port': int(settings['port']),
+        'path': '/' + str(settings['stream_path']).lstrip('/'),
+        'username': settings['username'],
+        'password': settings['password'],
+    }
+
+
+def parse_response(head: bytes) -> Dict[str, Any]:
+    """Status and headers of an RTSP response head; repeated headers are kept as lists"""
+    lines = head.decode('latin-1').split('\r\n')
+    parts = lines[0].split(' ', 2)
+    if len(parts) < 2 or not parts[0].startswith('RTSP/') or not parts[1].isdigit():
+        raise RtspError(f"not an RTSP response: {lines[0][:40]!r}")
+    headers: Dict[str, List[str]] = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(':')
+        if sep:
+            headers.setdefault(name.strip().lower(), []).append(value.strip())
+    return {'status': int(parts[1]), 'headers': headers}
+
+
+def authorization(method: str, url: str, challenges: List[str], username: str, password: str) -> Optional[str]:
+    """Authorization header answering a 401, preferring Digest over Basic"""
+    import base64
+    import hashlib
+
+    by_scheme = {}
+    for challenge in challenges:
+        scheme, _, params = challenge.partition(' ')
+        by_scheme[scheme.lower()] = {key.lower(): quoted if quoted else plain
+                                     for key, quoted, plain in AUTH_PARAM.findall(params)}
+    if 'digest' in by_scheme:
+        params = by_scheme['digest']
+        realm, nonce = params.get('realm', ''), params.get('nonce', '')
+
+        def md5(text: str) -> str:
+            return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+        ha1 = md5(f"{username}:{realm}:{password}")
+        ha2 = md5(f"{method}:{url}")
+        fields = f'username="{username}", realm="{realm}", nonce="{nonce}", uri="{url}"'
+        if 'auth' in params.get('qop', '').split(','):
+            cnonce = os.urandom(8).hex()
+            response = md5(f"{ha1}:{nonce}:00000001:{cnonce}:auth:{ha2}")
+            fields += f', qop=auth, nc=00000001, cnonce="{cnonce}"'
+        else:
+            response = md5(f"{ha1}:{nonce}:{ha2}")
+        if 'opaque' in params:
+            fields += f', opaque="{params["opaque"]}"'
+        return f'Digest {fields}, response="{response}"'
+    if 'basic' in by_scheme:
+        token = base64.b64encode(f"{username}:{password}".encode('utf-8')).decode('ascii')
+        return f"Basic {token}"
+    return None
+
+
+async def probe(ip: str, target: Dict[str, Any], timeout: float = DEFAULT_TIMEOUT) -> ProbeResult:
+    """Connect to one address and ask for its stream, all within timeout seconds"""
+    import asyncio
+
+    started = time.monotonic()
+    found = {'state': 'timeout', 'status': None, 'server': None, 'sdp': None}
+
+    async def talk():
+        reader, writer = await asyncio.open_connection(ip, target['port'])
+        found['state'] = 'open'
+        url = f"rtsp://{ip}:{target['port']}{target['path']}"
+        cseq = 0
+
+        async def request(method: str, extra: str = '') -> Dict[str, Any]:
+            nonlocal cseq
+            cseq += 1
+            writer.write(f"{method} {url} RTSP/1.0\r\nCSeq: {cseq}\r\nUser-Agent: {USER_AGENT}\r\n"
+                         f"{extra}\r\n".encode('utf-8'))
+            await writer.drain()
+            response = parse_response(await reader.readuntil(b'\r\n\r\n'))
+            length = int((response['headers'].get('content-length') or ['0'])[0])
+            response['body'] = await reader.readexactly(length) if length > 0 else b''
+            return response
+
+        try:
+            options = await request('OPTIONS')
+            found.update(state='rtsp', status=options['status'],
+                         server=(options['headers'].get('server') or [None])[0])
+            accept = "Accept: application/sdp\r\n"
+            describe = await request('DESCRIBE', accept)
+            challenges = describe['headers'].get('www-authenticate') or []
+            if describe['status'] == 401 and challenges:
+                credentials = authorization('DESCRIBE', url, challenges, target['username'], target['password'])
+                if credentials:
+                    describe = await request('DESCRIBE', f"{accept}Authorization: {credentials}\r\n")
+            found['status'] = describe['status']
+            if describe['status'] == 200:
+                found.update(state='stream', sdp=describe['body'].decode('utf-8', 'replace'))
+            elif describe['status'] == 401:
+                found['state'] = 'auth'
+        finally:
+            writer.close()
+
+    try:
+        await asyncio.wait_for(talk(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    except (RtspError, ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+        # Something answered, but not like an RTSP server
+        if found['state'] == 'timeout':
+            found['state'] = 'open'
+    except OSError:
+        if found['state'] == 'timeout':
+            found['state'] = 'closed'
+    return ProbeResult(ip, found['state'], found['status'], found['server'], found['sdp'],
+                       time.monotonic() - started)
+
+
+def scan(ips: Iterable[str], target: Dict[str, Any], concurrency: int = DEFAULT_CONCURRENCY,
+         timeout: float = DEFAULT_TIMEOUT,
+         on_result: Optional[Callable[[ProbeResult], None]] = None) -> List[ProbeResult]:
+    """Probe every address, keeping up to concurrency probes in flight.
+
+    Addresses are taken from ips lazily by a fixed set of workers, so a
+    /16 never materializes 65k pending tasks. on_result is called for
+    each result as it arrives; results are returned in completion order.
+    """
+    import asyncio
+
+    # Every probe in flight holds a socket
+    concurrency = max(1, raise_fd_limit(concurrency))
+    results: List[ProbeResult] = []
+
+    async def run():
+        pending = iter(ips)
+
+        async def worker():
+            for ip in pending:
+                result = await probe(ip, target, timeout)
+                results.append(result)
+                if on_result:
+                    on_result(result)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    asyncio.run(run())
+    return results
+
+
+def scan_record(results: List[ProbeResult], target: Dict[str, Any], elapsed: float) -> Dict[str, Any]:
+    """The 'scan' section of the state file: what was probed and where cameras answered"""
+    return {
+        'time': time.time(),
+        'elapsed': round(elapsed, 2),
+        'port': target['port'],
+        'path': target['path'],
+        'addresses': len(results),
+        'found': {r.ip: {'state': r.state, 'status': r.status, 'server': r.server}
+                  for r in results if r.state in LIVE_STATES},
+    }
+
+
+def live_cameras(record: Dict[str, Any]) -> List[str]:
+    """Addresses of a recorded scan where a camera answered"""
+    return [ip for ip, found in record['found'].items() if found['state'] in LIVE_STATES]
+
+
+def detect_settings(camera_config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Validate the optional cameras.stream_detection section; None when detection is off"""
+    detection = camera_config.get('stream_detection')
+    if detection is True:
+        detection = {}
+    if not isinstance(detection, dict) or not detection.get('enabled', True):
+        return None
+    result = {
+        'ttl': float(detection.get('ttl', DEFAULT_PROFILE_TTL)),
+        'timeout': float(detection.get('timeout', DEFAULT_TIMEOUT)),
+        'concurrency': int(detection.get('concurrency', DEFAULT_CONCURRENCY)),
+    }
+    if result['ttl'] <= 0 or result['timeout'] <= 0 or result['concurrency'] < 1:
+        raise ValueError("cameras.stream_detection needs a positive ttl, timeout and concurrency")
+    return result
+
+
+class BitReader:
+    """Big-endian bit reader with the Exp-Golomb codes of H.264 parameter sets"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def bits(self, count: int) -> int:
+        value = 0
+        for _ in range(count):
+            byte = self.data[self.pos >> 3]
+            value = (value << 1) | ((byte >> (7 - (self.pos & 7))) & 1)
+            self.pos += 1
+        return value
+
+    def ue(self) -> int:
+        zeros = 0
+        while not self.bits(1):
+            zeros += 1
+            if zeros > 31:
+                raise ValueError("invalid Exp-Golomb code")
+        return (1 << zeros) - 1 + self.bits(zeros)
+
+    def se(self) -> int:
+        value = self.ue()
+        return (value + 1) // 2 if value & 1 else -(value // 2)
+
+
+def h264_sps(nal: bytes) -> Dict[str, Any]:
+    """Width, height and (from the VUI timing, when present) frame rate of an H.264 sequence parameter set"""
+    if not nal or nal[0] & 0x1f != 7:
+        raise ValueError("not an H.264 sequence parameter set")
+    # Drop the emulation prevention bytes the encoder inserted after every 00 00
+    reader = BitReader(re.sub(b'\x00\x00\x03', b'\x00\x00', nal[1:]))
+    try:
+        profile = reader.bits(8)
+        reader.bits(16)  # constraint flags and level
+        reader.ue()  # seq_parameter_set_id
+        chroma_format = 1
+        if profile in HIGH_PROFILES:
+            chroma_format = reader.ue()
+            if chroma_format == 3:
+                reader.bits(1)  # separate_colour_plane_flag
+            reader.ue()  # bit depths
+            reader.ue()
+            reader.bits(1)
+            if reader.bits(1):  # seq_scaling_matrix_present_flag
+                for i in range(12 if chroma_format == 3 else 8):
+                    if reader.bits(1):
+                        last = scale = 8
+                        for _ in range(16 if i < 6 else 64):
+                            if scale:
+                                scale = (last + reader.se()) % 256
+                            last = scale or last
+        reader.ue()  # log2_max_frame_num_minus4
+        order_type = reader.ue()
+        if order_type == 0:
+            reader.ue()
+        elif order_type == 1:
+            reader.bits(1)
+            reader.se()
+            reader.se()
+            for _ in range(reader.ue()):
+                reader.se()
+        reader.ue()  # max_num_ref_frames
+        reader.bits(1)
+        width_mbs = reader.ue() + 1
+        height_units = reader.ue() + 1
+        frames_only = reader.bits(1)
+        if not frames_only:
+            reader.bits(1)  # mb_adaptive_frame_field_flag
+        reader.bits(1)
+        crop = [reader.ue() for _ in range(4)] if reader.bits(1) else [0, 0, 0, 0]
+    except IndexError:
+        raise ValueError("truncated H.264 sequence parameter set")
+
+    # Cropping counts chroma samples: two luma samples per step in subsampled directions
+    sub_width, sub_height = {0: (1, 1), 1: (2, 2), 2: (2, 1)}.get(chroma_format, (1, 1))
+    field_factor = 2 - frames_only
+    result: Dict[str, Any] = {
+        'width': width_mbs * 16 - sub_width * (crop[0] + crop[1]),
+        'height': field_factor * height_units * 16 - sub_height * field_factor * (crop[2] + crop[3]),
+    }
+    try:
+        if reader.bits(1):  # vui_parameters_present_flag
+            if reader.bits(1) and reader.bits(8) == 255:  # extended sample aspect ratio
+                reader.bits(32)
+            if reader.bits(1):
+                reader.bits(1)  # overscan_appropriate_flag
+            if reader.bits(1):
+                reader.bits(4)  # video_format, video_full_range_flag
+                if reader.bits(1):
+                    reader.bits(24)  # colour description
+            if reader.bits(1):
+                reader.ue()  # chroma sample locations
+                reader.ue()
+            if reader.bits(1):  # timing_info_present_flag
+                units, scale = reader.bits(32), reader.bits(32)
+                # One tick per field: two per frame
+                if units and 0 < scale / (2 * units) <= 240:
+                    result['fps'] = round(scale / (2 * units), 2)
+    except (IndexError, ValueError):
+        # The size is known; a damaged VUI only costs the frame rate
+        pass
+    return result
+
+
+def parse_sdp(sdp: str) -> Dict[str, Any]:
+    """Codec, width, height, fps and bitrate (bits per second) of the first video stream of a session description.
+
+    Cameras announce these in different ways: the size as a=x-dimensions,
+    a=framesize or a=cliprect, or only inside the H.264 parameter sets;
+    the frame rate as a=framerate or in the parameter sets' timing; the
+    bitrate as b=TIAS or b=AS. Whatever the description leaves out is
+    missing from the result.
+    """
+    session: Dict[str, Any] = {}
+    media: Optional[Dict[str, Any]] = None
+    found: Dict[str, Any] = {}
+    other_media = False
+    for line in sdp.splitlines():
+        kind, sep, value = line.strip().partition('=')
+        if not sep:
+            continue
+        if kind == 'm':
+            if media is not None:
+                # Only the first video stream counts
+                break
+            parts = value.split()
+            other_media = not parts or parts[0] != 'video'
+            if not other_media:
+                media = {'payload': parts[3] if len(parts) > 3 else None}
+                found = dict(session)
+            continue
+        if other_media:
+            continue
+        scope = found if media is not None else session
+        if kind == 'b':
+            modifier, _, amount = value.partition(':')
+            if modifier.upper() == 'TIAS' and amount.isdigit():
+                scope['tias'] = int(amount)
+            elif modifier.upper() == 'AS' and amount.isdigit():
+                scope['as'] = int(amount) * 1000
+        elif kind == 'a':
+            name, _, params = value.partition(':')
+            name = name.lower()
+            if name in ('framerate', 'x-framerate'):
+                try:
+                    scope['fps'] = float(params)
+                except ValueError:
+                    pass
+            elif name == 'x-dimensions':
+                width, _, height = params.partition(',')
+                if width.strip().isdigit() and height.strip().isdigit():
+                    scope['size'] = (int(width), int(height))
+            elif name == 'cliprect':
+                edges = params.split(',')
+                if len(edges) == 4 and all(edge.strip().isdigit() for edge in edges):
+                    top, left, bottom, right = (int(edge) for edge in edges)
+                    scope.setdefault('size', (right - left, bottom - top))
+            elif media is not None and name in ('rtpmap', 'framesize', 'fmtp'):
+                payload, _, rest = params.partition(' ')
+                if payload != media['payload']:
+                    continue
+                if name == 'rtpmap':
+                    media['encoding'] = rest.split('/')[0].strip().lower()
+                elif name == 'framesize':
+                    width, _, height = rest.partition('-')
+                    if width.strip().isdigit() and height.strip().isdigit():
+                        scope['size'] = (int(width), int(height))
+                else:
+                    media['fmtp'] = {key.strip().lower(): val.strip() for key, _, val in
+                                     (param.partition('=') for param in rest.split(';'))}
+    if media is None:
+        return {}
+
+    encoding = media.get('encoding') or STATIC_PAYLOADS.get(media['payload'] or '')
+    result: Dict[str, Any] = {}
+    if encoding:
+        result['codec'] = CODEC_NAMES.get(encoding, encoding)
+    sprop = (media.get('fmtp') or {}).get('sprop-parameter-sets')
+    if result.get('codec') == 'h264' and sprop and ('size' not in found or 'fps' not in found):
+        import base64
+        import binascii
+        try:
+            sps = h264_sps(base64.b64decode(sprop.split(',')[0] + '=='))
+            found.setdefault('size', (sps['width'], sps['height']))
+            if 'fps' in sps:
+                found.setdefault('fps', sps['fps'])
+        except (ValueError, binascii.Error):
+            pass
+    if 'size' in found and found['size'][0] > 0 and found['size'][1] > 0:
+        result['width'], result['height'] = found['size']
+    if found.get('fps', 0) > 0:
+        result['fps'] = found['fps']
+    bitrate = found.get('tias') or found.get('as')
+    if bitrate:
+        result['bitrate'] = bitrate
+    return result
+
+
+def stream_profile(sdp: Optional[str]) -> Dict[str, Any]:
+    """Camera profile fields (see capacity.profile_settings) a session description announces"""
+    found = parse_sdp(sdp or '')
+    profile: Dict[str, Any] = {}
+    if 'width' in found:
+        profile['resolution'] = f"{found['width']}x{found['height']}"
+    if 'fps' in found:
+        profile['fps'] = int(found['fps']) if float(found['fps']).is_integer() else found['fps']
+    for key in ('bitrate', 'codec'):
+        if key in found:
+            profile[key] = found[key]
+    return profile
+
+
+def cache_profiles(cache: Dict[str, Any], results: Iterable[ProbeResult], ttl: float = DEFAULT_PROFILE_TTL,
+                   now: Optional[float] = None) -> Dict[str, Any]:
+    """The 'streams' section of the state file with the profiles of results added and expired entries dropped.
+
+    Entries are {'time', 'profile'} by address. A camera that did not
+    describe its stream gets an empty profile, so it is not probed again
+    until that entry expires too.
+    """
+    now = time.time() if now is None else now
+    cache = {ip: entry for ip, entry in cache.items() if now - entry['time'] < ttl}
+    for result in results:
+        cache[result.ip] = {'time': now, 'profile': stream_profile(result.sdp) if result.state == 'stream' else {}}
+    return cache
+
+
+def stale_cameras(cache: Dict[str, Any], ips: Iterable[str], ttl: float, now: Optional[float] = None) -> List[str]:
+    """Addresses without a cached profile younger than ttl"""
+    now = time.time() if now is None else now
+    return [ip for ip in ips if ip not in cache or now - cache[ip]['time'] >= ttl]
+
+
+def cached_profiles(cache: Dict[str, Any], ips: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """Detected profiles of the given addresses, leaving out cameras whose stream told nothing"""
+    return {ip: cache[ip]['profile'] for ip in ips if ip in cache and cache[ip]['profile']}
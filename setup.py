@@ -16,7 +16,32 @@ setup(
     long_description_content_type="text/markdown",
     url="https://github.com/your-username/kerberos-swarms",
     packages=find_packages(),
-    py_modules=["kerberos_cli"],
+    py_modules=[
+        "kerberos_cli",
+        "config_cache",
+        "compose_writer",
+        "compose_projects",
+        "deploy_state",
+        "ip_ranges",
+        "docker_engine",
+        "kerberos_daemon",
+        "engine_backend",
+        "rollout",
+        "log_follower",
+        "fleet_status",
+        "agent_stats",
+        "metrics_exporter",
+        "image_pull",
+        "placement",
+        "capacity",
+        "multi_host",
+        "rtsp_scan",
+        "agent_watchdog",
+        "ports",
+        "calibration",
+        "recordings_index",
+        "fd_limits",
+    ],
     classifiers=[
         "Development Status :: 4 - Beta",
         "Intended Audience :: System Administrators",
@@ -32,6 +57,9 @@ setup(
     ],
     python_requires=">=3.7",
     install_requires=requirements,
+    extras_require={
+        "calibrate": ["numpy>=1.17"],
+    },
     entry_points={
         "console_scripts": [
             "kerberos=kerberos_cli:cli",
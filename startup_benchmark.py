@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Startup Benchmark for the Kerberos CLI
+Times quick commands end to end and checks they do not import heavy modules,
+exiting non-zero when a command goes over its startup budget
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+SCRIPT_DIR = Path(__file__).parent.absolute()
+
+# Modules that quick commands must not load
+HEAVY_MODULES = ('yaml', 'psutil', 'rich', 'docker', 'click', 'concurrent.futures')
+
+# (command arguments, budget in milliseconds)
+COMMANDS = [
+    (['--help'], 100),
+    (['info'], 100),
+]
+
+
+def time_command(argv, runs):
+    """Median wall time in milliseconds over several runs"""
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(argv, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def imported_heavy_modules(argv):
+    """Heavy top-level modules imported while running a command"""
+    result = subprocess.run([argv[0], '-X', 'importtime'] + argv[1:],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    found = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        module = line.rsplit('|', 1)[-1].strip()
+        for heavy in HEAVY_MODULES:
+            if module == heavy or module.startswith(heavy + '.'):
+                found.add(heavy)
+    return sorted(found)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Kerberos CLI startup time')
+    parser.add_argument('--config', '-c', default='config.yml', help='Configuration file path (default: config.yml)')
+    parser.add_argument('--runs', type=int, default=10, help='Runs per command (default: 10)')
+    parser.add_argument('--budget-ms', type=float, help='Override the per-command budget')
+    args = parser.parse_args()
+
+    entry = [sys.executable, str(SCRIPT_DIR / 'kerberos')]
+    baseline = time_command([sys.executable, '-c', 'pass'], args.runs)
+    print(f"Interpreter baseline: {baseline:.1f} ms")
+
+    ok = True
+    for command, budget in COMMANDS:
+        budget = args.budget_ms or budget
+        argv = entry + ['--config', args.config] + command
+        # Warm up the config snapshot and bytecode caches first
+        subprocess.run(argv, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        elapsed = time_command(argv, args.runs)
+        heavy = imported_heavy_modules(argv)
+        passed = elapsed <= budget and not heavy
+        ok = ok and passed
+
+        label = 'kerberos ' + ' '.join(command)
+        print(f"{'PASS' if passed else 'FAIL'}  {label:<20} {elapsed:7.1f} ms (budget {budget:.0f} ms)")
+        if heavy:
+            print(f"      imports heavy modules: {', '.join(heavy)}")
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,71 +4,51 @@ System Resources Check for Kerberos Multi-Agent Deployment
 Analyzes system capacity to run configured Kerberos agents
 """
 
+import json
+import os
 import psutil
-import yaml
 import sys
 from pathlib import Path
-import ipaddress
 
-def load_config(config_path="config.yml"):
-    """Load and parse the Kerberos configuration"""
+import config_cache
+from deploy_state import generated_config, load_state
+from ip_ranges import camera_ips
+
+def load_config(config_path="config.yml", compose_file="docker-compose.yml"):
+    """Load and parse the Kerberos configuration, with the cameras, stream profiles and ports the last generate
+    used and the costs of the latest calibration"""
+    from calibration import calibrated_model
+    from capacity import with_calibrated_model
     try:
-        with open(config_path, 'r') as file:
-            return yaml.safe_load(file)
+        state = load_state(compose_file)
+        return with_calibrated_model(generated_config(config_cache.load_config(config_path), state),
+                                     calibrated_model(state))
     except FileNotFoundError:
         print(f"❌ Configuration file '{config_path}' not found!")
         return None
-    except yaml.YAMLError as e:
+    except ValueError as e:
         print(f"❌ Error parsing configuration: {e}")
         return None
 
 def calculate_camera_count(config):
-    """Calculate total number of cameras from IP range"""
+    """Calculate total number of cameras from the configured IP ranges"""
     try:
-        start_ip = config['cameras']['ip_range']['start']
-        end_ip = config['cameras']['ip_range']['end']
-        
-        start = ipaddress.IPv4Address(start_ip)
-        end = ipaddress.IPv4Address(end_ip)
-        
-        return int(end) - int(start) + 1
-    except Exception as e:
+        return len(camera_ips(config.get('cameras', {})))
+    except ValueError as e:
         print(f"❌ Error calculating camera count: {e}")
         return 0
 
 def get_resource_requirements(config, camera_count):
-    """Calculate resource requirements based on configuration"""
-    
-    # Base resource requirements per agent
-    base_memory_mb = 256  # Base memory per agent
-    base_cpu_percent = 5  # Base CPU percentage per agent
-    
-    # Additional resources based on configuration
-    additional_memory = 0
-    additional_cpu = 0
-    
-    # Recording increases resource usage
-    if config.get('cameras', {}).get('recording', {}).get('enabled', False):
-        additional_memory += 128  # Additional MB for recording
-        additional_cpu += 3  # Additional CPU percentage
+    """Calculate resource requirements from the camera profiles (see capacity.py)"""
+    from capacity import fleet_demand
     
-    # Live streaming increases resource usage
-    if config.get('cameras', {}).get('stream', {}).get('enabled', False):
-        additional_memory += 64  # Additional MB for streaming
-        additional_cpu += 2  # Additional CPU percentage
+    demand = fleet_demand(config)
+    memory_per_agent = round(demand['memory'] / max(1, camera_count) / 1024 ** 2)
+    cpu_per_agent = round(demand['cpus'] / max(1, camera_count) * 100, 1)
     
-    # Motion detection increases resource usage
-    motion_config = config.get('cameras', {}).get('motion_detection', {})
-    if motion_config.get('enabled', False):
-        additional_memory += 32  # Additional MB for motion detection
-        additional_cpu += 2  # Additional CPU percentage
-    
-    # Calculate totals
-    memory_per_agent = base_memory_mb + additional_memory
-    cpu_per_agent = base_cpu_percent + additional_cpu
-    
-    total_memory_mb = memory_per_agent * camera_count
-    total_cpu_percent = cpu_per_agent * camera_count
+    total_memory_mb = demand['memory'] / 1024 ** 2
+    # Share of the whole host, kept under 80% by the capacity assessment
+    total_cpu_percent = round(demand['cpus'] / (psutil.cpu_count() or 1) * 100, 1)
     
     return {
         'camera_count': camera_count,
@@ -77,106 +57,162 @@ def get_resource_requirements(config, camera_count):
         'total_memory_mb': total_memory_mb,
         'total_memory_gb': round(total_memory_mb / 1024, 2),
         'total_cpu_percent': total_cpu_percent,
-        'estimated_disk_usage_gb_per_day': calculate_disk_usage(config, camera_count)
+        'estimated_disk_usage_gb_per_day': calculate_disk_usage(demand)
     }
 
-def calculate_disk_usage(config, camera_count):
-    """Estimate daily disk usage based on recording settings"""
-    if not config.get('cameras', {}).get('recording', {}).get('enabled', False):
-        return 0
-    
-    # Rough estimates for video data
-    # Assumes 720p video at medium quality
-    mb_per_minute = 10  # Rough estimate
-    
-    # Get recording duration
-    duration = config.get('cameras', {}).get('recording', {}).get('duration', 30)
-    pre_recording = config.get('cameras', {}).get('recording', {}).get('pre_recording', 5)
-    post_recording = config.get('cameras', {}).get('recording', {}).get('post_recording', 5)
-    
-    total_recording_seconds = duration + pre_recording + post_recording
-    
-    # Assume motion triggers recording every 10 minutes on average
-    recordings_per_day = 24 * 60 / 10  # 144 recordings per day
-    
-    mb_per_camera_per_day = (total_recording_seconds / 60) * mb_per_minute * recordings_per_day
-    total_mb_per_day = mb_per_camera_per_day * camera_count
-    
-    return round(total_mb_per_day / 1024, 2)  # Convert to GB
+def calculate_disk_usage(demand):
+    """Estimate daily disk usage in GB from every camera's stream bitrate and the recording settings.
 
-def check_system_resources():
-    """Check current system resources"""
-    # Memory
+    The bitrate is the one the camera announced when stream detection is
+    on, otherwise the estimate for its profile (see capacity.estimate);
+    motion is assumed to trigger a recording every 10 minutes.
+    """
+    return round(demand['storage'] / 1024 ** 3, 2)
+
+# CPU sampling windows in seconds; 'instant' reads the load average instead of waiting
+SAMPLING_PROFILES = {'instant': 0.0, 'quick': 0.25, 'standard': 1.0, 'long': 10.0}
+
+def sampling_window(value):
+    """CPU sampling window for a profile name or a number of seconds"""
+    if value in SAMPLING_PROFILES:
+        return SAMPLING_PROFILES[value]
+    try:
+        window = float(value)
+    except (TypeError, ValueError):
+        window = -1
+    if window < 0:
+        raise ValueError(f"CPU sampling must be one of {', '.join(SAMPLING_PROFILES)} or a number of seconds, "
+                         f"got '{value}'")
+    return window
+
+def probe_memory():
+    """Memory of the host"""
     memory = psutil.virtual_memory()
-    total_memory_gb = round(memory.total / (1024**3), 2)
-    available_memory_gb = round(memory.available / (1024**3), 2)
-    memory_usage_percent = memory.percent
-    
-    # CPU
-    cpu_count = psutil.cpu_count()
-    cpu_usage_percent = psutil.cpu_percent(interval=1)
-    
-    # Disk
-    disk = psutil.disk_usage('/')
-    total_disk_gb = round(disk.total / (1024**3), 2)
-    free_disk_gb = round(disk.free / (1024**3), 2)
-    disk_usage_percent = round((disk.used / disk.total) * 100, 1)
-    
     return {
-        'memory': {
-            'total_gb': total_memory_gb,
-            'available_gb': available_memory_gb,
-            'usage_percent': memory_usage_percent
-        },
-        'cpu': {
-            'cores': cpu_count,
-            'current_usage_percent': cpu_usage_percent
-        },
-        'disk': {
-            'total_gb': total_disk_gb,
-            'free_gb': free_disk_gb,
-            'usage_percent': disk_usage_percent
-        }
+        'total_gb': round(memory.total / (1024**3), 2),
+        'available_gb': round(memory.available / (1024**3), 2),
+        'usage_percent': memory.percent
     }
 
-def check_network_ports(config, camera_count):
-    """Check if required network ports are available"""
-    import socket
-    
-    web_port_start = config.get('docker', {}).get('web_port_start', 8080)
-    rtmp_port_start = config.get('docker', {}).get('rtmp_port_start', 1935)
-    
-    busy_ports = []
-    
-    # Check web ports
-    for i in range(camera_count):
-        port = web_port_start + i
-        if is_port_in_use(port):
-            busy_ports.append(f"Web port {port}")
-    
-    # Check RTMP ports
-    for i in range(camera_count):
-        port = rtmp_port_start + i
-        if is_port_in_use(port):
-            busy_ports.append(f"RTMP port {port}")
-    
-    return busy_ports
+def probe_cpu(window=1.0):
+    """CPU use averaged over the window, one reading per second; a window of 0 uses the 1-minute load average"""
+    cores = psutil.cpu_count() or 1
+    if window <= 0:
+        load = os.getloadavg()[0] if hasattr(os, 'getloadavg') else 0.0
+        usage = min(100.0, load / cores * 100)
+        return {'cores': cores, 'current_usage_percent': round(usage, 1), 'peak_percent': round(usage, 1),
+                'window_seconds': 0.0, 'source': 'load average'}
+    samples = max(1, int(window))
+    readings = [psutil.cpu_percent(interval=window / samples) for _ in range(samples)]
+    return {'cores': cores, 'current_usage_percent': round(sum(readings) / samples, 1),
+            'peak_percent': max(readings), 'window_seconds': window, 'source': 'sampled'}
 
-def is_port_in_use(port):
-    """Check if a port is currently in use"""
-    import socket
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        try:
-            s.bind(('localhost', port))
-            return False
-        except OSError:
-            return True
+def probe_disk(path):
+    """Space on the volume that holds path (or its nearest existing parent, before the first generate)"""
+    existing = Path(path).resolve()
+    while not existing.exists():
+        existing = existing.parent
+    mount = existing
+    while not os.path.ismount(mount) and mount != mount.parent:
+        mount = mount.parent
+    disk = psutil.disk_usage(str(existing))
+    return {
+        'path': str(existing),
+        'mount': str(mount),
+        'total_gb': round(disk.total / (1024**3), 2),
+        'free_gb': round(disk.free / (1024**3), 2),
+        'usage_percent': round((disk.used / disk.total) * 100, 1) if disk.total else 0.0
+    }
+
+def check_system_resources(recordings_path=".", cpu_window=1.0):
+    """Check current system resources"""
+    return {
+        'memory': probe_memory(),
+        'cpu': probe_cpu(cpu_window),
+        'disk': probe_disk(recordings_path)
+    }
+
+def measure_recordings(config, compose_file=None):
+    """What the configured cameras' recordings actually take, without the per-camera detail, or None before
+    any were written. With a compose file the scan keeps its index next to it and only stats new recordings"""
+    from compose_writer import camera_name_for, compose_settings
+    from recordings_index import measure_storage
+
+    settings = compose_settings(config)
+    names = [camera_name_for(ip) for ip in settings['ips']]
+    storage = measure_storage(settings['recordings_base_path'], names, compose_file)
+    if not storage['recording_cameras']:
+        return None
+    storage.pop('cameras')
+    return storage
+
+def run_checks(config, camera_count, cpu_window=1.0, compose_file=None):
+    """Run every probe at once and assess the host against the fleet.
+
+    The CPU window dominates the run time; memory, the recordings volume,
+    the recordings scan, the port snapshot and the fleet estimate are taken
+    while it samples. Once cameras have recorded, the week of storage is
+    checked against what they write per camera per day instead of the
+    estimate. Raises ValueError for camera profiles that cannot be estimated.
+    """
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    started = time.monotonic()
+    recordings_path = (config.get('global') or {}).get('recordings_base_path', './recordings')
+    probes = {
+        'cpu': (probe_cpu, cpu_window),
+        'memory': (probe_memory,),
+        'disk': (probe_disk, recordings_path),
+        'ports': (check_network_ports, config),
+        'storage': (measure_recordings, config, compose_file),
+        'requirements': (get_resource_requirements, config, camera_count),
+    }
+    with ThreadPoolExecutor(max_workers=len(probes)) as pool:
+        futures = {name: pool.submit(*probe) for name, probe in probes.items()}
+        results = {name: future.result() for name, future in futures.items()}
 
-def print_system_check_report(config_path="config.yml"):
-    """Generate and print comprehensive system check report"""
+    requirements = results['requirements']
+    resources = {name: results[name] for name in ('memory', 'cpu', 'disk')}
+    storage = results['storage']
+    if storage:
+        daily_storage_gb = storage['bytes_per_camera_day'] * camera_count / 1024 ** 3
+    else:
+        daily_storage_gb = requirements['estimated_disk_usage_gb_per_day']
+    weekly_storage_gb = daily_storage_gb * 7
+    checks = {
+        'memory': resources['memory']['available_gb'] >= requirements['total_memory_gb'],
+        'cpu': requirements['total_cpu_percent'] <= 80,  # Leave 20% headroom
+        'disk': resources['disk']['free_gb'] >= weekly_storage_gb,
+        'ports': not results['ports'],
+    }
+    return {
+        'cameras': camera_count,
+        'requirements': requirements,
+        'resources': resources,
+        'storage': storage,
+        'daily_storage_gb': round(daily_storage_gb, 2),
+        'storage_source': 'measured' if storage else 'estimated',
+        'weekly_storage_gb': round(weekly_storage_gb, 2),
+        'busy_ports': results['ports'],
+        'checks': checks,
+        'ready': all(checks.values()),
+        'elapsed_seconds': round(time.monotonic() - started, 3),
+    }
+
+def check_network_ports(config):
+    """Check which agent ports are already in use, against one snapshot of the listening sockets"""
+    from compose_writer import compose_settings
+    from ports import port_conflicts
+
+    return port_conflicts(compose_settings(config))
+
+def print_system_check_report(config_path="config.yml", cpu_window=1.0, as_json=False):
+    """Generate and print comprehensive system check report, or the raw report as JSON"""
     
-    print("🔍 Kerberos Multi-Agent System Check")
-    print("=" * 50)
+    if not as_json:
+        print("🔍 Kerberos Multi-Agent System Check")
+        print("=" * 50)
     
     # Load configuration
     config = load_config(config_path)
@@ -189,60 +225,76 @@ def print_system_check_report(config_path="config.yml"):
         print("❌ Unable to determine camera count from configuration")
         return False
     
-    requirements = get_resource_requirements(config, camera_count)
-    system_resources = check_system_resources()
+    try:
+        report = run_checks(config, camera_count, cpu_window, "docker-compose.yml")
+    except ValueError as e:
+        print(f"❌ Error in camera profiles: {e}")
+        return False
+    if as_json:
+        print(json.dumps(report, indent=2))
+        return report['ready']
+    requirements = report['requirements']
+    system_resources = report['resources']
+    checks = report['checks']
     
     # Print configuration summary
     print(f"\n📋 Configuration Summary:")
     print(f"   Cameras: {camera_count}")
-    print(f"   IP Range: {config['cameras']['ip_range']['start']} - {config['cameras']['ip_range']['end']}")
-    print(f"   Recording: {'✅ Enabled' if config.get('cameras', {}).get('recording', {}).get('enabled', False) else '❌ Disabled'}")
+    print(f"   IP Range: {camera_ips(config['cameras']).describe()}")
+    recording = (config.get('cameras', {}).get('agent_settings') or {}).get('recording') or {}
+    print(f"   Recording: {'✅ Enabled' if recording.get('enabled', False) else '❌ Disabled'}")
     print(f"   Streaming: {'✅ Enabled' if config.get('cameras', {}).get('stream', {}).get('enabled', False) else '❌ Disabled'}")
     print(f"   Motion Detection: {'✅ Enabled' if config.get('cameras', {}).get('motion_detection', {}).get('enabled', False) else '❌ Disabled'}")
     
     # Print resource requirements
     print(f"\n💾 Resource Requirements:")
     print(f"   Memory per agent: {requirements['memory_per_agent_mb']} MB")
-    print(f"   CPU per agent: {requirements['cpu_per_agent_percent']}%")
+    print(f"   CPU per agent: {requirements['cpu_per_agent_percent']}% of one core")
     print(f"   Total memory needed: {requirements['total_memory_gb']} GB")
-    print(f"   Total CPU needed: {requirements['total_cpu_percent']}%")
+    print(f"   Total CPU needed: {requirements['total_cpu_percent']}% of the host")
     print(f"   Estimated daily storage: {requirements['estimated_disk_usage_gb_per_day']} GB/day")
+    storage = report['storage']
+    if storage:
+        print(f"   Measured daily storage: {report['daily_storage_gb']} GB/day "
+              f"({storage['bytes_per_camera_day'] / 1024**3:.2f} GB per camera from {storage['recording_cameras']} recording cameras)")
     
     # Print current system resources
+    cpu = system_resources['cpu']
+    disk = system_resources['disk']
+    cpu_sample = (f"over {cpu['window_seconds']:g}s, peak {cpu['peak_percent']:.1f}%"
+                  if cpu['source'] == 'sampled' else "from the load average")
     print(f"\n💻 Current System Resources:")
     print(f"   Memory: {system_resources['memory']['available_gb']} GB available / {system_resources['memory']['total_gb']} GB total ({system_resources['memory']['usage_percent']:.1f}% used)")
-    print(f"   CPU: {system_resources['cpu']['cores']} cores, {system_resources['cpu']['current_usage_percent']:.1f}% current usage")
-    print(f"   Disk: {system_resources['disk']['free_gb']} GB free / {system_resources['disk']['total_gb']} GB total ({system_resources['disk']['usage_percent']:.1f}% used)")
+    print(f"   CPU: {cpu['cores']} cores, {cpu['current_usage_percent']:.1f}% current usage ({cpu_sample})")
+    print(f"   Disk ({disk['mount']}, holding {disk['path']}): {disk['free_gb']} GB free / {disk['total_gb']} GB total ({disk['usage_percent']:.1f}% used)")
     
     # Check capacity
     print(f"\n✅ Capacity Assessment:")
     
     # Memory check
-    memory_sufficient = system_resources['memory']['available_gb'] >= requirements['total_memory_gb']
-    memory_status = "✅ SUFFICIENT" if memory_sufficient else "❌ INSUFFICIENT"
+    memory_status = "✅ SUFFICIENT" if checks['memory'] else "❌ INSUFFICIENT"
     print(f"   Memory: {memory_status}")
-    if not memory_sufficient:
+    if not checks['memory']:
         needed = requirements['total_memory_gb'] - system_resources['memory']['available_gb']
         print(f"      Need {needed:.1f} GB more memory")
     
     # CPU check
-    cpu_sufficient = requirements['total_cpu_percent'] <= 80  # Leave 20% headroom
-    cpu_status = "✅ SUFFICIENT" if cpu_sufficient else "⚠️  HIGH USAGE"
+    cpu_status = "✅ SUFFICIENT" if checks['cpu'] else "⚠️  HIGH USAGE"
     print(f"   CPU: {cpu_status}")
-    if not cpu_sufficient:
+    if not checks['cpu']:
         print(f"      Warning: Estimated {requirements['total_cpu_percent']}% CPU usage may cause performance issues")
     
     # Disk check (1 week storage)
-    weekly_storage_gb = requirements['estimated_disk_usage_gb_per_day'] * 7
-    disk_sufficient = system_resources['disk']['free_gb'] >= weekly_storage_gb
-    disk_status = "✅ SUFFICIENT" if disk_sufficient else "⚠️  LIMITED"
+    disk_status = "✅ SUFFICIENT" if checks['disk'] else "⚠️  LIMITED"
     print(f"   Disk (1 week storage): {disk_status}")
-    if not disk_sufficient and requirements['estimated_disk_usage_gb_per_day'] > 0:
-        print(f"      Warning: Only {system_resources['disk']['free_gb']:.1f} GB free, need {weekly_storage_gb:.1f} GB for 1 week")
+    if not checks['disk'] and requirements['estimated_disk_usage_gb_per_day'] > 0:
+        print(f"      Warning: Only {disk['free_gb']:.1f} GB free, need {report['weekly_storage_gb']:.1f} GB for 1 week")
+    if storage and storage['days_until_full'] is not None:
+        print(f"   Recordings volume full in: {storage['days_until_full']:.1f} days at the current growth")
     
     # Port availability check
     print(f"\n🔌 Port Availability:")
-    busy_ports = check_network_ports(config, camera_count)
+    busy_ports = report['busy_ports']
     if not busy_ports:
         print("   ✅ All required ports are available")
     else:
@@ -253,23 +305,36 @@ def print_system_check_report(config_path="config.yml"):
     # Overall recommendation
     print(f"\n🎯 Overall Assessment:")
     
-    if memory_sufficient and cpu_sufficient and disk_sufficient and not busy_ports:
+    if report['ready']:
         print("   ✅ READY FOR DEPLOYMENT")
         print("   Your system can handle all configured Kerberos agents!")
         return True
     else:
         print("   ⚠️  DEPLOYMENT WITH CAUTION")
-        if not memory_sufficient:
+        if not checks['memory']:
             print("   - Consider reducing the number of cameras or adding more RAM")
-        if not cpu_sufficient:
+        if not checks['cpu']:
             print("   - Monitor CPU usage during deployment")
-        if not disk_sufficient:
+        if not checks['disk']:
             print("   - Plan for regular cleanup of recordings or add more storage")
         if busy_ports:
             print("   - Stop services using conflicting ports or modify port configuration")
         return False
 
-if __name__ == "__main__":
-    config_file = sys.argv[1] if len(sys.argv) > 1 else "config.yml"
-    success = print_system_check_report(config_file)
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Check whether this host can run the configured Kerberos agents')
+    parser.add_argument('config', nargs='?', default='config.yml', help='Configuration file (default: %(default)s)')
+    parser.add_argument('--sampling', default='standard',
+                        help=f"CPU sampling: {', '.join(SAMPLING_PROFILES)} or seconds (default: %(default)s)")
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    args = parser.parse_args()
+    try:
+        cpu_window = sampling_window(args.sampling)
+    except ValueError as e:
+        parser.error(str(e))
+    success = print_system_check_report(args.config, cpu_window, args.json)
     sys.exit(0 if success else 1)
+
+if __name__ == "__main__":
+    main()